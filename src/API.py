@@ -0,0 +1,511 @@
+# -*- coding: utf-8 -*-
+"""An embedded HTTP API serving the latest KPIs of the Workstations from the memory
+
+The LoopHandler puts the KPIs of each Workstation into the KPIStore after each calculation,
+and the KPIStore serialises them to JSON at once, so a request only copies bytes.
+The APIServer serves the KPIStore in a background thread:
+
+    GET /kpis: the KPIs of all Workstations, a JSON list
+        ?id=<workstation id>: only the listed Workstations, may be repeated
+        ?status=ok or ?status=error: only the Workstations whose calculation succeeded or failed
+    GET /kpis/<workstation id>: the KPIs of a Workstation, 404 if it is unknown
+    GET /health: {"status": "ok", "loopFinishedAt": ...}
+    GET /events: a stream of server-sent events of the KPI changes, see EventBroker
+    GET /sinks: the metrics of the KPI sinks, see Sinks.SinkDispatcher.get_metrics
+
+The KPIs of a Workstation:
+    {
+    "id": the Workstation's Orion id,
+    "oee", "availability", "performance", "quality", "throughput": null if the calculation failed,
+    "calculatedAt": the time of the calculation in ISO 8601 format (UTC),
+    "error": the error message of a failed calculation or null
+    }
+
+An event of the /events stream is sent when the KPIs of a Workstation change by more than API_EVENT_EPSILON,
+or its error changes. Its data only contains the id, the calculatedAt and the changed fields,
+the first event of a Workstation contains all of them.
+All subscribers are served from the same ring buffer of the last API_EVENT_BUFFER events,
+a reconnecting client receives the buffered events after its Last-Event-ID header.
+
+Environment variables (defaults are starred):
+    API_PORT: the port of the API, the API is disabled if not set
+        None*
+    API_HOST: the address the API listens on
+        0.0.0.0*
+    API_EVENT_EPSILON: the minimum change of a KPI that is sent as an event
+        0*
+    API_EVENT_BUFFER: the number of events kept for the reconnecting clients
+        1000*
+    API_EVENT_HEARTBEAT: the seconds after which a comment is sent if there is no event
+        15*
+"""
+# Standard Library imports
+import collections
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+from urllib.parse import parse_qs, unquote, urlsplit
+
+# Custom imports
+from Logger import getLogger
+import Sinks
+
+API_PORT = os.environ.get("API_PORT")
+if API_PORT is not None:
+    API_PORT = int(API_PORT)
+
+API_HOST = os.environ.get("API_HOST")
+if API_HOST is None:
+    API_HOST = "0.0.0.0"
+
+API_EVENT_EPSILON = os.environ.get("API_EVENT_EPSILON")
+if API_EVENT_EPSILON is None:
+    API_EVENT_EPSILON = 0
+else:
+    API_EVENT_EPSILON = float(API_EVENT_EPSILON)
+
+API_EVENT_BUFFER = os.environ.get("API_EVENT_BUFFER")
+if API_EVENT_BUFFER is None:
+    API_EVENT_BUFFER = 1000
+else:
+    API_EVENT_BUFFER = int(API_EVENT_BUFFER)
+
+API_EVENT_HEARTBEAT = os.environ.get("API_EVENT_HEARTBEAT")
+if API_EVENT_HEARTBEAT is None:
+    API_EVENT_HEARTBEAT = 15
+else:
+    API_EVENT_HEARTBEAT = float(API_EVENT_HEARTBEAT)
+
+KPIS = Sinks.KPIS
+# the fields of the KPIs compared for the events
+EVENT_FIELDS = KPIS + ("throughput", "error")
+
+
+def serialise(obj) -> bytes:
+    """Serialise an object to compact JSON
+
+    Args:
+        obj: the object
+
+    Returns:
+        the JSON (bytes) in UTF-8
+    """
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def has_changed(old, new, epsilon: float) -> bool:
+    """Check if a field of the KPIs changed
+
+    Args:
+        old: the previous value, a number, a str or None
+        new: the current value, a number, a str or None
+        epsilon (float): the numbers must change by more than this
+
+    Returns:
+        True if the field changed, False otherwise
+    """
+    if isinstance(old, (int, float)) and isinstance(new, (int, float)):
+        return abs(new - old) > epsilon
+    return old != new
+
+
+class EventBroker:
+    """A ring buffer of the KPI change events, shared by all subscribers
+
+    The events are formatted as server-sent events once, the subscribers wait for them on a condition.
+
+    Common usage:
+        broker.publish(record)
+        ...  # in each subscriber
+        frames, last_id = broker.wait(last_id, timeout)
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, epsilon: float = API_EVENT_EPSILON, max_events: int = API_EVENT_BUFFER):
+        """The constructor of the EventBroker class
+
+        Args:
+            epsilon (float): the minimum change of a KPI that is sent
+            max_events (int): the number of events kept in the ring buffer
+        """
+        self.epsilon = epsilon
+        self.events = collections.deque(maxlen=max_events)
+        # the id of the last event, the ids are consecutive
+        self.last_id = 0
+        # the fields of the last sent events of each Workstation, format: {workstation_id: dict}
+        self.sent = {}
+        self.condition = threading.Condition()
+
+    def __repr__(self):
+        return f"EventBroker(epsilon={self.epsilon}, max_events={self.events.maxlen})"
+
+    def get_delta(self, record: dict) -> dict:
+        """Get the changed fields of the KPIs of a Workstation
+
+        Args:
+            record (dict): the KPIs of a Workstation, see KPIStore.update
+
+        Returns:
+            the delta (dict) with the id, the calculatedAt and the changed fields, or None if nothing changed
+        """
+        sent = self.sent.get(record["id"])
+        if sent is None:
+            changed = EVENT_FIELDS
+        else:
+            changed = [field for field in EVENT_FIELDS if has_changed(sent[field], record[field], self.epsilon)]
+        if len(changed) == 0:
+            return None
+        delta = {"id": record["id"], "calculatedAt": record["calculatedAt"]}
+        delta.update({field: record[field] for field in changed})
+        return delta
+
+    def publish(self, record: dict) -> int:
+        """Send an event if the KPIs of a Workstation changed
+
+        A field that did not change by more than epsilon is compared to its last sent value next time,
+        so slow drifts are sent too.
+
+        Args:
+            record (dict): the KPIs of a Workstation, see KPIStore.update
+
+        Returns:
+            the id of the event (int) or None if nothing changed
+        """
+        with self.condition:
+            delta = self.get_delta(record)
+            if delta is None:
+                return None
+            sent = self.sent.setdefault(record["id"], {})
+            sent.update({field: delta[field] for field in EVENT_FIELDS if field in delta})
+            self.last_id += 1
+            frame = f"id: {self.last_id}\nevent: kpis\ndata: ".encode("utf-8") + serialise(delta) + b"\n\n"
+            self.events.append((self.last_id, frame))
+            self.condition.notify_all()
+            return self.last_id
+
+    def get_events(self, after_id: int) -> tuple:
+        """Get the buffered events after an event, without waiting
+
+        If the event is no longer buffered, all buffered events are returned.
+
+        Args:
+            after_id (int): the id of the last event the subscriber received, 0 for none
+
+        Returns:
+            tuple: (the frames (list of bytes), the id of the last event)
+        """
+        with self.condition:
+            if after_id > self.last_id:
+                # the service was restarted, the ids started again
+                after_id = 0
+            frames = [frame for id_, frame in self.events if id_ > after_id]
+            return frames, self.last_id
+
+    def wait(self, after_id: int, timeout: float) -> tuple:
+        """Wait for events after an event
+
+        Args:
+            after_id (int): the id of the last event the subscriber received
+            timeout (float): the maximum seconds to wait
+
+        Returns:
+            tuple: (the frames (list of bytes), empty if there was no event, the id of the last event)
+        """
+        with self.condition:
+            if self.last_id == after_id:
+                self.condition.wait(timeout)
+        return self.get_events(after_id)
+
+    def wake(self):
+        """Wake the waiting subscribers, for example when the server stops"""
+        with self.condition:
+            self.condition.notify_all()
+
+
+class KPIStore:
+    """The latest KPIs of each Workstation, serialised to JSON
+
+    The dicts and the bodies are replaced, never changed, so the readers need no lock.
+
+    Common usage:
+        kpi_store.update(workstation_id, calculated_at, oee, throughput, error)
+        ...
+        kpi_store.publish(workstation_ids, finished_at)
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, events: EventBroker = None):
+        """The constructor of the KPIStore class
+
+        Args:
+            events (EventBroker): the broker the KPI changes are sent to. Default: None, no events
+        """
+        self.events = events
+        # the KPIs of each Workstation, format: {workstation_id: dict}
+        self.records = {}
+        # the serialised KPIs of each Workstation, format: {workstation_id: bytes}
+        self.bodies = {}
+        # the serialised list of all Workstations' KPIs, set by publish
+        self.all_body = b"[]"
+        self.health_body = serialise({"status": "ok", "loopFinishedAt": None})
+        # the writers are the LoopHandlers
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"KPIStore(workstations={len(self.records)})"
+
+    def update(
+        self,
+        workstation_id: str,
+        calculated_at: datetime,
+        oee: dict = None,
+        throughput: float = None,
+        error: str = None,
+    ):
+        """Set the KPIs of a Workstation
+
+        Args:
+            workstation_id (str): the Workstation's Orion id
+            calculated_at (datetime): the time of the calculation, timezone aware
+            oee (dict): the OEE object, see OEECalculator.OEE_template. Default: None, the KPIs are null
+            throughput (float): the throughput per shift. Default: None
+            error (str): the error message if the calculation failed. Default: None
+        """
+        record = Sinks.get_record(workstation_id, calculated_at, oee, throughput, error)
+        body = serialise(record)
+        with self.lock:
+            records = dict(self.records)
+            records[workstation_id] = record
+            bodies = dict(self.bodies)
+            bodies[workstation_id] = body
+            self.records, self.bodies = records, bodies
+        if self.events is not None:
+            self.events.publish(record)
+
+    def publish(self, workstation_ids: list, finished_at: datetime):
+        """Serialise the list of all Workstations' KPIs after a loop
+
+        The Workstations not in the loop are removed.
+
+        Args:
+            workstation_ids (list): the ids of the Workstations of the loop
+            finished_at (datetime): the end of the loop, timezone aware
+        """
+        with self.lock:
+            workstation_ids = set(workstation_ids)
+            self.records = {id_: record for id_, record in self.records.items() if id_ in workstation_ids}
+            self.bodies = {id_: body for id_, body in self.bodies.items() if id_ in workstation_ids}
+            self.all_body = self.join(sorted(self.bodies))
+            self.health_body = serialise({"status": "ok", "loopFinishedAt": finished_at.isoformat()})
+
+    def join(self, workstation_ids: list, bodies: dict = None) -> bytes:
+        """Join the serialised KPIs of Workstations into a JSON list
+
+        Args:
+            workstation_ids (list): the ids of the Workstations, the unknown ones are skipped
+            bodies (dict): the serialised KPIs. Default: None, self.bodies
+
+        Returns:
+            the JSON list (bytes)
+        """
+        if bodies is None:
+            bodies = self.bodies
+        return b"[" + b",".join(bodies[id_] for id_ in workstation_ids if id_ in bodies) + b"]"
+
+    def get_list(self, ids: list = None, status: str = None) -> bytes:
+        """Get the serialised KPIs of the Workstations
+
+        Args:
+            ids (list): the ids of the Workstations. Default: None, all Workstations
+            status (str): "ok" or "error", filter by the calculation's success. Default: None, no filter
+
+        Returns:
+            the JSON list (bytes)
+
+        Raises:
+            ValueError:
+                if the status is not supported
+        """
+        if ids is None and status is None:
+            return self.all_body
+        if status not in (None, "ok", "error"):
+            raise ValueError(f"Unsupported status: {status}")
+        records, bodies = self.records, self.bodies
+        if ids is None:
+            ids = sorted(records)
+        if status is not None:
+            ids = [id_ for id_ in ids if id_ in records and (records[id_]["error"] is None) == (status == "ok")]
+        return self.join(ids, bodies)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Serve the KPIStore of the server"""
+
+    logger = getLogger(__name__)
+
+    def send_body(self, status: int, body: bytes):
+        """Send a JSON response
+
+        Args:
+            status (int): HTTP status code
+            body (bytes): the JSON
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_body(self, status: int, message: str):
+        """Send a JSON error response
+
+        Args:
+            status (int): HTTP status code
+            message (str): the error message
+        """
+        self.send_body(status, serialise({"error": message}))
+
+    def do_GET(self):
+        """Serve a GET request, see the module's docs"""
+        kpi_store = self.server.kpi_store
+        url = urlsplit(self.path)
+        path = url.path.rstrip("/")
+        if path == "/kpis":
+            query = parse_qs(url.query)
+            status = query.get("status", [None])[-1]
+            try:
+                body = kpi_store.get_list(query.get("id"), status)
+            except ValueError as error:
+                self.send_error_body(400, str(error))
+                return
+            self.send_body(200, body)
+        elif path.startswith("/kpis/"):
+            body = kpi_store.bodies.get(unquote(path[len("/kpis/"):]))
+            if body is None:
+                self.send_error_body(404, "Unknown Workstation")
+                return
+            self.send_body(200, body)
+        elif path == "/health":
+            self.send_body(200, kpi_store.health_body)
+        elif path == "/sinks":
+            if self.server.sinks is None:
+                self.send_error_body(404, "Not found")
+                return
+            self.send_body(200, serialise(self.server.sinks.get_metrics()))
+        elif path == "/events":
+            if kpi_store.events is None:
+                self.send_error_body(404, "Not found")
+                return
+            self.stream_events(kpi_store.events, url.query)
+        else:
+            self.send_error_body(404, "Not found")
+
+    def stream_events(self, events: EventBroker, query: str):
+        """Stream the KPI change events until the client disconnects or the server stops
+
+        Args:
+            events (EventBroker): the events
+            query (str): the query string of the request, it may contain the lastEventId
+        """
+        last_event_id = self.headers.get("Last-Event-ID") or parse_qs(query).get("lastEventId", ["0"])[-1]
+        try:
+            last_id = int(last_event_id)
+        except ValueError:
+            self.send_error_body(400, f"Invalid Last-Event-ID: {last_event_id}")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        # the buffered events after the Last-Event-ID are sent first
+        frames, last_id = events.get_events(last_id)
+        try:
+            while not self.server.stopping.is_set():
+                self.wfile.write(b"".join(frames) if frames else b": heartbeat\n\n")
+                self.wfile.flush()
+                frames, last_id = events.wait(last_id, self.server.heartbeat)
+        except (BrokenPipeError, ConnectionResetError):
+            self.logger.debug(f"The event subscriber {self.address_string()} disconnected")
+        # the stream ends with the connection
+        self.close_connection = True
+
+    def log_message(self, format: str, *args):
+        """Log the requests in debug level instead of writing them to stderr"""
+        self.logger.debug(f"{self.address_string()} {format % args}")
+
+
+class APIServer:
+    """The HTTP server of the API, running in a daemon thread
+
+    Common usage:
+        server = APIServer(kpi_store)
+        server.start()
+        ...
+        server.stop()
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(
+        self,
+        kpi_store: KPIStore,
+        host: str = API_HOST,
+        port: int = API_PORT,
+        heartbeat: float = API_EVENT_HEARTBEAT,
+        sinks: Sinks.SinkDispatcher = None,
+    ):
+        """The constructor of the APIServer class
+
+        Args:
+            kpi_store (KPIStore): the served KPIs
+            host (str): the address the API listens on
+            port (int): the port of the API, 0 chooses a free port
+            heartbeat (float): the seconds after which a comment is sent to the event subscribers
+            sinks (Sinks.SinkDispatcher): the KPI sinks whose metrics are served. Default: None
+        """
+        self.kpi_store = kpi_store
+        self.host = host
+        self.port = port
+        self.heartbeat = heartbeat
+        self.sinks = sinks
+        self.httpd = None
+        self.thread = None
+
+    def __repr__(self):
+        return f"APIServer(host={self.host}, port={self.port})"
+
+    def start(self):
+        """Start serving in a daemon thread
+
+        Raises:
+            OSError:
+                if the address cannot be bound
+        """
+        self.httpd = ThreadingHTTPServer((self.host, self.port), RequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.kpi_store = self.kpi_store
+        self.httpd.heartbeat = self.heartbeat
+        self.httpd.sinks = self.sinks
+        # ends the event streams
+        self.httpd.stopping = threading.Event()
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="API", daemon=True)
+        self.thread.start()
+        self.logger.info(f"Serving the API on {self.host}:{self.port}")
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        if self.httpd is None:
+            return
+        self.httpd.stopping.set()
+        if self.kpi_store.events is not None:
+            self.kpi_store.events.wake()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+        self.httpd = None
+        self.thread = None
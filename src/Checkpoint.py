@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Checkpoints of the incremental KPI state of the Workstations
+
+In the "chunked" processing mode, the OEECalculator streams the logs through reducers, see Reducers.
+With a CheckpointStore, the reducers' state of each Workstation is kept after the calculation,
+with the watermark: the time until which the logs were processed.
+The watermark lags CHECKPOINT_LAG_MS milliseconds behind the calculation's time,
+because the rows Cygnus was inserting at the calculation may become visible only later.
+The KPIs are still calculated from all logs until now: the reducers continue with the logs
+after the watermark once their state is taken.
+The next calculation restores the reducers and only streams the logs after the watermark,
+see OEECalculator.prepare_chunked.
+The state is only restored if it belongs to today and to the current refShift and refJob
+of the Workstation, otherwise the logs are processed from midnight.
+Logs becoming visible more than CHECKPOINT_LAG_MS milliseconds after their timestamp are not processed.
+
+The states are saved to a JSON file with a version header at most every CHECKPOINT_INTERVAL seconds,
+and loaded when the service starts, so the first loop after a restart is as cheap as the others.
+The file is written into a temporary file and renamed, so a crash never leaves a partial file.
+
+Environment variables (defaults are starred):
+    CHECKPOINT_FILE: the checkpoint file, the checkpoints are disabled if not set
+        None*
+    CHECKPOINT_INTERVAL: the minimum number of seconds between writing the file
+        60*
+    CHECKPOINT_LAG_MS: the milliseconds the watermark lags behind the calculation's time
+        60000*
+"""
+# Standard Library imports
+import json
+import os
+import tempfile
+import time
+
+# Custom imports
+from Logger import getLogger
+
+CHECKPOINT_FILE = os.environ.get("CHECKPOINT_FILE")
+
+CHECKPOINT_INTERVAL = os.environ.get("CHECKPOINT_INTERVAL")
+if CHECKPOINT_INTERVAL is None:
+    CHECKPOINT_INTERVAL = 60
+else:
+    CHECKPOINT_INTERVAL = float(CHECKPOINT_INTERVAL)
+
+CHECKPOINT_LAG_MS = os.environ.get("CHECKPOINT_LAG_MS")
+if CHECKPOINT_LAG_MS is None:
+    CHECKPOINT_LAG_MS = 60000
+else:
+    CHECKPOINT_LAG_MS = int(CHECKPOINT_LAG_MS)
+
+# increase if the format of the states changes, so the old checkpoints are not restored
+CHECKPOINT_VERSION = 1
+
+
+class CheckpointStore:
+    """The incremental KPI state of each Workstation, saved to a file
+
+    The CheckpointStore outlives the LoopHandlers, so the states are kept between the loops.
+
+    Common usage:
+        checkpoint = CheckpointStore(path)
+        state = checkpoint.get(workstation_id, day, shift_id, job_id)
+        ...  # continue the calculation from the state
+        checkpoint.put(workstation_id, state)
+        checkpoint.save()
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, path: str, interval: float = CHECKPOINT_INTERVAL, lag: int = CHECKPOINT_LAG_MS):
+        """The constructor of the CheckpointStore class
+
+        Loads the states from the file if it exists
+
+        Args:
+            path (str): the checkpoint file
+            interval (float): the minimum number of seconds between writing the file
+            lag (int): the milliseconds the watermark lags behind the calculation's time
+        """
+        self.path = path
+        self.interval = interval
+        self.lag = lag
+        # the time.monotonic of the last write
+        self.saved = None
+        # format: {workstation_id: state}, see OEECalculator.prepare_chunked
+        self.states = self.load()
+
+    def __repr__(self):
+        return f"CheckpointStore(path={self.path}, interval={self.interval}, lag={self.lag})"
+
+    def load(self) -> dict:
+        """Read the states from the checkpoint file
+
+        Returns:
+            the states (dict), empty if the file does not exist,
+            cannot be read or was written by another version
+        """
+        try:
+            with open(self.path, "r") as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as error:
+            self.logger.warning(f"The checkpoint file {self.path} cannot be read, ignoring it: {error}")
+            return {}
+        if not isinstance(checkpoint, dict) or checkpoint.get("version") != CHECKPOINT_VERSION:
+            self.logger.warning(f"The checkpoint file {self.path} has an unsupported version, ignoring it")
+            return {}
+        states = checkpoint.get("states")
+        if not isinstance(states, dict):
+            self.logger.warning(f"The checkpoint file {self.path} has no states, ignoring it")
+            return {}
+        self.logger.info(f"Restored the checkpoints of {len(states)} Workstations from {self.path}")
+        return states
+
+    def get(self, workstation_id: str, day: str, shift_id: str, job_id: str) -> dict:
+        """Get the state of a Workstation if it is still valid
+
+        An invalid state is deleted.
+
+        Args:
+            workstation_id (str): the Workstation's Orion id
+            day (str): today in ISO format
+            shift_id (str): the Workstation's current refShift
+            job_id (str): the Workstation's current refJob
+
+        Returns:
+            the state (dict) or None
+        """
+        state = self.states.get(workstation_id)
+        if state is None:
+            return None
+        if (state.get("day"), state.get("shift_id"), state.get("job_id")) != (day, shift_id, job_id):
+            self.logger.debug(f"The checkpoint of {workstation_id} is outdated")
+            del self.states[workstation_id]
+            return None
+        return state
+
+    def put(self, workstation_id: str, state: dict):
+        """Set the state of a Workstation
+
+        Args:
+            workstation_id (str): the Workstation's Orion id
+            state (dict): the state, containing the day, shift_id and job_id keys, see get
+        """
+        self.states[workstation_id] = state
+
+    def save(self, force: bool = False) -> bool:
+        """Write the states atomically into the checkpoint file
+
+        Args:
+            force (bool): write even if the interval has not elapsed since the last write. Default: False
+
+        Returns:
+            True if the file was written, False otherwise
+
+        Raises:
+            OSError:
+                if the file cannot be written
+        """
+        if not force and self.saved is not None and time.monotonic() - self.saved < self.interval:
+            return False
+        directory = os.path.dirname(os.path.abspath(self.path))
+        file_descriptor, temporary = tempfile.mkstemp(prefix=".checkpoint.", dir=directory)
+        try:
+            with os.fdopen(file_descriptor, "w") as f:
+                json.dump({"version": CHECKPOINT_VERSION, "states": self.states}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, self.path)
+        except (OSError, TypeError, ValueError):
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        self.saved = time.monotonic()
+        self.logger.debug(f"Saved the checkpoints of {len(self.states)} Workstations to {self.path}")
+        return True
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""A bulk reader of the Cygnus logs using PostgreSQL's COPY
+
+pd.read_sql_query fetches the rows through a cursor and creates a Python object for every cell.
+The CopyReader streams the result of a query with
+    COPY (select ...) TO STDOUT
+and parses it into NumPy arrays in chunks of at most chunk_size rows:
+    recvtimets: int64 timestamps in milliseconds
+    attrname: int32 codes of the attribute names
+    attrvalue: int32 codes of the attribute values
+The codes refer to the CopyReader's categories (attrnames and attrvalues),
+shared by all chunks read by the same CopyReader,
+or only by a single chunk if chunk_categories is True.
+
+The chunks are either passed to a callback as soon as they are parsed,
+so the memory use is bounded by the chunk size,
+or collected into a single LogArrays object.
+
+Environment variables (defaults are starred):
+    COPY_CHUNK_SIZE:
+        100000*
+"""
+# Standard Library imports
+import os
+
+# PyPI packages
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from sqlalchemy.dialects import postgresql
+
+# Custom imports
+from Logger import getLogger
+
+# COPY's text format represents NULL as \N
+COPY_NULL = b"\\N"
+COPY_ESCAPES = {b"b": b"\b", b"f": b"\f", b"n": b"\n", b"r": b"\r", b"t": b"\t", b"v": b"\v", b"\\": b"\\"}
+
+
+class LogArrays:
+    """Cygnus logs in NumPy arrays
+
+    Attributes:
+        recvtimets (np.ndarray): int64 timestamps in milliseconds
+        attrname (np.ndarray): int32 codes of the attribute names
+        attrvalue (np.ndarray): int32 codes of the attribute values
+        reader (CopyReader): the CopyReader that holds the categories of the codes
+    """
+
+    def __init__(self, recvtimets: np.ndarray, attrname: np.ndarray, attrvalue: np.ndarray, reader):
+        self.recvtimets = recvtimets
+        self.attrname = attrname
+        self.attrvalue = attrvalue
+        self.reader = reader
+
+    def __len__(self):
+        return len(self.recvtimets)
+
+    def __repr__(self):
+        return f"LogArrays({len(self)} rows)"
+
+    def attrname_code(self, attrname: str) -> int:
+        """Get the code of an attribute name
+
+        Args:
+            attrname (str): attribute name
+
+        Returns:
+            the code (int) or -1 if the attribute name has not been read
+        """
+        return self.reader.attrname_codes.get(attrname, -1)
+
+    def attrvalue_code(self, attrvalue: str) -> int:
+        """Get the code of an attribute value
+
+        Args:
+            attrvalue (str): attribute value
+
+        Returns:
+            the code (int) or -1 if the attribute value has not been read
+        """
+        return self.reader.attrvalue_codes.get(attrvalue, -1)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Convert the arrays into a pandas DataFrame
+
+        Returns:
+            pandas DataFrame with the columns recvtimets (int64), attrname and attrvalue (str)
+        """
+        return pd.DataFrame(
+            {
+                "recvtimets": self.recvtimets,
+                "attrname": np.array(self.reader.attrnames, dtype=object)[self.attrname],
+                "attrvalue": np.array(self.reader.attrvalues, dtype=object)[self.attrvalue],
+            }
+        )
+
+
+class CopyReader:
+    """Read Cygnus logs with COPY into NumPy arrays
+
+    Common usage:
+        reader = CopyReader()
+        logs = reader.read(con, query)
+        # or in chunks
+        reader.read(con, query, on_chunk=callback)
+    """
+
+    logger = getLogger(__name__)
+    COPY_CHUNK_SIZE = os.environ.get("COPY_CHUNK_SIZE")
+    if COPY_CHUNK_SIZE is None:
+        COPY_CHUNK_SIZE = 100000
+    else:
+        COPY_CHUNK_SIZE = int(COPY_CHUNK_SIZE)
+
+    def __init__(self, chunk_size: int = None, chunk_categories: bool = False):
+        """The constructor of the CopyReader class
+
+        Args:
+            chunk_size (int): the maximum number of rows in a chunk. Default: COPY_CHUNK_SIZE
+            chunk_categories (bool): if True, the categories are cleared before each chunk,
+                so the memory use does not grow with the number of distinct values,
+                but the codes of different chunks cannot be compared. Default: False
+        """
+        self.chunk_size = self.COPY_CHUNK_SIZE if chunk_size is None else chunk_size
+        if self.chunk_size < 1:
+            raise ValueError(f"Invalid chunk size: {self.chunk_size}")
+        self.chunk_categories = chunk_categories
+        # the categories of the codes and their inverse
+        self.attrnames = []
+        self.attrname_codes = {}
+        self.attrvalues = []
+        self.attrvalue_codes = {}
+        # the buffers are allocated once and reused by every chunk
+        self.recvtimets_buffer = np.empty(self.chunk_size, dtype=np.int64)
+        self.attrname_buffer = np.empty(self.chunk_size, dtype=np.int32)
+        self.attrvalue_buffer = np.empty(self.chunk_size, dtype=np.int32)
+
+    def __repr__(self):
+        return f"CopyReader(chunk_size={self.chunk_size}, chunk_categories={self.chunk_categories})"
+
+    def get_copy_query(self, query: str, params: dict = None) -> str:
+        """Wrap a query of Cygnus logs into a COPY statement
+
+        The query may return any columns, only recvtimets, attrname and attrvalue are copied.
+        The named parameters are bound by the PostgreSQL dialect,
+        because COPY does not accept parameters.
+
+        Args:
+            query (str): the SQL query, it may contain :named parameters
+            params (dict): the values of the query's named parameters. Default: None
+
+        Returns:
+            the COPY statement (str)
+        """
+        statement = sqlalchemy.text(query.strip().rstrip(";"))
+        if params:
+            statement = statement.bindparams(**params)
+        query = str(
+            statement.compile(dialect=postgresql.dialect(paramstyle="named"), compile_kwargs={"literal_binds": True})
+        )
+        return f"""copy (select cast (recvtimets as bigint), attrname, attrvalue
+                   from ({query}) as copied_logs) to stdout;"""
+
+    def decode(self, field: bytes) -> str:
+        """Decode a field of COPY's text format
+
+        Args:
+            field (bytes): the field
+
+        Returns:
+            the decoded field (str) or None if it is NULL
+        """
+        if field == COPY_NULL:
+            return None
+        if b"\\" in field:
+            parts = field.split(b"\\")
+            decoded = [parts[0]]
+            i = 1
+            while i < len(parts):
+                if parts[i] == b"" and i + 1 < len(parts):
+                    # an escaped backslash
+                    decoded.append(b"\\" + parts[i + 1])
+                    i += 2
+                    continue
+                decoded.append(COPY_ESCAPES.get(parts[i][:1], parts[i][:1]) + parts[i][1:])
+                i += 1
+            field = b"".join(decoded)
+        return field.decode("utf-8")
+
+    def encode_categories(self, values: np.ndarray, categories: list, codes: dict) -> np.ndarray:
+        """Convert a chunk's values to codes, extending the categories with the new values
+
+        Args:
+            values (np.ndarray): the values in COPY's text format
+            categories (list): the decoded values of the codes
+            codes (dict): the codes of the decoded values
+
+        Returns:
+            the codes (np.ndarray)
+        """
+        uniques, inverse = np.unique(values, return_inverse=True)
+        unique_codes = np.empty(len(uniques), dtype=np.int32)
+        for i, unique in enumerate(uniques):
+            value = self.decode(unique)
+            code = codes.get(value)
+            if code is None:
+                code = len(categories)
+                categories.append(value)
+                codes[value] = code
+            unique_codes[i] = code
+        return unique_codes[inverse]
+
+    def parse_chunk(self, lines: list) -> LogArrays:
+        """Parse the rows of a chunk into the buffers
+
+        Args:
+            lines (list): at most chunk_size rows in COPY's text format, without the line breaks
+
+        Returns:
+            LogArrays of views of the buffers,
+            valid until the next chunk is parsed
+        """
+        n_rows = len(lines)
+        if self.chunk_categories:
+            self.attrnames.clear()
+            self.attrname_codes.clear()
+            self.attrvalues.clear()
+            self.attrvalue_codes.clear()
+        # splitting the joined rows creates all fields at once
+        fields = b"\t".join(lines).split(b"\t")
+        if len(fields) != 3 * n_rows:
+            raise ValueError("Unexpected number of columns in the copied logs")
+        self.recvtimets_buffer[:n_rows] = np.array(fields[0::3]).astype(np.int64)
+        self.attrname_buffer[:n_rows] = self.encode_categories(
+            np.array(fields[1::3]), self.attrnames, self.attrname_codes
+        )
+        self.attrvalue_buffer[:n_rows] = self.encode_categories(
+            np.array(fields[2::3]), self.attrvalues, self.attrvalue_codes
+        )
+        return LogArrays(
+            self.recvtimets_buffer[:n_rows],
+            self.attrname_buffer[:n_rows],
+            self.attrvalue_buffer[:n_rows],
+            self,
+        )
+
+    def read(self, con, query: str, params: dict = None, on_chunk=None):
+        """Read the result of a query
+
+        Args:
+            con (sqlalchemy connection object): connection to PostgreSQL
+            query (str): the SQL query, it may contain :named parameters
+            params (dict): the values of the query's named parameters. Default: None
+            on_chunk (callable): called with each chunk (LogArrays).
+                The chunk's arrays are reused for the next chunk, copy them to keep them.
+                Default: None, the chunks are collected
+
+        Returns:
+            LogArrays of all rows if on_chunk is None,
+            otherwise the number of rows read (int)
+
+        Raises:
+            psycopg2 errors:
+                if the query fails
+        """
+        chunks = []
+
+        def handle_chunk(chunk: LogArrays):
+            if on_chunk is None:
+                chunks.append(
+                    (chunk.recvtimets.copy(), chunk.attrname.copy(), chunk.attrvalue.copy())
+                )
+            else:
+                on_chunk(chunk)
+
+        stream = _CopyStream(self, handle_chunk)
+        cursor = con.connection.cursor()
+        try:
+            cursor.copy_expert(self.get_copy_query(query, params), stream)
+        except Exception:
+            # like sqlalchemy does, so the connection can be used after the error
+            if not con.in_transaction():
+                con.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+        stream.flush()
+        self.logger.debug(f"Copied {stream.n_rows} rows in {stream.n_chunks} chunks")
+        if on_chunk is not None:
+            return stream.n_rows
+        if len(chunks) == 0:
+            return LogArrays(
+                np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), self
+            )
+        return LogArrays(*(np.concatenate(arrays) for arrays in zip(*chunks)), self)
+
+    def read_frame(self, con, query: str, params: dict = None) -> pd.DataFrame:
+        """Read the result of a query into a pandas DataFrame
+
+        Args:
+            con (sqlalchemy connection object): connection to PostgreSQL
+            query (str): the SQL query, it may contain :named parameters
+            params (dict): the values of the query's named parameters. Default: None
+
+        Returns:
+            pandas DataFrame with the columns recvtimets (int64), attrname and attrvalue (str)
+        """
+        return self.read(con, query, params).to_frame()
+
+
+class _CopyStream:
+    """The file-like object copy_expert writes the rows into
+
+    The rows are collected until a chunk is complete, then parsed and passed on
+    """
+
+    def __init__(self, reader: CopyReader, handle_chunk):
+        self.reader = reader
+        self.handle_chunk = handle_chunk
+        self.parts = []
+        # PostgreSQL sends a row in each write, but the rows are split by the line breaks anyway
+        self.n_writes = 0
+        self.n_rows = 0
+        self.n_chunks = 0
+
+    def write(self, data: bytes):
+        self.parts.append(data)
+        self.n_writes += 1
+        if self.n_writes >= self.reader.chunk_size:
+            self.flush(final=False)
+
+    def flush(self, final: bool = True):
+        """Parse the collected complete rows in chunks
+
+        Args:
+            final (bool): if True, all rows are parsed, otherwise only complete chunks
+        """
+        lines = b"".join(self.parts).split(b"\n")
+        # the last item is an incomplete row or b""
+        rest = lines.pop()
+        chunk_size = self.reader.chunk_size
+        start = 0
+        while len(lines) - start >= chunk_size or (final and start < len(lines)):
+            chunk = lines[start:start + chunk_size]
+            start += len(chunk)
+            self.n_rows += len(chunk)
+            self.n_chunks += 1
+            self.handle_chunk(self.reader.parse_chunk(chunk))
+        remaining = lines[start:]
+        self.parts = [b"\n".join(remaining) + b"\n"] if remaining else []
+        if rest:
+            self.parts.append(rest)
+        self.n_writes = len(remaining) + len(self.parts) - 1 if remaining else len(self.parts)
@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+"""
+A set of functions for inspecting the Fiware Cygnus PostgreSQL tables that the OEE microservice reads
+
+The tables are found through the Workstation objects in Orion,
+the same way the OEECalculator finds them:
+each Workstation's table and the table of its current Job.
+
+Cygnus persists the attributes in one of two layouts (attr_persistence):
+    row: one row for each attribute of a notification, with the columns attrname and attrvalue
+    column: one row for each notification, with a column for each attribute
+The column-mode tables are read through a relation in the row-mode layout,
+see get_column_logs_relation.
+
+Cygnus names the tables according to its data model:
+    dm-by-entity: a table for each entity, named after the entity's id and type
+    dm-by-entity-type: a table for each entity type, shared by all entities of the type,
+        so the logs of an entity are filtered by the entityid column
+
+Environment variables (defaults are starred):
+    CYGNUS_ATTR_PERSISTENCE:
+        row*
+        column
+        auto: detected for each table from its columns
+    CYGNUS_DATA_MODEL:
+        dm-by-entity*
+        dm-by-entity-type
+"""
+# Standard Library imports
+from datetime import datetime
+import hashlib
+import os
+import statistics
+import time
+
+# PyPI packages
+import sqlalchemy
+
+# Custom imports
+from Logger import getLogger
+import Orion
+
+logger_Cygnus = getLogger(__name__)
+
+# PostgreSQL truncates identifiers longer than this
+MAX_IDENTIFIER_LENGTH = 63
+
+POSTGRES_SCHEMA = os.environ.get("POSTGRES_SCHEMA")
+if POSTGRES_SCHEMA is None:
+    POSTGRES_SCHEMA = "default_service"
+
+CYGNUS_ATTR_PERSISTENCE = os.environ.get("CYGNUS_ATTR_PERSISTENCE")
+if CYGNUS_ATTR_PERSISTENCE is None:
+    CYGNUS_ATTR_PERSISTENCE = "row"
+
+CYGNUS_DATA_MODEL = os.environ.get("CYGNUS_DATA_MODEL")
+if CYGNUS_DATA_MODEL is None:
+    CYGNUS_DATA_MODEL = "dm-by-entity"
+
+
+def get_postgres_table(orion_obj: dict, data_model: str = None) -> str:
+    """Get the table name of the PostgreSQL logs of an Orion object
+
+    The table names are set by Fiware Cygnus, this function just recreates the table name
+
+    Args:
+        orion_obj (dict): Orion object
+        data_model (str): "dm-by-entity" or "dm-by-entity-type". Default: CYGNUS_DATA_MODEL
+
+    Returns:
+        postgres table name (str)
+
+    Raises:
+        NotImplementedError:
+            if the data model is not supported
+    """
+    if data_model is None:
+        data_model = CYGNUS_DATA_MODEL
+    if data_model == "dm-by-entity":
+        return (
+            orion_obj["id"].replace(":", "_").lower() + "_" + orion_obj["type"].lower()
+        )
+    if data_model == "dm-by-entity-type":
+        return orion_obj["type"].lower()
+    raise NotImplementedError(f"Unsupported Cygnus data model: {data_model}")
+
+
+def quote_literal(value: str) -> str:
+    """Quote a string as an SQL literal
+
+    Used where the value is part of a relation that is embedded in other queries,
+    so it cannot be a bound parameter
+
+    Args:
+        value (str): the string
+
+    Returns:
+        the SQL literal (str)
+    """
+    return "'" + value.replace("'", "''") + "'"
+
+
+def get_entity_logs_relation(table_name: str, entity_id: str = None) -> str:
+    """Get the relation of an entity's logs in a row-mode table
+
+    Args:
+        table_name (str): PostgreSQL table name
+        entity_id (str): the entity's id if the table is shared by more entities. Default: None
+
+    Returns:
+        the relation (str) used in the from clause of the queries
+    """
+    if entity_id is None:
+        return f"{POSTGRES_SCHEMA}.{table_name}"
+    return f"""(select * from {POSTGRES_SCHEMA}.{table_name}
+                where entityid = {quote_literal(entity_id)}) as entity_logs"""
+
+
+def get_table_entities(workstations: list, data_model: str = None) -> dict:
+    """Get the tables of the Workstations and their current Jobs with the ids of the entities logged in them
+
+    Args:
+        workstations (list): the Workstation objects, see Orion.get_workstations
+        data_model (str): "dm-by-entity" or "dm-by-entity-type". Default: CYGNUS_DATA_MODEL
+
+    Returns:
+        dict: {table_name: [entity ids without duplicates]}
+        The Jobs that cannot be read from Orion are skipped
+    """
+    tables = {}
+    job_ids = []
+    for workstation in workstations:
+        tables.setdefault(get_postgres_table(workstation, data_model), []).append(workstation["id"])
+        try:
+            job_ids.append(workstation["refJob"]["value"])
+        except (KeyError, TypeError) as error:
+            logger_Cygnus.warning(f'The workstation {workstation["id"]} has no Job: {error}')
+    # the Jobs' types are needed for their tables, they are downloaded together
+    try:
+        jobs = Orion.get_objects(job_ids) if job_ids else []
+    except (RuntimeError, ValueError) as error:
+        logger_Cygnus.warning(f"The Jobs of the workstations cannot be read: {error}")
+        jobs = []
+    for job in jobs:
+        tables.setdefault(get_postgres_table(job, data_model), []).append(job["id"])
+    return {table_name: list(dict.fromkeys(entity_ids)) for table_name, entity_ids in tables.items()}
+
+
+def get_identifier(table_name: str, suffix: str) -> str:
+    """Get the name of an object derived from a Cygnus table, like an index or a mirror table
+
+    If the name would be too long for PostgreSQL,
+    the table name is shortened and a hash is appended to keep it unique
+
+    Args:
+        table_name (str): PostgreSQL table name
+        suffix (str): the suffix appended to the table name
+
+    Returns:
+        identifier (str)
+    """
+    identifier = table_name + suffix
+    if len(identifier) <= MAX_IDENTIFIER_LENGTH:
+        return identifier
+    digest = hashlib.md5(table_name.encode()).hexdigest()[:8]
+    keep = MAX_IDENTIFIER_LENGTH - len(suffix) - len(digest) - 1
+    return f"{table_name[:keep]}_{digest}{suffix}"
+
+
+def get_service_tables() -> list:
+    """Get the names of the Cygnus tables that the OEE microservice reads
+
+    Returns:
+        list of the table names of all Workstations and their current Jobs, without duplicates
+
+    Raises:
+        RuntimeError: if an Orion request fails
+        KeyError or TypeError: if a Workstation has no valid refJob attribute
+    """
+    tables = []
+    for workstation in Orion.get_workstations():
+        tables.append(get_postgres_table(workstation))
+        try:
+            job_id = workstation["refJob"]["value"]
+        except (KeyError, TypeError) as error:
+            raise error.__class__(
+                f'The workstation object {workstation["id"]} has no valid RefJob attribute'
+            ) from error
+        tables.append(get_postgres_table(Orion.get(job_id)))
+    return list(dict.fromkeys(tables))
+
+
+def table_exists(con, table_name: str) -> bool:
+    """Check if a table exists in the POSTGRES_SCHEMA
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        table_name (str): PostgreSQL table name
+
+    Returns:
+        True if the table exists, False otherwise
+    """
+    query = "select to_regclass(:table) is not null;"
+    return bool(
+        con.execute(
+            sqlalchemy.text(query), {"table": f"{POSTGRES_SCHEMA}.{table_name}"}
+        ).scalar()
+    )
+
+
+def get_schema_tables(con) -> list:
+    """Get the names of all Cygnus tables in the POSTGRES_SCHEMA
+
+    A table is considered a Cygnus table if it has the columns recvtimets, attrname and attrvalue
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+
+    Returns:
+        list of the table names in alphabetical order
+    """
+    query = """select table_name from information_schema.columns
+               where table_schema = :schema
+               and column_name in ('recvtimets', 'attrname', 'attrvalue')
+               group by table_name having count(*) = 3
+               order by table_name;"""
+    return [
+        row[0] for row in con.execute(sqlalchemy.text(query), {"schema": POSTGRES_SCHEMA})
+    ]
+
+
+def get_table_columns(con, table_name: str) -> list:
+    """Get the column names of a table in the POSTGRES_SCHEMA
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        table_name (str): PostgreSQL table name
+
+    Returns:
+        list of the column names in their order, empty if the table does not exist
+    """
+    query = """select column_name from information_schema.columns
+               where table_schema = :schema and table_name = :table
+               order by ordinal_position;"""
+    return [
+        row[0]
+        for row in con.execute(sqlalchemy.text(query), {"schema": POSTGRES_SCHEMA, "table": table_name})
+    ]
+
+
+def get_attr_persistence(con, table_name: str, attr_persistence: str = None) -> str:
+    """Get the attr_persistence of a Cygnus table
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        table_name (str): PostgreSQL table name
+        attr_persistence (str): "row", "column" or "auto". Default: CYGNUS_ATTR_PERSISTENCE
+
+    Returns:
+        "row" or "column"
+        In the "auto" mode, a table is in the row mode if it has the columns attrname and attrvalue
+        or it does not exist, otherwise it is in the column mode
+
+    Raises:
+        NotImplementedError:
+            if the attr_persistence is not supported
+    """
+    if attr_persistence is None:
+        attr_persistence = CYGNUS_ATTR_PERSISTENCE
+    if attr_persistence in ("row", "column"):
+        return attr_persistence
+    if attr_persistence != "auto":
+        raise NotImplementedError(f"Unsupported Cygnus attr_persistence: {attr_persistence}")
+    columns = get_table_columns(con, table_name)
+    if len(columns) == 0 or {"attrname", "attrvalue"}.issubset(columns):
+        return "row"
+    return "column"
+
+
+def get_column_logs_relation(con, table_name: str, attributes: tuple, entity_id: str = None) -> str:
+    """Get a relation of a column-mode table in the row-mode layout
+
+    Each attribute column is unpivoted into rows of (recvtimets, attrname, attrvalue),
+    skipping the NULL values of the attributes missing from a notification.
+    recvtimets is calculated from recvTime, which Cygnus writes in UTC.
+    The values are cast to text, like in the row-mode tables.
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        table_name (str): PostgreSQL table name of the column-mode table
+        attributes (tuple): the attribute names to unpivot, the missing columns are skipped
+        entity_id (str): the entity's id if the table is shared by more entities. Default: None
+
+    Returns:
+        the relation (str) used in the from clause of the queries,
+        its columns are recvtimets (bigint), attrname, attrvalue and entityid (text)
+
+    Raises:
+        ValueError:
+            if the table has no recvTime or entityId column or none of the attribute columns
+    """
+    # Cygnus creates the columns unquoted, so they are lowercase, but the original case is accepted too
+    columns = {column.lower(): column for column in get_table_columns(con, table_name)}
+    for column in ("recvtime", "entityid"):
+        if column not in columns:
+            raise ValueError(f"The column-mode table: {table_name} has no {column} column")
+    values = ", ".join(
+        f"""('{attribute}', cast ("{columns[attribute.lower()]}" as text))"""
+        for attribute in attributes
+        if attribute.lower() in columns
+    )
+    if values == "":
+        raise ValueError(f"The column-mode table: {table_name} has none of the attributes: {attributes}")
+    # a timestamp without time zone ignores the zone of the text, then it is interpreted as UTC
+    recvtimets = f"""cast (extract(epoch from cast ("{columns['recvtime']}" as timestamp) at time zone 'UTC') * 1000 as bigint)"""
+    entity_filter = ""
+    if entity_id is not None:
+        entity_filter = f"""and "{columns['entityid']}" = {quote_literal(entity_id)}"""
+    return f"""(select {recvtimets} as recvtimets, unpivoted.attrname, unpivoted.attrvalue,
+                "{columns['entityid']}" as entityid
+                from {POSTGRES_SCHEMA}.{table_name}
+                cross join lateral (values {values}) as unpivoted (attrname, attrvalue)
+                where unpivoted.attrvalue is not null {entity_filter}) as column_logs"""
+
+
+def get_table_statistics(con, table_name: str) -> dict:
+    """Get the size and the scan statistics of a table
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        table_name (str): PostgreSQL table name
+
+    Returns:
+        dict with the following keys:
+            total_bytes: size of the table including its indexes and toast
+            n_live_tup: estimated number of rows
+            seq_scan: number of sequential scans since the statistics reset
+            seq_tup_read: number of rows read by sequential scans
+            idx_scan: number of index scans
+        or None if the table does not exist
+    """
+    query = """select pg_total_relation_size(c.oid) as total_bytes,
+               s.n_live_tup, s.seq_scan, s.seq_tup_read, s.idx_scan
+               from pg_class c
+               join pg_namespace n on n.oid = c.relnamespace
+               left join pg_stat_user_tables s on s.relid = c.oid
+               where n.nspname = :schema and c.relname = :table;"""
+    row = con.execute(
+        sqlalchemy.text(query), {"schema": POSTGRES_SCHEMA, "table": table_name}
+    ).fetchone()
+    if row is None:
+        return None
+    return dict(row._mapping)
+
+
+def get_todays_window() -> tuple:
+    """Get today's query window in milliseconds, just like the OEECalculator's "from_midnight" queries
+
+    Returns:
+        (midnight, now) timestamps in milliseconds (int), see OEECalculator.datetime_to_milliseconds
+    """
+    now = datetime.now()
+    midnight = datetime.combine(now.date(), datetime.min.time())
+    return round(midnight.timestamp() * 1e3), round(now.timestamp() * 1e3)
+
+
+def get_benchmark_queries(table_name: str) -> dict:
+    """Get queries with the same predicates as the OEECalculator's queries
+
+    Args:
+        table_name (str): PostgreSQL table name
+
+    Returns:
+        dict of the query name and the query (str)
+    """
+    midnight, now = get_todays_window()
+    table = f"{POSTGRES_SCHEMA}.{table_name}"
+    window = f"""{midnight} <= cast (recvtimets as bigint)
+                and cast (recvtimets as bigint) <= {now}"""
+    return {
+        "todays_data": f"select * from {table} where {window};",
+        "attribute_window": f"select * from {table} where attrname = 'available' and {window};",
+        "boundary_row": f"""select * from {table} where attrname = 'refJob' and {window}
+                            order by cast (recvtimets as bigint) desc limit 1;""",
+    }
+
+
+def time_query(con, query: str, repeat: int = 3) -> float:
+    """Measure the latency of a query
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        query (str): the SQL query
+        repeat (int): the number of runs. Default: 3
+
+    Returns:
+        the median latency in milliseconds (float)
+    """
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        con.execute(sqlalchemy.text(query)).fetchall()
+        latencies.append((time.perf_counter() - start) * 1e3)
+    return statistics.median(latencies)
+
+
+def time_benchmark_queries(con, table_name: str) -> dict:
+    """Measure the latency of the benchmark queries of a table
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        table_name (str): PostgreSQL table name
+
+    Returns:
+        dict of the query name and its median latency in milliseconds
+    """
+    return {
+        name: time_query(con, query)
+        for name, query in get_benchmark_queries(table_name).items()
+    }
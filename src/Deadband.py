@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""Deadband suppression of the Orion attribute writes
+
+Each loop writes the KPI attributes of every Workstation, even if they did not change,
+and each write makes Orion notify Cygnus, that logs yet more rows.
+The DeadbandFilter remembers the last value written into each attribute,
+and a write is suppressed if the new value is within the deadband of the last one:
+    numbers: |new - last| <= DEADBAND_ABSOLUTE or |new - last| <= DEADBAND_RELATIVE * |last|
+    dicts (the OEE object): the same keys, each value within the deadband
+    other values (None, str, bool): equal
+An attribute is written anyway if it has not been written for DEADBAND_MAX_STALENESS seconds,
+so the consumers can tell a stale value from a dead service.
+
+Environment variables (defaults are starred):
+    DEADBAND:
+        TRUE
+        FALSE*
+    DEADBAND_ABSOLUTE:
+        0.000001*
+    DEADBAND_RELATIVE:
+        0*
+    DEADBAND_MAX_STALENESS: seconds
+        600*
+"""
+# Standard Library imports
+import copy
+import os
+import threading
+import time
+
+# Custom imports
+from Logger import getLogger
+
+DEADBAND = os.environ.get("DEADBAND")
+if DEADBAND is None:
+    DEADBAND = False
+elif DEADBAND.lower() == "true":
+    DEADBAND = True
+else:
+    DEADBAND = False
+
+DEADBAND_ABSOLUTE = os.environ.get("DEADBAND_ABSOLUTE")
+if DEADBAND_ABSOLUTE is None:
+    DEADBAND_ABSOLUTE = 1e-6
+else:
+    DEADBAND_ABSOLUTE = float(DEADBAND_ABSOLUTE)
+
+DEADBAND_RELATIVE = os.environ.get("DEADBAND_RELATIVE")
+if DEADBAND_RELATIVE is None:
+    DEADBAND_RELATIVE = 0
+else:
+    DEADBAND_RELATIVE = float(DEADBAND_RELATIVE)
+
+DEADBAND_MAX_STALENESS = os.environ.get("DEADBAND_MAX_STALENESS")
+if DEADBAND_MAX_STALENESS is None:
+    DEADBAND_MAX_STALENESS = 600
+else:
+    DEADBAND_MAX_STALENESS = float(DEADBAND_MAX_STALENESS)
+
+
+def is_number(value) -> bool:
+    """Check if a value is a number, but not a bool
+
+    Args:
+        value: the value
+
+    Returns:
+        True if the value is an int or a float, False otherwise
+    """
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def within_deadband(last, new, absolute: float, relative: float) -> bool:
+    """Check if a new value is within the deadband of the last one
+
+    Args:
+        last: the last written value
+        new: the new value
+        absolute (float): the absolute deadband
+        relative (float): the deadband relative to the last value
+
+    Returns:
+        True if the write can be suppressed, False otherwise
+    """
+    if is_number(last) and is_number(new):
+        difference = abs(new - last)
+        return difference <= absolute or difference <= relative * abs(last)
+    if isinstance(last, dict) and isinstance(new, dict):
+        if last.keys() != new.keys():
+            return False
+        return all(within_deadband(last[key], new[key], absolute, relative) for key in last)
+    return type(last) is type(new) and last == new
+
+
+class DeadbandFilter:
+    """Decide which attribute writes can be suppressed, and count them
+
+    The DeadbandFilter outlives the LoopHandlers, so the last written values are kept between the loops.
+
+    Common usage:
+        if not deadband.suppress(object_id, attribute_name, value):
+            Orion.update_attribute(object_id, attribute_name, attribute_type, value)
+            deadband.written(object_id, attribute_name, value)
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(
+        self,
+        absolute: float = DEADBAND_ABSOLUTE,
+        relative: float = DEADBAND_RELATIVE,
+        max_staleness: float = DEADBAND_MAX_STALENESS,
+    ):
+        """The constructor of the DeadbandFilter class
+
+        Args:
+            absolute (float): the absolute deadband
+            relative (float): the deadband relative to the last value
+            max_staleness (float): the seconds after which an attribute is written anyway
+        """
+        self.absolute = absolute
+        self.relative = relative
+        self.max_staleness = max_staleness
+        # format: {(object_id, attribute_name): (value, time.monotonic of the write)}
+        self.last = {}
+        self.counts = {"written": 0, "suppressed": 0, "heartbeats": 0}
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return (
+            f"DeadbandFilter(absolute={self.absolute}, relative={self.relative}, "
+            f"max_staleness={self.max_staleness})"
+        )
+
+    def suppress(self, object_id: str, attribute_name: str, value) -> bool:
+        """Check if the write of an attribute can be suppressed
+
+        A suppressed write is counted.
+
+        Args:
+            object_id (str): the object's id in Orion
+            attribute_name (str): the attribute's name
+            value: the new value
+
+        Returns:
+            True if the write can be suppressed, False if it must be written
+        """
+        with self.lock:
+            last = self.last.get((object_id, attribute_name))
+            if last is None:
+                return False
+            last_value, written_at = last
+            if not within_deadband(last_value, value, self.absolute, self.relative):
+                return False
+            if time.monotonic() - written_at >= self.max_staleness:
+                self.counts["heartbeats"] += 1
+                return False
+            self.counts["suppressed"] += 1
+        self.logger.debug(f"Suppressed the write of {object_id} {attribute_name}: {value}")
+        return True
+
+    def written(self, object_id: str, attribute_name: str, value):
+        """Remember a written value
+
+        Args:
+            object_id (str): the object's id in Orion
+            attribute_name (str): the attribute's name
+            value: the written value
+        """
+        with self.lock:
+            self.last[(object_id, attribute_name)] = (copy.deepcopy(value), time.monotonic())
+            self.counts["written"] += 1
+
+    def get_counts(self) -> dict:
+        """Get the number of the written and suppressed writes
+
+        Returns:
+            dict: written, suppressed and heartbeats (the writes forced by max_staleness)
+        """
+        with self.lock:
+            return dict(self.counts)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""A maintenance command for the indexes of the Cygnus log tables
+
+Cygnus creates its tables with text columns only and without any index
+that would help the OEE microservice's queries.
+The IndexAdvisor reports the size and the scan statistics of the tables
+the microservice reads and, if enabled, creates an expression index on each of them
+that matches the microservice's predicates:
+    (attrname, cast (recvtimets as bigint))
+
+The indexes are created concurrently, so Cygnus can keep writing the tables.
+Running the command again is safe: existing valid indexes are kept,
+the invalid leftovers of an interrupted concurrent build are rebuilt.
+The latency of the benchmark queries (see Cygnus.get_benchmark_queries)
+is reported before and after the index creation.
+
+Usage (from the src directory, with the environment variables of the microservice):
+    python IndexAdvisor.py
+
+Environment variables:
+    CREATE_INDEXES:
+        TRUE
+        FALSE*
+"""
+# Standard Library imports
+import os
+
+# PyPI packages
+import sqlalchemy
+
+# Custom imports
+import Cygnus
+from Logger import getLogger
+from LoopHandler import LoopHandler
+
+logger_IndexAdvisor = getLogger(__name__)
+
+INDEX_SUFFIX = "_attrname_ts_idx"
+
+CREATE_INDEXES = os.environ.get("CREATE_INDEXES")
+if CREATE_INDEXES is None:
+    CREATE_INDEXES = False
+elif CREATE_INDEXES.lower() == "true":
+    CREATE_INDEXES = True
+else:
+    CREATE_INDEXES = False
+
+
+def get_index_name(table_name: str) -> str:
+    """Get the name of the IndexAdvisor's index of a table
+
+    Args:
+        table_name (str): PostgreSQL table name
+
+    Returns:
+        index name (str)
+    """
+    return Cygnus.get_identifier(table_name, INDEX_SUFFIX)
+
+
+def get_index_state(con, table_name: str) -> str:
+    """Get the state of the IndexAdvisor's index of a table
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        table_name (str): PostgreSQL table name
+
+    Returns:
+        "missing", "valid" or "invalid"
+        An index is invalid if its concurrent build was interrupted
+    """
+    query = """select i.indisvalid from pg_index i
+               join pg_class c on c.oid = i.indexrelid
+               join pg_namespace n on n.oid = c.relnamespace
+               where n.nspname = :schema and c.relname = :index;"""
+    is_valid = con.execute(
+        sqlalchemy.text(query),
+        {"schema": Cygnus.POSTGRES_SCHEMA, "index": get_index_name(table_name)}
+    ).scalar()
+    if is_valid is None:
+        return "missing"
+    return "valid" if is_valid else "invalid"
+
+
+def create_index(con, table_name: str):
+    """Create the IndexAdvisor's index of a table concurrently
+
+    The connection must be in autocommit mode,
+    because PostgreSQL cannot build an index concurrently inside a transaction block.
+    An invalid index is dropped and rebuilt, a valid one is kept.
+
+    Args:
+        con (sqlalchemy connection object): autocommit connection to PostgreSQL
+        table_name (str): PostgreSQL table name
+    """
+    schema = Cygnus.POSTGRES_SCHEMA
+    index_name = get_index_name(table_name)
+    if get_index_state(con, table_name) == "invalid":
+        logger_IndexAdvisor.warning(f"Dropping invalid index: {schema}.{index_name}")
+        con.execute(sqlalchemy.text(f"drop index concurrently if exists {schema}.{index_name};"))
+    logger_IndexAdvisor.info(f"Creating index: {schema}.{index_name}")
+    con.execute(
+        sqlalchemy.text(
+            f"""create index concurrently if not exists {index_name}
+                on {schema}.{table_name} (attrname, (cast (recvtimets as bigint)));"""
+        )
+    )
+    # refresh the statistics of the indexed expression for the planner
+    con.execute(sqlalchemy.text(f"analyze {schema}.{table_name};"))
+
+
+def advise(engine, create: bool = CREATE_INDEXES) -> list:
+    """Report the state of the Cygnus tables the OEE microservice reads and create the missing indexes
+
+    Args:
+        engine (sqlalchemy engine): engine of the PostgreSQL database
+        create (bool): if True, the missing or invalid indexes are created. Default: CREATE_INDEXES
+
+    Returns:
+        list of dicts, one for each table, with the following keys:
+            table: table name
+            statistics: see Cygnus.get_table_statistics
+            index: index state before the creation, see get_index_state
+            latency_before: see Cygnus.time_benchmark_queries
+            latency_after: the same after the index creation, None if no index was created
+
+    Raises:
+        RuntimeError, KeyError or TypeError: if the tables cannot be found through Orion
+    """
+    reports = []
+    with engine.connect() as con:
+        con = con.execution_options(isolation_level="AUTOCOMMIT")
+        for table_name in Cygnus.get_service_tables():
+            if not Cygnus.table_exists(con, table_name):
+                logger_IndexAdvisor.warning(f"The table {Cygnus.POSTGRES_SCHEMA}.{table_name} does not exist, skipping")
+                continue
+            report = {
+                "table": table_name,
+                "statistics": Cygnus.get_table_statistics(con, table_name),
+                "index": get_index_state(con, table_name),
+                "latency_before": Cygnus.time_benchmark_queries(con, table_name),
+                "latency_after": None,
+            }
+            if create and report["index"] != "valid":
+                create_index(con, table_name)
+                report["latency_after"] = Cygnus.time_benchmark_queries(con, table_name)
+            logger_IndexAdvisor.info(f"Index report: {report}")
+            reports.append(report)
+    return reports
+
+
+def main():
+    """Run the IndexAdvisor on the Cygnus tables of all Workstations"""
+    engine = LoopHandler.create_postgres_engine()
+    try:
+        for report in advise(engine):
+            statistics = report["statistics"]
+            print(
+                f'{report["table"]}: {statistics["total_bytes"]} bytes, ~{statistics["n_live_tup"]} rows, '
+                f'seq_scan: {statistics["seq_scan"]}, idx_scan: {statistics["idx_scan"]}, index: {report["index"]}'
+            )
+            for name, latency in report["latency_before"].items():
+                line = f"    {name}: {latency:.2f} ms"
+                if report["latency_after"] is not None:
+                    line += f' -> {report["latency_after"][name]:.2f} ms'
+                print(line)
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
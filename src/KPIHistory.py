@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""A typed history of the KPIs calculated in each loop
+
+The LoopHandler overwrites the KPIs of the Workstations in Orion,
+so the KPIs of each loop are also appended to a narrow typed table:
+    recvtime timestamptz: the start of the loop
+    workstation text: the Workstation's Orion id
+    availability, performance, quality, oee, throughput double precision:
+        NULL if the KPIs could not be calculated
+The table is partitioned by UTC days, the table and its partitions are created automatically.
+
+The rows of a loop are buffered and written with a single COPY after the loop.
+If the write fails, the rows are kept and written after the next loop,
+but at most KPI_HISTORY_MAX_ROWS rows are kept, the oldest are dropped.
+
+Environment variables (defaults are starred):
+    KPI_HISTORY:
+        TRUE
+        FALSE*
+    KPI_HISTORY_TABLE:
+        oee_kpi_history*
+    KPI_HISTORY_MAX_ROWS:
+        100000*
+"""
+# Standard Library imports
+import csv
+from datetime import datetime, timedelta, timezone
+import io
+import os
+
+# PyPI packages
+import sqlalchemy
+
+# Custom imports
+import Cygnus
+from Logger import getLogger
+
+KPI_HISTORY = os.environ.get("KPI_HISTORY")
+if KPI_HISTORY is None:
+    KPI_HISTORY = False
+elif KPI_HISTORY.lower() == "true":
+    KPI_HISTORY = True
+else:
+    KPI_HISTORY = False
+
+KPI_HISTORY_TABLE = os.environ.get("KPI_HISTORY_TABLE")
+if KPI_HISTORY_TABLE is None:
+    KPI_HISTORY_TABLE = "oee_kpi_history"
+
+KPI_HISTORY_MAX_ROWS = os.environ.get("KPI_HISTORY_MAX_ROWS")
+if KPI_HISTORY_MAX_ROWS is None:
+    KPI_HISTORY_MAX_ROWS = 100000
+else:
+    KPI_HISTORY_MAX_ROWS = int(KPI_HISTORY_MAX_ROWS)
+
+KPIS = ("availability", "performance", "quality", "oee")
+COLUMNS = ("recvtime", "workstation") + KPIS + ("throughput",)
+
+
+def get_partition(table_name: str, day: datetime) -> str:
+    """Get the name of the partition of a day
+
+    Args:
+        table_name (str): the name of the history table
+        day (datetime): a date in UTC
+
+    Returns:
+        the partition's name (str)
+    """
+    return Cygnus.get_identifier(table_name, f"_p{day:%Y%m%d}")
+
+
+def create_history_table(con, table_name: str):
+    """Create the history table partitioned by recvtime, if it does not exist
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        table_name (str): the name of the history table
+    """
+    con.execute(
+        sqlalchemy.text(
+            f"""create table if not exists {Cygnus.POSTGRES_SCHEMA}.{table_name} (
+                recvtime timestamptz not null,
+                workstation text not null,
+                availability double precision,
+                performance double precision,
+                quality double precision,
+                oee double precision,
+                throughput double precision)
+                partition by range (recvtime);"""
+        )
+    )
+
+
+def create_day_partition(con, table_name: str, day: datetime) -> str:
+    """Create the partition of a UTC day, if it does not exist
+
+    The partition is indexed by (workstation, recvtime) for the trends of a Workstation.
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        table_name (str): the name of the history table
+        day (datetime): the UTC day, only its date is used
+
+    Returns:
+        the partition's name (str)
+    """
+    start = datetime.combine(day.date(), datetime.min.time(), tzinfo=timezone.utc)
+    end = start + timedelta(days=1)
+    partition = get_partition(table_name, start)
+    schema = Cygnus.POSTGRES_SCHEMA
+    con.execute(
+        sqlalchemy.text(
+            f"""create table if not exists {schema}.{partition}
+                partition of {schema}.{table_name}
+                for values from ('{start.isoformat()}') to ('{end.isoformat()}');"""
+        )
+    )
+    con.execute(
+        sqlalchemy.text(
+            f"""create index if not exists {Cygnus.get_identifier(partition, "_idx")}
+                on {schema}.{partition} (workstation, recvtime);"""
+        )
+    )
+    return partition
+
+
+class KPIHistory:
+    """Buffer the KPIs of a loop and append them to the history table
+
+    The KPIHistory outlives the LoopHandlers, so the rows of a failed write are kept.
+
+    Common usage:
+        history.add(timestamp, workstation_id, oee, throughput)
+        ...
+        history.flush(con)
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, table_name: str = KPI_HISTORY_TABLE, max_rows: int = KPI_HISTORY_MAX_ROWS):
+        """The constructor of the KPIHistory class
+
+        Args:
+            table_name (str): the name of the history table
+            max_rows (int): the maximum number of buffered rows
+        """
+        self.table_name = table_name
+        self.max_rows = max_rows
+        # the rows to be written, in the order of COLUMNS
+        self.rows = []
+        # the days whose partitions exist, so they are not created in each loop
+        self.days = set()
+
+    def __repr__(self):
+        return f"KPIHistory(table_name={self.table_name}, max_rows={self.max_rows})"
+
+    def add(self, timestamp: datetime, workstation_id: str, oee: dict = None, throughput: float = None):
+        """Buffer the KPIs of a Workstation
+
+        Args:
+            timestamp (datetime): the time of the loop, timezone aware
+            workstation_id (str): the Workstation's Orion id
+            oee (dict): the OEE object, see OEECalculator.OEE_template. Default: None, the KPIs are NULL
+            throughput (float): the throughput per shift. Default: None
+        """
+        if oee is None:
+            oee = {}
+        self.rows.append((timestamp, workstation_id) + tuple(oee.get(kpi) for kpi in KPIS) + (throughput,))
+        if len(self.rows) > self.max_rows:
+            n_dropped = len(self.rows) - self.max_rows
+            self.logger.warning(f"The KPI history buffer is full, dropping the oldest {n_dropped} rows")
+            del self.rows[:n_dropped]
+
+    def get_csv(self) -> io.StringIO:
+        """Format the buffered rows for COPY
+
+        Returns:
+            the rows in CSV (io.StringIO), a None is an unquoted empty field, that is NULL
+        """
+        stream = io.StringIO()
+        writer = csv.writer(stream)
+        for row in self.rows:
+            writer.writerow(
+                [row[0].isoformat(), row[1]] + ["" if value is None else repr(float(value)) for value in row[2:]]
+            )
+        stream.seek(0)
+        return stream
+
+    def flush(self, con) -> int:
+        """Write the buffered rows with a single COPY in a transaction
+
+        The table and the partitions of the rows' days are created first.
+        If the write fails, the rows are kept.
+
+        Args:
+            con (sqlalchemy connection object): connection to PostgreSQL, not in a transaction
+
+        Returns:
+            the number of rows written (int)
+
+        Raises:
+            psycopg2 or sqlalchemy errors:
+                if the write fails
+        """
+        if len(self.rows) == 0:
+            return 0
+        days = {row[0].astimezone(timezone.utc).date() for row in self.rows}
+        new_days = days - self.days
+        with con.begin():
+            if new_days:
+                create_history_table(con, self.table_name)
+                for day in sorted(new_days):
+                    create_day_partition(con, self.table_name, datetime.combine(day, datetime.min.time()))
+            cursor = con.connection.cursor()
+            try:
+                cursor.copy_expert(
+                    f"""copy {Cygnus.POSTGRES_SCHEMA}.{self.table_name} ({", ".join(COLUMNS)})
+                        from stdin with (format csv)""",
+                    self.get_csv(),
+                )
+            finally:
+                cursor.close()
+        self.days.update(new_days)
+        n_rows = len(self.rows)
+        self.rows = []
+        self.logger.debug(f"Wrote {n_rows} rows into the KPI history table: {self.table_name}")
+        return n_rows
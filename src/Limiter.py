@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""Adaptive concurrency limits of the requests sent to Orion and PostgreSQL
+
+The loop, the background publisher and the API share the Orion client and the query paths,
+so a fixed number of parallel requests either underuses Orion and PostgreSQL,
+or overloads them when Cygnus writes many logs at once.
+An AdaptiveLimiter bounds the number of in-flight requests with additive increase, multiplicative decrease:
+    a request finished within LIMIT_LATENCY_TOLERANCE times the baseline latency
+        increases the limit by 1, if at least half of the limit was used
+    a request overloading the server (5xx response, timeout, connection error)
+    or slower than LIMIT_LATENCY_TOLERANCE times the baseline latency
+        multiplies the limit by LIMIT_BACKOFF_RATIO
+The limit stays between LIMIT_MIN and LIMIT_MAX.
+The baseline latency is the exponential moving average of the latencies of the successful requests,
+so it follows a slow drift, but not a sudden rise.
+A baseline is kept for each class of requests, like Orion's method and endpoint or the PostgreSQL query class,
+and a request is compared with the baseline of its own class.
+Otherwise the requests of a slow class would look like a rising latency of the fast ones,
+and shrink the limit down to LIMIT_MIN.
+A request waits while the limit is reached.
+
+Environment variables (defaults are starred):
+    ADAPTIVE_LIMIT:
+        TRUE
+        FALSE*
+    LIMIT_INITIAL:
+        4*
+    LIMIT_MIN:
+        1*
+    LIMIT_MAX:
+        64*
+    LIMIT_LATENCY_TOLERANCE:
+        2*
+    LIMIT_BACKOFF_RATIO:
+        0.7*
+"""
+# Standard Library imports
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+# Custom imports
+from Logger import getLogger
+
+ADAPTIVE_LIMIT = os.environ.get("ADAPTIVE_LIMIT")
+if ADAPTIVE_LIMIT is None:
+    ADAPTIVE_LIMIT = False
+elif ADAPTIVE_LIMIT.lower() == "true":
+    ADAPTIVE_LIMIT = True
+else:
+    ADAPTIVE_LIMIT = False
+
+LIMIT_INITIAL = os.environ.get("LIMIT_INITIAL")
+if LIMIT_INITIAL is None:
+    LIMIT_INITIAL = 4
+else:
+    LIMIT_INITIAL = int(LIMIT_INITIAL)
+
+LIMIT_MIN = os.environ.get("LIMIT_MIN")
+if LIMIT_MIN is None:
+    LIMIT_MIN = 1
+else:
+    LIMIT_MIN = int(LIMIT_MIN)
+
+LIMIT_MAX = os.environ.get("LIMIT_MAX")
+if LIMIT_MAX is None:
+    LIMIT_MAX = 64
+else:
+    LIMIT_MAX = int(LIMIT_MAX)
+
+LIMIT_LATENCY_TOLERANCE = os.environ.get("LIMIT_LATENCY_TOLERANCE")
+if LIMIT_LATENCY_TOLERANCE is None:
+    LIMIT_LATENCY_TOLERANCE = 2
+else:
+    LIMIT_LATENCY_TOLERANCE = float(LIMIT_LATENCY_TOLERANCE)
+
+LIMIT_BACKOFF_RATIO = os.environ.get("LIMIT_BACKOFF_RATIO")
+if LIMIT_BACKOFF_RATIO is None:
+    LIMIT_BACKOFF_RATIO = 0.7
+else:
+    LIMIT_BACKOFF_RATIO = float(LIMIT_BACKOFF_RATIO)
+
+# the weight of a new latency in the baseline latency
+BASELINE_SMOOTHING = 0.1
+
+# the class of the requests sent without one
+DEFAULT_REQUEST_CLASS = "default"
+
+
+class AdaptiveLimiter:
+    """Limit the number of in-flight requests to a server, adapting the limit to its latency and errors
+
+    Common usage:
+        with limiter.limit("GET /v2/entities") as slot:
+            response = requests.get(url)
+            slot["overloaded"] = response.status_code >= 500
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(
+        self,
+        name: str,
+        initial: int = LIMIT_INITIAL,
+        min_limit: int = LIMIT_MIN,
+        max_limit: int = LIMIT_MAX,
+        tolerance: float = LIMIT_LATENCY_TOLERANCE,
+        backoff_ratio: float = LIMIT_BACKOFF_RATIO,
+    ):
+        """The constructor of the AdaptiveLimiter class
+
+        Args:
+            name (str): the name of the server, used in the logs
+            initial (int): the initial limit
+            min_limit (int): the minimum limit
+            max_limit (int): the maximum limit
+            tolerance (float): the latency above tolerance times the baseline latency decreases the limit
+            backoff_ratio (float): the limit is multiplied by this when decreased
+
+        Raises:
+            ValueError: if the limits are inconsistent
+        """
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError(f"Invalid limits of {name}: min: {min_limit}, max: {max_limit}")
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff_ratio = backoff_ratio
+        self.limit_ = float(min(max(initial, min_limit), max_limit))
+        self.in_flight = 0
+        # the baseline latency of each request class in seconds, format: {request_class: float}
+        self.baselines = {}
+        self.metrics = {"increases": 0, "decreases": 0, "throttled": 0, "max_in_flight": 0}
+        self.condition = threading.Condition()
+
+    def __repr__(self):
+        return (
+            f"AdaptiveLimiter(name={self.name!r}, min_limit={self.min_limit}, max_limit={self.max_limit}, "
+            f"tolerance={self.tolerance}, backoff_ratio={self.backoff_ratio})"
+        )
+
+    def get_limit(self) -> int:
+        """Get the current limit
+
+        Returns:
+            the number of requests allowed in flight (int)
+        """
+        return int(self.limit_)
+
+    def acquire(self):
+        """Wait until a request is allowed, then count it as in flight"""
+        with self.condition:
+            if self.in_flight >= self.get_limit():
+                self.metrics["throttled"] += 1
+                self.condition.wait_for(lambda: self.in_flight < self.get_limit())
+            self.in_flight += 1
+            self.metrics["max_in_flight"] = max(self.metrics["max_in_flight"], self.in_flight)
+
+    def release(self, latency: float = None, overloaded: bool = False, request_class: str = DEFAULT_REQUEST_CLASS):
+        """Count a request as finished and adapt the limit
+
+        Args:
+            latency (float): the seconds the request took. Default: None, the limit is not adapted
+            overloaded (bool): whether the server was overloaded. Default: False
+            request_class (str): the class of the request, whose baseline latency is compared. Default: "default"
+        """
+        with self.condition:
+            utilised = self.in_flight * 2 >= self.get_limit()
+            self.in_flight -= 1
+            baseline = self.baselines.get(request_class)
+            if overloaded or (latency is not None and baseline is not None and latency > self.tolerance * baseline):
+                self.decrease()
+            elif latency is not None:
+                if baseline is None:
+                    self.baselines[request_class] = latency
+                else:
+                    self.baselines[request_class] = baseline + BASELINE_SMOOTHING * (latency - baseline)
+                if utilised and self.limit_ < self.max_limit:
+                    self.limit_ = min(self.limit_ + 1, self.max_limit)
+                    self.metrics["increases"] += 1
+            self.condition.notify_all()
+
+    def decrease(self):
+        """Decrease the limit multiplicatively. The caller holds the condition."""
+        limit = max(self.limit_ * self.backoff_ratio, self.min_limit)
+        if int(limit) < self.get_limit():
+            self.logger.info(f"Decreased the concurrency limit of {self.name}: {self.get_limit()} -> {int(limit)}")
+        self.limit_ = limit
+        self.metrics["decreases"] += 1
+
+    @contextmanager
+    def limit(self, request_class: str = DEFAULT_REQUEST_CLASS):
+        """Run a request in the block within the limit
+
+        If the block raises an exception, the limit is not adapted, unless the block marked the slot overloaded.
+
+        Args:
+            request_class (str): the class of the request, see release. Default: "default"
+
+        Yields:
+            dict: the block sets its "overloaded" key to True if the server was overloaded
+        """
+        self.acquire()
+        slot = {"overloaded": False}
+        started = time.monotonic()
+        try:
+            yield slot
+        except BaseException:
+            self.release(overloaded=slot["overloaded"], request_class=request_class)
+            raise
+        self.release(time.monotonic() - started, slot["overloaded"], request_class)
+
+    def get_metrics(self) -> dict:
+        """Get the metrics of the limiter
+
+        Returns:
+            dict: the current limit, the requests in flight, their maximum,
+                the baseline latency of each request class in seconds (dict), the number of the increases,
+                the decreases and the requests that waited for the limit
+        """
+        with self.condition:
+            return dict(
+                self.metrics, limit=self.get_limit(), in_flight=self.in_flight, baseline_seconds=dict(self.baselines)
+            )
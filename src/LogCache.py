@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""A local on-disk cache of today's parsed Cygnus logs
+
+Without the cache, every loop downloads and parses the logs of each table from midnight,
+and after a restart all Workstations do so at once.
+With the cache, the parsed logs of a table are stored as NumPy arrays:
+    recvtimets.npy (int64), attrname.npy and attrvalue.npy (fixed width unicode)
+in a directory for each table and day, with a meta.json containing the watermark:
+the time until which the logs were downloaded.
+The arrays are memory-mapped when they are loaded, so a restarted service
+only downloads the logs since the watermark, see OEECalculator.query_cached_logs.
+
+The logs of the last LOG_CACHE_OVERLAP_MS milliseconds before the watermark are downloaded again,
+because the rows Cygnus was inserting at the download may become visible only later.
+The logs downloaded since the watermark are appended to the entry as a segment,
+a subdirectory with the same arrays and a meta.json containing its start and its watermark,
+so a loop writes only its tail instead of the whole day.
+A segment replaces the logs of the entry since its start, the logs of the overlap.
+When an entry has LOG_CACHE_MAX_SEGMENTS segments, it is compacted: rewritten with all its logs.
+An entry or a segment is written into a temporary directory and renamed, so a crash never leaves a partial one.
+The entries of the past days are deleted, and if the cache grows above LOG_CACHE_MAX_BYTES,
+the least recently written entries are deleted.
+The sizes of the entries are kept in memory, the cache's directory is only scanned
+when the cache is created and when the day changes.
+
+Environment variables (defaults are starred):
+    LOG_CACHE_DIR: the cache's directory, the cache is disabled if not set
+        None*
+    LOG_CACHE_MAX_BYTES:
+        536870912* (512 MiB)
+    LOG_CACHE_OVERLAP_MS:
+        60000*
+    LOG_CACHE_MAX_SEGMENTS:
+        16*
+"""
+# Standard Library imports
+from datetime import date, datetime
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+# PyPI packages
+import numpy as np
+
+# Custom imports
+from Logger import getLogger
+
+LOG_CACHE_DIR = os.environ.get("LOG_CACHE_DIR")
+
+LOG_CACHE_MAX_BYTES = os.environ.get("LOG_CACHE_MAX_BYTES")
+if LOG_CACHE_MAX_BYTES is None:
+    LOG_CACHE_MAX_BYTES = 512 * 1024 ** 2
+else:
+    LOG_CACHE_MAX_BYTES = int(LOG_CACHE_MAX_BYTES)
+
+LOG_CACHE_OVERLAP_MS = os.environ.get("LOG_CACHE_OVERLAP_MS")
+if LOG_CACHE_OVERLAP_MS is None:
+    LOG_CACHE_OVERLAP_MS = 60000
+else:
+    LOG_CACHE_OVERLAP_MS = int(LOG_CACHE_OVERLAP_MS)
+
+LOG_CACHE_MAX_SEGMENTS = os.environ.get("LOG_CACHE_MAX_SEGMENTS")
+if LOG_CACHE_MAX_SEGMENTS is None:
+    LOG_CACHE_MAX_SEGMENTS = 16
+else:
+    LOG_CACHE_MAX_SEGMENTS = int(LOG_CACHE_MAX_SEGMENTS)
+
+COLUMNS = ("recvtimets", "attrname", "attrvalue")
+META_FILE = "meta.json"
+SEGMENT_PREFIX = "segment-"
+
+
+def get_key(table_name: str, entity_id: str = None) -> str:
+    """Get the cache key of the logs of a table
+
+    Args:
+        table_name (str): PostgreSQL table name
+        entity_id (str): the entity's id if the table is shared by more entities. Default: None
+
+    Returns:
+        the key (str), usable as a directory name
+    """
+    if entity_id is None:
+        return table_name
+    return f"{table_name}_{hashlib.md5(entity_id.encode()).hexdigest()[:8]}"
+
+
+def get_directory_size(path: str) -> int:
+    """Get the size of the files in a directory and its subdirectories
+
+    Args:
+        path (str): the directory
+
+    Returns:
+        the size in bytes (int)
+    """
+    size = 0
+    for entry in os.scandir(path):
+        if entry.is_file():
+            size += entry.stat().st_size
+        elif entry.is_dir():
+            size += get_directory_size(entry.path)
+    return size
+
+
+def write_arrays(path: str, arrays: dict, meta: dict):
+    """Write the COLUMNS and a meta.json into a directory
+
+    Args:
+        path (str): the directory, it exists
+        arrays (dict): the COLUMNS (np.ndarray)
+        meta (dict): the content of the meta.json
+    """
+    np.save(os.path.join(path, "recvtimets.npy"), np.asarray(arrays["recvtimets"], dtype=np.int64))
+    for column in ("attrname", "attrvalue"):
+        np.save(os.path.join(path, f"{column}.npy"), np.asarray(arrays[column]).astype(str))
+    with open(os.path.join(path, META_FILE), "w") as f:
+        json.dump(meta, f)
+
+
+def read_arrays(path: str) -> tuple:
+    """Read the memory-mapped COLUMNS and the meta.json of a directory
+
+    Args:
+        path (str): the directory
+
+    Returns:
+        tuple: (the COLUMNS (dict of np.ndarray), the meta.json (dict))
+
+    Raises:
+        OSError, ValueError:
+            if the files cannot be read
+    """
+    with open(os.path.join(path, META_FILE), "r") as f:
+        meta = json.load(f)
+    arrays = {column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r") for column in COLUMNS}
+    if len(set(len(array) for array in arrays.values())) != 1:
+        raise ValueError("the arrays differ in length")
+    return arrays, meta
+
+
+class LogCache:
+    """The cache of today's parsed logs of each table
+
+    The LogCache outlives the LoopHandlers. It only keeps the sizes of the entries in memory,
+    they are scanned when it is created, so a new LogCache on the same directory continues
+    where the previous one stopped.
+
+    Common usage:
+        cached = log_cache.load(key, day)
+        ...  # download the logs since start = cached["watermark"] - log_cache.overlap
+        if cached["segments"] < log_cache.max_segments:
+            log_cache.append(key, day, tail, start, watermark)
+        else:
+            log_cache.store(key, day, arrays, watermark)
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = LOG_CACHE_MAX_BYTES,
+        overlap: int = LOG_CACHE_OVERLAP_MS,
+        max_segments: int = LOG_CACHE_MAX_SEGMENTS,
+    ):
+        """The constructor of the LogCache class
+
+        Creates the directory and deletes the entries of the past days
+
+        Args:
+            directory (str): the cache's directory
+            max_bytes (int): the maximum size of the cache
+            overlap (int): the milliseconds before the watermark that are downloaded again
+            max_segments (int): the number of segments an entry is compacted at
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.overlap = overlap
+        self.max_segments = max_segments
+        os.makedirs(self.directory, exist_ok=True)
+        self.clean_up(datetime.now().date(), remove_temporary=True)
+
+    def __repr__(self):
+        return (
+            f"LogCache(directory={self.directory}, max_bytes={self.max_bytes}, overlap={self.overlap}, "
+            f"max_segments={self.max_segments})"
+        )
+
+    def get_path(self, key: str, day: date) -> str:
+        """Get the directory of an entry
+
+        Args:
+            key (str): the cache key, see get_key
+            day (date): the day of the logs
+
+        Returns:
+            the entry's directory (str)
+        """
+        return os.path.join(self.directory, day.isoformat(), key)
+
+    def get_segments(self, path: str) -> list:
+        """Get the segments of an entry
+
+        Args:
+            path (str): the entry's directory
+
+        Returns:
+            the sorted directories of the segments (list of str)
+        """
+        return sorted(
+            entry.path for entry in os.scandir(path) if entry.is_dir() and entry.name.startswith(SEGMENT_PREFIX)
+        )
+
+    def load(self, key: str, day: date) -> dict:
+        """Load an entry with memory-mapped arrays, the logs of its segments replace the logs since their start
+
+        Args:
+            key (str): the cache key, see get_key
+            day (date): the day of the logs
+
+        Returns:
+            dict with the COLUMNS (np.ndarray), the watermark in milliseconds (float) and the number of segments (int),
+            or None if the entry does not exist or cannot be read
+        """
+        path = self.get_path(key, day)
+        try:
+            entry, meta = read_arrays(path)
+            segments = self.get_segments(path)
+            for segment in segments:
+                arrays, meta = read_arrays(segment)
+                kept = entry["recvtimets"] < meta["start"]
+                entry = {column: np.concatenate([entry[column][kept], arrays[column]]) for column in COLUMNS}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as error:
+            self.logger.warning(f"The cache entry {path} cannot be read, deleting it: {error}")
+            shutil.rmtree(path, ignore_errors=True)
+            self.entries.pop(path, None)
+            return None
+        entry["watermark"] = meta["watermark"]
+        entry["segments"] = len(segments)
+        return entry
+
+    def append(self, key: str, day: date, arrays: dict, start: float, watermark: float):
+        """Write the logs downloaded since a time as a new segment of an entry atomically
+
+        Args:
+            key (str): the cache key, see get_key
+            day (date): the day of the logs
+            arrays (dict): the COLUMNS (np.ndarray) since start
+            start (float): the time since which the logs were downloaded, in milliseconds
+            watermark (float): the time until which the logs were downloaded, in milliseconds
+        """
+        path = self.get_path(key, day)
+        temporary = None
+        try:
+            segments = self.get_segments(path)
+            index = int(os.path.basename(segments[-1])[len(SEGMENT_PREFIX):]) + 1 if segments else 0
+            temporary = tempfile.mkdtemp(prefix=f".{SEGMENT_PREFIX}", dir=path)
+            write_arrays(temporary, arrays, {"start": start, "watermark": watermark, "rows": len(arrays["recvtimets"])})
+            segment = os.path.join(path, f"{SEGMENT_PREFIX}{index:06d}")
+            os.replace(temporary, segment)
+            # the entry was written recently, see clean_up
+            os.utime(os.path.join(path, META_FILE))
+        except OSError as error:
+            self.logger.warning(f"The segment of the cache entry {path} cannot be written: {error}")
+            if temporary is not None:
+                shutil.rmtree(temporary, ignore_errors=True)
+            return
+        self.written(path, day, get_directory_size(segment))
+
+    def store(self, key: str, day: date, arrays: dict, watermark: float):
+        """Write an entry atomically without segments, then enforce the cache's limits
+
+        Args:
+            key (str): the cache key, see get_key
+            day (date): the day of the logs
+            arrays (dict): the COLUMNS (np.ndarray)
+            watermark (float): the time until which the logs were downloaded, in milliseconds
+        """
+        path = self.get_path(key, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = tempfile.mkdtemp(prefix=f".{key}.", dir=os.path.dirname(path))
+        try:
+            write_arrays(temporary, arrays, {"watermark": watermark, "rows": len(arrays["recvtimets"])})
+            if os.path.exists(path):
+                # os.replace cannot replace a non-empty directory, the old entry is renamed first
+                old = tempfile.mkdtemp(prefix=f".{key}.old.", dir=os.path.dirname(path))
+                os.replace(path, os.path.join(old, key))
+                os.replace(temporary, path)
+                shutil.rmtree(old, ignore_errors=True)
+            else:
+                os.replace(temporary, path)
+        except OSError as error:
+            self.logger.warning(f"The cache entry {path} cannot be written: {error}")
+            shutil.rmtree(temporary, ignore_errors=True)
+            return
+        self.entries.pop(path, None)
+        self.written(path, day, get_directory_size(path))
+
+    def clean_up(self, today: date, remove_temporary: bool = False):
+        """Delete the entries of the past days, rescan the sizes of the entries and enforce max_bytes
+
+        The cache's directory is only scanned here, when the cache is created and when the day changes.
+
+        Args:
+            today (date): the current day
+            remove_temporary (bool): delete the temporary directories left by a crash too. Default: False
+        """
+        self.day = today
+        self.entries = {}
+        for day_entry in os.scandir(self.directory):
+            if not day_entry.is_dir():
+                continue
+            if day_entry.name < today.isoformat():
+                self.logger.debug(f"Deleting the cache of {day_entry.name}")
+                shutil.rmtree(day_entry.path, ignore_errors=True)
+                continue
+            for entry in os.scandir(day_entry.path):
+                if not entry.is_dir():
+                    continue
+                if entry.name.startswith("."):
+                    if remove_temporary:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    continue
+                if remove_temporary:
+                    for segment in os.scandir(entry.path):
+                        if segment.is_dir() and segment.name.startswith("."):
+                            shutil.rmtree(segment.path, ignore_errors=True)
+                try:
+                    written = os.stat(os.path.join(entry.path, META_FILE)).st_mtime
+                except FileNotFoundError:
+                    written = 0
+                self.entries[entry.path] = {
+                    "day": day_entry.name, "written": written, "bytes": get_directory_size(entry.path)
+                }
+        self.evict()
+
+    def written(self, path: str, day: date, n_bytes: int):
+        """Account for the bytes written into an entry, then enforce the cache's limits
+
+        Args:
+            path (str): the entry's directory
+            day (date): the day of the logs
+            n_bytes (int): the bytes written, the new size of the entry if it was rewritten
+        """
+        if day > self.day:
+            self.clean_up(day)
+            return
+        entry = self.entries.setdefault(path, {"day": day.isoformat(), "written": 0, "bytes": 0})
+        entry["written"] = time.time()
+        entry["bytes"] += n_bytes
+        self.evict()
+
+    def evict(self):
+        """Delete the entries of the past days and the least recently written entries above max_bytes"""
+        for path, entry in list(self.entries.items()):
+            if entry["day"] < self.day.isoformat():
+                self.logger.debug(f"Deleting the cache of {entry['day']}")
+                shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+                del self.entries[path]
+        total = sum(entry["bytes"] for entry in self.entries.values())
+        for path, entry in sorted(self.entries.items(), key=lambda item: item[1]["written"]):
+            if total <= self.max_bytes:
+                break
+            self.logger.info(f"The log cache exceeds {self.max_bytes} bytes, deleting {path}")
+            shutil.rmtree(path, ignore_errors=True)
+            del self.entries[path]
+            total -= entry["bytes"]
@@ -10,19 +10,75 @@ Environment variables:
     POSTGRES_PORT
 If any of the previous environment variables (except the port)
 is missing, a RuntimeError is raised
+
+Optional environment variables (defaults are starred):
+    BULK_QUERIES: in Cygnus' "dm-by-entity-type" data model, query the logs
+        of all Workstations and Jobs with one query for each table
+        TRUE
+        FALSE*
+    KPI_HISTORY: append the KPIs of each loop to a history table, see KPIHistory
+        TRUE
+        FALSE*
+    ROLLUPS: update the hourly, shift and daily rollups after each loop, see Rollups
+        TRUE
+        FALSE*
+    LOG_CACHE_DIR: cache today's logs in this directory, see LogCache
+        None*
+    CHECKPOINT_FILE: keep the incremental KPI state in this file, see Checkpoint
+        None*
+    API_PORT: serve the latest KPIs on this port, see API
+        None*
+    KPI_SINKS: dispatch the KPIs to these sinks besides Orion, see Sinks
+        None*
+    DEADBAND: suppress the writes of the KPIs that did not change, see Deadband
+        TRUE
+        FALSE*
+    ORION_PUBLISHER: write the KPIs to Orion in the background, see Publisher
+        TRUE
+        FALSE*
+    ADAPTIVE_LIMIT: limit the concurrent requests to Orion and PostgreSQL adaptively, see Limiter
+        TRUE
+        FALSE*
+    QUARANTINE: skip the persistently failing Workstations for a while, see Quarantine
+        TRUE
+        FALSE*
+    ORION_CIRCUIT_BREAKER: stop the loop while Orion is failing, see Resilience
+        TRUE
+        FALSE*
+
+The durations of the stages, the errors and the state of the optional components are collected, see Metrics.
+The loops, the Workstations' calculations and their stages are traced, see Tracing.
 """
 # Standard Library imports
+from datetime import datetime, timezone
 import os
+import time
 
 # PyPI packages
+import requests
 import sqlalchemy
 from sqlalchemy import create_engine
 import psycopg2
 
 # Custom imports
+import API
+import Checkpoint
+import Cygnus
+import Deadband
+import KPIHistory
+import LogCache
 from Logger import getLogger
+import Metrics
 from OEE import OEECalculator
 import Orion
+import Planner
+import Publisher
+import Quarantine
+import Resilience
+import Rollups
+import Sinks
+import Statements
+import Tracing
 
 
 class LoopHandler:
@@ -58,8 +114,70 @@ class LoopHandler:
             f"POSTGRES_PORT environment variable is not set, using default: {POSTGRES_PORT}"
         )
 
+    BULK_QUERIES = os.environ.get("BULK_QUERIES")
+    if BULK_QUERIES is None:
+        BULK_QUERIES = False
+    elif BULK_QUERIES.lower() == "true":
+        BULK_QUERIES = True
+    else:
+        BULK_QUERIES = False
+
+    # shared by all loops, so the planner remembers the last seen counts
+    planner = Planner.QueryPlanner() if Planner.QUERY_PLANNER else None
+    # shared by all loops, so the rows of a failed write are written after the next loop
+    history = KPIHistory.KPIHistory() if KPIHistory.KPI_HISTORY else None
+    rollups = Rollups.RollupMaintainer() if Rollups.ROLLUPS else None
+    log_cache = LogCache.LogCache(LogCache.LOG_CACHE_DIR) if LogCache.LOG_CACHE_DIR else None
+    # restored when the service starts
+    checkpoint = Checkpoint.CheckpointStore(Checkpoint.CHECKPOINT_FILE) if Checkpoint.CHECKPOINT_FILE else None
+    # served by the API.APIServer started in main
+    kpi_store = API.KPIStore(API.EventBroker()) if API.API_PORT is not None else None
+    # shared by all loops, so the last written values are kept
+    deadband = Deadband.DeadbandFilter() if Deadband.DEADBAND else None
+    # the sinks' threads write the KPIs in the background, closed in main
+    sinks = (
+        Sinks.create_dispatcher(
+            Sinks.KPI_SINKS, f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}"
+        )
+        if Sinks.KPI_SINKS
+        else None
+    )
+    # the publisher's thread writes the KPIs into Orion in the background, closed in main
+    # the deadband only takes the values written by the publisher, not the dropped ones
+    publisher = (
+        Publisher.BackgroundPublisher(on_written=deadband.written if deadband is not None else None)
+        if Publisher.ORION_PUBLISHER
+        else None
+    )
+    # shared by all loops, so the consecutive failures are counted
+    quarantine = Quarantine.Quarantine() if Quarantine.QUARANTINE else None
+    # the failures of Orion and PostgreSQL, not of a Workstation's data, see is_transient_error
+    TRANSIENT_ERRORS = (
+        requests.exceptions.RequestException,
+        Resilience.CircuitOpenError,
+        psycopg2.OperationalError,
+        sqlalchemy.exc.OperationalError,
+        sqlalchemy.exc.TimeoutError,
+    )
+
     def __init__(self):
-        pass
+        # today's logs of the tables shared by more entities, see prefetch_logs
+        self.prefetched = {}
+        # the end of the prefetched logs' window in milliseconds, the calculators' time
+        self.prefetched_until = None
+        # the start of the loop, the timestamp of the KPI history rows, see handle
+        self.started = datetime.now(timezone.utc)
+
+    @classmethod
+    def create_postgres_engine(cls):
+        """Create the sqlalchemy engine of the PostgreSQL database Cygnus logs into
+
+        Returns:
+            sqlalchemy engine
+        """
+        return create_engine(
+            f"postgresql://{cls.POSTGRES_USER}:{cls.POSTGRES_PASSWORD}@{cls.POSTGRES_HOST}:{cls.POSTGRES_PORT}"
+        )
 
     def calculate_KPIs(self, workstation_id: str) -> tuple:
         """Calculate the OEE and the Throughput of the current Workstation
@@ -79,11 +197,122 @@ class LoopHandler:
                     the Throughput object to be uploaded to Orion
         """
         oeeCalculator = OEECalculator(workstation_id)
-        oeeCalculator.prepare(self.con)
-        oee = oeeCalculator.calculate_OEE()
-        throughput = oeeCalculator.calculate_throughput()
+        oeeCalculator.planner = self.planner
+        oeeCalculator.prefetched = self.prefetched
+        oeeCalculator.prefetched_until = self.prefetched_until
+        oeeCalculator.log_cache = self.log_cache
+        oeeCalculator.checkpoint = self.checkpoint
+        started = time.perf_counter()
+        try:
+            oeeCalculator.prepare(self.con)
+            with Metrics.STAGE_DURATION.time(("compute",)):
+                oee = oeeCalculator.calculate_OEE()
+                throughput = oeeCalculator.calculate_throughput()
+            Metrics.WORKSTATION_DURATION.set(time.perf_counter() - started, (workstation_id,))
+            if self.planner is not None:
+                self.planner.record(oeeCalculator)
+        finally:
+            if self.planner is not None:
+                # the plan of a failed calculation is not recorded
+                self.planner.plans.pop(workstation_id, None)
         return oee, throughput
 
+    def update_attribute(self, object_id: str, attribute_name: str, attribute_type: str, attribute_value):
+        """Update an attribute in Orion, unless the write is suppressed by the deadband
+
+        If the publisher is set, the update is only enqueued, see Publisher.BackgroundPublisher,
+        and the publisher marks the value written in the deadband once Orion has it
+
+        Args:
+            object_id (str): the object's id in Orion
+            attribute_name (str): the attribute's name
+            attribute_type (str): the attribute's type
+            attribute_value: the attribute's new value
+
+        Raises:
+            RuntimeError: if the update fails, see Orion.update_attribute
+        """
+        if self.deadband is not None and self.deadband.suppress(object_id, attribute_name, attribute_value):
+            return
+        if self.publisher is not None:
+            self.publisher.publish(object_id, attribute_name, attribute_type, attribute_value)
+            return
+        Orion.update_attribute(object_id, attribute_name, attribute_type, attribute_value)
+        if self.deadband is not None:
+            self.deadband.written(object_id, attribute_name, attribute_value)
+
+    def get_fingerprint(self, workstation: dict) -> tuple:
+        """Get the fingerprint of a Workstation, its change releases the Workstation from the quarantine
+
+        Only the Orion object got in the loop and one cheap query are used,
+        so the fingerprint costs no more Orion requests.
+
+        Args:
+            workstation (dict): the Workstation's Orion object
+
+        Returns:
+            tuple: (the relationships of the Workstation, like refJob, sorted by name,
+                whether the Workstation's Cygnus table exists)
+        """
+        relationships = tuple(
+            sorted(
+                (name, str(attribute.get("value")))
+                for name, attribute in workstation.items()
+                if isinstance(attribute, dict) and attribute.get("type") == "Relationship"
+            )
+        )
+        try:
+            table_exists = Cygnus.table_exists(self.con, Cygnus.get_postgres_table(workstation))
+        except (KeyError, NotImplementedError):
+            table_exists = None
+        return relationships, table_exists
+
+    @classmethod
+    def is_transient_error(cls, error: BaseException) -> bool:
+        """Check if an error is caused by Orion or PostgreSQL, like a refused connection or a statement timeout
+
+        The exceptions the error was raised from are checked as well,
+        like the cause of the RuntimeError of a failed GET request, see Orion.get_request.
+
+        Args:
+            error (BaseException): the error of a Workstation's calculation
+
+        Returns:
+            True if the error is not caused by the Workstation's data, False otherwise
+        """
+        while error is not None:
+            if isinstance(error, cls.TRANSIENT_ERRORS):
+                return True
+            error = error.__cause__ or error.__context__
+        return False
+
+    def is_circuit_open(self, n_remaining: int) -> bool:
+        """Check if Orion's circuit is open, so the remaining Workstations are skipped in this loop
+
+        Args:
+            n_remaining (int): the number of the remaining Workstations, used in the log
+
+        Returns:
+            True if the circuit is open, see Resilience.CircuitBreaker.is_open, False otherwise
+        """
+        if Orion.breaker is None or not Orion.breaker.is_open():
+            return False
+        self.logger.error(f"The circuit of Orion is open, skipping the remaining {n_remaining} Workstations")
+        return True
+
+    def is_quarantined(self, workstation: dict) -> bool:
+        """Check if a Workstation is skipped in this loop, see Quarantine.Quarantine.check
+
+        Args:
+            workstation (dict): the Workstation's Orion object
+
+        Returns:
+            True if the Workstation is quarantined, False otherwise
+        """
+        if self.quarantine is None or not self.quarantine.is_failing(workstation["id"]):
+            return False
+        return self.quarantine.check(workstation["id"], self.get_fingerprint(workstation))
+
     def handle_workstation(self, workstation_id: str):
         """Handle everything related to calculating and updating the OEE and Throughput of a Workstation
 
@@ -93,15 +322,19 @@ class LoopHandler:
             workstation_id:
                 The Orion Workstation object's id
         """ 
+        oee, throughput, error_message = None, None, None
         try:
             self.logger.info(f'Calculating KPIs for {workstation_id}')
             oee, throughput = self.calculate_KPIs(workstation_id)
-            Orion.update_attribute(workstation_id, "oeeObject", "OEE", oee)
-            Orion.update_attribute(workstation_id, "oeeAvailability", "Number", oee["availability"])
-            Orion.update_attribute(workstation_id, "oeePerformance", "Number", oee["performance"])
-            Orion.update_attribute(workstation_id, "oeeQuality", "Number", oee["quality"])
-            Orion.update_attribute(workstation_id, "oee", "Number", oee["oee"])
-            Orion.update_attribute(workstation_id, "throughputPerShift", "Number", throughput)
+            with Metrics.STAGE_DURATION.time(("publish",)):
+                self.update_attribute(workstation_id, "oeeObject", "OEE", oee)
+                self.update_attribute(workstation_id, "oeeAvailability", "Number", oee["availability"])
+                self.update_attribute(workstation_id, "oeePerformance", "Number", oee["performance"])
+                self.update_attribute(workstation_id, "oeeQuality", "Number", oee["quality"])
+                self.update_attribute(workstation_id, "oee", "Number", oee["oee"])
+                self.update_attribute(workstation_id, "throughputPerShift", "Number", throughput)
+            if self.quarantine is not None:
+                self.quarantine.succeeded(workstation_id)
         except (
             AttributeError,
             KeyError,
@@ -111,10 +344,201 @@ class LoopHandler:
             ValueError,
             ZeroDivisionError,
             psycopg2.OperationalError,
+            requests.exceptions.RequestException,
             sqlalchemy.exc.OperationalError
         ) as error:
             self.logger.error(error)
-            self.clear_KPIs(workstation_id)
+            Metrics.ERRORS.inc(("workstation", type(error).__name__))
+            error_message = str(error)
+            # the KPIs calculated before a failed update are not recorded, they are cleared in Orion
+            oee, throughput = None, None
+            # only the errors of the Workstation count towards its quarantine, not the outages of Orion or PostgreSQL,
+            # the KPIs of a Workstation failing repeatedly are cleared only once
+            if (
+                self.quarantine is None
+                or self.is_transient_error(error)
+                or self.quarantine.failed(workstation_id, error_message)
+            ):
+                self.clear_KPIs(workstation_id)
+        if self.history is not None:
+            self.history.add(self.started, workstation_id, oee, throughput)
+        calculated_at = datetime.now(timezone.utc)
+        if self.kpi_store is not None:
+            self.kpi_store.update(workstation_id, calculated_at, oee, throughput, error_message)
+        if self.sinks is not None:
+            self.sinks.dispatch(Sinks.get_record(workstation_id, calculated_at, oee, throughput, error_message))
+
+    def flush_history(self):
+        """Write the KPIs of the loop into the KPI history table
+
+        A failed write is logged, the rows are written after the next loop, see KPIHistory.KPIHistory.flush
+        """
+        if self.history is None:
+            return
+        try:
+            self.history.flush(self.con)
+        except (
+            psycopg2.Error,
+            sqlalchemy.exc.DBAPIError,
+        ) as error:
+            self.logger.error(f"The KPI history cannot be written, {len(self.history.rows)} rows are kept: {error}")
+
+    def save_checkpoint(self):
+        """Save the incremental KPI state of the Workstations if the checkpoint interval has elapsed
+
+        A failed write is logged, the state is saved after the next loop, see Checkpoint.CheckpointStore.save
+        """
+        if self.checkpoint is None:
+            return
+        try:
+            self.checkpoint.save()
+        except (OSError, TypeError, ValueError) as error:
+            self.logger.error(f"The checkpoint cannot be saved: {error}")
+
+    def log_deadband(self):
+        """Log the number of the written and suppressed attribute writes, see Deadband.DeadbandFilter"""
+        if self.deadband is None:
+            return
+        counts = self.deadband.get_counts()
+        self.logger.info(
+            f'Orion attribute writes: {counts["written"]} written, {counts["suppressed"]} suppressed '
+            f'by the deadband, {counts["heartbeats"]} forced by the maximum staleness'
+        )
+
+    def log_publisher(self):
+        """Log the metrics of the background publisher, see Publisher.BackgroundPublisher"""
+        if self.publisher is None:
+            return
+        metrics = self.publisher.get_metrics()
+        self.logger.info(
+            f'Orion publisher: {metrics["pending"]} objects pending, {metrics["published"]} published, '
+            f'{metrics["coalesced"]} updates coalesced, {metrics["dropped"]} dropped, {metrics["failed"]} objects failed, '
+            f'last publish lag: {metrics["last_lag_seconds"]} s'
+        )
+
+    def log_quarantine(self):
+        """Log the quarantined Workstations, see Quarantine.Quarantine"""
+        if self.quarantine is None:
+            return
+        metrics = self.quarantine.get_metrics()
+        if metrics["failing"] == 0:
+            return
+        quarantined = {
+            workstation_id: round(entry["remaining_seconds"])
+            for workstation_id, entry in metrics["workstations"].items()
+            if entry["remaining_seconds"] > 0
+        }
+        self.logger.info(
+            f'Failing Workstations: {metrics["failing"]}, quarantined for seconds: {quarantined}, '
+            f'{metrics["skipped"]} calculations skipped'
+        )
+
+    def log_circuit(self):
+        """Log the state of Orion's circuit breaker and hedger, see Resilience"""
+        if Orion.breaker is not None:
+            metrics = Orion.breaker.get_metrics()
+            self.logger.info(
+                f'Circuit of Orion: {metrics["state"]}, opened {metrics["opened"]} times, '
+                f'{metrics["rejected"]} requests rejected, {metrics["trials"]} trial requests'
+            )
+        if Orion.hedger is not None:
+            metrics = Orion.hedger.get_metrics()
+            self.logger.info(
+                f'Hedged Orion requests: {metrics["hedged"]} of {metrics["requests"]}, '
+                f'{metrics["hedge_wins"]} won, delay: {metrics["delay_seconds"]} s'
+            )
+
+    def log_limits(self):
+        """Log the adaptive concurrency limits of Orion and PostgreSQL, see Limiter.AdaptiveLimiter"""
+        for limiter in (Orion.limiter, Statements.limiter):
+            if limiter is None:
+                continue
+            metrics = limiter.get_metrics()
+            self.logger.info(
+                f'Concurrency limit of {limiter.name}: {metrics["limit"]}, max in flight: {metrics["max_in_flight"]}, '
+                f'{metrics["increases"]} increases, {metrics["decreases"]} decreases, {metrics["throttled"]} throttled'
+            )
+
+    def record_pool(self):
+        """Record the state of the loop's connection pool, see Metrics.POOL_CONNECTIONS"""
+        pool = self.engine.pool
+        if not isinstance(pool, sqlalchemy.pool.QueuePool):
+            return
+        for state, count in (
+            ("size", pool.size()),
+            ("checked_out", pool.checkedout()),
+            ("idle", pool.checkedin()),
+            ("overflow", max(pool.overflow(), 0)),
+        ):
+            Metrics.POOL_CONNECTIONS.set(count, (state,))
+
+    @classmethod
+    def collect_metrics(cls) -> list:
+        """Collect the state of the optional components at the scrape of the metrics, see Metrics.Registry
+
+        Returns:
+            list of the metric families
+        """
+        families = []
+        if cls.publisher is not None:
+            families += Metrics.get_families("oee_publisher", "Orion publisher", [({}, cls.publisher.get_metrics())])
+        limiters = [limiter for limiter in (Orion.limiter, Statements.limiter) if limiter is not None]
+        if limiters:
+            families += Metrics.get_families(
+                "oee_limiter", "Adaptive concurrency limit",
+                [({"limiter": limiter.name}, limiter.get_metrics()) for limiter in limiters],
+            )
+        if Orion.breaker is not None:
+            metrics = Orion.breaker.get_metrics()
+            families += Metrics.get_families("oee_orion_circuit", "Circuit of Orion", [({}, metrics)])
+            families.append((
+                "oee_orion_circuit_state", "gauge", "Circuit of Orion: 1 for the current state",
+                [({"state": state}, int(state == metrics["state"])) for state in ("closed", "open", "half_open")],
+            ))
+        if Orion.hedger is not None:
+            families += Metrics.get_families(
+                "oee_orion_hedger", "Hedged Orion requests", [({}, Orion.hedger.get_metrics())]
+            )
+        if cls.deadband is not None:
+            families += Metrics.get_families(
+                "oee_deadband", "Orion attribute writes", [({}, cls.deadband.get_counts())]
+            )
+        if cls.quarantine is not None:
+            families += Metrics.get_families("oee_quarantine", "Quarantine", [({}, cls.quarantine.get_metrics())])
+        if cls.sinks is not None:
+            families += Metrics.get_families(
+                "oee_sink", "KPI sink",
+                [({"sink": name}, metrics) for name, metrics in cls.sinks.get_metrics().items()],
+            )
+        return families
+
+    def publish_kpis(self):
+        """Publish the KPIs of the loop's Workstations in the API, see API.KPIStore.publish"""
+        if self.kpi_store is None:
+            return
+        self.kpi_store.publish([workstation["id"] for workstation in self.workstations], datetime.now(timezone.utc))
+
+    def update_rollups(self):
+        """Update the rollups of all Workstations
+
+        A failed update is logged, the rollups are updated from the same hour after the next loop,
+        see Rollups.RollupMaintainer.update
+        """
+        if self.rollups is None:
+            return
+        for workstation in self.workstations:
+            try:
+                self.rollups.update(self.con, workstation["id"])
+            except (
+                KeyError,
+                RuntimeError,
+                TypeError,
+                ValueError,
+                ZeroDivisionError,
+                psycopg2.Error,
+                sqlalchemy.exc.DBAPIError,
+            ) as error:
+                self.logger.error(f'The rollups of {workstation["id"]} cannot be updated: {error}')
 
     def clear_oee(self, workstation_id: str):
         """Clear OEE of a Workstation in case of an error 
@@ -122,11 +546,11 @@ class LoopHandler:
         Args:
             workstation_id (str): the Workstation's Orion id 
         """
-        Orion.update_attribute(workstation_id, "oeeObject", "OEE", OEECalculator.OEE_template.copy())
-        Orion.update_attribute(workstation_id, "oee", "Number", None)
-        Orion.update_attribute(workstation_id, "oeeAvailability", "Number", None)
-        Orion.update_attribute(workstation_id, "oeePerformance", "Number", None)
-        Orion.update_attribute(workstation_id, "oeeQuality", "Number", None)
+        self.update_attribute(workstation_id, "oeeObject", "OEE", OEECalculator.OEE_template.copy())
+        self.update_attribute(workstation_id, "oee", "Number", None)
+        self.update_attribute(workstation_id, "oeeAvailability", "Number", None)
+        self.update_attribute(workstation_id, "oeePerformance", "Number", None)
+        self.update_attribute(workstation_id, "oeeQuality", "Number", None)
         self.logger.info(f"OEE cleared successfully for workstation: {workstation_id}")
 
     def clear_throughputPerShift(self, workstation_id: str):
@@ -135,7 +559,7 @@ class LoopHandler:
         Args:
             workstation_id (str): the Workstation's Orion id 
         """
-        Orion.update_attribute(workstation_id, "throughputPerShift", "Number", None)
+        self.update_attribute(workstation_id, "throughputPerShift", "Number", None)
         self.logger.info(f"ThroughputPerShift cleared successfully for workstation: {workstation_id}")
 
     def clear_KPIs(self, workstation_id: str):
@@ -152,9 +576,49 @@ class LoopHandler:
         """Clear OEE and ThroughputPerShift attributes of all Workstations in case of an error 
         """
         self.logger.error("Error: an error happened, trying to clear all KPIs.")
+        if self.is_circuit_open(len(self.workstations)):
+            return
         for workstation in self.workstations:
             self.clear_KPIs(workstation["id"])
 
+    @Tracing.traced("sql")
+    def prefetch_logs(self):
+        """Query today's logs of all Workstations and their Jobs with one query for each table
+
+        Only in Cygnus' "dm-by-entity-type" data model if BULK_QUERIES is TRUE,
+        where the entities of the same type are logged in the same table.
+        The logs are queried until the loop's time, and the OEECalculators of the loop use it as their time,
+        so the prefetched logs cover their query windows.
+        The OEECalculators filter their entity's logs from the prefetched logs
+        in the "from_midnight" and "rows" query modes of the "frames" processing mode,
+        see OEECalculator.filter_prefetched_logs.
+        The other modes, "boundary", "aggregate" and "chunked", query only a few rows or stream the logs,
+        so they bypass the prefetched logs and query PostgreSQL.
+        If a table cannot be prefetched, its logs are queried for each Workstation.
+        """
+        self.prefetched = {}
+        self.prefetched_until = None
+        if not self.BULK_QUERIES or Cygnus.CYGNUS_DATA_MODEL != "dm-by-entity-type":
+            return
+        if self.planner is None and OEECalculator.PROCESSING_MODE != "frames":
+            # no OEECalculator would read the prefetched logs
+            return
+        midnight, now = Cygnus.get_todays_window()
+        for table_name, entity_ids in Cygnus.get_table_entities(self.workstations).items():
+            try:
+                self.prefetched[table_name] = OEECalculator.query_entities_logs(
+                    self.con, table_name, entity_ids, midnight, now
+                )
+            except (RuntimeError, ValueError, NotImplementedError) as error:
+                self.logger.warning(f"The logs of the table {table_name} cannot be prefetched: {error}")
+                continue
+            self.logger.info(
+                f"Prefetched {len(self.prefetched[table_name])} rows of {table_name} for {len(entity_ids)} entities"
+            )
+        if self.prefetched:
+            self.prefetched_until = now
+
+    @Tracing.traced("loop")
     def handle(self):
         """A function for handling the OEE and Throughput calculations of all Workstations
 
@@ -176,20 +640,41 @@ class LoopHandler:
                 "Critical: no Workstation is found in the Orion broker, no OEE data"
             )
             return
-        self.engine = create_engine(
-            f"postgresql://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}"
-        )
+        self.started = datetime.now(timezone.utc)
+        self.engine = self.create_postgres_engine()
         try:
             with self.engine.connect() as self.con:
-                for workstation in self.workstations:
-                    self.handle_workstation(workstation["id"])
+                self.prefetch_logs()
+                for i, workstation in enumerate(self.workstations):
+                    if self.is_circuit_open(len(self.workstations) - i):
+                        break
+                    if self.is_quarantined(workstation):
+                        continue
+                    try:
+                        with Tracing.span("handle_workstation", "loop", workstation_id=workstation["id"]):
+                            self.handle_workstation(workstation["id"])
+                    except Resilience.CircuitOpenError as error:
+                        self.logger.error(error)
+                self.flush_history()
+                self.update_rollups()
+                self.save_checkpoint()
+                self.publish_kpis()
+                self.record_pool()
+                self.log_deadband()
+                self.log_publisher()
+                self.log_limits()
+                self.log_quarantine()
+                self.log_circuit()
 
         except (
             psycopg2.OperationalError,
             sqlalchemy.exc.OperationalError
         ) as error:
             self.logger.error(error)
+            Metrics.ERRORS.inc(("loop", type(error).__name__))
             self.clear_all_KPIs()
         finally:
             self.engine.dispose()
 
+
+Metrics.registry.add_collector(LoopHandler.collect_metrics)
@@ -0,0 +1,489 @@
+# -*- coding: utf-8 -*-
+"""Prometheus-style metrics of the loops and their stages
+
+The metrics are collected in the memory of the process, an update only takes a lock and a dict update,
+so the hot path is not slowed down. If METRICS_PORT is set, the MetricsServer serves them
+in the Prometheus text format at GET /metrics, see main.
+
+The metrics:
+    oee_loop_duration_seconds: histogram of the loops' durations
+    oee_scheduler_lag_seconds: histogram of the delays of the loops' starts after their scheduled times
+    oee_stage_duration_seconds{stage}: histogram of the stages' durations,
+        orion_fetch: an Orion GET request
+        sql_query: a query of the Cygnus logs, see Statements.timed_query
+        parse: the conversion of the queried logs, see OEE.OEECalculator.convert_and_sort_logs
+        compute: the calculation of the KPIs from the prepared logs
+        publish: the writes or enqueues of the KPIs of a Workstation
+    oee_workstation_compute_seconds{workstation}: the duration of the last calculation of each Workstation
+    oee_orion_requests_total{method, status}: the Orion requests, the status is "error" if no response came
+    oee_orion_response_bytes_total: the size of the Orion responses
+    oee_sql_queries_total{query_class}, oee_sql_rows_total{query_class}: the queries and the rows fetched
+    oee_sql_result_bytes_total{query_class}: the approximate (shallow) in-memory size of the fetched logs
+    oee_errors_total{stage, exception}: the errors by the exception's class
+    oee_cache_requests_total{cache, result}, oee_cache_hit_ratio{cache}: the hits and misses of the log caches
+    oee_db_pool_connections{state}: the connection pool of the loop, sampled at the end of each loop
+    and the state of the optional components, see LoopHandler.collect_metrics
+
+Environment variables (defaults are starred):
+    METRICS_PORT: the port of the metrics endpoint, the endpoint is disabled if not set
+        None*
+    METRICS_HOST: the address the metrics endpoint listens on
+        127.0.0.1*
+"""
+# Standard Library imports
+import bisect
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import math
+import os
+import threading
+import time
+
+# Custom imports
+from Logger import getLogger
+
+METRICS_PORT = os.environ.get("METRICS_PORT")
+if METRICS_PORT is not None:
+    METRICS_PORT = int(METRICS_PORT)
+
+METRICS_HOST = os.environ.get("METRICS_HOST")
+if METRICS_HOST is None:
+    METRICS_HOST = "127.0.0.1"
+
+# the upper bounds of the histograms' buckets in seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_value(value) -> str:
+    """Format a sample value in the Prometheus text format
+
+    Args:
+        value: int, float, bool or None
+
+    Returns:
+        the value (str), None is NaN
+    """
+    if value is None:
+        return "NaN"
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(int(value)) if value.is_integer() and abs(value) < 1e15 else repr(value)
+
+
+def format_labels(labels: dict) -> str:
+    """Format the labels of a sample in the Prometheus text format
+
+    Args:
+        labels (dict): {name: value}
+
+    Returns:
+        the labels in braces (str), empty if there are no labels
+    """
+    if not labels:
+        return ""
+    pairs = (
+        f'{name}="' + str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') + '"'
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+def get_families(prefix: str, help_: str, labelled_metrics: list) -> list:
+    """Convert the metrics dicts of a component to gauge families, see Registry
+
+    The counters of the components are exported as gauges of their current values.
+
+    Args:
+        prefix (str): the prefix of the names, like "oee_publisher"
+        help_ (str): the description of the component
+        labelled_metrics (list): (labels (dict), metrics (dict)) tuples,
+            only the numeric and None values of the metrics are converted
+
+    Returns:
+        list of the gauge families, one for each key of the metrics
+    """
+    families = {}
+    for labels, metrics in labelled_metrics:
+        for key, value in metrics.items():
+            if value is None or isinstance(value, (int, float)):
+                families.setdefault(key, []).append((labels, value))
+    return [(f"{prefix}_{key}", "gauge", f"{help_}: {key}", samples) for key, samples in families.items()]
+
+
+class Metric:
+    """The base class of the metrics, holding a value for each combination of the label values"""
+
+    kind = None
+
+    def __init__(self, name: str, help_: str, labelnames: tuple = ()):
+        """The constructor of the Metric class
+
+        Args:
+            name (str): the metric's name
+            help_ (str): the metric's description
+            labelnames (tuple): the names of the labels
+        """
+        self.name = name
+        self.help = help_
+        self.labelnames = tuple(labelnames)
+        # format: {label values (tuple): value}
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(name={self.name!r}, labelnames={self.labelnames})"
+
+    def get_samples(self) -> list:
+        """Get the samples of the metric
+
+        Returns:
+            list of (name, labels (dict), value) tuples
+        """
+        with self.lock:
+            values = list(self.values.items())
+        return [(self.name, dict(zip(self.labelnames, labels)), value) for labels, value in values]
+
+    def get(self, labels: tuple = ()):
+        """Get the value of a label combination
+
+        Args:
+            labels (tuple): the label values. Default: ()
+
+        Returns:
+            the value, None if it was never set
+        """
+        with self.lock:
+            return self.values.get(tuple(labels))
+
+
+class Counter(Metric):
+    """A monotonically increasing value"""
+
+    kind = "counter"
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        """Increase the counter
+
+        Args:
+            labels (tuple): the label values. Default: ()
+            amount (float): the increase. Default: 1
+        """
+        labels = tuple(labels)
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that can go up and down"""
+
+    kind = "gauge"
+
+    def set(self, value: float, labels: tuple = ()):
+        """Set the gauge
+
+        Args:
+            value (float): the value
+            labels (tuple): the label values. Default: ()
+        """
+        with self.lock:
+            self.values[tuple(labels)] = value
+
+
+class Histogram(Metric):
+    """The distribution of the observed values in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_: str, labelnames: tuple = (), buckets: tuple = DURATION_BUCKETS):
+        """The constructor of the Histogram class
+
+        Args:
+            name (str): the metric's name
+            help_ (str): the metric's description
+            labelnames (tuple): the names of the labels
+            buckets (tuple): the upper bounds of the buckets in increasing order, +Inf is added
+        """
+        super().__init__(name, help_, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: tuple = ()):
+        """Observe a value
+
+        Args:
+            value (float): the value
+            labels (tuple): the label values. Default: ()
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        labels = tuple(labels)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                # format: [the counts of the buckets and +Inf (not cumulative), sum]
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, labels: tuple = ()):
+        """Observe the duration of the block in seconds, even if it raises an exception
+
+        Args:
+            labels (tuple): the label values. Default: ()
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, labels)
+
+    def get(self, labels: tuple = ()) -> tuple:
+        """Get the number and the sum of the observed values of a label combination
+
+        Args:
+            labels (tuple): the label values. Default: ()
+
+        Returns:
+            tuple: (count, sum), (0, 0) if nothing was observed
+        """
+        with self.lock:
+            state = self.values.get(tuple(labels))
+            if state is None:
+                return 0, 0
+            return sum(state[0]), state[1]
+
+    def get_samples(self) -> list:
+        """Get the samples of the histogram: the cumulative buckets, the sum and the count
+
+        Returns:
+            list of (name, labels (dict), value) tuples
+        """
+        with self.lock:
+            values = [(labels, list(state[0]), state[1]) for labels, state in self.values.items()]
+        samples = []
+        for labels, counts, sum_ in values:
+            labels = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", dict(labels, le=format_value(bound)), cumulative))
+            samples.append((f"{self.name}_sum", labels, sum_))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    """The metrics and the collectors rendered at GET /metrics
+
+    A collector is a function called at each scrape, returning a list of
+    (name, kind, help, [(labels (dict), value)]) tuples,
+    used for the metrics that are cheaper to read at the scrape than to update continuously.
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self):
+        """The constructor of the Registry class"""
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"Registry(metrics={list(self.metrics)})"
+
+    def register(self, metric: Metric) -> Metric:
+        """Register a metric
+
+        Args:
+            metric (Metric): the metric
+
+        Returns:
+            the metric
+
+        Raises:
+            ValueError: if a metric with the same name is registered
+        """
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"The metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_: str, labelnames: tuple = ()) -> Counter:
+        """Register a Counter, see Counter.__init__"""
+        return self.register(Counter(name, help_, labelnames))
+
+    def gauge(self, name: str, help_: str, labelnames: tuple = ()) -> Gauge:
+        """Register a Gauge, see Gauge.__init__"""
+        return self.register(Gauge(name, help_, labelnames))
+
+    def histogram(self, name: str, help_: str, labelnames: tuple = (), buckets: tuple = DURATION_BUCKETS) -> Histogram:
+        """Register a Histogram, see Histogram.__init__"""
+        return self.register(Histogram(name, help_, labelnames, buckets))
+
+    def add_collector(self, collector):
+        """Add a collector called at each scrape
+
+        Args:
+            collector: a function without arguments, see the class's docs
+        """
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self) -> bytes:
+        """Render the metrics and the collected metrics in the Prometheus text format
+
+        A failing collector is logged and skipped.
+
+        Returns:
+            the metrics (bytes)
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+            collectors = list(self.collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample_name, labels, value in metric.get_samples():
+                lines.append(f"{sample_name}{format_labels(labels)} {format_value(value)}")
+        for collector in collectors:
+            try:
+                collected = collector()
+            except Exception as error:
+                self.logger.error(f"The metrics collector {collector} failed: {error}")
+                continue
+            for name, kind, help_, samples in collected:
+                lines.append(f"# HELP {name} {help_}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+registry = Registry()
+
+LOOP_DURATION = registry.histogram("oee_loop_duration_seconds", "The duration of the loops")
+SCHEDULER_LAG = registry.histogram(
+    "oee_scheduler_lag_seconds", "The delay of the start of the loops after their scheduled time"
+)
+STAGE_DURATION = registry.histogram("oee_stage_duration_seconds", "The duration of the stages", ("stage",))
+WORKSTATION_DURATION = registry.gauge(
+    "oee_workstation_compute_seconds", "The duration of the last calculation of the Workstation", ("workstation",)
+)
+ORION_REQUESTS = registry.counter("oee_orion_requests_total", "The requests sent to Orion", ("method", "status"))
+ORION_BYTES = registry.counter("oee_orion_response_bytes_total", "The size of the responses of Orion")
+SQL_QUERIES = registry.counter("oee_sql_queries_total", "The queries of the Cygnus logs", ("query_class",))
+SQL_ROWS = registry.counter("oee_sql_rows_total", "The rows fetched by the queries", ("query_class",))
+SQL_BYTES = registry.counter(
+    "oee_sql_result_bytes_total", "The approximate in-memory size of the fetched rows", ("query_class",)
+)
+ERRORS = registry.counter("oee_errors_total", "The errors by the exception's class", ("stage", "exception"))
+CACHE_REQUESTS = registry.counter(
+    "oee_cache_requests_total", "The hits and misses of the log caches", ("cache", "result")
+)
+POOL_CONNECTIONS = registry.gauge(
+    "oee_db_pool_connections", "The connections of the loop's pool at the end of the loop", ("state",)
+)
+
+
+def collect_cache_hit_ratios() -> list:
+    """Collect the hit ratios of the log caches from CACHE_REQUESTS
+
+    Returns:
+        the oee_cache_hit_ratio metric, see Registry
+    """
+    requests = {}
+    for _, labels, value in CACHE_REQUESTS.get_samples():
+        requests.setdefault(labels["cache"], {})[labels["result"]] = value
+    samples = [
+        ({"cache": cache}, results.get("hit", 0) / sum(results.values()))
+        for cache, results in requests.items()
+        if sum(results.values()) > 0
+    ]
+    return [("oee_cache_hit_ratio", "gauge", "The ratio of the cache hits", samples)]
+
+
+registry.add_collector(collect_cache_hit_ratios)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Serve the registry of the server at GET /metrics"""
+
+    logger = getLogger(__name__)
+
+    def do_GET(self):
+        """Serve a GET request"""
+        if self.path.split("?")[0].rstrip("/") != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.server.registry.render()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args):
+        """Log the requests in debug level instead of writing them to stderr"""
+        self.logger.debug(f"{self.address_string()} {format % args}")
+
+
+class MetricsServer:
+    """The HTTP server of the metrics endpoint, running in a daemon thread
+
+    Common usage:
+        server = MetricsServer()
+        server.start()
+        ...
+        server.stop()
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, registry_: Registry = registry, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        """The constructor of the MetricsServer class
+
+        Args:
+            registry_ (Registry): the served metrics. Default: registry
+            host (str): the address the endpoint listens on
+            port (int): the port of the endpoint, 0 chooses a free port
+        """
+        self.registry = registry_
+        self.host = host
+        self.port = port
+        self.httpd = None
+        self.thread = None
+
+    def __repr__(self):
+        return f"MetricsServer(host={self.host}, port={self.port})"
+
+    def start(self):
+        """Start serving in a daemon thread
+
+        Raises:
+            OSError:
+                if the address cannot be bound
+        """
+        self.httpd = ThreadingHTTPServer((self.host, self.port), RequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = self.registry
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+        self.logger.info(f"Serving the metrics on {self.host}:{self.port}/metrics")
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        if self.httpd is None:
+            return
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+        self.httpd = None
+        self.thread = None
@@ -13,14 +13,37 @@ import psycopg2
 import sqlalchemy
 
 # custom imports
+from CopyReader import CopyReader
+import Cygnus
+import LogCache
 from Logger import getLogger
+import Metrics
 import Orion
+import Reducers
+import ShadowTables
+import Statements
+import Tracing
 
 # type definitions for type hints
 milliseconds = int
 oee = dict
 
 
+def get_span_args(oeeCalculator, *args, **kwargs) -> dict:
+    """Get the tracing span's arguments of an OEECalculator method, see Tracing.traced"""
+    return {"workstation_id": oeeCalculator.workstation["id"]}
+
+
+def get_query_span_args(oeeCalculator, con, table_name: str, how: str) -> dict:
+    """Get the tracing span's arguments of OEECalculator.query_todays_data, see Tracing.traced"""
+    return {"workstation_id": oeeCalculator.workstation["id"], "table_name": table_name, "how": how}
+
+
+def get_df_span_args(oeeCalculator, df: pd.DataFrame) -> dict:
+    """Get the tracing span's arguments of an OEECalculator method processing a DataFrame, see Tracing.traced"""
+    return {"workstation_id": oeeCalculator.workstation["id"], "rows": len(df)}
+
+
 class OEECalculator:
     """An OEE calculator class that builds on Fiware Cygnus logs.
 
@@ -92,6 +115,10 @@ class OEECalculator:
         "performance": None,
         "quality": None
         }
+    # the Job attributes used for counting the production cycles
+    COUNTER_ATTRIBUTES = ("goodPartCounter", "rejectPartCounter")
+    # the attributes read from the logs, the column-mode tables are unpivoted to these
+    LOG_ATTRIBUTES = ("available", "refJob") + COUNTER_ATTRIBUTES
     # get environment variables
     POSTGRES_SCHEMA = os.environ.get("POSTGRES_SCHEMA")
     if POSTGRES_SCHEMA is None:
@@ -99,6 +126,27 @@ class OEECalculator:
         logger.warning(
             f'POSTGRES_SCHEMA environment varialbe not found, using default: "{POSTGRES_SCHEMA}"'
         )
+    # "from_midnight": download the Workstation's logs from midnight
+    # "boundary": download only the rows needed for the availability and the Job's start time
+    WORKSTATION_QUERY_MODE = os.environ.get("WORKSTATION_QUERY_MODE")
+    if WORKSTATION_QUERY_MODE is None:
+        WORKSTATION_QUERY_MODE = "from_midnight"
+    # "rows": download the Job's logs and count the cycles in pandas
+    # "aggregate": let PostgreSQL calculate the counter aggregates
+    JOB_QUERY_MODE = os.environ.get("JOB_QUERY_MODE")
+    if JOB_QUERY_MODE is None:
+        JOB_QUERY_MODE = "rows"
+    # "pandas": read the logs with pd.read_sql_query
+    # "copy": read the logs with PostgreSQL's COPY into NumPy arrays, see CopyReader
+    LOG_READER = os.environ.get("LOG_READER")
+    if LOG_READER is None:
+        LOG_READER = "pandas"
+    # "frames": read the logs into pandas DataFrames, see the query modes above
+    # "chunked": stream the logs in chunks of at most COPY_CHUNK_SIZE rows through reducers,
+    #   the query modes and the log reader are not used, see prepare_chunked
+    PROCESSING_MODE = os.environ.get("PROCESSING_MODE")
+    if PROCESSING_MODE is None:
+        PROCESSING_MODE = "frames"
 
     def __init__(self, workstation_id: str):
         """The constructor of the OEECalculator class
@@ -114,11 +162,48 @@ class OEECalculator:
 
         self.workstation = self.object_.copy()
         self.workstation["id"] = workstation_id
+        # set in the "boundary" workstation query mode if an available: true
+        # record exists since midnight that is not among the queried logs
+        self.workstation["available_since_midnight"] = False
+        # set in the "chunked" processing mode, see prepare_chunked
+        self.workstation["availability_reducer"] = None
+        self.workstation_query_mode = self.WORKSTATION_QUERY_MODE
 
         self.job = self.object_.copy()
+        # counter aggregates queried in the "aggregate" job query mode
+        self.job["counters"] = None
+        self.job_query_mode = self.JOB_QUERY_MODE
 
         self.operation = self.object_.copy()
 
+        # read the typed shadow tables where they exist, see get_logs_source
+        self.shadow_tables = ShadowTables.SHADOW_TABLES
+        # the layout of the Cygnus tables, see Cygnus.get_attr_persistence
+        self.attr_persistence = Cygnus.CYGNUS_ATTR_PERSISTENCE
+        # the naming of the Cygnus tables, see Cygnus.get_postgres_table
+        self.data_model = Cygnus.CYGNUS_DATA_MODEL
+        self.logs_sources = {}
+        self.log_reader = self.LOG_READER
+        self.processing_mode = self.PROCESSING_MODE
+        self.chunk_size = CopyReader.COPY_CHUNK_SIZE
+        # chooses the modes above in prepare if set, see Planner.QueryPlanner
+        self.planner = None
+        # the number of rows read from each table, format: {table_name: rows}
+        self.rows_read = {}
+        # the logs of the tables queried for all Workstations at once, see LoopHandler.prefetch_logs
+        # format: {table_name: DataFrame of recvtimets, attrname, attrvalue and entityid}
+        self.prefetched = {}
+        # the time in milliseconds until which the logs were prefetched, it is used as now in set_now,
+        # so the prefetched logs cover the query windows. Default: None, the calculation's time
+        self.prefetched_until = None
+        # the on-disk cache of today's logs, see query_cached_logs. Default: None, not cached
+        self.log_cache = None
+        # the number of rows of each table returned from the log cache, format: {table_name: rows}
+        # only the downloaded rows are counted in rows_read
+        self.rows_cached = {}
+        # the reducers' state between the calculations, see prepare_chunked. Default: None, not kept
+        self.checkpoint = None
+
     def __repr__(self):
         return f'OEECalculator({self.workstation["id"]})'
 
@@ -133,8 +218,12 @@ class OEECalculator:
         The human readable datetime objects are displayed locally.
 
         This method is called only once per calculation.
+        The time of the loop's prefetch is used if set, see LoopHandler.prefetch_logs.
         """
-        self.now_unix = datetime.now().timestamp() * 1e3
+        if self.prefetched_until is not None:
+            self.now_unix = self.prefetched_until
+            return
+        self.now_unix = round(datetime.now().timestamp() * 1e3)
 
     @property
     def now_datetime(self) -> datetime:
@@ -174,13 +263,16 @@ class OEECalculator:
     def datetime_to_milliseconds(self, datetime_) -> milliseconds:
         """Convert datetime to unix timestamp in milliseconds
 
+        The timestamp is an int, so the queries compare it with the bigint recvtimets,
+        and the indexes on cast (recvtimets as bigint) can be used.
+
         Args:
             datetime_ (datetime): datetime to convert
 
         Returns:
-            unix timestamp in milliseconds
+            unix timestamp in milliseconds (int)
         """
-        return datetime_.timestamp() * 1000
+        return round(datetime_.timestamp() * 1000)
 
     def convert_recvtimets_column_to_int(self, df):
         """Convert a pandas DataFrame's recvtimets column to int64
@@ -190,25 +282,44 @@ class OEECalculator:
         """
         df["recvtimets"] = df["recvtimets"].astype("float64").astype("int64")
 
-    def get_cygnus_postgres_table(self, orion_obj: dict) -> str:
+    @classmethod
+    def get_cygnus_postgres_table(cls, orion_obj: dict, data_model: str = None) -> str:
         """Get the table name of the PostgreSQL logs
 
         The table names are set by Fiware Cygnus, this method just recreates the table name
 
         Args:
             orion_obj (dict): Orion object
+            data_model (str): Cygnus' data model. Default: None, Cygnus.CYGNUS_DATA_MODEL
 
         Returns:
             postgres table name (str)
         """
-        return (
-            orion_obj["id"].replace(":", "_").lower() + "_" + orion_obj["type"].lower()
-        )
+        return Cygnus.get_postgres_table(orion_obj, data_model)
+
+    def get_table_entity_id(self, table_name: str) -> str:
+        """Get the id of the entity whose logs are read from a table shared by more entities
+
+        Args:
+            table_name (str): PostgreSQL table name
+
+        Returns:
+            the id of the Workstation or the Job logged in the table (str),
+            or None in the "dm-by-entity" data model, where each entity has its own table
+        """
+        if self.data_model == "dm-by-entity":
+            return None
+        for object_ in (self.workstation, self.job):
+            if object_.get("postgres_table") == table_name:
+                return object_["id"]
+        return None
 
     def get_workstation(self):
         """Download the Workstation object from Orion, get the table name of PostgreSQL logs"""
         self.workstation["orion"] = Orion.get(self.workstation["id"])
-        self.workstation["postgres_table"] = self.get_cygnus_postgres_table(self.workstation["orion"])
+        self.workstation["postgres_table"] = self.get_cygnus_postgres_table(
+            self.workstation["orion"], self.data_model
+        )
         self.logger.debug(f"Workstation: {self.workstation}")
 
     def get_shift(self):
@@ -288,7 +399,7 @@ class OEECalculator:
         """Get Job from Orion, fill the self.job dict"""
         self.job["id"] = self.get_job_id()
         self.job["orion"] = Orion.get(self.job["id"])
-        self.job["postgres_table"] = self.get_cygnus_postgres_table(self.job["orion"])
+        self.job["postgres_table"] = self.get_cygnus_postgres_table(self.job["orion"], self.data_model)
         self.logger.debug(f"Job: {self.job}")
 
     def get_operation_id(self):
@@ -359,6 +470,7 @@ class OEECalculator:
                 f"Cannot set query start time. Unsupported argument: how={how}"
             )
 
+    @Tracing.traced("sql", get_query_span_args, rows=True)
     def query_todays_data(self, con, table_name: str, how: str) -> pd.DataFrame:
         """Query today's data from PostgreSQL from a table
 
@@ -376,20 +488,549 @@ class OEECalculator:
         """
         start_timestamp = self.get_query_start_timestamp(how)
         self.logger.debug(f"query_todays_data: start_timestamp: {start_timestamp}")
-        query = f"""select * from {self.POSTGRES_SCHEMA}.{table_name}
-                    where {start_timestamp} <= cast (recvtimets as bigint)
-                    and cast (recvtimets as bigint) <= {self.now_unix};"""
+        if self.prefetched:
+            Metrics.CACHE_REQUESTS.inc(("prefetch", "hit" if table_name in self.prefetched else "miss"))
+        if table_name in self.prefetched:
+            return self.filter_prefetched_logs(table_name, start_timestamp)
+        source = self.get_logs_source(con, table_name)
+        if self.log_cache is not None:
+            return self.query_cached_logs(con, table_name, source, start_timestamp)
+        query = f"""select * from {source["relation"]}
+                    where {start_timestamp} <= {source["recvtimets"]}
+                    and {source["recvtimets"]} <= {self.now_unix};"""
+        return self.read_logs(con, query, table_name)
+
+    def query_cached_logs(self, con, table_name: str, source: dict, start_timestamp: float) -> pd.DataFrame:
+        """Query today's logs of a table through the on-disk log cache
+
+        The logs since midnight are cached, see LogCache. Only the logs since the cached watermark
+        minus the cache's overlap are queried, they replace the cached logs of the same period.
+        Then they are appended to the cache as a segment, or the entry is rewritten
+        if it does not exist yet or has the cache's maximum number of segments.
+
+        Args:
+            con (sqlalchemy connection object): self.con, the LoopHandler creates it
+            table_name (str): PostgreSQL table name
+            source (dict): the relation of the logs, see get_logs_source
+            start_timestamp (float): the start of the query window in milliseconds
+
+        Returns:
+            pandas DataFrame containing the recvtimets (int64), attrname and attrvalue (str) columns
+
+        Raises:
+            RuntimeError:
+                if the SQL query fails
+        """
+        key = LogCache.get_key(table_name, self.get_table_entity_id(table_name))
+        day = self.now_datetime.date()
+        cached = self.log_cache.load(key, day)
+        Metrics.CACHE_REQUESTS.inc(("log_cache", "miss" if cached is None else "hit"))
+        if cached is None:
+            fetch_start = self.get_query_start_timestamp("from_midnight")
+            cached = {column: np.array([], dtype=np.int64 if column == "recvtimets" else str)
+                      for column in LogCache.COLUMNS}
+        else:
+            fetch_start = cached["watermark"] - self.log_cache.overlap
+        self.logger.debug(f"Reading {table_name} from the log cache, querying the logs since {fetch_start}")
+        query = f"""select {source["recvtimets"]} as recvtimets, attrname, attrvalue from {source["relation"]}
+                    where {fetch_start} <= {source["recvtimets"]}
+                    and {source["recvtimets"]} <= {self.now_unix};"""
+        df_tail = self.read_logs(con, query, table_name)
+        tail = {
+            "recvtimets": df_tail["recvtimets"].astype("float64").astype(np.int64).to_numpy(),
+            "attrname": df_tail["attrname"].astype(str).to_numpy(),
+            "attrvalue": df_tail["attrvalue"].astype(str).to_numpy(),
+        }
+        kept = np.asarray(cached["recvtimets"]) < fetch_start
+        arrays = {
+            column: np.concatenate([np.asarray(cached[column])[kept], tail[column]]) for column in LogCache.COLUMNS
+        }
+        if "watermark" not in cached:
+            self.log_cache.store(key, day, arrays, self.now_unix)
+        elif cached["watermark"] < self.now_unix:
+            if cached["segments"] < self.log_cache.max_segments:
+                self.log_cache.append(key, day, tail, fetch_start, self.now_unix)
+            else:
+                # compact the entry
+                self.log_cache.store(key, day, arrays, self.now_unix)
+        mask = (start_timestamp <= arrays["recvtimets"]) & (arrays["recvtimets"] <= self.now_unix)
+        df = pd.DataFrame({column: arrays[column][mask] for column in LogCache.COLUMNS})
+        self.rows_cached[table_name] = self.rows_cached.get(table_name, 0) + len(df)
+        return df
+
+    def filter_prefetched_logs(self, table_name: str, start_timestamp: float) -> pd.DataFrame:
+        """Get today's logs of the OEECalculator's entity from the prefetched logs of a table
+
+        Args:
+            table_name (str): PostgreSQL table name
+            start_timestamp (float): the start of the query window in milliseconds
+
+        Returns:
+            pandas DataFrame containing the recvtimets, attrname and attrvalue columns
+        """
+        df = self.prefetched[table_name]
+        entity_id = self.get_table_entity_id(table_name)
+        mask = (start_timestamp <= df["recvtimets"]) & (df["recvtimets"] <= self.now_unix)
+        if entity_id is not None:
+            mask &= df["entityid"] == entity_id
+        df = df.loc[mask, ["recvtimets", "attrname", "attrvalue"]].reset_index(drop=True)
+        self.logger.debug(f"Read {len(df)} prefetched rows of {table_name}")
+        self.count_rows_read(table_name, len(df))
+        return df
+
+    @classmethod
+    def query_entities_logs(
+        cls,
+        con,
+        table_name: str,
+        entity_ids: list,
+        start_timestamp: float,
+        end_timestamp: float,
+        attr_persistence: str = None,
+    ) -> pd.DataFrame:
+        """Query the logs of more entities from a table shared by them in a single query
+
+        Used in the "dm-by-entity-type" data model, where the Workstations or the Jobs
+        of the same type are logged in the same table, see LoopHandler.prefetch_logs.
+
+        Args:
+            con (sqlalchemy connection object): connection to PostgreSQL
+            table_name (str): PostgreSQL table name
+            entity_ids (list): the ids of the entities
+            start_timestamp (float): the start of the query window in milliseconds
+            end_timestamp (float): the end of the query window in milliseconds
+            attr_persistence (str): the layout of the table. Default: None, Cygnus.CYGNUS_ATTR_PERSISTENCE
+
+        Returns:
+            pandas DataFrame containing the recvtimets (int64), attrname, attrvalue and entityid columns
+
+        Raises:
+            RuntimeError:
+                if the SQL query fails or exceeds the statement_timeout
+        """
+        if Cygnus.get_attr_persistence(con, table_name, attr_persistence) == "column":
+            relation = Cygnus.get_column_logs_relation(con, table_name, cls.LOG_ATTRIBUTES)
+            recvtimets = "recvtimets"
+        else:
+            relation = Cygnus.get_entity_logs_relation(table_name)
+            recvtimets = "cast (recvtimets as bigint)"
+        query = f"""select {recvtimets} as recvtimets, attrname, attrvalue, entityid from {relation}
+                    where entityid = any(:entity_ids) and {start_timestamp} <= {recvtimets}
+                    and {recvtimets} <= {end_timestamp};"""
+        params = {"entity_ids": list(entity_ids)}
         try:
-            df = pd.read_sql_query(sqlalchemy.text(query), con=con)
+            with Statements.timed_query(con, "logs", table_name, query, params) as result:
+                df = pd.read_sql_query(sqlalchemy.text(query), con=con, params=params)
+                result["rows"] = len(df)
+                result["bytes"] = int(df.memory_usage(index=False).sum())
         except (
             psycopg2.errors.UndefinedTable,
             sqlalchemy.exc.ProgrammingError,
+        ) as error:
+            raise RuntimeError(
+                f"The SQL table: {table_name} cannot be queried from the table_schema: {cls.POSTGRES_SCHEMA}."
+            ) from error
+        df["recvtimets"] = df["recvtimets"].astype(np.int64)
+        return df
+
+    def get_logs_source(self, con, table_name: str) -> dict:
+        """Get the relation the logs of a Cygnus table are queried from
+
+        If the table is in Cygnus' column mode, its LOG_ATTRIBUTES columns are queried
+        in the row-mode layout, see Cygnus.get_column_logs_relation.
+        If self.shadow_tables is True and the table has a typed shadow table,
+        the shadow table is queried, so the timestamps are not cast in the queries
+        and the queried logs need not be converted, see ShadowTables.
+        Otherwise the Cygnus table is queried.
+        If the table is shared by more entities, only the OEECalculator's entity is queried,
+        see get_table_entity_id. The shadow tables have no entityid, so they are not used then.
+        The result is cached for the OEECalculator's lifetime.
+
+        Args:
+            con (sqlalchemy connection object): self.con, the LoopHandler creates it
+            table_name (str): PostgreSQL table name of the Cygnus table
+
+        Returns:
+            dict with the following keys:
+                relation: the relation (str) used in the from clause of the queries
+                recvtimets: the expression (str) of the timestamp in bigint
+                counter_value: the expression (str) of a counter value in bigint
+
+        Raises:
+            ValueError:
+                if a column-mode table has no recvTime column or none of the LOG_ATTRIBUTES
+            NotImplementedError:
+                if the attr_persistence is not supported
+        """
+        if table_name in self.logs_sources:
+            return self.logs_sources[table_name]
+        entity_id = self.get_table_entity_id(table_name)
+        if Cygnus.get_attr_persistence(con, table_name, self.attr_persistence) == "column":
+            self.logger.debug(f"Reading the column-mode table {table_name}")
+            source = {
+                "relation": Cygnus.get_column_logs_relation(con, table_name, self.LOG_ATTRIBUTES, entity_id),
+                "recvtimets": "recvtimets",
+                "counter_value": "cast (attrvalue as bigint)",
+            }
+        elif entity_id is None and self.shadow_tables and ShadowTables.shadow_table_exists(con, table_name):
+            self.logger.debug(f"Reading the shadow table of {table_name}")
+            source = {
+                "relation": ShadowTables.get_logs_relation(table_name),
+                "recvtimets": "recvtimets",
+                # like the Cygnus tables, a non-integer or non-numeric value raises an error:
+                # the attrvalue is only cast if the numvalue is not an integer
+                "counter_value": (
+                    "case when numvalue = trunc(numvalue) then cast (numvalue as bigint) "
+                    "else cast (attrvalue as bigint) end"
+                ),
+            }
+        else:
+            source = {
+                "relation": Cygnus.get_entity_logs_relation(table_name, entity_id),
+                "recvtimets": "cast (recvtimets as bigint)",
+                "counter_value": "cast (attrvalue as bigint)",
+            }
+        self.logs_sources[table_name] = source
+        return source
+
+    def count_rows_read(self, table_name: str, n_rows: int):
+        """Add to the number of rows read from a table
+
+        Args:
+            table_name (str): PostgreSQL table name
+            n_rows (int): the number of rows read
+        """
+        self.rows_read[table_name] = self.rows_read.get(table_name, 0) + n_rows
+
+    def read_sql_query(
+        self, con, query: str, table_name: str, params: dict = None, query_class: str = "logs"
+    ) -> pd.DataFrame:
+        """Run an SQL query on a Cygnus table and return the result
+
+        The query runs under the statement_timeout of its class, see Statements.
+
+        Args:
+            con (sqlalchemy connection object): self.con, the LoopHandler creates it
+            query (str): the SQL query, it may contain :named parameters
+            table_name (str): PostgreSQL table name, used in the error message
+            params (dict): the values of the query's named parameters. Default: None
+            query_class (str): "logs", "aggregate" or "exists". Default: "logs"
+
+        Returns:
+            pandas DataFrame containing the queried data
+
+        Raises:
+            RuntimeError:
+                if the SQL query fails or exceeds the statement_timeout
+        """
+        try:
+            with Statements.timed_query(con, query_class, table_name, query, params) as result:
+                df = pd.read_sql_query(sqlalchemy.text(query), con=con, params=params)
+                result["rows"] = len(df)
+                result["bytes"] = int(df.memory_usage(index=False).sum())
+        except (
+            psycopg2.errors.UndefinedTable,
+            sqlalchemy.exc.ProgrammingError,
+        ) as error:
+            raise RuntimeError(
+                f"The SQL table: {table_name} cannot be queried from the table_schema: {self.POSTGRES_SCHEMA}."
+            ) from error
+        self.count_rows_read(table_name, len(df))
+        return df
+
+    def read_logs(self, con, query: str, table_name: str, params: dict = None) -> pd.DataFrame:
+        """Run an SQL query of Cygnus logs and return the result
+
+        In the "pandas" log reader mode, the same as read_sql_query.
+        In the "copy" log reader mode, the result is copied with PostgreSQL's COPY,
+        and only the recvtimets (int64), attrname and attrvalue columns are returned.
+
+        Args:
+            con (sqlalchemy connection object): self.con, the LoopHandler creates it
+            query (str): the SQL query, it may contain :named parameters
+            table_name (str): PostgreSQL table name, used in the error message
+            params (dict): the values of the query's named parameters. Default: None
+
+        Returns:
+            pandas DataFrame containing the queried data
+
+        Raises:
+            RuntimeError:
+                if the SQL query fails or exceeds the statement_timeout
+            NotImplementedError:
+                if the log reader mode is not supported
+        """
+        if self.log_reader == "pandas":
+            return self.read_sql_query(con, query, table_name, params)
+        if self.log_reader != "copy":
+            raise NotImplementedError(f"Unsupported log reader: {self.log_reader}")
+        try:
+            with Statements.timed_query(con, "logs", table_name, query, params) as result:
+                df = CopyReader().read_frame(con, query, params)
+                result["rows"] = len(df)
+                result["bytes"] = int(df.memory_usage(index=False).sum())
+        except (
+            psycopg2.errors.UndefinedTable,
+            psycopg2.ProgrammingError,
         ) as error:
             raise RuntimeError(
                 f"The SQL table: {table_name} cannot be queried from the table_schema: {self.POSTGRES_SCHEMA}."
             ) from error
+        self.count_rows_read(table_name, len(df))
         return df
 
+    def stream_logs(self, con, query: str, table_name: str, on_chunk, params: dict = None) -> int:
+        """Run an SQL query of Cygnus logs and pass the result to a callback in chunks
+
+        The result is copied with PostgreSQL's COPY in chunks of at most self.chunk_size rows,
+        so the memory use does not grow with the number of rows, see CopyReader.
+        The chunks' codes refer to the chunks' own categories.
+
+        Args:
+            con (sqlalchemy connection object): self.con, the LoopHandler creates it
+            query (str): the SQL query, it may contain :named parameters
+            table_name (str): PostgreSQL table name, used in the error message
+            on_chunk (callable): called with each chunk (LogArrays)
+            params (dict): the values of the query's named parameters. Default: None
+
+        Returns:
+            the number of rows read (int)
+
+        Raises:
+            RuntimeError:
+                if the SQL query fails or exceeds the statement_timeout
+        """
+        try:
+            with Statements.timed_query(con, "logs", table_name, query, params) as result:
+                n_rows = CopyReader(self.chunk_size, chunk_categories=True).read(con, query, params, on_chunk=on_chunk)
+                result["rows"] = n_rows
+        except (
+            psycopg2.errors.UndefinedTable,
+            psycopg2.ProgrammingError,
+        ) as error:
+            raise RuntimeError(
+                f"The SQL table: {table_name} cannot be queried from the table_schema: {self.POSTGRES_SCHEMA}."
+            ) from error
+        self.count_rows_read(table_name, n_rows)
+        return n_rows
+
+    def stream_attribute_logs(
+        self,
+        con,
+        table_name: str,
+        attributes: tuple,
+        start_timestamp: milliseconds,
+        on_chunk,
+        end_timestamp: milliseconds = None,
+    ) -> int:
+        """Stream the logs of some attributes from a timestamp until now in chronological order
+
+        Args:
+            con (sqlalchemy connection object): self.con, the LoopHandler creates it
+            table_name (str): PostgreSQL table name
+            attributes (tuple): the attribute names
+            start_timestamp (milliseconds): the first timestamp of the logs
+            on_chunk (callable): called with each chunk (LogArrays)
+            end_timestamp (milliseconds): the last timestamp of the logs. Default: None, self.now_unix
+
+        Returns:
+            the number of rows read (int)
+
+        Raises:
+            RuntimeError:
+                if the SQL query fails
+        """
+        if end_timestamp is None:
+            end_timestamp = self.now_unix
+        source = self.get_logs_source(con, table_name)
+        names = ", ".join(f"'{attribute}'" for attribute in attributes)
+        query = f"""select * from {source["relation"]}
+                    where attrname in ({names})
+                    and {start_timestamp} <= {source["recvtimets"]}
+                    and {source["recvtimets"]} <= {end_timestamp}
+                    order by {source["recvtimets"]};"""
+        return self.stream_logs(con, query, table_name, on_chunk)
+
+    def stream_checkpointed_logs(
+        self,
+        con,
+        table_name: str,
+        attributes: tuple,
+        start_timestamp: milliseconds,
+        reducer: Reducers.Reducer,
+        watermark: milliseconds,
+    ) -> dict:
+        """Stream the logs of some attributes until now through a reducer, taking its state at the watermark
+
+        Args:
+            con (sqlalchemy connection object): self.con, the LoopHandler creates it
+            table_name (str): PostgreSQL table name
+            attributes (tuple): the attribute names
+            start_timestamp (milliseconds): the first timestamp of the logs
+            reducer (Reducers.Reducer): the reducer updated with the chunks
+            watermark (milliseconds): the last timestamp of the logs in the state, None if no state is needed
+
+        Returns:
+            the reducer's state after the logs until the watermark (dict), None if watermark is None
+        """
+        if watermark is None:
+            self.stream_attribute_logs(con, table_name, attributes, start_timestamp, reducer.update)
+            return None
+        self.stream_attribute_logs(con, table_name, attributes, start_timestamp, reducer.update, watermark)
+        state = reducer.get_state()
+        # the logs after the watermark are only in the current KPIs, the next calculation streams them again
+        self.stream_attribute_logs(con, table_name, attributes, max(start_timestamp, watermark + 1), reducer.update)
+        return state
+
+    def query_refJob_boundary_rows(self, con, table_name: str) -> pd.DataFrame:
+        """Query the Workstation's refJob rows needed for the current Job's start time
+
+        Instead of today's full log, only two rows are queried,
+        both by an indexed lookup:
+            the last refJob record since midnight
+            the first refJob record since midnight that refers to the current Job
+        These are all get_current_job_start_time_today needs.
+
+        Args:
+            con (sqlalchemy connection object): self.con, the LoopHandler creates it
+            table_name (str): PostgreSQL table name of the Workstation's logs
+
+        Returns:
+            pandas DataFrame containing at most two rows
+
+        Raises:
+            RuntimeError:
+                if the SQL query fails
+        """
+        midnight = self.get_query_start_timestamp("from_midnight")
+        source = self.get_logs_source(con, table_name)
+        query = f"""(select * from {source["relation"]}
+                    where attrname = 'refJob'
+                    and {midnight} <= {source["recvtimets"]}
+                    and {source["recvtimets"]} <= {self.now_unix}
+                    order by {source["recvtimets"]} desc limit 1)
+                    union all
+                    (select * from {source["relation"]}
+                    where attrname = 'refJob' and attrvalue = :job_id
+                    and {midnight} <= {source["recvtimets"]}
+                    and {source["recvtimets"]} <= {self.now_unix}
+                    order by {source["recvtimets"]} limit 1);"""
+        return self.read_logs(con, query, table_name, params={"job_id": self.job["id"]})
+
+    def query_availability_boundary_rows(self, con, table_name: str) -> pd.DataFrame:
+        """Query the Workstation's available rows needed for the availability
+
+        calc_availability needs the last available record before reference_start_time
+        and all available records since reference_start_time.
+        The boundary row is queried since midnight, just like in the "from_midnight" mode.
+
+        Args:
+            con (sqlalchemy connection object): self.con, the LoopHandler creates it
+            table_name (str): PostgreSQL table name of the Workstation's logs
+
+        Returns:
+            pandas DataFrame containing the queried data
+
+        Raises:
+            RuntimeError:
+                if the SQL query fails
+        """
+        midnight = self.get_query_start_timestamp("from_midnight")
+        reference_start_timestamp = self.datetime_to_milliseconds(self.today["reference_start_time"])
+        source = self.get_logs_source(con, table_name)
+        query = f"""(select * from {source["relation"]}
+                    where attrname = 'available'
+                    and {midnight} <= {source["recvtimets"]}
+                    and {source["recvtimets"]} < {reference_start_timestamp}
+                    order by {source["recvtimets"]} desc limit 1)
+                    union all
+                    (select * from {source["relation"]}
+                    where attrname = 'available'
+                    and {reference_start_timestamp} <= {source["recvtimets"]}
+                    and {source["recvtimets"]} <= {self.now_unix});"""
+        return self.read_logs(con, query, table_name)
+
+    def query_available_since_midnight(self, con, table_name: str) -> bool:
+        """Check in PostgreSQL if the Workstation was turned available since midnight
+
+        Args:
+            con (sqlalchemy connection object): self.con, the LoopHandler creates it
+            table_name (str): PostgreSQL table name of the Workstation's logs
+
+        Returns:
+            True if there is an available: true record since midnight,
+            False otherwise
+
+        Raises:
+            RuntimeError:
+                if the SQL query fails
+        """
+        midnight = self.get_query_start_timestamp("from_midnight")
+        source = self.get_logs_source(con, table_name)
+        query = f"""select exists (select 1 from {source["relation"]}
+                    where attrname = 'available' and attrvalue = 'true'
+                    and {midnight} <= {source["recvtimets"]}
+                    and {source["recvtimets"]} <= {self.now_unix}) as available_since_midnight;"""
+        df = self.read_sql_query(con, query, table_name, query_class="exists")
+        return bool(df["available_since_midnight"].iloc[0])
+
+    def query_counter_aggregates(self, con, table_name: str) -> dict:
+        """Query the aggregates of the Job's counters since reference_start_time from PostgreSQL
+
+        Instead of downloading every counter log, PostgreSQL calculates
+        the minimum and maximum of each counter and whether 0 is present.
+        This is all count_cycles_based_on_counter_extrema needs,
+        so the transferred data does not grow with the line speed.
+
+        Args:
+            con (sqlalchemy connection object): self.con, the LoopHandler creates it
+            table_name (str): PostgreSQL table name of the Job's logs
+
+        Returns:
+            dict of the counter aggregates, keyed by the counter attribute names
+            format:
+                {
+                "goodPartCounter": {"min_value": 16, "max_value": 56, "zero_present": False},
+                ...
+                }
+            A counter is missing from the dict if it has no logs since reference_start_time
+
+        Raises:
+            RuntimeError:
+                if the SQL query fails
+            ValueError:
+                if a counter value cannot be converted to int
+        """
+        start_timestamp = self.datetime_to_milliseconds(self.today["reference_start_time"])
+        self.logger.debug(f"query_counter_aggregates: start_timestamp: {start_timestamp}")
+        attributes = ", ".join(f"'{attribute}'" for attribute in self.COUNTER_ATTRIBUTES)
+        source = self.get_logs_source(con, table_name)
+        query = f"""select attrname,
+                    min({source["counter_value"]}) as min_value,
+                    max({source["counter_value"]}) as max_value,
+                    bool_or({source["counter_value"]} = 0) as zero_present
+                    from {source["relation"]}
+                    where attrname in ({attributes})
+                    and {start_timestamp} <= {source["recvtimets"]}
+                    and {source["recvtimets"]} <= {self.now_unix}
+                    group by attrname;"""
+        try:
+            df = self.read_sql_query(con, query, table_name, query_class="aggregate")
+        except sqlalchemy.exc.DataError as error:
+            raise ValueError(
+                "At least one goodPartCounter or rejectPartCounter value cannot be converted to int"
+            ) from error
+        counters = {}
+        for _, row in df.iterrows():
+            counters[row["attrname"]] = {
+                "min_value": int(row["min_value"]),
+                "max_value": int(row["max_value"]),
+                "zero_present": bool(row["zero_present"]),
+            }
+        self.logger.debug(f"Counter aggregates: {counters}")
+        return counters
+
+    @Tracing.traced("parse", get_df_span_args)
     def convert_dataframe_to_str(self, df: pd.DataFrame) -> pd.DataFrame:
         """Convert a pandas DataFrame's all columns to str
 
@@ -423,6 +1064,24 @@ class OEECalculator:
             )
         return df_.sort_values(by=["recvtimets"])
 
+    @Tracing.traced("parse", get_df_span_args)
+    def convert_and_sort_logs(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Convert the queried Cygnus logs to str, the recvtimets column to int and sort them by time
+
+        The logs queried from a shadow table are already typed, they are only sorted
+
+        Args:
+            df (pd.DataFrame): queried Cygnus logs
+
+        Returns:
+            converted and sorted pandas DataFrame
+        """
+        with Metrics.STAGE_DURATION.time(("parse",)):
+            if df["recvtimets"].dtype != np.int64:
+                df = self.convert_dataframe_to_str(df)
+                self.convert_recvtimets_column_to_int(df)
+            return self.sort_df_by_time(df)
+
     def get_current_job_start_time_today(self) -> datetime:
         """Get the Job's start time. If it is before the shift's start, return the shift start time
 
@@ -486,11 +1145,13 @@ class OEECalculator:
                 f'The current job started before this shift, reference_start_time: {self.today["reference_start_time"]}'
             )
 
+    @Tracing.traced("prepare", get_span_args)
     def prepare(self, con):
         """Prepare the OEECalculator object
 
         Download all Objects from Orion
         Set time data
+        Choose the query modes with self.planner if set
         Query logs from Cygnus
         Sets reference_start_time
 
@@ -506,6 +1167,18 @@ class OEECalculator:
 
         """
         self.set_now()
+        if self.workstation_query_mode not in ("from_midnight", "boundary"):
+            raise NotImplementedError(
+                f"Unsupported workstation query mode: {self.workstation_query_mode}"
+            )
+        if self.job_query_mode not in ("rows", "aggregate"):
+            raise NotImplementedError(
+                f"Unsupported job query mode: {self.job_query_mode}"
+            )
+        if self.processing_mode not in ("frames", "chunked"):
+            raise NotImplementedError(
+                f"Unsupported processing mode: {self.processing_mode}"
+            )
         try:
             # also includes getting the shift's limits
             self.get_objects_shift_limits()
@@ -519,26 +1192,160 @@ class OEECalculator:
                 f"The current time: {self.now_datetime} is outside today's shift, no OEE data"
             )
 
-        self.workstation["df"] = self.query_todays_data(
-            con=con, table_name=self.workstation["postgres_table"], how="from_midnight"
-        )
-        self.workstation["df"] = self.convert_dataframe_to_str(self.workstation["df"])
-        self.convert_recvtimets_column_to_int(self.workstation["df"])
-        self.workstation["df"] = self.sort_df_by_time(self.workstation["df"])
+        if self.planner is not None:
+            # sets the query modes and the processing mode
+            self.planner.plan(con, self)
 
-        self.job["df"] = self.query_todays_data(
-            con=con, table_name=self.job["postgres_table"], how="from_shift_start"
+        if self.processing_mode == "chunked":
+            self.prepare_chunked(con)
+            return
+
+        if self.workstation_query_mode == "from_midnight":
+            self.workstation["df"] = self.query_todays_data(
+                con=con, table_name=self.workstation["postgres_table"], how="from_midnight"
+            )
+        else:
+            self.workstation["df"] = self.query_refJob_boundary_rows(
+                con=con, table_name=self.workstation["postgres_table"]
+            )
+        self.workstation["df"] = self.convert_and_sort_logs(self.workstation["df"])
+
+        if self.job_query_mode == "rows":
+            self.job["df"] = self.query_todays_data(
+                con=con, table_name=self.job["postgres_table"], how="from_shift_start"
+            )
+            self.job["df"] = self.convert_and_sort_logs(self.job["df"])
+
+        self.set_reference_start_time()
+
+        if self.workstation_query_mode == "boundary":
+            self.prepare_availability_boundary_rows(con)
+
+        if self.job_query_mode == "rows":
+            # make sure that no job record is before reference_start_time
+            # for example if someone turns on the Workstation before Start
+            # despite the documentation's clear statement about not to do that
+            self.job["df"] = self.filter_in_relation_to_reference_start_time(self.job["df"], how="after")
+        else:
+            # the aggregates are queried from reference_start_time on
+            self.job["counters"] = self.query_counter_aggregates(con, self.job["postgres_table"])
+
+    @Tracing.traced("prepare", get_span_args)
+    def prepare_chunked(self, con):
+        """Prepare the OEECalculator object in the "chunked" processing mode
+
+        The logs are streamed in chunks through reducers, see Reducers,
+        so at most self.chunk_size rows are held in the memory at a time:
+            the refJob records since midnight: the two rows get_current_job_start_time_today needs
+            the available records since midnight: the availability, see handle_availability
+            the Job's counter records since reference_start_time: the counter aggregates, see count_cycles
+        If self.checkpoint is set and it has a valid state of the Workstation,
+        the reducers continue from the state and only the logs after its watermark are streamed.
+        The availability and the counter reducers start again if the reference_start_time changed.
+        The reducers' state at the new watermark, self.checkpoint.lag milliseconds before now,
+        is put into self.checkpoint, so the rows Cygnus commits late are processed by the next calculation.
+
+        Args:
+            con (sqlalchemy connection object): LoopHandler creates it
+        """
+        midnight = self.get_query_start_timestamp("from_midnight")
+        state = None
+        if self.checkpoint is not None:
+            state = self.checkpoint.get(
+                self.workstation["id"], self.now_datetime.date().isoformat(), self.shift["id"], self.job["id"]
+            )
+        if state is not None and state["watermark"] > self.now_unix:
+            # the clock was set back, the logs after now are already in the state
+            state = None
+        if state is None:
+            start_timestamp = midnight
+            refJob_reducer = Reducers.RefJobReducer(self.job["id"])
+        else:
+            # the logs until the watermark are already in the state, the timestamps are integers
+            start_timestamp = int(state["watermark"]) + 1
+            refJob_reducer = Reducers.RefJobReducer.from_state(state["reducers"]["refJob"])
+            self.logger.debug(f"Continuing from the checkpoint of {self.workstation['id']} at {state['watermark']}")
+        watermark = None
+        if self.checkpoint is not None:
+            # the watermark never moves back, the state already contains the logs until the previous one
+            watermark = max(self.now_unix - self.checkpoint.lag, start_timestamp - 1)
+        refJob_state = self.stream_checkpointed_logs(
+            con, self.workstation["postgres_table"], ("refJob",), start_timestamp, refJob_reducer, watermark
         )
-        self.job["df"] = self.convert_dataframe_to_str(self.job["df"])
-        self.convert_recvtimets_column_to_int(self.job["df"])
-        self.job["df"] = self.sort_df_by_time(self.job["df"])
+        self.workstation["df"] = refJob_reducer.to_frame()
 
         self.set_reference_start_time()
+        reference_start_timestamp = self.datetime_to_milliseconds(self.today["reference_start_time"])
 
-        # make sure that no job record is before reference_start_time
-        # for example if someone turns on the Workstation before Start 
-        # despite the documentation's clear statement about not to do that
-        self.job["df"] = self.filter_in_relation_to_reference_start_time(self.job["df"], how="after")
+        if state is None or state["reference_start_timestamp"] != reference_start_timestamp:
+            availability_start_timestamp = midnight
+            availability_reducer = Reducers.AvailabilityReducer(reference_start_timestamp)
+            counter_start_timestamp = reference_start_timestamp
+            counter_reducer = Reducers.CounterReducer(self.COUNTER_ATTRIBUTES)
+        else:
+            availability_start_timestamp = start_timestamp
+            # the Job may have started after the watermark
+            counter_start_timestamp = max(start_timestamp, reference_start_timestamp)
+            availability_reducer = Reducers.AvailabilityReducer.from_state(state["reducers"]["availability"])
+            counter_reducer = Reducers.CounterReducer.from_state(state["reducers"]["counter"])
+        availability_state = self.stream_checkpointed_logs(
+            con,
+            self.workstation["postgres_table"],
+            ("available",),
+            availability_start_timestamp,
+            availability_reducer,
+            watermark,
+        )
+        self.workstation["availability_reducer"] = availability_reducer
+        self.workstation["available_since_midnight"] = availability_reducer.available_since_midnight
+
+        counter_state = self.stream_checkpointed_logs(
+            con, self.job["postgres_table"], self.COUNTER_ATTRIBUTES, counter_start_timestamp, counter_reducer, watermark
+        )
+        self.job["counters"] = counter_reducer.counters
+        self.logger.debug(f"Counter aggregates: {self.job['counters']}")
+
+        if self.checkpoint is not None:
+            self.checkpoint.put(
+                self.workstation["id"],
+                {
+                    "day": self.now_datetime.date().isoformat(),
+                    "shift_id": self.shift["id"],
+                    "job_id": self.job["id"],
+                    "watermark": watermark,
+                    "reference_start_timestamp": reference_start_timestamp,
+                    "reducers": {
+                        "refJob": refJob_state,
+                        "availability": availability_state,
+                        "counter": counter_state,
+                    },
+                },
+            )
+
+    def prepare_availability_boundary_rows(self, con):
+        """Query the available rows of the "boundary" workstation query mode
+
+        The queried rows are appended to the refJob rows in self.workstation["df"].
+        If none of them is an available: true record,
+        PostgreSQL is asked if there is any since midnight,
+        see handle_availability.
+
+        Args:
+            con (sqlalchemy connection object): LoopHandler creates it
+        """
+        df_av = self.query_availability_boundary_rows(
+            con=con, table_name=self.workstation["postgres_table"]
+        )
+        df_av = self.convert_and_sort_logs(df_av)
+        if (df_av["attrvalue"] == "true").any():
+            self.workstation["available_since_midnight"] = True
+        else:
+            self.workstation["available_since_midnight"] = self.query_available_since_midnight(
+                con=con, table_name=self.workstation["postgres_table"]
+            )
+        self.workstation["df"] = self.sort_df_by_time(
+            pd.concat([self.workstation["df"], df_av], ignore_index=True)
+        )
 
     def filter_in_relation_to_reference_start_time(self, df: pd.DataFrame, how: str) -> pd.DataFrame:
         """Filter Cygnus logs in relation to reference_start_time
@@ -700,6 +1507,7 @@ class OEECalculator:
             raise ZeroDivisionError("Total time so far in the shift is 0, no OEE data")
         return self.total_available_time / self.total_time_so_far_since_reference_start_time
 
+    @Tracing.traced("compute", get_df_span_args)
     def calc_availability(self, df_av: pd.DataFrame) -> float:
         """Calculate the availability of the Workstation
 
@@ -751,16 +1559,46 @@ class OEECalculator:
             ValueError:
                 if the Workstation was not turned on since midnight
         """
+        if self.workstation["availability_reducer"] is not None:
+            self.handle_availability_chunked()
+            return
         df = self.workstation["df"]
         df_av = df[df["attrname"] == "available"]
         available_true = df_av[df_av["attrvalue"] == "true"]
-        if available_true.size == 0:
+        if available_true.size == 0 and not self.workstation["available_since_midnight"]:
             raise ValueError(
                 f'The Workstation {self.workstation["id"]} was not turned available by {self.now_datetime} since midnight, no OEE data'
             )
         self.oee["availability"] = self.calc_availability(df_av)
         self.logger.info(f"availability: {self.oee['availability']}")
 
+    def handle_availability_chunked(self):
+        """Handle the availability KPI using the reducer of the "chunked" processing mode
+
+        The same as handle_availability, see Reducers.AvailabilityReducer
+
+        Raises:
+            ValueError:
+                if the Workstation was not turned on since midnight
+                or the Cygnus log contains an invalid availability value
+            ZeroDivisionError:
+                if the total time so far since reference_start_time is 0
+        """
+        if not self.workstation["available_since_midnight"]:
+            raise ValueError(
+                f'The Workstation {self.workstation["id"]} was not turned available by {self.now_datetime} since midnight, no OEE data'
+            )
+        try:
+            (
+                self.oee["availability"],
+                self.total_available_time,
+                self.total_time_so_far_since_reference_start_time,
+            ) = self.workstation["availability_reducer"].calculate(self.now_unix)
+        except ValueError as error:
+            raise ValueError(f"{error} in postgres_table: {self.workstation['postgres_table']}") from error
+        self.logger.info(f"Total available time: {self.total_available_time}")
+        self.logger.info(f"availability: {self.oee['availability']}")
+
     def count_cycles_based_on_counter_values(self, values: np.array) -> int:
         """Count number of machine cycles based on a np.array of goodPartCounter values
 
@@ -794,21 +1632,68 @@ class OEECalculator:
                 The number of successful or failed cycles
         """
         self.logger.debug(f"Count Workstation cycles based on counter values: {values}")
-        if self.operation["orion"]["partsPerCycle"]["value"] == 0:
-            raise ZeroDivisionError(f"The following operation's partsPerCycle value is 0, cannot calculate OEE: {self.operation['id']}")
         values = np.unique(np.array(values))
         try:
             values = values.astype(int)
         except ValueError as error:
             raise ValueError("At least one goodPartCounter or rejectPartCounter value cannot be converted to int") from error
-        min = values.min()
-        max = values.max()
-        if 0 in values:
+        return self.count_cycles_based_on_counter_extrema(
+            min_value=values.min(),
+            max_value=values.max(),
+            zero_present=0 in values
+        )
+
+    def count_cycles_based_on_counter_extrema(self, min_value: int, max_value: int, zero_present: bool) -> int:
+        """Count number of machine cycles based on the extrema of a counter
+
+        The arithmetic of count_cycles_based_on_counter_values,
+        also used with the counter aggregates queried from PostgreSQL
+            if 0 is present among the counter values:
+                result = (max-min)/PartsPerCycle
+            if 0 is not present among the counter values:
+                result = (max-min)/PartsPerCycle + 1
+
+        Args:
+            min_value (int): the minimum of the counter values
+            max_value (int): the maximum of the counter values
+            zero_present (bool): True if 0 is among the counter values
+
+        Returns:
+            Integer:
+                The number of successful or failed cycles
+
+        Raises:
+            ZeroDivisionError:
+                if the Operation's partsPerCycle is 0
+        """
+        if self.operation["orion"]["partsPerCycle"]["value"] == 0:
+            raise ZeroDivisionError(f"The following operation's partsPerCycle value is 0, cannot calculate OEE: {self.operation['id']}")
+        if zero_present:
             self.logger.debug("0 in values")
-            return (max - min) / self.operation["orion"]["partsPerCycle"]["value"]
-        if 0 not in values:
+            return (max_value - min_value) / self.operation["orion"]["partsPerCycle"]["value"]
+        else:
             self.logger.debug("0 not in values")
-            return (max - min) / self.operation["orion"]["partsPerCycle"]["value"] + 1
+            return (max_value - min_value) / self.operation["orion"]["partsPerCycle"]["value"] + 1
+
+    def get_counter_aggregate(self, attribute: str) -> dict:
+        """Get the queried aggregates of a Job counter
+
+        Args:
+            attribute (str): "goodPartCounter" or "rejectPartCounter"
+
+        Returns:
+            the counter's aggregates, see query_counter_aggregates
+
+        Raises:
+            ValueError:
+                if the counter has no logs since reference_start_time
+        """
+        try:
+            return self.job["counters"][attribute]
+        except KeyError as error:
+            raise ValueError(
+                f'No {attribute} record found in the logs of the Job {self.job["id"]} since {self.today["reference_start_time"]}'
+            ) from error
 
     def count_cycles(self) -> int:
         """Count the number of successful and failed production cycles 
@@ -821,6 +1706,9 @@ class OEECalculator:
             n_successful_cycles
             n_failed_cycles
             n_total_cycles"""
+        if self.job_query_mode == "aggregate" or self.processing_mode == "chunked":
+            self.count_cycles_from_aggregates()
+            return
         df = self.job["df"]
         attr_name_val = df[["attrname", "attrvalue"]]
         goodPartCounter_values = attr_name_val[
@@ -838,6 +1726,32 @@ class OEECalculator:
         self.n_total_cycles = self.n_successful_cycles + self.n_failed_cycles
         self.logger.debug(f"Number of total cycles: {self.n_total_cycles}")
 
+    def count_cycles_from_aggregates(self):
+        """Count the number of successful and failed production cycles using the queried counter aggregates
+
+        Used in the "aggregate" job query mode and the "chunked" processing mode, see count_cycles"""
+        self.n_successful_cycles = self.count_cycles_based_on_counter_extrema(
+            **self.get_counter_aggregate("goodPartCounter")
+        )
+        self.logger.debug(f"Number of successful cycles: {self.n_successful_cycles}")
+        self.n_failed_cycles = self.count_cycles_based_on_counter_extrema(
+            **self.get_counter_aggregate("rejectPartCounter")
+        )
+        self.logger.debug(f"Number of failed cycles: {self.n_failed_cycles}")
+        self.n_total_cycles = self.n_successful_cycles + self.n_failed_cycles
+        self.logger.debug(f"Number of total cycles: {self.n_total_cycles}")
+
+    def has_job_data(self) -> bool:
+        """Check if there is any Job data since reference_start_time
+
+        Returns:
+            True if the Job's logs or counter aggregates contain any data,
+            False otherwise
+        """
+        if self.job_query_mode == "aggregate" or self.processing_mode == "chunked":
+            return len(self.job["counters"]) > 0
+        return self.job["df"].size > 0
+
     def handle_quality(self):
         """Handle everything related to quality KPI
 
@@ -846,7 +1760,7 @@ class OEECalculator:
         Raises:
             ValueError:
                 No completed production cycle in the Job's logs"""
-        if self.job["df"].size == 0:
+        if not self.has_job_data():
             raise ValueError(
                 f'No job data found for {self.job["id"]} up to time {self.now_datetime} on day {self.today}, no OEE data'
             )
@@ -872,6 +1786,7 @@ class OEECalculator:
         )
         self.logger.info(f"performance: {self.oee['performance']}")
 
+    @Tracing.traced("compute", get_span_args)
     def calculate_OEE(self) -> oee:
         """Calculate the OEE
 
@@ -889,6 +1804,7 @@ class OEECalculator:
         self.logger.info(f"OEE data: {self.oee}")
         return self.oee
 
+    @Tracing.traced("compute", get_span_args)
     def calculate_throughput(self) -> float:
         """Calculate the Throughput
 
@@ -7,18 +7,32 @@ The Orion host and port are read from the environment variables
 Environment variables:
     ORION_HOST: the URL of the Orion broker
     ORION_PORT: the port of the Orion broker
+    ORION_TIMEOUT: the timeout of the requests in seconds, not set means no timeout,
+        or the circuit breaker's latency if it is enabled, so a hung Orion counts as a failure
+    ADAPTIVE_LIMIT: limit the concurrent requests to Orion adaptively, see Limiter
+    ORION_CIRCUIT_BREAKER: fail fast while Orion is failing, see Resilience
+    ORION_HEDGING: hedge the slow GET requests, see Resilience
+
+The requests, their errors, the size of the responses and the duration of the GET requests
+are counted, see Metrics. The functions are traced, see Tracing.
 
 Raises:
     RuntimeError: if the ORION_HOST is not set
 """
 # Standard Library imports
+import functools
 import os
+import urllib.parse
 
 # PyPI packages
 import requests
 
 # Custom imports
+import Limiter
 from Logger import getLogger
+import Metrics
+import Resilience
+import Tracing
 
 logger_Orion = getLogger(__name__)
 
@@ -26,6 +40,8 @@ logger_Orion = getLogger(__name__)
 WORKSTATION_OBJECT_TYPE = "i40Asset"
 WORKSTATION_OBJECT_SUBTYPE_NAME = "i40AssetType"
 WORKSTATION_OBJECT_SUBTYPE_VALUE = "Workstation"
+# the maximum number of ids in a GET request of get_objects, so the URL stays short
+GET_OBJECTS_BATCH_SIZE = 100
 
 # environment variables
 ORION_HOST = os.environ.get("ORION_HOST")
@@ -40,6 +56,105 @@ if ORION_PORT is None:
     )
     ORION_PORT = default_port
 
+ORION_TIMEOUT = os.environ.get("ORION_TIMEOUT")
+if ORION_TIMEOUT is not None:
+    ORION_TIMEOUT = float(ORION_TIMEOUT)
+
+# shared by all threads sending requests to Orion
+limiter = Limiter.AdaptiveLimiter("Orion") if Limiter.ADAPTIVE_LIMIT else None
+breaker = Resilience.CircuitBreaker("Orion") if Resilience.ORION_CIRCUIT_BREAKER else None
+hedger = Resilience.Hedger() if Resilience.ORION_HEDGING else None
+
+
+def get_request_class(send_request, url: str) -> str:
+    """Get the class of a request, its method and endpoint, whose latencies are compared, see Limiter
+
+    Args:
+        send_request: requests.get or requests.post
+        url (str): the request's URL
+
+    Returns:
+        the method and the path without the query and the entity's id (str), like "GET /v2/entities/{id}"
+    """
+    method = getattr(send_request, "__name__", "request").upper()
+    path = urllib.parse.urlsplit(url).path
+    if path.startswith("/v2/entities/"):
+        path = "/v2/entities/{id}"
+    return f"{method} {path}"
+
+
+def send_limited(send_request, url: str, hedged: bool = False, **kwargs) -> requests.Response:
+    """Send a request to Orion within the adaptive concurrency limit, see Limiter
+
+    The 5xx responses, the timeouts and the connection errors decrease the limit.
+
+    Args:
+        send_request: requests.get or requests.post
+        url (str): the request's URL
+        hedged (bool): hedge the request if the hedger is set, only for idempotent requests. Default: False
+        kwargs: the keyword arguments of send_request
+
+    Returns:
+        the response
+    """
+    request_class = get_request_class(send_request, url)
+    if hedged and hedger is not None:
+        send_request = functools.partial(hedger.send, send_request)
+    if limiter is None:
+        return send_request(url, **kwargs)
+    with limiter.limit(request_class) as slot:
+        try:
+            response = send_request(url, **kwargs)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            slot["overloaded"] = True
+            raise
+        slot["overloaded"] = response.status_code >= 500
+        return response
+
+
+def send(send_request, url: str, hedged: bool = False, **kwargs) -> requests.Response:
+    """Send a request to Orion through the circuit breaker, see send_limited
+
+    The errors and the 5xx responses count as failures of the circuit breaker.
+    The request is counted by its method and status, or as an error, see Metrics.
+
+    Args:
+        send_request: requests.get or requests.post
+        url (str): the request's URL
+        hedged (bool): hedge the request if the hedger is set, only for idempotent requests. Default: False
+        kwargs: the keyword arguments of send_request
+
+    Returns:
+        the response
+
+    Raises:
+        Resilience.CircuitOpenError: if the circuit is open
+    """
+    if ORION_TIMEOUT is not None:
+        kwargs.setdefault("timeout", ORION_TIMEOUT)
+    elif breaker is not None and breaker.latency is not None:
+        # otherwise a hung request would never be counted as a failure
+        kwargs.setdefault("timeout", breaker.latency)
+    method = getattr(send_request, "__name__", "request").upper()
+    try:
+        if breaker is None:
+            response = send_limited(send_request, url, hedged, **kwargs)
+        else:
+            with breaker.call() as slot:
+                try:
+                    response = send_limited(send_request, url, hedged, **kwargs)
+                except requests.exceptions.RequestException:
+                    slot["failed"] = True
+                    raise
+                slot["failed"] = response.status_code >= 500
+    except Exception as error:
+        Metrics.ORION_REQUESTS.inc((method, "error"))
+        Metrics.ERRORS.inc(("orion", type(error).__name__))
+        raise
+    Metrics.ORION_REQUESTS.inc((method, str(response.status_code)))
+    Metrics.ORION_BYTES.inc(amount=len(response.content or b""))
+    return response
+
 
 def get_request(url: str) -> tuple:
     """Send a GET request to Orion
@@ -55,7 +170,9 @@ def get_request(url: str) -> tuple:
         ValueError: if the json parsing fails
     """
     try:
-        response = requests.get(url)
+        with Tracing.span("GET", "orion", url=url) as span_args, Metrics.STAGE_DURATION.time(("orion_fetch",)):
+            response = send(requests.get, url, hedged=True)
+            span_args["status_code"] = response.status_code
         response.close()
     except Exception as error:
         raise RuntimeError(f"Get request failed to URL: {url}") from error
@@ -84,6 +201,7 @@ def is_reachable() -> bool:
     status_code, _ = get_request(url)
     return status_code == 200
 
+@Tracing.traced("orion", lambda object_id, *args, **kwargs: {"object_id": object_id})
 def get(object_id: str, host: str=ORION_HOST, port: int=ORION_PORT) -> dict:
     """Get an object from Orion identified by the ID
 
@@ -125,6 +243,7 @@ def exists(object_id: str) -> bool:
         return False
 
 
+@Tracing.traced("orion")
 def get_workstations() -> tuple:
     """Download all Workstation objects at once from Orion
 
@@ -143,6 +262,37 @@ def get_workstations() -> tuple:
     return workstations
 
 
+@Tracing.traced("orion", lambda object_ids: {"objects": len(object_ids)})
+def get_objects(object_ids: list) -> list:
+    """Download more objects at once from Orion identified by their IDs
+
+    The objects are downloaded in batches of GET_OBJECTS_BATCH_SIZE ids, one GET request each.
+
+    Args:
+        object_ids (list): the Orion object ids
+
+    Returns:
+        A list of the found objects, the missing ids are skipped
+
+    Raises:
+        RuntimeError: if a get request's status_code is not 200
+    """
+    object_ids = list(dict.fromkeys(object_ids))
+    objects = []
+    for i in range(0, len(object_ids), GET_OBJECTS_BATCH_SIZE):
+        batch = object_ids[i : i + GET_OBJECTS_BATCH_SIZE]
+        url = f"http://{ORION_HOST}:{ORION_PORT}/v2/entities?id={','.join(batch)}&limit={len(batch)}"
+        status_code, found = get_request(url)
+        if status_code != 200:
+            raise RuntimeError(
+                f"Failed to get objects from Orion with GET request to URL: {url}, status_code:{status_code}"
+            )
+        batch = set(batch)
+        objects.extend(object_ for object_ in found if object_.get("id") in batch)
+    return objects
+
+
+@Tracing.traced("orion", lambda objects: {"objects": len(objects)})
 def update(objects: list) -> int:
     """Updates the objects in Orion
 
@@ -170,7 +320,7 @@ def update(objects: list) -> int:
         raise TypeError(
             f"The objects {objects} are not iterable, cannot make a list. Please, provide an iterable object"
         ) from error
-    response = requests.post(url, json=data)
+    response = send(requests.post, url, json=data)
     if response.status_code != 204:
         raise RuntimeError(
             f"Failed to update objects in Orion.\nStatus_code: {response.status_code}\nObjects:\n{objects}"
@@ -178,6 +328,7 @@ def update(objects: list) -> int:
     else:
         return response.status_code
 
+@Tracing.traced("orion", lambda object_id, attribute_name, *args: {"object_id": object_id, "attribute": attribute_name})
 def update_attribute(object_id: str, attribute_name: str, attribute_type: str, attribute_value) -> int:
     """Updates the object's given attribute in Orion
 
@@ -216,7 +367,7 @@ attribute_value: {attribute_value}""")
         "entities": [payload]
         }
     logger_Orion.debug(f"update_attribute: data: {data}")
-    response = requests.post(url, json=data)
+    response = send(requests.post, url, json=data)
     if response.status_code != 204:
         raise RuntimeError(
             f"Failed to update attribute in Orion. Status_code: {response.status_code}"
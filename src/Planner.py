@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""A query planner choosing how the OEECalculator reads the Cygnus logs
+
+Small tables are cheapest to download and process in pandas,
+huge tables are cheapest to aggregate in PostgreSQL.
+The QueryPlanner estimates the number of rows of the Workstation's and the Job's tables
+in the OEECalculator's query windows and chooses a strategy for each Workstation:
+    full: download the logs into pandas DataFrames
+        (the "from_midnight" and "rows" query modes)
+    chunked: stream the logs through reducers in bounded chunks
+        (the "chunked" processing mode)
+    database: let PostgreSQL aggregate the logs and download only the boundary rows
+        (the "boundary" and "aggregate" query modes)
+
+The estimate of a table is based on
+    the last seen count: the number of rows today's previous full download read,
+        scaled by the length of the query window
+    the table statistics otherwise: the rows since the last ANALYZE
+        distributed by the histogram of recvtimets, plus the rows modified since
+In the data models where more entities share a table, the rows of the entity are estimated:
+the last seen counts are kept for each entity of a table,
+and the statistics are divided by the number of distinct entityids of the table.
+The other strategies do not read all rows of the windows, so after them the table is estimated
+from its statistics again, instead of from a last seen count that does not follow the table's growth.
+
+The plan and the realised cost (rows read and seconds spent) are logged,
+so the thresholds can be tuned.
+
+Environment variables (defaults are starred):
+    QUERY_PLANNER:
+        TRUE
+        FALSE*
+    PLANNER_FULL_MAX_ROWS:
+        50000*
+    PLANNER_DATABASE_MIN_ROWS:
+        1000000*
+"""
+# Standard Library imports
+import os
+import time
+
+# PyPI packages
+import numpy as np
+import sqlalchemy
+
+# Custom imports
+import Cygnus
+from Logger import getLogger
+
+QUERY_PLANNER = os.environ.get("QUERY_PLANNER")
+if QUERY_PLANNER is None:
+    QUERY_PLANNER = False
+elif QUERY_PLANNER.lower() == "true":
+    QUERY_PLANNER = True
+else:
+    QUERY_PLANNER = False
+
+PLANNER_FULL_MAX_ROWS = os.environ.get("PLANNER_FULL_MAX_ROWS")
+if PLANNER_FULL_MAX_ROWS is None:
+    PLANNER_FULL_MAX_ROWS = 50000
+else:
+    PLANNER_FULL_MAX_ROWS = int(PLANNER_FULL_MAX_ROWS)
+
+PLANNER_DATABASE_MIN_ROWS = os.environ.get("PLANNER_DATABASE_MIN_ROWS")
+if PLANNER_DATABASE_MIN_ROWS is None:
+    PLANNER_DATABASE_MIN_ROWS = 1000000
+else:
+    PLANNER_DATABASE_MIN_ROWS = int(PLANNER_DATABASE_MIN_ROWS)
+
+# the OEECalculator's modes of each strategy
+STRATEGIES = {
+    "full": {"workstation_query_mode": "from_midnight", "job_query_mode": "rows", "processing_mode": "frames"},
+    "chunked": {"workstation_query_mode": "from_midnight", "job_query_mode": "rows", "processing_mode": "chunked"},
+    "database": {"workstation_query_mode": "boundary", "job_query_mode": "aggregate", "processing_mode": "frames"},
+}
+
+
+def get_table_histogram(con, table_name: str) -> dict:
+    """Get the row statistics and the recvtimets histogram of a table
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        table_name (str): PostgreSQL table name
+
+    Returns:
+        dict with the following keys:
+            n_live_tup: estimated number of rows
+            n_mod_since_analyze: number of rows modified since the last ANALYZE
+            bounds: the sorted histogram bounds of recvtimets (np.ndarray) or None if not analyzed
+            n_entities: the estimated number of distinct entityids (int) or None if not analyzed
+        or None if the table has no statistics
+    """
+    query = """select s.n_live_tup, s.n_mod_since_analyze, cast (h.histogram_bounds as text) as bounds,
+               e.n_distinct
+               from pg_stat_user_tables s
+               left join pg_stats h on h.schemaname = s.schemaname
+               and h.tablename = s.relname and h.attname = 'recvtimets'
+               left join pg_stats e on e.schemaname = s.schemaname
+               and e.tablename = s.relname and e.attname = 'entityid'
+               where s.schemaname = :schema and s.relname = :table;"""
+    row = con.execute(
+        sqlalchemy.text(query), {"schema": Cygnus.POSTGRES_SCHEMA, "table": table_name}
+    ).fetchone()
+    if row is None:
+        return None
+    bounds = None
+    if row.bounds is not None:
+        values = [value.strip('"') for value in row.bounds.strip("{}").split(",")]
+        try:
+            bounds = np.sort(np.array(values, dtype=np.float64))
+        except ValueError:
+            # not timestamps, the histogram cannot be used
+            bounds = None
+        if bounds is not None and len(bounds) < 2:
+            bounds = None
+    n_entities = None
+    if row.n_distinct is not None:
+        # a negative n_distinct is the negated ratio of the distinct values to the rows
+        n_distinct = row.n_distinct if row.n_distinct > 0 else -row.n_distinct * (row.n_live_tup or 0)
+        n_entities = max(int(round(n_distinct)), 1)
+    return {
+        "n_live_tup": int(row.n_live_tup or 0),
+        "n_mod_since_analyze": int(row.n_mod_since_analyze or 0),
+        "bounds": bounds,
+        "n_entities": n_entities,
+    }
+
+
+def estimate_rows_from_statistics(statistics: dict, start: float, end: float) -> int:
+    """Estimate the number of rows of a table in a time window from its statistics
+
+    Each histogram bucket contains the same number of rows.
+    The rows modified since the last ANALYZE are assumed to be new logs in the window,
+    because Cygnus only appends.
+
+    Args:
+        statistics (dict): see get_table_histogram
+        start (float): the window's start timestamp in milliseconds
+        end (float): the window's end timestamp in milliseconds
+
+    Returns:
+        the estimated number of rows (int)
+    """
+    if statistics["bounds"] is None:
+        # the whole table is an upper bound
+        return statistics["n_live_tup"]
+    bounds = statistics["bounds"]
+    cumulative = np.linspace(0, 1, len(bounds))
+    fraction = np.interp(end, bounds, cumulative) - np.interp(start, bounds, cumulative)
+    n_analyzed = max(statistics["n_live_tup"] - statistics["n_mod_since_analyze"], 0)
+    return int(round(n_analyzed * fraction)) + statistics["n_mod_since_analyze"]
+
+
+class QueryPlanner:
+    """Choose the OEECalculator's strategy for each Workstation
+
+    The QueryPlanner outlives the LoopHandlers, so the last seen counts are kept between the loops.
+
+    Common usage:
+        oeeCalculator.planner = planner
+        oeeCalculator.prepare(con)  # calls planner.plan
+        ...
+        planner.record(oeeCalculator, seconds)
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, full_max_rows: int = PLANNER_FULL_MAX_ROWS, database_min_rows: int = PLANNER_DATABASE_MIN_ROWS):
+        """The constructor of the QueryPlanner class
+
+        Args:
+            full_max_rows (int): the maximum estimated rows of the "full" strategy
+            database_min_rows (int): the minimum estimated rows of the "database" strategy
+        """
+        if full_max_rows > database_min_rows:
+            raise ValueError(
+                f"The full strategy's maximum: {full_max_rows} is above the database strategy's minimum: {database_min_rows}"
+            )
+        self.full_max_rows = full_max_rows
+        self.database_min_rows = database_min_rows
+        # the rows of an entity read by the last full download of a table in a window of a length in milliseconds
+        # the entity_id is None if the table is not shared, see OEECalculator.get_table_entity_id
+        # format: {(table_name, entity_id): (rows, window_length)}
+        self.last_seen = {}
+        # the day of the last seen counts, they expire at midnight
+        self.day = None
+        # the plans of the Workstations being calculated, see plan and record
+        self.plans = {}
+
+    def __repr__(self):
+        return f"QueryPlanner(full_max_rows={self.full_max_rows}, database_min_rows={self.database_min_rows})"
+
+    def estimate_rows(self, con, table_name: str, start: float, end: float, entity_id: str = None) -> tuple:
+        """Estimate the number of rows of a table, or of an entity in a shared table, in a time window
+
+        Args:
+            con (sqlalchemy connection object): connection to PostgreSQL
+            table_name (str): PostgreSQL table name
+            start (float): the window's start timestamp in milliseconds
+            end (float): the window's end timestamp in milliseconds
+            entity_id (str): the entity's id if the table is shared by more entities. Default: None
+
+        Returns:
+            tuple: (estimated rows (int), the source of the estimate (str))
+                the source is "last_seen", "statistics" or "unknown"
+        """
+        if (table_name, entity_id) in self.last_seen:
+            rows, window_length = self.last_seen[(table_name, entity_id)]
+            if window_length > 0:
+                return int(round(rows * (end - start) / window_length)), "last_seen"
+        statistics = get_table_histogram(con, table_name)
+        if statistics is None:
+            return 0, "unknown"
+        estimated_rows = estimate_rows_from_statistics(statistics, start, end)
+        if entity_id is not None and statistics["n_entities"] is not None:
+            # the statistics are of all entities logged in the table
+            estimated_rows = int(round(estimated_rows / statistics["n_entities"]))
+        return estimated_rows, "statistics"
+
+    def choose_strategy(self, estimated_rows: int) -> str:
+        """Choose the strategy of a number of estimated rows
+
+        Args:
+            estimated_rows (int): the estimated rows of the Workstation's and the Job's tables
+
+        Returns:
+            "full", "chunked" or "database"
+        """
+        if estimated_rows <= self.full_max_rows:
+            return "full"
+        if estimated_rows < self.database_min_rows:
+            return "chunked"
+        return "database"
+
+    def get_windows(self, oee) -> dict:
+        """Get the query windows of the OEECalculator's tables
+
+        Args:
+            oee (OEECalculator): an OEECalculator with its Orion objects and shift limits
+
+        Returns:
+            dict: {table_name: (start, end)} timestamps in milliseconds
+        """
+        return {
+            oee.workstation["postgres_table"]: (oee.get_query_start_timestamp("from_midnight"), oee.now_unix),
+            oee.job["postgres_table"]: (oee.get_query_start_timestamp("from_shift_start"), oee.now_unix),
+        }
+
+    def plan(self, con, oee) -> dict:
+        """Choose and set the OEECalculator's strategy
+
+        Called by OEECalculator.prepare after getting the Orion objects.
+
+        Args:
+            con (sqlalchemy connection object): connection to PostgreSQL
+            oee (OEECalculator): an OEECalculator with its Orion objects and shift limits
+
+        Returns:
+            the plan (dict) with the following keys:
+                strategy: "full", "chunked" or "database"
+                estimated_rows: the estimated rows of all tables (int)
+                tables: {table_name: {"estimated_rows": int, "source": str, "window": (start, end)}}
+                started: time.perf_counter() at the planning
+        """
+        day = oee.now_datetime.date()
+        if day != self.day:
+            # the windows start at midnight again
+            self.last_seen.clear()
+            self.day = day
+        tables = {}
+        for table_name, (start, end) in self.get_windows(oee).items():
+            estimated_rows, source = self.estimate_rows(
+                con, table_name, start, end, oee.get_table_entity_id(table_name)
+            )
+            tables[table_name] = {"estimated_rows": estimated_rows, "source": source, "window": (start, end)}
+        estimated_rows = sum(table["estimated_rows"] for table in tables.values())
+        strategy = self.choose_strategy(estimated_rows)
+        for attribute, mode in STRATEGIES[strategy].items():
+            setattr(oee, attribute, mode)
+        plan = {
+            "strategy": strategy,
+            "estimated_rows": estimated_rows,
+            "tables": tables,
+            "started": time.perf_counter(),
+        }
+        self.plans[oee.workstation["id"]] = plan
+        sources = ", ".join(f'{table_name}: {table["estimated_rows"]} ({table["source"]})' for table_name, table in tables.items())
+        self.logger.info(
+            f'Plan of {oee.workstation["id"]}: {strategy}, estimated rows: {estimated_rows} [{sources}]'
+        )
+        return plan
+
+    def record(self, oee, seconds: float = None) -> dict:
+        """Log the realised cost of a Workstation's plan and update the last seen counts
+
+        Only the full strategy reads all rows of the windows, so only its counts are kept as last seen counts.
+        After the other strategies, the last seen counts of the tables are forgotten,
+        so the next plan estimates them from the table statistics.
+        The plan is removed.
+
+        Args:
+            oee (OEECalculator): the OEECalculator after the calculation
+            seconds (float): the time spent. Default: None, the time since the planning
+
+        Returns:
+            the realised cost (dict) with the following keys:
+                strategy, estimated_rows, rows_read, seconds
+            or None if the Workstation has not been planned
+        """
+        plan = self.plans.pop(oee.workstation["id"], None)
+        if plan is None:
+            return None
+        if seconds is None:
+            seconds = time.perf_counter() - plan["started"]
+        for table_name, table in plan["tables"].items():
+            key = (table_name, oee.get_table_entity_id(table_name))
+            if plan["strategy"] == "full":
+                start, end = table["window"]
+                # the log cache only downloads the tail, so the rows of the window are counted from its result
+                rows = oee.rows_cached.get(table_name, oee.rows_read.get(table_name, 0))
+                self.last_seen[key] = (rows, end - start)
+            else:
+                self.last_seen.pop(key, None)
+        cost = {
+            "strategy": plan["strategy"],
+            "estimated_rows": plan["estimated_rows"],
+            "rows_read": sum(oee.rows_read.values()),
+            "seconds": seconds,
+        }
+        self.logger.info(
+            f'Realised cost of {oee.workstation["id"]}: {cost["strategy"]}, estimated rows: {cost["estimated_rows"]}, rows read: {cost["rows_read"]}, seconds: {cost["seconds"]:.3f}'
+        )
+        return cost
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""A background publisher of the KPI attributes to Orion
+
+Without the publisher, the LoopHandler waits for each Orion write before calculating the next Workstation.
+With the publisher, the LoopHandler only puts the attributes into the pending updates,
+and a background thread writes them with Orion.update, at most PUBLISHER_BATCH_SIZE objects at once.
+The pending updates of an object are coalesced: only the latest value of each attribute is written.
+At most PUBLISHER_MAX_PENDING objects are pending, the oldest update is dropped if a new object comes.
+A failed batch is retried PUBLISHER_MAX_RETRIES times with exponential backoff
+starting from PUBLISHER_BACKOFF seconds, then it is dropped.
+The on_written callback, e.g. Deadband.DeadbandFilter.written, is only called for the written attributes,
+so a dropped or failed update is not taken as Orion's value.
+The publish lag, the seconds between the first pending update of an object and its write, is tracked,
+see BackgroundPublisher.get_metrics.
+
+Environment variables (defaults are starred):
+    ORION_PUBLISHER:
+        TRUE
+        FALSE*
+    PUBLISHER_MAX_PENDING:
+        1000*
+    PUBLISHER_BATCH_SIZE:
+        100*
+    PUBLISHER_MAX_RETRIES:
+        5*
+    PUBLISHER_BACKOFF: seconds
+        0.5*
+"""
+# Standard Library imports
+import collections
+import os
+import threading
+import time
+
+# PyPI packages
+import requests
+
+# Custom imports
+from Logger import getLogger
+import Orion
+
+ORION_PUBLISHER = os.environ.get("ORION_PUBLISHER")
+if ORION_PUBLISHER is None:
+    ORION_PUBLISHER = False
+elif ORION_PUBLISHER.lower() == "true":
+    ORION_PUBLISHER = True
+else:
+    ORION_PUBLISHER = False
+
+PUBLISHER_MAX_PENDING = os.environ.get("PUBLISHER_MAX_PENDING")
+if PUBLISHER_MAX_PENDING is None:
+    PUBLISHER_MAX_PENDING = 1000
+else:
+    PUBLISHER_MAX_PENDING = int(PUBLISHER_MAX_PENDING)
+
+PUBLISHER_BATCH_SIZE = os.environ.get("PUBLISHER_BATCH_SIZE")
+if PUBLISHER_BATCH_SIZE is None:
+    PUBLISHER_BATCH_SIZE = 100
+else:
+    PUBLISHER_BATCH_SIZE = int(PUBLISHER_BATCH_SIZE)
+
+PUBLISHER_MAX_RETRIES = os.environ.get("PUBLISHER_MAX_RETRIES")
+if PUBLISHER_MAX_RETRIES is None:
+    PUBLISHER_MAX_RETRIES = 5
+else:
+    PUBLISHER_MAX_RETRIES = int(PUBLISHER_MAX_RETRIES)
+
+PUBLISHER_BACKOFF = os.environ.get("PUBLISHER_BACKOFF")
+if PUBLISHER_BACKOFF is None:
+    PUBLISHER_BACKOFF = 0.5
+else:
+    PUBLISHER_BACKOFF = float(PUBLISHER_BACKOFF)
+
+# the maximum seconds between two retries
+MAX_BACKOFF = 30
+
+
+class BackgroundPublisher:
+    """Coalesce the attribute updates of the objects and write them to Orion in a background thread
+
+    Common usage:
+        publisher = BackgroundPublisher()
+        publisher.publish(object_id, attribute_name, attribute_type, attribute_value)
+        ...
+        publisher.flush(timeout)
+        publisher.close()
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(
+        self,
+        max_pending: int = PUBLISHER_MAX_PENDING,
+        batch_size: int = PUBLISHER_BATCH_SIZE,
+        max_retries: int = PUBLISHER_MAX_RETRIES,
+        backoff: float = PUBLISHER_BACKOFF,
+        on_written=None,
+    ):
+        """The constructor of the BackgroundPublisher class, starts the thread
+
+        Args:
+            max_pending (int): the maximum number of objects with pending updates
+            batch_size (int): the maximum number of objects written at once
+            max_retries (int): the number of retries of a failed batch
+            backoff (float): the seconds before the first retry, doubled for each retry
+            on_written (callable): called with the object's id, the attribute's name and value
+                of each attribute written to Orion. Default: None
+        """
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.on_written = on_written
+        # the pending updates in the order of their first update
+        # format: {object_id: {"attributes": {name: {"type": type, "value": value}}, "since": time.monotonic}}
+        self.pending = collections.OrderedDict()
+        # the number of objects taken by the thread and not yet written or dropped
+        self.in_flight = 0
+        self.metrics = {
+            "enqueued": 0,
+            "coalesced": 0,
+            "dropped": 0,
+            "published": 0,
+            "failed": 0,
+            "retries": 0,
+            "batches": 0,
+            "last_lag_seconds": None,
+            "max_lag_seconds": None,
+        }
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name="publisher", daemon=True)
+        self.thread.start()
+
+    def __repr__(self):
+        return (
+            f"BackgroundPublisher(max_pending={self.max_pending}, batch_size={self.batch_size}, "
+            f"max_retries={self.max_retries}, backoff={self.backoff})"
+        )
+
+    def publish(self, object_id: str, attribute_name: str, attribute_type: str, attribute_value):
+        """Put an attribute update among the pending updates without waiting
+
+        Args:
+            object_id (str): the object's id in Orion
+            attribute_name (str): the attribute's name
+            attribute_type (str): the attribute's type
+            attribute_value: the attribute's new value
+        """
+        attribute = {"type": attribute_type, "value": attribute_value}
+        with self.condition:
+            self.metrics["enqueued"] += 1
+            update = self.pending.get(object_id)
+            if update is not None:
+                if attribute_name in update["attributes"]:
+                    self.metrics["coalesced"] += 1
+                update["attributes"][attribute_name] = attribute
+                return
+            if len(self.pending) >= self.max_pending:
+                dropped_id, dropped = self.pending.popitem(last=False)
+                self.metrics["dropped"] += len(dropped["attributes"])
+                self.logger.warning(f"The publisher's queue is full, dropping the update of {dropped_id}")
+            self.pending[object_id] = {"attributes": {attribute_name: attribute}, "since": time.monotonic()}
+            self.condition.notify_all()
+
+    def take_batch(self) -> list:
+        """Wait for pending updates and take a batch of them
+
+        Returns:
+            list of (object_id, update) tuples, empty if the publisher is stopping and nothing is pending
+        """
+        with self.condition:
+            while not self.pending and not self.stopping:
+                self.condition.wait()
+            batch = []
+            while self.pending and len(batch) < self.batch_size:
+                batch.append(self.pending.popitem(last=False))
+            self.in_flight = len(batch)
+            return batch
+
+    def absorb(self, batch: list):
+        """Move the newer pending updates of the objects of a batch into the batch
+
+        So a retry writes the latest values. The caller holds the condition.
+
+        Args:
+            batch (list): list of (object_id, update) tuples
+        """
+        for object_id, update in batch:
+            newer = self.pending.pop(object_id, None)
+            if newer is None:
+                continue
+            self.metrics["coalesced"] += len(newer["attributes"].keys() & update["attributes"].keys())
+            update["attributes"].update(newer["attributes"])
+
+    def write_batch(self, batch: list) -> bool:
+        """Write a batch to Orion, retrying with exponential backoff
+
+        Args:
+            batch (list): list of (object_id, update) tuples
+
+        Returns:
+            True if the batch was written, False if it was dropped
+        """
+        backoff = self.backoff
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                with self.condition:
+                    self.metrics["retries"] += 1
+                    if not self.stopping:
+                        self.condition.wait(backoff)
+                    self.absorb(batch)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+            entities = [dict(update["attributes"], id=object_id) for object_id, update in batch]
+            try:
+                Orion.update(entities)
+                return True
+            except (RuntimeError, requests.exceptions.RequestException) as error:
+                self.logger.warning(f"Publishing {len(entities)} objects to Orion failed, attempt {attempt + 1}: {error}")
+        return False
+
+    def run(self):
+        """Write the pending updates until closed, then write the remaining ones"""
+        while True:
+            batch = self.take_batch()
+            if not batch:
+                return
+            written = self.write_batch(batch)
+            now = time.monotonic()
+            if written and self.on_written is not None:
+                for object_id, update in batch:
+                    for attribute_name, attribute in update["attributes"].items():
+                        self.on_written(object_id, attribute_name, attribute["value"])
+            with self.condition:
+                if written:
+                    lag = max(now - update["since"] for _, update in batch)
+                    self.metrics["published"] += len(batch)
+                    self.metrics["batches"] += 1
+                    self.metrics["last_lag_seconds"] = lag
+                    self.metrics["max_lag_seconds"] = max(lag, self.metrics["max_lag_seconds"] or 0)
+                else:
+                    self.metrics["failed"] += len(batch)
+                    self.logger.error(f"Dropped the updates of {len(batch)} objects after {self.max_retries} retries")
+                self.in_flight = 0
+                self.condition.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until the pending updates are written or dropped
+
+        Args:
+            timeout (float): the maximum seconds to wait. Default: None, no limit
+
+        Returns:
+            True if nothing is pending, False if the timeout elapsed
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and self.in_flight == 0, timeout)
+
+    def get_metrics(self) -> dict:
+        """Get the metrics of the publisher
+
+        Returns:
+            dict: the enqueued, coalesced, dropped and failed attribute updates or objects,
+                the published objects, the retries, the batches, the last and the maximum publish lag
+                in seconds and the number of objects with pending updates
+        """
+        with self.condition:
+            metrics = dict(self.metrics)
+            metrics["pending"] = len(self.pending)
+        return metrics
+
+    def close(self, timeout: float = None):
+        """Write the pending updates and stop the thread
+
+        Args:
+            timeout (float): the maximum seconds to wait. Default: None, no limit
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
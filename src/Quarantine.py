@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""Quarantine of the Workstations failing in every loop
+
+A Workstation with a missing Cygnus table, a broken refJob or a partsPerCycle of 0 fails in every loop,
+paying the Orion requests, the queries and the clearing writes again and again.
+After QUARANTINE_AFTER consecutive failures, a Workstation is quarantined for QUARANTINE_BACKOFF seconds,
+doubled after each further failure, up to QUARANTINE_MAX_BACKOFF seconds.
+A quarantined Workstation is skipped by the loops. After its backoff, it is calculated again as a trial:
+a success releases it, a failure quarantines it again for longer.
+Its KPIs are cleared once, at the first failure, not in every loop.
+It is released early if its fingerprint changes: the relationships of its Orion object,
+like refJob, or the existence of its Cygnus table, see LoopHandler.get_fingerprint.
+Only the errors of the Workstation's data count as failures: the errors of Orion or PostgreSQL,
+like a refused connection, an open circuit or a statement timeout, neither count nor reset the failures,
+see LoopHandler.is_transient_error.
+
+Environment variables (defaults are starred):
+    QUARANTINE:
+        TRUE
+        FALSE*
+    QUARANTINE_AFTER: consecutive failures
+        3*
+    QUARANTINE_BACKOFF: seconds
+        60*
+    QUARANTINE_MAX_BACKOFF: seconds
+        3600*
+"""
+# Standard Library imports
+import os
+import threading
+import time
+
+# Custom imports
+from Logger import getLogger
+
+QUARANTINE = os.environ.get("QUARANTINE")
+if QUARANTINE is None:
+    QUARANTINE = False
+elif QUARANTINE.lower() == "true":
+    QUARANTINE = True
+else:
+    QUARANTINE = False
+
+QUARANTINE_AFTER = os.environ.get("QUARANTINE_AFTER")
+if QUARANTINE_AFTER is None:
+    QUARANTINE_AFTER = 3
+else:
+    QUARANTINE_AFTER = int(QUARANTINE_AFTER)
+
+QUARANTINE_BACKOFF = os.environ.get("QUARANTINE_BACKOFF")
+if QUARANTINE_BACKOFF is None:
+    QUARANTINE_BACKOFF = 60
+else:
+    QUARANTINE_BACKOFF = float(QUARANTINE_BACKOFF)
+
+QUARANTINE_MAX_BACKOFF = os.environ.get("QUARANTINE_MAX_BACKOFF")
+if QUARANTINE_MAX_BACKOFF is None:
+    QUARANTINE_MAX_BACKOFF = 3600
+else:
+    QUARANTINE_MAX_BACKOFF = float(QUARANTINE_MAX_BACKOFF)
+
+
+class Quarantine:
+    """Track the consecutive failures of the Workstations and quarantine the persistently failing ones
+
+    The Quarantine outlives the LoopHandlers, so the failures are counted across the loops.
+
+    Common usage:
+        if quarantine.is_failing(workstation_id) and quarantine.check(workstation_id, fingerprint):
+            skip the Workstation
+        try:
+            calculate and write the KPIs
+            quarantine.succeeded(workstation_id)
+        except ...:
+            if quarantine.failed(workstation_id, str(error)):
+                clear the KPIs
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(
+        self,
+        after: int = QUARANTINE_AFTER,
+        backoff: float = QUARANTINE_BACKOFF,
+        max_backoff: float = QUARANTINE_MAX_BACKOFF,
+    ):
+        """The constructor of the Quarantine class
+
+        Args:
+            after (int): the number of consecutive failures before the quarantine
+            backoff (float): the seconds of the first quarantine, doubled after each further failure
+            max_backoff (float): the maximum seconds of a quarantine
+        """
+        self.after = after
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # the failing Workstations
+        # format: {workstation_id: {"failures": int, "error": str, "until": time.monotonic or None, "fingerprint"}}
+        self.entries = {}
+        self.counts = {"quarantined": 0, "skipped": 0, "released": 0, "released_early": 0}
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"Quarantine(after={self.after}, backoff={self.backoff}, max_backoff={self.max_backoff})"
+
+    def is_failing(self, workstation_id: str) -> bool:
+        """Check if the last calculation of a Workstation failed
+
+        Args:
+            workstation_id (str): the Workstation's Orion id
+
+        Returns:
+            True if the Workstation is failing, quarantined or not, False otherwise
+        """
+        with self.lock:
+            return workstation_id in self.entries
+
+    def check(self, workstation_id: str, fingerprint) -> bool:
+        """Check if a failing Workstation is quarantined, releasing it early if its fingerprint changed
+
+        A skipped Workstation is counted.
+
+        Args:
+            workstation_id (str): the Workstation's Orion id
+            fingerprint: any comparable value that changes if the cause of the failure may be fixed
+
+        Returns:
+            True if the Workstation must be skipped, False if it must be calculated
+        """
+        with self.lock:
+            entry = self.entries.get(workstation_id)
+            if entry is None:
+                return False
+            changed = entry["fingerprint"] is not None and entry["fingerprint"] != fingerprint
+            entry["fingerprint"] = fingerprint
+            if entry["until"] is None:
+                return False
+            if changed:
+                entry["until"] = None
+                self.counts["released_early"] += 1
+                self.logger.info(f"Released {workstation_id} from the quarantine early, its fingerprint changed")
+                return False
+            if time.monotonic() < entry["until"]:
+                self.counts["skipped"] += 1
+                return True
+            return False
+
+    def failed(self, workstation_id: str, error: str) -> bool:
+        """Count a failure of a Workstation, and quarantine it after too many consecutive failures
+
+        Args:
+            workstation_id (str): the Workstation's Orion id
+            error (str): the error message
+
+        Returns:
+            True if this is the first failure, so the KPIs must be cleared, False if they are already cleared
+        """
+        with self.lock:
+            entry = self.entries.setdefault(
+                workstation_id, {"failures": 0, "error": None, "until": None, "fingerprint": None}
+            )
+            entry["failures"] += 1
+            entry["error"] = error
+            if entry["failures"] < self.after:
+                return entry["failures"] == 1
+            seconds = min(self.backoff * 2 ** (entry["failures"] - self.after), self.max_backoff)
+            entry["until"] = time.monotonic() + seconds
+            self.counts["quarantined"] += 1
+            self.logger.warning(
+                f'Quarantined {workstation_id} for {seconds:g} s after {entry["failures"]} consecutive failures: {error}'
+            )
+            return entry["failures"] == 1
+
+    def succeeded(self, workstation_id: str):
+        """Forget the failures of a Workstation after a successful calculation
+
+        Args:
+            workstation_id (str): the Workstation's Orion id
+        """
+        with self.lock:
+            entry = self.entries.pop(workstation_id, None)
+            if entry is None or entry["failures"] < self.after:
+                return
+            self.counts["released"] += 1
+        self.logger.info(f"Released {workstation_id} from the quarantine after a successful calculation")
+
+    def get_metrics(self) -> dict:
+        """Get the state of the quarantine
+
+        Returns:
+            dict: the number of the currently failing and quarantined Workstations,
+                the number of the quarantines, the skipped calculations, the releases and the early releases,
+                and the failures, the last error and the remaining quarantine seconds of each failing Workstation
+        """
+        now = time.monotonic()
+        with self.lock:
+            workstations = {
+                workstation_id: {
+                    "failures": entry["failures"],
+                    "error": entry["error"],
+                    "remaining_seconds": max(entry["until"] - now, 0) if entry["until"] is not None else 0,
+                }
+                for workstation_id, entry in self.entries.items()
+            }
+            return dict(
+                self.counts,
+                failing=len(workstations),
+                in_quarantine=sum(1 for entry in workstations.values() if entry["remaining_seconds"] > 0),
+                workstations=workstations,
+            )
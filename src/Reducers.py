@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""Streaming reducers of the Cygnus logs
+
+The reducers calculate what the OEECalculator needs from the logs
+chunk by chunk (see CopyReader), so only a chunk of the logs is in the memory at a time.
+The reducers only compare a chunk's codes to the codes of the same chunk,
+so the chunks may be read with per-chunk categories (chunk_categories=True).
+
+    RefJobReducer: the refJob records needed for the current Job's start time
+    AvailabilityReducer: the Workstation's available and total time since reference_start_time
+    CounterReducer: the extrema of the Job's counters since reference_start_time
+
+The reducers can continue with the logs after the ones they processed,
+so their state is saved between the loops, see Checkpoint.
+"""
+# Standard Library imports
+import copy
+
+# PyPI packages
+import numpy as np
+import pandas as pd
+
+# Custom imports
+from CopyReader import LogArrays
+
+
+def to_builtin(value):
+    """Convert a NumPy scalar to the Python type, so it can be saved in JSON
+
+    Args:
+        value: the value to convert
+
+    Returns:
+        the value, with NumPy scalars converted and tuples converted to lists
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (tuple, list)):
+        return [to_builtin(item) for item in value]
+    if isinstance(value, dict):
+        return {key: to_builtin(item) for key, item in value.items()}
+    return value
+
+
+class Reducer:
+    """The base class of the reducers, saving and restoring their state"""
+
+    def get_state(self) -> dict:
+        """Get the reducer's state
+
+        Returns:
+            the attributes of the reducer (dict), that can be saved in JSON
+        """
+        return {key: to_builtin(value) for key, value in vars(self).items()}
+
+    @classmethod
+    def from_state(cls, state: dict):
+        """Restore a reducer from its state
+
+        Args:
+            state (dict): the state, see get_state
+
+        Returns:
+            the reducer that continues where the saved reducer stopped
+        """
+        reducer = cls.__new__(cls)
+        # the state is not changed by the reducer
+        reducer.__dict__.update(copy.deepcopy(state))
+        return reducer
+
+
+class RefJobReducer(Reducer):
+    """Keep the Workstation's refJob records that get_current_job_start_time_today needs
+
+    The chunks must be in chronological order and contain only refJob records.
+    The kept records are:
+        the last refJob record
+        the first refJob record that refers to the current Job
+    """
+
+    def __init__(self, job_id: str):
+        """The constructor of the RefJobReducer class
+
+        Args:
+            job_id (str): the current Job's Orion id
+        """
+        self.job_id = job_id
+        self.last = None
+        self.first_current_job = None
+
+    def update(self, chunk: LogArrays):
+        """Process a chunk of refJob records
+
+        Args:
+            chunk (LogArrays): refJob records in chronological order
+        """
+        if len(chunk) == 0:
+            return
+        self.last = (int(chunk.recvtimets[-1]), chunk.reader.attrvalues[chunk.attrvalue[-1]])
+        if self.first_current_job is None:
+            matches = np.flatnonzero(chunk.attrvalue == chunk.attrvalue_code(self.job_id))
+            if len(matches) > 0:
+                self.first_current_job = (int(chunk.recvtimets[matches[0]]), self.job_id)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Get the kept refJob records
+
+        Returns:
+            pandas DataFrame with the columns recvtimets (int64), attrname and attrvalue, sorted by time
+        """
+        rows = [row for row in (self.first_current_job, self.last) if row is not None]
+        return pd.DataFrame(
+            {
+                "recvtimets": np.array([row[0] for row in rows], dtype=np.int64),
+                "attrname": ["refJob"] * len(rows),
+                "attrvalue": [row[1] for row in rows],
+            }
+        )
+
+
+class AvailabilityReducer(Reducer):
+    """Calculate the Workstation's available time since reference_start_time
+
+    The chunks must be in chronological order and contain only available records since midnight.
+    The calculation is the same as OEECalculator.calc_availability's.
+    """
+
+    def __init__(self, reference_start_timestamp: float):
+        """The constructor of the AvailabilityReducer class
+
+        Args:
+            reference_start_timestamp (float): reference_start_time in milliseconds
+        """
+        self.reference_start_timestamp = reference_start_timestamp
+        # True if there is an available: true record since midnight
+        self.available_since_midnight = False
+        # the last record before reference_start_time
+        self.last_before = None
+        # the state of the interval integration since reference_start_time
+        self.previous_timestamp = None
+        self.available = None
+        self.time_on = 0
+        self.time_off = 0
+
+    def update(self, chunk: LogArrays):
+        """Process a chunk of available records
+
+        Args:
+            chunk (LogArrays): available records in chronological order
+        """
+        if len(chunk) == 0:
+            return
+        is_true = chunk.attrvalue == chunk.attrvalue_code("true")
+        self.available_since_midnight = self.available_since_midnight or bool(is_true.any())
+        n_before = int(np.searchsorted(chunk.recvtimets, self.reference_start_timestamp, side="left"))
+        if n_before > 0:
+            self.last_before = chunk.reader.attrvalues[chunk.attrvalue[n_before - 1]]
+        if n_before == len(chunk):
+            return
+        if self.previous_timestamp is None:
+            # the first interval starts at reference_start_time
+            # if there is no record before, the Workstation is assumed to be off
+            self.previous_timestamp = self.reference_start_timestamp
+            self.available = self.last_before == "true"
+        timestamps = chunk.recvtimets[n_before:]
+        durations = np.diff(timestamps, prepend=self.previous_timestamp)
+        # each interval's state is set by the record at its start
+        states = np.concatenate(([self.available], is_true[n_before:-1]))
+        self.time_on += durations[states].sum()
+        self.time_off += durations[~states].sum()
+        self.previous_timestamp = timestamps[-1]
+        self.available = bool(is_true[-1])
+
+    def calculate(self, now: float) -> tuple:
+        """Calculate the availability
+
+        Args:
+            now (float): the current timestamp in milliseconds
+
+        Returns:
+            tuple: (availability, total_available_time, total_time_so_far_since_reference_start_time)
+
+        Raises:
+            ValueError:
+                if there is no record since reference_start_time
+                and the last record before is not a valid availability value
+            ZeroDivisionError:
+                if the total time so far since reference_start_time is 0
+        """
+        if self.previous_timestamp is None:
+            total_time = now - self.reference_start_timestamp
+            if self.last_before == "true":
+                return 1, total_time, total_time
+            if self.last_before == "false":
+                return 0, 0, total_time
+            raise ValueError(f"Invalid availability value: {self.last_before}")
+        time_on = self.time_on
+        time_off = self.time_off
+        # the last interval ends now
+        if self.available:
+            time_on += now - self.previous_timestamp
+        else:
+            time_off += now - self.previous_timestamp
+        total_time = time_on + time_off
+        if total_time == 0:
+            raise ZeroDivisionError("Total time so far in the shift is 0, no OEE data")
+        return time_on / total_time, time_on, total_time
+
+
+class CounterReducer(Reducer):
+    """Calculate the extrema of the Job's counters
+
+    The chunks may be in any order and contain only counter records.
+    """
+
+    def __init__(self, attributes: tuple):
+        """The constructor of the CounterReducer class
+
+        Args:
+            attributes (tuple): the counter attribute names
+        """
+        self.attributes = attributes
+        self.counters = {}
+
+    def update(self, chunk: LogArrays):
+        """Process a chunk of counter records
+
+        Args:
+            chunk (LogArrays): counter records
+
+        Raises:
+            ValueError:
+                if a counter value cannot be converted to int
+        """
+        if len(chunk) == 0:
+            return
+        try:
+            # only the categories are converted, not every value
+            value_ints = np.array(chunk.reader.attrvalues, dtype=str).astype(np.int64)
+        except ValueError as error:
+            raise ValueError(
+                "At least one goodPartCounter or rejectPartCounter value cannot be converted to int"
+            ) from error
+        values = value_ints[chunk.attrvalue]
+        for attribute in self.attributes:
+            attribute_values = values[chunk.attrname == chunk.attrname_code(attribute)]
+            if len(attribute_values) == 0:
+                continue
+            min_value = int(attribute_values.min())
+            max_value = int(attribute_values.max())
+            zero_present = bool((attribute_values == 0).any())
+            if attribute in self.counters:
+                counter = self.counters[attribute]
+                min_value = min(min_value, counter["min_value"])
+                max_value = max(max_value, counter["max_value"])
+                zero_present = zero_present or counter["zero_present"]
+            self.counters[attribute] = {
+                "min_value": min_value,
+                "max_value": max_value,
+                "zero_present": zero_present,
+            }
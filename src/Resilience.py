@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""A circuit breaker and hedged reads for the requests sent to Orion
+
+When Orion is slow or down, each Workstation of the loop would wait out its own failing requests.
+The CircuitBreaker opens after BREAKER_FAILURES consecutive failures:
+errors, 5xx responses or requests slower than BREAKER_LATENCY seconds.
+While it is open, the requests fail fast with a CircuitOpenError, so the loop is not slowed down by Orion.
+After BREAKER_RESET seconds it is half-open: at most BREAKER_TRIALS trial requests are let through,
+a successful trial closes it, a failed one opens it again.
+
+The Hedger sends a second, identical GET request if the first one is slower than
+the HEDGE_PERCENTILE percentile of the latencies of the recent GET requests, and the first response wins.
+It starts hedging after HEDGE_MIN_SAMPLES requests. Only idempotent requests may be hedged.
+With a request timeout, the hedged requests are waited for at most the timeout after the second one is sent.
+
+Environment variables (defaults are starred):
+    ORION_CIRCUIT_BREAKER:
+        TRUE
+        FALSE*
+    BREAKER_FAILURES:
+        5*
+    BREAKER_LATENCY: seconds
+        10*
+    BREAKER_RESET: seconds
+        30*
+    BREAKER_TRIALS:
+        1*
+    ORION_HEDGING:
+        TRUE
+        FALSE*
+    HEDGE_PERCENTILE:
+        95*
+    HEDGE_MIN_SAMPLES:
+        20*
+"""
+# Standard Library imports
+import collections
+from concurrent import futures
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+# PyPI packages
+import requests
+
+# Custom imports
+from Logger import getLogger
+
+ORION_CIRCUIT_BREAKER = os.environ.get("ORION_CIRCUIT_BREAKER")
+if ORION_CIRCUIT_BREAKER is None:
+    ORION_CIRCUIT_BREAKER = False
+elif ORION_CIRCUIT_BREAKER.lower() == "true":
+    ORION_CIRCUIT_BREAKER = True
+else:
+    ORION_CIRCUIT_BREAKER = False
+
+BREAKER_FAILURES = os.environ.get("BREAKER_FAILURES")
+if BREAKER_FAILURES is None:
+    BREAKER_FAILURES = 5
+else:
+    BREAKER_FAILURES = int(BREAKER_FAILURES)
+
+BREAKER_LATENCY = os.environ.get("BREAKER_LATENCY")
+if BREAKER_LATENCY is None:
+    BREAKER_LATENCY = 10
+else:
+    BREAKER_LATENCY = float(BREAKER_LATENCY)
+
+BREAKER_RESET = os.environ.get("BREAKER_RESET")
+if BREAKER_RESET is None:
+    BREAKER_RESET = 30
+else:
+    BREAKER_RESET = float(BREAKER_RESET)
+
+BREAKER_TRIALS = os.environ.get("BREAKER_TRIALS")
+if BREAKER_TRIALS is None:
+    BREAKER_TRIALS = 1
+else:
+    BREAKER_TRIALS = int(BREAKER_TRIALS)
+
+ORION_HEDGING = os.environ.get("ORION_HEDGING")
+if ORION_HEDGING is None:
+    ORION_HEDGING = False
+elif ORION_HEDGING.lower() == "true":
+    ORION_HEDGING = True
+else:
+    ORION_HEDGING = False
+
+HEDGE_PERCENTILE = os.environ.get("HEDGE_PERCENTILE")
+if HEDGE_PERCENTILE is None:
+    HEDGE_PERCENTILE = 95
+else:
+    HEDGE_PERCENTILE = float(HEDGE_PERCENTILE)
+
+HEDGE_MIN_SAMPLES = os.environ.get("HEDGE_MIN_SAMPLES")
+if HEDGE_MIN_SAMPLES is None:
+    HEDGE_MIN_SAMPLES = 20
+else:
+    HEDGE_MIN_SAMPLES = int(HEDGE_MIN_SAMPLES)
+
+# the number of recent latencies the hedging delay is calculated from
+HEDGE_WINDOW = 200
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of sending a request while the circuit is open"""
+
+
+class CircuitBreaker:
+    """Fail fast while a server is failing, and probe it with trial requests
+
+    Common usage:
+        with breaker.call() as slot:
+            response = requests.get(url)
+            slot["failed"] = response.status_code >= 500
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(
+        self,
+        name: str,
+        failures: int = BREAKER_FAILURES,
+        latency: float = BREAKER_LATENCY,
+        reset: float = BREAKER_RESET,
+        trials: int = BREAKER_TRIALS,
+    ):
+        """The constructor of the CircuitBreaker class
+
+        Args:
+            name (str): the name of the server, used in the logs
+            failures (int): the number of consecutive failures opening the circuit
+            latency (float): a request slower than this many seconds counts as a failure, None means no limit
+            reset (float): the seconds after which an open circuit lets trial requests through
+            trials (int): the maximum number of concurrent trial requests
+        """
+        self.name = name
+        self.failures = failures
+        self.latency = latency
+        self.reset = reset
+        self.trials = trials
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trials_in_flight = 0
+        self.counts = {"opened": 0, "rejected": 0, "trials": 0}
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return (
+            f"CircuitBreaker(name={self.name!r}, failures={self.failures}, latency={self.latency}, "
+            f"reset={self.reset}, trials={self.trials})"
+        )
+
+    def is_open(self) -> bool:
+        """Check if the requests fail fast now
+
+        Returns:
+            True if the circuit is open and no trial request is let through yet, False otherwise
+        """
+        with self.lock:
+            return self.state == "open" and time.monotonic() - self.opened_at < self.reset
+
+    def open(self):
+        """Open the circuit. The caller holds the lock."""
+        if self.state != "open":
+            self.counts["opened"] += 1
+            self.logger.error(
+                f"The circuit of {self.name} is open after {self.consecutive_failures} consecutive failures, "
+                f"the requests fail fast for {self.reset:g} s"
+            )
+        self.state = "open"
+        self.opened_at = time.monotonic()
+
+    def before(self) -> bool:
+        """Check if a request may be sent
+
+        Returns:
+            True if the request is a trial request, False otherwise
+
+        Raises:
+            CircuitOpenError: if the circuit is open, or all trial requests are in flight
+        """
+        with self.lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset:
+                self.state = "half_open"
+            if self.state == "closed":
+                return False
+            if self.state == "half_open" and self.trials_in_flight < self.trials:
+                self.trials_in_flight += 1
+                self.counts["trials"] += 1
+                return True
+            self.counts["rejected"] += 1
+        raise CircuitOpenError(f"The circuit of {self.name} is open, the request is not sent")
+
+    def after(self, trial: bool, failed: bool, latency: float = None):
+        """Record the outcome of a request
+
+        Args:
+            trial (bool): whether the request was a trial request, see before
+            failed (bool): whether the request failed
+            latency (float): the seconds the request took. Default: None, the outcome is unknown,
+                only a failure is recorded
+        """
+        with self.lock:
+            if trial:
+                self.trials_in_flight -= 1
+            if latency is None and not failed:
+                return
+            if failed or (self.latency is not None and latency > self.latency):
+                self.consecutive_failures += 1
+                if trial or self.consecutive_failures >= self.failures:
+                    self.open()
+                return
+            self.consecutive_failures = 0
+            if self.state != "closed":
+                self.state = "closed"
+                self.logger.info(f"The circuit of {self.name} is closed after a successful trial request")
+
+    @contextmanager
+    def call(self):
+        """Run a request in the block if the circuit lets it through
+
+        If the block raises an exception, only a failure marked in the slot is recorded.
+
+        Yields:
+            dict: the block sets its "failed" key to True if the request failed
+
+        Raises:
+            CircuitOpenError: if the circuit is open, see before
+        """
+        trial = self.before()
+        slot = {"failed": False}
+        started = time.monotonic()
+        try:
+            yield slot
+        except BaseException:
+            self.after(trial, slot["failed"])
+            raise
+        self.after(trial, slot["failed"], time.monotonic() - started)
+
+    def get_metrics(self) -> dict:
+        """Get the state of the circuit breaker
+
+        Returns:
+            dict: the state ("closed", "open" or "half_open"), the consecutive failures,
+                the number of openings, the rejected and the trial requests
+        """
+        with self.lock:
+            return dict(self.counts, state=self.state, consecutive_failures=self.consecutive_failures)
+
+
+class Hedger:
+    """Send a second request if the first one is slower than the recent requests
+
+    Common usage:
+        response = hedger.send(requests.get, url)
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, percentile: float = HEDGE_PERCENTILE, min_samples: int = HEDGE_MIN_SAMPLES):
+        """The constructor of the Hedger class
+
+        Args:
+            percentile (float): the percentile of the recent latencies after which the request is hedged
+            min_samples (int): the number of latencies needed before hedging
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.latencies = collections.deque(maxlen=HEDGE_WINDOW)
+        self.counts = {"requests": 0, "hedged": 0, "hedge_wins": 0}
+        self.lock = threading.Lock()
+        self.executor = futures.ThreadPoolExecutor(thread_name_prefix="hedge")
+
+    def __repr__(self):
+        return f"Hedger(percentile={self.percentile}, min_samples={self.min_samples})"
+
+    def get_delay(self) -> float:
+        """Get the seconds after which a request is hedged
+
+        Returns:
+            the percentile of the recent latencies (float), None if there are not enough of them
+        """
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        index = min(int(len(latencies) * self.percentile / 100), len(latencies) - 1)
+        return latencies[index]
+
+    def send(self, send_request, url: str, **kwargs):
+        """Send an idempotent request, and hedge it if it is slow
+
+        Args:
+            send_request: requests.get or any idempotent request function
+            url (str): the request's URL
+            kwargs: the keyword arguments of send_request, their timeout in seconds bounds the wait
+
+        Returns:
+            the first successful response
+
+        Raises:
+            requests.exceptions.Timeout: if neither request finished within the timeout after hedging
+            the exception of the last failed request, if both failed
+        """
+        delay = self.get_delay()
+        started = time.monotonic()
+        if delay is None:
+            response = send_request(url, **kwargs)
+            self.record(time.monotonic() - started, hedged=False, hedge_won=False)
+            return response
+        first = self.executor.submit(send_request, url, **kwargs)
+        try:
+            response = first.result(timeout=delay)
+            self.record(time.monotonic() - started, hedged=False, hedge_won=False)
+            return response
+        except futures.TimeoutError:
+            pass
+        self.logger.debug(f"Hedging the request to {url} after {delay:.3f} s")
+        second = self.executor.submit(send_request, url, **kwargs)
+        timeout = kwargs.get("timeout")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pending = {first, second}
+        while pending:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            done, pending = futures.wait(pending, timeout=remaining, return_when=futures.FIRST_COMPLETED)
+            if not done:
+                error = requests.exceptions.Timeout(f"The hedged requests to {url} timed out after {timeout} s")
+                break
+            for future in done:
+                if future.exception() is None:
+                    self.record(time.monotonic() - started, hedged=True, hedge_won=future is second)
+                    return future.result()
+                error = future.exception()
+        with self.lock:
+            self.counts["requests"] += 1
+            self.counts["hedged"] += 1
+        raise error
+
+    def record(self, latency: float, hedged: bool, hedge_won: bool):
+        """Record the latency and the outcome of a successful request
+
+        Args:
+            latency (float): the seconds until the response
+            hedged (bool): whether a second request was sent
+            hedge_won (bool): whether the second request's response came first
+        """
+        with self.lock:
+            self.latencies.append(latency)
+            self.counts["requests"] += 1
+            self.counts["hedged"] += hedged
+            self.counts["hedge_wins"] += hedge_won
+
+    def get_metrics(self) -> dict:
+        """Get the metrics of the hedger
+
+        Returns:
+            dict: the number of requests, hedged requests and the hedges that won,
+                and the current hedging delay in seconds
+        """
+        delay = self.get_delay()
+        with self.lock:
+            return dict(self.counts, delay_seconds=delay)
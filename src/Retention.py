@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""A maintenance command for archiving the old rows of the Cygnus tables
+
+The Cygnus tables keep growing, but the OEE microservice only reads today's logs.
+The retention job moves the rows older than RETENTION_DAYS days
+into compressed columnar files, one for each table (entity) and day:
+    ARCHIVE_DIR/<table name>/<YYYY-MM-DD>.npz
+then deletes them from the table in batches of RETENTION_BATCH_SIZE rows,
+so Cygnus is never blocked for long. The shadow tables are trimmed the same way.
+Finally, the tables are vacuumed, so the space of the deleted rows can be reused.
+
+An archive file is written before any row of its day is deleted.
+If the job is interrupted, running it again merges the remaining rows into the archive,
+without duplicates.
+The archived logs can be read with read_archive for historical recomputations.
+
+Usage (from the src directory, with the environment variables of the microservice):
+    python Retention.py
+
+Environment variables (defaults are starred):
+    RETENTION_DAYS:
+        7*
+    RETENTION_BATCH_SIZE:
+        10000*
+    ARCHIVE_DIR:
+        archive*
+"""
+# Standard Library imports
+from datetime import datetime, timedelta
+import os
+import tempfile
+
+# PyPI packages
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+# Custom imports
+import Cygnus
+from Logger import getLogger
+from LoopHandler import LoopHandler
+import ShadowTables
+
+logger_Retention = getLogger(__name__)
+
+DATE_FORMAT = "%Y-%m-%d"
+
+RETENTION_DAYS = os.environ.get("RETENTION_DAYS")
+if RETENTION_DAYS is None:
+    RETENTION_DAYS = 7
+else:
+    RETENTION_DAYS = int(RETENTION_DAYS)
+
+RETENTION_BATCH_SIZE = os.environ.get("RETENTION_BATCH_SIZE")
+if RETENTION_BATCH_SIZE is None:
+    RETENTION_BATCH_SIZE = 10000
+else:
+    RETENTION_BATCH_SIZE = int(RETENTION_BATCH_SIZE)
+
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR")
+if ARCHIVE_DIR is None:
+    ARCHIVE_DIR = "archive"
+
+
+def get_horizon(now: datetime = None, days: int = RETENTION_DAYS) -> datetime:
+    """Get the retention horizon: the rows before it are archived
+
+    Args:
+        now (datetime): the current time. Default: datetime.now()
+        days (int): the number of days kept in the tables, including today. Default: RETENTION_DAYS
+
+    Returns:
+        the midnight days - 1 days before today (datetime)
+    """
+    if now is None:
+        now = datetime.now()
+    return datetime.combine(now.date(), datetime.min.time()) - timedelta(days=days - 1)
+
+
+def get_archive_path(table_name: str, day: datetime, archive_dir: str = ARCHIVE_DIR) -> str:
+    """Get the path of the archive file of a table's day
+
+    Args:
+        table_name (str): PostgreSQL table name
+        day (datetime): the day's midnight
+        archive_dir (str): the archive's root directory. Default: ARCHIVE_DIR
+
+    Returns:
+        path of the archive file (str)
+    """
+    return os.path.join(archive_dir, table_name, day.strftime(DATE_FORMAT) + ".npz")
+
+
+def get_oldest_day(con, table_name: str) -> datetime:
+    """Get the midnight of the day of the oldest row of a table
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        table_name (str): PostgreSQL table name
+
+    Returns:
+        the midnight (datetime) or None if the table is empty
+    """
+    oldest = con.execute(
+        sqlalchemy.text(
+            f"select min(cast (recvtimets as bigint)) from {Cygnus.POSTGRES_SCHEMA}.{table_name};"
+        )
+    ).scalar()
+    if oldest is None:
+        return None
+    return datetime.combine(datetime.fromtimestamp(oldest / 1e3).date(), datetime.min.time())
+
+
+def get_rows_size(con, table_name: str, before: int) -> int:
+    """Get the size of the rows of a table before a timestamp
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        table_name (str): PostgreSQL table name
+        before (int): timestamp in milliseconds
+
+    Returns:
+        the total size of the rows in bytes (int)
+    """
+    size = con.execute(
+        sqlalchemy.text(
+            f"""select sum(pg_column_size(t.*)) from {Cygnus.POSTGRES_SCHEMA}.{table_name} t
+                where cast (recvtimets as bigint) < {before};"""
+        )
+    ).scalar()
+    return 0 if size is None else int(size)
+
+
+def query_day(con, table_name: str, day: datetime) -> pd.DataFrame:
+    """Query a day's rows of a table
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        table_name (str): PostgreSQL table name
+        day (datetime): the day's midnight
+
+    Returns:
+        pandas DataFrame containing the rows of the day
+    """
+    start = round(day.timestamp() * 1e3)
+    end = round((day + timedelta(days=1)).timestamp() * 1e3)
+    query = f"""select * from {Cygnus.POSTGRES_SCHEMA}.{table_name}
+                where {start} <= cast (recvtimets as bigint)
+                and cast (recvtimets as bigint) < {end};"""
+    return pd.read_sql_query(sqlalchemy.text(query), con=con)
+
+
+def write_archive(df: pd.DataFrame, path: str):
+    """Write Cygnus logs into an archive file, merging them with the file's contents
+
+    Each column is stored as an array, recvtimets as int64, the others as str.
+    The file is replaced atomically, so it is never left half written.
+
+    Args:
+        df (pd.DataFrame): Cygnus logs
+        path (str): path of the archive file
+    """
+    df = df.applymap(str)
+    df["recvtimets"] = df["recvtimets"].astype("float64").astype("int64")
+    if os.path.exists(path):
+        df = pd.concat([load_archive_file(path), df], ignore_index=True).drop_duplicates()
+    df = df.sort_values(by=["recvtimets"])
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".npz")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(
+                f,
+                **{
+                    column: df[column].to_numpy(dtype=np.int64 if column == "recvtimets" else str)
+                    for column in df.columns
+                },
+            )
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def load_archive_file(path: str) -> pd.DataFrame:
+    """Load an archive file
+
+    Args:
+        path (str): path of the archive file
+
+    Returns:
+        pandas DataFrame, recvtimets is int64, the other columns are str
+    """
+    with np.load(path) as archive:
+        return pd.DataFrame({column: archive[column] for column in archive.files}).astype(
+            {column: object for column in archive.files if column != "recvtimets"}
+        )
+
+
+def read_archive(table_name: str, start: datetime, end: datetime, archive_dir: str = ARCHIVE_DIR) -> pd.DataFrame:
+    """Read the archived logs of a table for historical recomputations
+
+    The result can be used like the logs queried from the table,
+    see OEECalculator.convert_and_sort_logs
+
+    Args:
+        table_name (str): PostgreSQL table name
+        start (datetime): the start of the period, inclusive
+        end (datetime): the end of the period, exclusive
+        archive_dir (str): the archive's root directory. Default: ARCHIVE_DIR
+
+    Returns:
+        pandas DataFrame containing the archived logs of the period, sorted by time
+        recvtimets is int64, the other columns are str
+
+    Raises:
+        FileNotFoundError:
+            if there is no archived log of the period
+    """
+    frames = []
+    day = datetime.combine(start.date(), datetime.min.time())
+    while day < end:
+        path = get_archive_path(table_name, day, archive_dir)
+        if os.path.exists(path):
+            frames.append(load_archive_file(path))
+        day += timedelta(days=1)
+    if len(frames) == 0:
+        raise FileNotFoundError(
+            f"No archived log of the table {table_name} between {start} and {end} in {archive_dir}"
+        )
+    df = pd.concat(frames, ignore_index=True)
+    df = df[
+        (start.timestamp() * 1e3 <= df["recvtimets"]) & (df["recvtimets"] < end.timestamp() * 1e3)
+    ]
+    return df.sort_values(by=["recvtimets"]).reset_index(drop=True)
+
+
+def delete_in_batches(engine, table_name: str, before: int, recvtimets: str, batch_size: int) -> int:
+    """Delete the rows of a table before a timestamp in batches, each batch in its own transaction
+
+    Args:
+        engine (sqlalchemy engine): engine of the PostgreSQL database
+        table_name (str): PostgreSQL table name
+        before (int): the rows before this timestamp in milliseconds are deleted
+        recvtimets (str): the expression of the timestamp in bigint
+        batch_size (int): the maximum number of rows deleted in one transaction
+
+    Returns:
+        the number of deleted rows (int)
+    """
+    table = f"{Cygnus.POSTGRES_SCHEMA}.{table_name}"
+    query = f"""delete from {table} where ctid in (
+                select ctid from {table} where {recvtimets} < {before} limit {batch_size});"""
+    deleted = 0
+    while True:
+        with engine.begin() as con:
+            rowcount = con.execute(sqlalchemy.text(query)).rowcount
+        deleted += rowcount
+        if rowcount < batch_size:
+            return deleted
+
+
+def vacuum(engine, table_name: str):
+    """Vacuum a table, so the space of the deleted rows can be reused
+
+    Args:
+        engine (sqlalchemy engine): engine of the PostgreSQL database
+        table_name (str): PostgreSQL table name
+    """
+    with engine.connect() as con:
+        con.execution_options(isolation_level="AUTOCOMMIT").execute(
+            sqlalchemy.text(f"vacuum (analyze) {Cygnus.POSTGRES_SCHEMA}.{table_name};")
+        )
+
+
+def archive_table(
+    engine,
+    table_name: str,
+    horizon: datetime,
+    archive_dir: str = ARCHIVE_DIR,
+    batch_size: int = RETENTION_BATCH_SIZE,
+) -> dict:
+    """Archive and delete the rows of a table before the horizon
+
+    Args:
+        engine (sqlalchemy engine): engine of the PostgreSQL database
+        table_name (str): PostgreSQL table name
+        horizon (datetime): the rows before it are archived
+        archive_dir (str): the archive's root directory. Default: ARCHIVE_DIR
+        batch_size (int): the maximum number of rows deleted in one transaction. Default: RETENTION_BATCH_SIZE
+
+    Returns:
+        dict with the following keys:
+            table: table name
+            archived_rows: the number of archived and deleted rows
+            archive_files: the paths of the written archive files
+            bytes_reclaimed: the size of the deleted rows, reusable after the vacuum
+            bytes_before: the size of the table before the retention job
+            bytes_after: the size of the table after the retention job,
+                it only shrinks if the deleted rows were at the end of the table
+            latency_before: see Cygnus.time_benchmark_queries
+            latency_after: the same after the retention job
+    """
+    before = round(horizon.timestamp() * 1e3)
+    with engine.connect() as con:
+        report = {
+            "table": table_name,
+            "archived_rows": 0,
+            "archive_files": [],
+            "bytes_reclaimed": get_rows_size(con, table_name, before),
+            "bytes_before": Cygnus.get_table_statistics(con, table_name)["total_bytes"],
+            "latency_before": Cygnus.time_benchmark_queries(con, table_name),
+        }
+        day = get_oldest_day(con, table_name)
+        while day is not None and day < horizon:
+            df = query_day(con, table_name, day)
+            if len(df) > 0:
+                path = get_archive_path(table_name, day, archive_dir)
+                write_archive(df, path)
+                report["archive_files"].append(path)
+                logger_Retention.info(f"Archived {len(df)} rows of {table_name} to {path}")
+            day += timedelta(days=1)
+        has_shadow_table = ShadowTables.shadow_table_exists(con, table_name)
+
+    report["archived_rows"] = delete_in_batches(
+        engine, table_name, before, "cast (recvtimets as bigint)", batch_size
+    )
+    vacuum(engine, table_name)
+    if has_shadow_table:
+        shadow_table = ShadowTables.get_shadow_table(table_name)
+        delete_in_batches(engine, shadow_table, before, "recvtimets", batch_size)
+        vacuum(engine, shadow_table)
+
+    with engine.connect() as con:
+        report["bytes_after"] = Cygnus.get_table_statistics(con, table_name)["total_bytes"]
+        report["latency_after"] = Cygnus.time_benchmark_queries(con, table_name)
+    logger_Retention.info(f"Retention report: {report}")
+    return report
+
+
+def main():
+    """Run the retention job on all Cygnus tables of the POSTGRES_SCHEMA"""
+    engine = LoopHandler.create_postgres_engine()
+    horizon = get_horizon()
+    try:
+        with engine.connect() as con:
+            tables = Cygnus.get_schema_tables(con)
+        for table_name in tables:
+            report = archive_table(engine, table_name, horizon)
+            print(
+                f'{report["table"]}: archived {report["archived_rows"]} rows, '
+                f'reclaimed {report["bytes_reclaimed"]} bytes, '
+                f'table size: {report["bytes_before"]} -> {report["bytes_after"]} bytes'
+            )
+            for name, latency in report["latency_before"].items():
+                print(f'    {name}: {latency:.2f} ms -> {report["latency_after"][name]:.2f} ms')
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,809 @@
+# -*- coding: utf-8 -*-
+"""Incrementally maintained rollups of the OEE's components
+
+Reports over weeks or months cannot recalculate the OEE from the Cygnus logs,
+so the components of the OEE are rolled up into tables:
+    oee_rollup_hourly: per Workstation, per Job and per hour
+    oee_rollup_shift: per Workstation and per shift
+    oee_rollup_daily: per Workstation and per day
+with the following additive measures:
+    available_ms: the time the Workstation was available in the shift
+    total_ms: the time of the shift
+    good_cycles, reject_cycles: the production cycles, see OEECalculator.count_cycles
+    ideal_ms: the cycles multiplied by the cycle time of the Job's Operation
+so the KPIs of any period are ratios of sums, see get_period_rollup:
+    availability = available_ms / total_ms
+    performance = ideal_ms / available_ms
+    quality = good_cycles / (good_cycles + reject_cycles)
+
+The hourly rollups are calculated from the day's logs like the OEECalculator calculates the KPIs:
+the Workstation is unavailable until its first available record since midnight,
+the Job running before the first refJob record of the day is the one referenced last before midnight
+(or the Workstation's current Job if no refJob is logged at all),
+and the counters of a Job are counted from the start of its part of the shift.
+Every hour starts 3600 s after the previous one, counted from the day's midnight.
+
+After each loop, the rollups are updated from the last rolled up hour (see RollupMaintainer.update),
+the shift and daily rollups are summed from the hourly ones.
+Each hourly rollup stores the state carried over to the following hour at the end of its window:
+the Workstation's availability and the levels of the Job's counters.
+So the update continues from the stored state and only queries the logs since the last rolled up hour.
+The day is calculated from midnight only if no state is stored, like at the start of the shift.
+Each hourly rollup also stores the number of logs it was calculated from.
+If the logs of a completed hour within ROLLUP_LATE_HOURS changed, because some arrived late,
+the rollups of the day are recalculated from midnight and rewritten from that hour on,
+since the availability and the counters carry over to the following hours.
+The logs are checked for late arrivals at most every ROLLUP_LATE_CHECK_INTERVAL seconds.
+
+Environment variables (defaults are starred):
+    ROLLUPS:
+        TRUE
+        FALSE*
+    ROLLUP_LATE_HOURS:
+        24*
+    ROLLUP_LATE_CHECK_INTERVAL: seconds
+        300*
+"""
+# Standard Library imports
+from datetime import datetime, timedelta
+import os
+import time
+
+# PyPI packages
+import numpy as np
+import sqlalchemy
+
+# Custom imports
+import Cygnus
+from Logger import getLogger
+from OEE import OEECalculator
+import Orion
+
+ROLLUPS = os.environ.get("ROLLUPS")
+if ROLLUPS is None:
+    ROLLUPS = False
+elif ROLLUPS.lower() == "true":
+    ROLLUPS = True
+else:
+    ROLLUPS = False
+
+ROLLUP_LATE_HOURS = os.environ.get("ROLLUP_LATE_HOURS")
+if ROLLUP_LATE_HOURS is None:
+    ROLLUP_LATE_HOURS = 24
+else:
+    ROLLUP_LATE_HOURS = int(ROLLUP_LATE_HOURS)
+
+ROLLUP_LATE_CHECK_INTERVAL = os.environ.get("ROLLUP_LATE_CHECK_INTERVAL")
+if ROLLUP_LATE_CHECK_INTERVAL is None:
+    ROLLUP_LATE_CHECK_INTERVAL = 300
+else:
+    ROLLUP_LATE_CHECK_INTERVAL = float(ROLLUP_LATE_CHECK_INTERVAL)
+
+HOURLY_TABLE = "oee_rollup_hourly"
+SHIFT_TABLE = "oee_rollup_shift"
+DAILY_TABLE = "oee_rollup_daily"
+MEASURES = ("available_ms", "total_ms", "good_cycles", "reject_cycles", "ideal_ms")
+HOUR_MS = 3600000
+# the logs the rollups are calculated from
+WORKSTATION_ATTRIBUTES = ("available", "refJob")
+# the state at the end of an hourly rollup's window, carried over to the following hour, see calculate_day
+CARRIED_COLUMNS = {
+    "window_end": "timestamptz",
+    "end_available": "boolean",
+    "good_level": "double precision",
+    "reject_level": "double precision",
+}
+
+
+def create_rollup_tables(con):
+    """Create the rollup tables, if they do not exist
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+    """
+    schema = Cygnus.POSTGRES_SCHEMA
+    measures = ", ".join(f"{measure} double precision not null" for measure in MEASURES)
+    con.execute(
+        sqlalchemy.text(
+            f"""create table if not exists {schema}.{HOURLY_TABLE} (
+                workstation text not null,
+                job text not null,
+                bucket_start timestamptz not null,
+                {measures},
+                job_table text,
+                n_workstation_logs bigint not null,
+                n_job_logs bigint not null,
+                primary key (workstation, bucket_start, job));"""
+        )
+    )
+    # the tables of the earlier versions have no carried state, their days are calculated from midnight
+    carried = ", ".join(f"add column if not exists {column} {type_}" for column, type_ in CARRIED_COLUMNS.items())
+    con.execute(sqlalchemy.text(f"alter table {schema}.{HOURLY_TABLE} {carried};"))
+    con.execute(
+        sqlalchemy.text(
+            f"""create table if not exists {schema}.{SHIFT_TABLE} (
+                workstation text not null,
+                shift text not null,
+                shift_start timestamptz not null,
+                shift_end timestamptz not null,
+                {measures},
+                primary key (workstation, shift_start));"""
+        )
+    )
+    con.execute(
+        sqlalchemy.text(
+            f"""create table if not exists {schema}.{DAILY_TABLE} (
+                workstation text not null,
+                day date not null,
+                {measures},
+                primary key (workstation, day));"""
+        )
+    )
+
+
+def get_kpis(measures: dict) -> dict:
+    """Calculate the KPIs of summed measures
+
+    Args:
+        measures (dict): the sums of MEASURES
+
+    Returns:
+        dict: the availability, performance, quality and oee,
+        a KPI is None if its denominator is 0
+    """
+    n_cycles = measures["good_cycles"] + measures["reject_cycles"]
+    kpis = {
+        "availability": measures["available_ms"] / measures["total_ms"] if measures["total_ms"] else None,
+        "performance": measures["ideal_ms"] / measures["available_ms"] if measures["available_ms"] else None,
+        "quality": measures["good_cycles"] / n_cycles if n_cycles else None,
+    }
+    if None in kpis.values():
+        kpis["oee"] = None
+    else:
+        kpis["oee"] = kpis["availability"] * kpis["performance"] * kpis["quality"]
+    return kpis
+
+
+def get_period_rollup(con, workstation_id: str, first_day, last_day) -> dict:
+    """Sum the daily rollups of a Workstation in a period
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        workstation_id (str): the Workstation's Orion id
+        first_day (date): the first day of the period
+        last_day (date): the last day of the period, inclusive
+
+    Returns:
+        dict: the sums of MEASURES and the KPIs, see get_kpis
+    """
+    sums = ", ".join(f"coalesce(sum({measure}), 0) as {measure}" for measure in MEASURES)
+    row = con.execute(
+        sqlalchemy.text(
+            f"""select {sums} from {Cygnus.POSTGRES_SCHEMA}.{DAILY_TABLE}
+                where workstation = :workstation and :first_day <= day and day <= :last_day;"""
+        ),
+        {"workstation": workstation_id, "first_day": first_day, "last_day": last_day},
+    ).fetchone()
+    measures = {measure: float(row[measure]) for measure in MEASURES}
+    measures.update(get_kpis(measures))
+    return measures
+
+
+def get_week_to_date(con, workstation_id: str, today=None) -> dict:
+    """Sum the daily rollups of a Workstation since Monday
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        workstation_id (str): the Workstation's Orion id
+        today (date): Default: None, the current date
+
+    Returns:
+        dict: see get_period_rollup
+    """
+    if today is None:
+        today = datetime.now().date()
+    return get_period_rollup(con, workstation_id, today - timedelta(days=today.weekday()), today)
+
+
+def get_month_to_date(con, workstation_id: str, today=None) -> dict:
+    """Sum the daily rollups of a Workstation since the first day of the month
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        workstation_id (str): the Workstation's Orion id
+        today (date): Default: None, the current date
+
+    Returns:
+        dict: see get_period_rollup
+    """
+    if today is None:
+        today = datetime.now().date()
+    return get_period_rollup(con, workstation_id, today.replace(day=1), today)
+
+
+def get_available_time(timestamps: np.array, values: np.array, start: float, end: float) -> float:
+    """Integrate the Workstation's availability in a time window
+
+    Args:
+        timestamps (np.array): the sorted timestamps of the available records since midnight
+        values (np.array): the available values (bool) of the records
+        start (float): the window's start in milliseconds
+        end (float): the window's end in milliseconds
+
+    Returns:
+        the available time in milliseconds (float), unavailable before the first record
+    """
+    index = np.searchsorted(timestamps, start, side="right")
+    available = bool(values[index - 1]) if index > 0 else False
+    available_time = 0
+    previous = start
+    for timestamp, value in zip(timestamps[index:], values[index:]):
+        if timestamp >= end:
+            break
+        if available:
+            available_time += timestamp - previous
+        previous = timestamp
+        available = bool(value)
+    if available:
+        available_time += end - previous
+    return available_time
+
+
+def is_available_at(timestamps: np.array, values: np.array, timestamp: float) -> bool:
+    """Get the Workstation's availability just before a time, the state carried over from a window ending then
+
+    Args:
+        timestamps (np.array): the sorted timestamps of the available records since midnight
+        values (np.array): the available values (bool) of the records
+        timestamp (float): the time in milliseconds
+
+    Returns:
+        the value of the last record strictly before the time (bool), unavailable before the first record
+    """
+    index = np.searchsorted(timestamps, timestamp, side="left")
+    return bool(values[index - 1]) if index > 0 else False
+
+
+def get_counter_levels(timestamps: np.array, values: np.array, parts_per_cycle: int, initial: float = None) -> tuple:
+    """Get a function of a counter's level at any time, the cycles between two times are the difference of the levels
+
+    The level is the running maximum of the counter since the start of the Job's part of the shift.
+    Before the first record, it is the level that makes the cycles of the whole part
+    equal to OEECalculator.count_cycles_based_on_counter_extrema: the minimum if 0 is logged,
+    one cycle below the minimum otherwise.
+    If the level at the start of the records is carried over from an earlier hour, the level starts from it.
+
+    Args:
+        timestamps (np.array): the sorted timestamps of the counter's records
+        values (np.array): the counter's values (int)
+        parts_per_cycle (int): the Operation's partsPerCycle
+        initial (float): the carried over level in cycles before the records. Default: None, no records before
+
+    Returns:
+        callable: level(timestamp) in cycles, counting the records strictly before the timestamp
+    """
+    if len(values) == 0:
+        return lambda timestamp: 0 if initial is None else initial
+    if initial is None:
+        baseline = (values.min() if 0 in values else values.min() - parts_per_cycle) / parts_per_cycle
+        levels = np.maximum.accumulate(values) / parts_per_cycle
+    else:
+        baseline = initial
+        levels = np.maximum(np.maximum.accumulate(values) / parts_per_cycle, initial)
+
+    def level(timestamp: float) -> float:
+        index = np.searchsorted(timestamps, timestamp, side="left")
+        if index == 0:
+            return baseline
+        return levels[index - 1]
+
+    return level
+
+
+class RollupMaintainer:
+    """Maintain the rollups of the Workstations incrementally
+
+    Common usage:
+        rollups = RollupMaintainer()
+        rollups.update(con, workstation_id)
+        ...
+        get_week_to_date(con, workstation_id)
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, late_hours: int = ROLLUP_LATE_HOURS, late_check_interval: float = ROLLUP_LATE_CHECK_INTERVAL):
+        """The constructor of the RollupMaintainer class
+
+        Args:
+            late_hours (int): how many hours back the logs are checked for late arrivals
+            late_check_interval (float): the minimum number of seconds between the checks of a Workstation
+        """
+        self.late_hours = late_hours
+        self.late_check_interval = late_check_interval
+        # the time.monotonic of the last check of each Workstation, format: {workstation_id: float}
+        self.late_checked = {}
+        self.tables_created = False
+
+    def __repr__(self):
+        return f"RollupMaintainer(late_hours={self.late_hours}, late_check_interval={self.late_check_interval})"
+
+    def get_calculator(self, workstation_id: str, now: datetime, day) -> OEECalculator:
+        """Get an OEECalculator of a Workstation frozen at the end of a day or now
+
+        Args:
+            workstation_id (str): the Workstation's Orion id
+            now (datetime): the current time
+            day (date): the day
+
+        Returns:
+            OEECalculator with its Workstation, Shift and the day's shift limits
+        """
+        oee = OEECalculator(workstation_id)
+        # the last millisecond of the day, so the OEECalculator's "today" is the day
+        day_end = datetime.combine(day, datetime.min.time()) + timedelta(days=1, milliseconds=-1)
+        oee.now_unix = oee.datetime_to_milliseconds(min(now, day_end))
+        oee.get_workstation()
+        oee.get_shift()
+        oee.get_todays_shift_limits()
+        return oee
+
+    def set_job(self, oee: OEECalculator, job_id: str):
+        """Set the Job and its Operation of an OEECalculator
+
+        Args:
+            oee (OEECalculator): the OEECalculator
+            job_id (str): the Job's Orion id
+        """
+        oee.job = oee.object_.copy()
+        oee.job["id"] = job_id
+        oee.job["orion"] = Orion.get(job_id)
+        oee.job["postgres_table"] = oee.get_cygnus_postgres_table(oee.job["orion"], oee.data_model)
+        oee.operation = oee.object_.copy()
+        oee.get_operation()
+        # the entity filter of the logs depends on the Job
+        oee.logs_sources = {}
+
+    def query_last_job_before(self, con, oee: OEECalculator, timestamp: float) -> str:
+        """Query the Job referenced last before a time
+
+        Args:
+            con (sqlalchemy connection object): connection to PostgreSQL
+            oee (OEECalculator): the Workstation's OEECalculator
+            timestamp (float): the time in milliseconds
+
+        Returns:
+            the Job's Orion id (str) or None
+        """
+        table_name = oee.workstation["postgres_table"]
+        source = oee.get_logs_source(con, table_name)
+        query = f"""select attrvalue from {source["relation"]}
+                    where attrname = 'refJob' and {source["recvtimets"]} < {timestamp}
+                    order by {source["recvtimets"]} desc limit 1;"""
+        df = oee.read_sql_query(con, query, table_name)
+        if len(df) == 0:
+            return None
+        return df["attrvalue"].iloc[0]
+
+    def get_job_segments(self, oee: OEECalculator, df, start: float, job_id: str) -> list:
+        """Get the Jobs of the day and the times they ran
+
+        Args:
+            oee (OEECalculator): the Workstation's OEECalculator
+            df (pd.DataFrame): the Workstation's sorted refJob logs since start
+            start (float): the start of the logs in milliseconds
+            job_id (str): the Job running at start, None if unknown
+
+        Returns:
+            list of (job_id, start, end) tuples in milliseconds, job_id is None if unknown
+        """
+        segments = []
+        for timestamp, value in zip(df["recvtimets"], df["attrvalue"]):
+            if value == job_id:
+                continue
+            segments.append((job_id, start, timestamp))
+            job_id, start = value, timestamp
+        segments.append((job_id, start, oee.now_unix))
+        return [segment for segment in segments if segment[1] < segment[2]]
+
+    def query_carried_state(self, con, workstation_id: str, timestamp: datetime) -> dict:
+        """Query the state carried over from the hourly rollup whose window ends at a time
+
+        Args:
+            con (sqlalchemy connection object): connection to PostgreSQL
+            workstation_id (str): the Workstation's Orion id
+            timestamp (datetime): the end of the window, the start of an hour
+
+        Returns:
+            dict: the job (str, None if unknown), end_available (bool), good_level and reject_level (float or None)
+            or None if no rollup with a state ends at the time
+        """
+        row = con.execute(
+            sqlalchemy.text(
+                f"""select job, end_available, good_level, reject_level from {Cygnus.POSTGRES_SCHEMA}.{HOURLY_TABLE}
+                    where workstation = :workstation and window_end = :window_end and end_available is not null
+                    limit 1;"""
+            ),
+            {"workstation": workstation_id, "window_end": timestamp.astimezone()},
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job": row.job or None,
+            "end_available": row.end_available,
+            "goodPartCounter": row.good_level,
+            "rejectPartCounter": row.reject_level,
+        }
+
+    def calculate_day(self, con, workstation_id: str, now: datetime, day, first_bucket: datetime = None) -> tuple:
+        """Calculate the hourly rollups of a Workstation on a day from the logs
+
+        If first_bucket is set and the state at its start is stored, see query_carried_state,
+        only the logs since first_bucket are queried and only the rollups from first_bucket on are calculated.
+        Otherwise the day is calculated from midnight.
+
+        Args:
+            con (sqlalchemy connection object): connection to PostgreSQL
+            workstation_id (str): the Workstation's Orion id
+            now (datetime): the current time
+            day (date): the day
+            first_bucket (datetime): the first hour needed. Default: None, from midnight
+
+        Returns:
+            tuple: (the OEECalculator of the day, list of the hourly rollups (dict))
+
+        Raises:
+            RuntimeError, KeyError, TypeError:
+                if getting the Orion objects or querying the logs fails
+            ValueError:
+                if a counter value is not an integer
+            ZeroDivisionError:
+                if the partsPerCycle of an Operation is 0
+        """
+        oee = self.get_calculator(workstation_id, now, day)
+        midnight = oee.datetime_to_milliseconds(datetime.combine(day, datetime.min.time()))
+        shift_start = oee.datetime_to_milliseconds(oee.today["start"])
+        shift_end = min(oee.datetime_to_milliseconds(oee.today["end"]), oee.now_unix)
+        if shift_end <= shift_start:
+            return oee, []
+        first_hour = int((shift_start - midnight) // HOUR_MS)
+        carried = None
+        if first_bucket is not None and oee.datetime_to_milliseconds(first_bucket) > midnight + first_hour * HOUR_MS:
+            carried = self.query_carried_state(con, workstation_id, first_bucket)
+        if carried is None:
+            logs_start = midnight
+        else:
+            logs_start = oee.datetime_to_milliseconds(first_bucket)
+            first_hour = int((logs_start - midnight) // HOUR_MS)
+        df = self.query_attribute_logs(
+            con, oee, oee.workstation["postgres_table"], WORKSTATION_ATTRIBUTES, logs_start, oee.now_unix
+        )
+        df_available = df[df["attrname"] == "available"]
+        available_timestamps = df_available["recvtimets"].to_numpy()
+        available_values = (df_available["attrvalue"] == "true").to_numpy()
+        if carried is not None:
+            # the availability carried over is a record at the start of the logs
+            available_timestamps = np.concatenate([[logs_start], available_timestamps])
+            available_values = np.concatenate([[carried["end_available"]], available_values])
+        workstation_timestamps = df["recvtimets"].to_numpy()
+        df_refJob = df[df["attrname"] == "refJob"]
+        if carried is not None:
+            job_id = carried["job"]
+        elif len(df_refJob) == 0:
+            # no refJob is logged today
+            job_id = oee.get_job_id()
+        else:
+            job_id = self.query_last_job_before(con, oee, midnight)
+        segments = self.get_job_segments(oee, df_refJob, logs_start, job_id)
+
+        buckets = [
+            midnight + hour * HOUR_MS
+            for hour in range(first_hour, int(np.ceil((shift_end - midnight) / HOUR_MS)))
+        ]
+        rollups = []
+        for job_id, segment_start, segment_end in segments:
+            start, end = max(segment_start, shift_start), min(segment_end, shift_end)
+            if end <= start:
+                continue
+            # the Job's part continues from the carried over counter levels
+            continued = carried is not None and segment_start == logs_start and job_id == carried["job"]
+            # no cycles are counted if the Job is unknown
+            job_timestamps = np.empty(0, dtype=np.int64)
+            levels = {attribute: lambda timestamp: 0 for attribute in OEECalculator.COUNTER_ATTRIBUTES}
+            counter_timestamps = {attribute: job_timestamps for attribute in OEECalculator.COUNTER_ATTRIBUTES}
+            cycle_time, job_table = 0, None
+            if job_id is not None:
+                self.set_job(oee, job_id)
+                job_table = oee.job["postgres_table"]
+                job_df = self.query_counter_logs(con, oee, buckets[0], oee.now_unix)
+                job_timestamps = job_df["recvtimets"].to_numpy()
+                parts_per_cycle = oee.operation["orion"]["partsPerCycle"]["value"]
+                if parts_per_cycle == 0:
+                    raise ZeroDivisionError(f"The following operation's partsPerCycle value is 0: {oee.operation['id']}")
+                cycle_time = oee.operation["orion"]["cycleTime"]["value"] * 1e3
+                for attribute in OEECalculator.COUNTER_ATTRIBUTES:
+                    counter = job_df[
+                        (job_df["attrname"] == attribute) & (start <= job_df["recvtimets"]) & (job_df["recvtimets"] <= end)
+                    ]
+                    try:
+                        values = counter["attrvalue"].astype(np.int64).to_numpy()
+                    except ValueError as error:
+                        raise ValueError(
+                            "At least one goodPartCounter or rejectPartCounter value cannot be converted to int"
+                        ) from error
+                    counter_timestamps[attribute] = counter["recvtimets"].to_numpy()
+                    levels[attribute] = get_counter_levels(
+                        counter_timestamps[attribute], values, parts_per_cycle, carried[attribute] if continued else None
+                    )
+            for bucket_start in buckets:
+                bucket_end = bucket_start + HOUR_MS
+                window_start, window_end = max(bucket_start, start), min(bucket_end, end)
+                if window_end <= window_start:
+                    continue
+                # the logs at the end of the Job's part belong to it, like in the OEECalculator
+                level_end = window_end + 1 if window_end == end else window_end
+                level_start = window_start if window_start > start else -np.inf
+                good = levels["goodPartCounter"](level_end) - levels["goodPartCounter"](level_start)
+                reject = levels["rejectPartCounter"](level_end) - levels["rejectPartCounter"](level_start)
+                # the counter levels carried over to the next hour, None before the first record of the Job's part
+                end_levels = {}
+                for attribute in OEECalculator.COUNTER_ATTRIBUTES:
+                    counted = continued and carried[attribute] is not None
+                    if counted or np.searchsorted(counter_timestamps[attribute], window_end, side="left") > 0:
+                        end_levels[attribute] = float(levels[attribute](window_end))
+                    else:
+                        end_levels[attribute] = None
+                rollups.append(
+                    {
+                        "workstation": workstation_id,
+                        "job": job_id or "",
+                        "bucket_start": oee.milliseconds_to_datetime(bucket_start).astimezone(),
+                        "available_ms": int(
+                            get_available_time(available_timestamps, available_values, window_start, window_end)
+                        ),
+                        "total_ms": int(window_end - window_start),
+                        "good_cycles": good,
+                        "reject_cycles": reject,
+                        "ideal_ms": (good + reject) * cycle_time,
+                        "job_table": job_table,
+                        "n_workstation_logs": int(
+                            np.count_nonzero((bucket_start <= workstation_timestamps) & (workstation_timestamps < bucket_end))
+                        ),
+                        "n_job_logs": int(np.count_nonzero((bucket_start <= job_timestamps) & (job_timestamps < bucket_end))),
+                        "window_end": oee.milliseconds_to_datetime(window_end).astimezone(),
+                        "end_available": is_available_at(available_timestamps, available_values, window_end),
+                        "good_level": end_levels["goodPartCounter"],
+                        "reject_level": end_levels["rejectPartCounter"],
+                    }
+                )
+        return oee, rollups
+
+    def query_attribute_logs(self, con, oee: OEECalculator, table_name: str, attributes: tuple, start: float, end: float):
+        """Query the logs of some attributes of a table in a time window
+
+        Args:
+            con (sqlalchemy connection object): connection to PostgreSQL
+            oee (OEECalculator): the OEECalculator of the table's entity
+            table_name (str): PostgreSQL table name
+            attributes (tuple): the attribute names
+            start (float): the first timestamp in milliseconds
+            end (float): the last timestamp in milliseconds
+
+        Returns:
+            pandas DataFrame of the sorted logs
+        """
+        source = oee.get_logs_source(con, table_name)
+        names = ", ".join(f"'{attribute}'" for attribute in attributes)
+        query = f"""select * from {source["relation"]}
+                    where attrname in ({names})
+                    and {start} <= {source["recvtimets"]} and {source["recvtimets"]} <= {end};"""
+        return oee.convert_and_sort_logs(oee.read_logs(con, query, table_name))
+
+    def query_counter_logs(self, con, oee: OEECalculator, start: float, end: float):
+        """Query the counter logs of the OEECalculator's Job
+
+        Args:
+            con (sqlalchemy connection object): connection to PostgreSQL
+            oee (OEECalculator): the OEECalculator with its Job set, see set_job
+            start (float): the first timestamp in milliseconds
+            end (float): the last timestamp in milliseconds
+
+        Returns:
+            pandas DataFrame of the sorted logs
+        """
+        return self.query_attribute_logs(
+            con, oee, oee.job["postgres_table"], OEECalculator.COUNTER_ATTRIBUTES, start, end
+        )
+
+    def count_logs_per_hour(self, con, oee: OEECalculator, table_name: str, attributes: tuple, first_bucket: float, end: float) -> dict:
+        """Count the logs of a table in each hour in PostgreSQL
+
+        Args:
+            con (sqlalchemy connection object): connection to PostgreSQL
+            oee (OEECalculator): the OEECalculator of the table's entity
+            table_name (str): PostgreSQL table name
+            attributes (tuple): the counted attributes
+            first_bucket (float): the start of the first hour in milliseconds
+            end (float): the end of the last hour in milliseconds
+
+        Returns:
+            dict: {the hour's start in milliseconds: the number of logs}
+        """
+        source = oee.get_logs_source(con, table_name)
+        names = ", ".join(f"'{attribute}'" for attribute in attributes)
+        query = f"""select floor(({source["recvtimets"]} - {first_bucket}) / {HOUR_MS}) as hour, count(*) as n_logs
+                    from {source["relation"]}
+                    where attrname in ({names})
+                    and {first_bucket} <= {source["recvtimets"]} and {source["recvtimets"]} < {end}
+                    group by 1;"""
+        df = oee.read_sql_query(con, query, table_name, query_class="aggregate")
+        return {first_bucket + int(row.hour) * HOUR_MS: int(row.n_logs) for row in df.itertuples()}
+
+    def find_late_hours(self, con, workstation_id: str, now: datetime) -> list:
+        """Find the completed hours whose logs changed since they were rolled up
+
+        Args:
+            con (sqlalchemy connection object): connection to PostgreSQL
+            workstation_id (str): the Workstation's Orion id
+            now (datetime): the current time
+
+        Returns:
+            the sorted starts of the changed hours (datetime)
+        """
+        lookback = now - timedelta(hours=self.late_hours)
+        rows = con.execute(
+            sqlalchemy.text(
+                f"""select bucket_start, job, job_table, n_workstation_logs, n_job_logs
+                    from {Cygnus.POSTGRES_SCHEMA}.{HOURLY_TABLE}
+                    where workstation = :workstation and :lookback <= bucket_start
+                    and bucket_start + interval '1 hour' <= :now
+                    order by bucket_start;"""
+            ),
+            {"workstation": workstation_id, "lookback": lookback.astimezone(), "now": now.astimezone()},
+        ).fetchall()
+        if len(rows) == 0:
+            return []
+        oee = OEECalculator(workstation_id)
+        oee.get_workstation()
+        first_bucket = round(rows[0].bucket_start.timestamp() * 1e3)
+        end = round(rows[-1].bucket_start.timestamp() * 1e3) + HOUR_MS
+        workstation_counts = self.count_logs_per_hour(
+            con, oee, oee.workstation["postgres_table"], WORKSTATION_ATTRIBUTES, first_bucket, end
+        )
+        job_counts = {}
+        late = set()
+        for row in rows:
+            bucket_start = round(row.bucket_start.timestamp() * 1e3)
+            if workstation_counts.get(bucket_start, 0) != row.n_workstation_logs:
+                late.add(bucket_start)
+            if not row.job_table:
+                continue
+            if row.job not in job_counts:
+                oee.job = {"id": row.job, "postgres_table": row.job_table}
+                oee.logs_sources = {}
+                job_counts[row.job] = self.count_logs_per_hour(
+                    con, oee, row.job_table, OEECalculator.COUNTER_ATTRIBUTES, first_bucket, end
+                )
+            if job_counts[row.job].get(bucket_start, 0) != row.n_job_logs:
+                late.add(bucket_start)
+        return [oee.milliseconds_to_datetime(bucket_start) for bucket_start in sorted(late)]
+
+    def write_day(self, con, oee: OEECalculator, day, rollups: list, first_bucket: datetime):
+        """Replace the hourly rollups of a day from an hour on, and sum the shift and daily rollups
+
+        Args:
+            con (sqlalchemy connection object): connection to PostgreSQL in a transaction
+            oee (OEECalculator): the OEECalculator of the day, see calculate_day
+            day (date): the day
+            rollups (list): the day's hourly rollups, see calculate_day
+            first_bucket (datetime): the first replaced hour
+        """
+        schema = Cygnus.POSTGRES_SCHEMA
+        workstation_id = oee.workstation["id"]
+        midnight = datetime.combine(day, datetime.min.time())
+        day_params = {
+            "workstation": workstation_id,
+            "first_bucket": first_bucket.astimezone(),
+            "day_start": midnight.astimezone(),
+            "day_end": (midnight + timedelta(days=1)).astimezone(),
+        }
+        con.execute(
+            sqlalchemy.text(
+                f"""delete from {schema}.{HOURLY_TABLE} where workstation = :workstation
+                    and :first_bucket <= bucket_start and bucket_start < :day_end;"""
+            ),
+            day_params,
+        )
+        rollups = [rollup for rollup in rollups if rollup["bucket_start"] >= day_params["first_bucket"]]
+        if rollups:
+            columns = list(rollups[0])
+            con.execute(
+                sqlalchemy.text(
+                    f"""insert into {schema}.{HOURLY_TABLE} ({", ".join(columns)})
+                        values ({", ".join(f":{column}" for column in columns)});"""
+                ),
+                rollups,
+            )
+        sums = ", ".join(f"sum({measure})" for measure in MEASURES)
+        for table, key in ((DAILY_TABLE, "day = :day"), (SHIFT_TABLE, "shift_start = :shift_start")):
+            con.execute(
+                sqlalchemy.text(f"delete from {schema}.{table} where workstation = :workstation and {key};"),
+                {"day": day, "shift_start": oee.today["start"].astimezone(), **day_params},
+            )
+        con.execute(
+            sqlalchemy.text(
+                f"""insert into {schema}.{DAILY_TABLE} (workstation, day, {", ".join(MEASURES)})
+                    select workstation, :day, {sums} from {schema}.{HOURLY_TABLE}
+                    where workstation = :workstation and :day_start <= bucket_start and bucket_start < :day_end
+                    group by workstation;"""
+            ),
+            {"day": day, **day_params},
+        )
+        con.execute(
+            sqlalchemy.text(
+                f"""insert into {schema}.{SHIFT_TABLE} (workstation, shift, shift_start, shift_end, {", ".join(MEASURES)})
+                    select workstation, :shift, :shift_start, :shift_end, {sums} from {schema}.{HOURLY_TABLE}
+                    where workstation = :workstation and :day_start <= bucket_start and bucket_start < :day_end
+                    group by workstation;"""
+            ),
+            {
+                "shift": oee.shift["id"],
+                "shift_start": oee.today["start"].astimezone(),
+                "shift_end": oee.today["end"].astimezone(),
+                **day_params,
+            },
+        )
+
+    def update(self, con, workstation_id: str) -> list:
+        """Update the rollups of a Workstation from the last rolled up hour and the hours of late logs
+
+        Args:
+            con (sqlalchemy connection object): connection to PostgreSQL, not in a transaction
+            workstation_id (str): the Workstation's Orion id
+
+        Returns:
+            the first recalculated hour (datetime) of each recalculated day
+
+        Raises:
+            see calculate_day
+        """
+        now = datetime.now()
+        if not self.tables_created:
+            with con.begin():
+                create_rollup_tables(con)
+            self.tables_created = True
+        last_bucket = con.execute(
+            sqlalchemy.text(
+                f"select max(bucket_start) from {Cygnus.POSTGRES_SCHEMA}.{HOURLY_TABLE} where workstation = :workstation;"
+            ),
+            {"workstation": workstation_id},
+        ).scalar()
+        # the first recalculated hour of each day
+        first_buckets = {}
+        if last_bucket is None:
+            first_buckets[now.date()] = datetime.combine(now.date(), datetime.min.time())
+        else:
+            last_bucket = datetime.fromtimestamp(last_bucket.timestamp())
+            day = last_bucket.date()
+            first_buckets[day] = last_bucket
+            while day < now.date():
+                day += timedelta(days=1)
+                first_buckets[day] = datetime.combine(day, datetime.min.time())
+        # the days recalculated from midnight
+        late_days = set()
+        checked = self.late_checked.get(workstation_id)
+        if checked is None or time.monotonic() - checked >= self.late_check_interval:
+            for bucket_start in self.find_late_hours(con, workstation_id, now):
+                self.logger.info(f"Late logs of {workstation_id} found in the hour: {bucket_start}")
+                day = bucket_start.date()
+                first_buckets[day] = min(first_buckets.get(day, bucket_start), bucket_start)
+                late_days.add(day)
+            self.late_checked[workstation_id] = time.monotonic()
+        for day, first_bucket in sorted(first_buckets.items()):
+            oee, rollups = self.calculate_day(
+                con, workstation_id, now, day, None if day in late_days else first_bucket
+            )
+            with con.begin():
+                self.write_day(con, oee, day, rollups, first_bucket)
+            self.logger.debug(f"Rolled up {workstation_id} on {day} from {first_bucket}")
+        return sorted(first_buckets.values())
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""Typed shadow tables maintained alongside the Cygnus tables
+
+Cygnus stores every column as text, so each query of the OEE microservice
+casts recvtimets and the queried logs are parsed again in pandas.
+A shadow table is a compact typed mirror of a Cygnus table:
+    recvtimets bigint
+    attrcode integer (see the attribute codes table)
+    numvalue numeric, boolvalue boolean or textvalue text (only one of them is set)
+indexed by (attrcode, recvtimets).
+
+The shadow table is filled when it is created
+and kept current by a trigger on the Cygnus table.
+A value that is neither numeric nor boolean is stored in textvalue,
+a row with a timestamp that cannot be converted is not mirrored,
+and a row that cannot be mirrored for any other reason is skipped with a warning in the PostgreSQL log,
+so the trigger never blocks Cygnus' inserts.
+
+If SHADOW_TABLES is TRUE, the OEECalculator reads the shadow tables
+instead of the Cygnus tables wherever they exist, see OEECalculator.get_logs_source.
+
+Usage (from the src directory, with the environment variables of the microservice):
+    python ShadowTables.py
+
+Environment variables:
+    SHADOW_TABLES:
+        TRUE
+        FALSE*
+"""
+# Standard Library imports
+import os
+
+# PyPI packages
+import sqlalchemy
+
+# Custom imports
+import Cygnus
+from Logger import getLogger
+
+logger_ShadowTables = getLogger(__name__)
+
+SHADOW_TABLE_SUFFIX = "_typed"
+SHADOW_INDEX_SUFFIX = "_typed_idx"
+TRIGGER_NAME = "oee_shadow_table_trigger"
+TRIGGER_FUNCTION = "oee_shadow_table_insert"
+ATTRIBUTE_CODES_TABLE = "oee_attribute_codes"
+NUMERIC_PATTERN = r"^[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?$"
+
+SHADOW_TABLES = os.environ.get("SHADOW_TABLES")
+if SHADOW_TABLES is None:
+    SHADOW_TABLES = False
+elif SHADOW_TABLES.lower() == "true":
+    SHADOW_TABLES = True
+else:
+    SHADOW_TABLES = False
+
+
+def get_shadow_table(table_name: str) -> str:
+    """Get the name of the shadow table of a Cygnus table
+
+    Args:
+        table_name (str): PostgreSQL table name
+
+    Returns:
+        shadow table name (str)
+    """
+    return Cygnus.get_identifier(table_name, SHADOW_TABLE_SUFFIX)
+
+
+def get_logs_relation(table_name: str) -> str:
+    """Get a relation that reads the shadow table of a Cygnus table like the Cygnus table
+
+    The relation has the columns:
+        recvtimets (bigint)
+        attrname (text)
+        attrvalue (text), formatted in the database
+        numvalue (numeric), null if the value is not numeric
+
+    Args:
+        table_name (str): PostgreSQL table name of the Cygnus table
+
+    Returns:
+        the relation (str) that can be used in a from clause
+    """
+    schema = Cygnus.POSTGRES_SCHEMA
+    return f"""(select s.recvtimets, c.attrname,
+                coalesce(cast (s.numvalue as text), cast (s.boolvalue as text), s.textvalue) as attrvalue,
+                s.numvalue
+                from {schema}.{get_shadow_table(table_name)} s
+                join {schema}.{ATTRIBUTE_CODES_TABLE} c on c.attrcode = s.attrcode) as logs"""
+
+
+def upgrade_attrcode_column(con, table: str):
+    """Change the attrcode column of a table created with a smallint attrcode to integer
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        table (str): the attribute codes table or a shadow table
+    """
+    data_type = con.execute(
+        sqlalchemy.text(
+            """select data_type from information_schema.columns
+               where table_schema = :schema and table_name = :table and column_name = 'attrcode';"""
+        ),
+        {"schema": Cygnus.POSTGRES_SCHEMA, "table": table},
+    ).scalar()
+    if data_type == "smallint":
+        logger_ShadowTables.info(f"Changing the attrcode column of {Cygnus.POSTGRES_SCHEMA}.{table} to integer")
+        con.execute(sqlalchemy.text(f"alter table {Cygnus.POSTGRES_SCHEMA}.{table} alter column attrcode type integer;"))
+
+
+def create_attribute_codes_table(con):
+    """Create the attribute codes table and the trigger function shared by all shadow tables
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+    """
+    schema = Cygnus.POSTGRES_SCHEMA
+    con.execute(
+        sqlalchemy.text(
+            f"""create table if not exists {schema}.{ATTRIBUTE_CODES_TABLE} (
+                attrcode integer generated by default as identity primary key,
+                attrname text not null unique);"""
+        )
+    )
+    upgrade_attrcode_column(con, ATTRIBUTE_CODES_TABLE)
+    # the shadow table is the trigger's first argument
+    # the code is only inserted if it is missing, so the identity sequence is not used up by the known attributes
+    # a row is always inserted into the Cygnus table, even if it cannot be mirrored
+    con.execute(
+        sqlalchemy.text(
+            f"""create or replace function {schema}.{TRIGGER_FUNCTION}() returns trigger as $$
+                declare
+                    code integer;
+                begin
+                    if new.attrname is null or new.recvtimets is null
+                       or new.recvtimets !~ '{NUMERIC_PATTERN}' then
+                        return new;
+                    end if;
+                    begin
+                        select attrcode into code from {schema}.{ATTRIBUTE_CODES_TABLE}
+                            where attrname = new.attrname;
+                        if code is null then
+                            begin
+                                insert into {schema}.{ATTRIBUTE_CODES_TABLE} (attrname) values (new.attrname)
+                                    returning attrcode into code;
+                            exception when unique_violation then
+                                select attrcode into code from {schema}.{ATTRIBUTE_CODES_TABLE}
+                                    where attrname = new.attrname;
+                            end;
+                        end if;
+                        execute format(
+                            'insert into {schema}.%I (recvtimets, attrcode, numvalue, boolvalue, textvalue) values ($1, $2, $3, $4, $5)',
+                            tg_argv[0]
+                        ) using
+                            cast (cast (new.recvtimets as numeric) as bigint),
+                            code,
+                            case when new.attrvalue ~ '{NUMERIC_PATTERN}' then cast (new.attrvalue as numeric) end,
+                            case when new.attrvalue in ('true', 'false') then cast (new.attrvalue as boolean) end,
+                            case when new.attrvalue is null
+                                 or (new.attrvalue !~ '{NUMERIC_PATTERN}' and new.attrvalue not in ('true', 'false'))
+                                 then new.attrvalue end;
+                    exception when others then
+                        raise warning 'The row of %.% cannot be mirrored into %: %',
+                            tg_table_schema, tg_table_name, tg_argv[0], sqlerrm;
+                    end;
+                    return new;
+                end;
+                $$ language plpgsql;"""
+        )
+    )
+
+
+def shadow_table_exists(con, table_name: str) -> bool:
+    """Check if a Cygnus table has a shadow table
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        table_name (str): PostgreSQL table name of the Cygnus table
+
+    Returns:
+        True if the shadow table exists, False otherwise
+    """
+    return Cygnus.table_exists(con, get_shadow_table(table_name))
+
+
+def create_shadow_table(con, table_name: str):
+    """Create the shadow table of a Cygnus table, fill it and install its trigger
+
+    Must be called within a transaction.
+    Creating the trigger locks the Cygnus table against inserts until the transaction ends,
+    so no row is lost or mirrored twice between the initial fill and the trigger.
+    If the shadow table already exists, only the trigger function is updated
+    and a smallint attrcode column is changed to integer.
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL in a transaction
+        table_name (str): PostgreSQL table name of the Cygnus table
+    """
+    if shadow_table_exists(con, table_name):
+        logger_ShadowTables.debug(f"The shadow table of {table_name} already exists")
+        create_attribute_codes_table(con)
+        upgrade_attrcode_column(con, get_shadow_table(table_name))
+        return
+    schema = Cygnus.POSTGRES_SCHEMA
+    shadow_table = get_shadow_table(table_name)
+    logger_ShadowTables.info(f"Creating shadow table: {schema}.{shadow_table}")
+    create_attribute_codes_table(con)
+    con.execute(
+        sqlalchemy.text(
+            f"""create table {schema}.{shadow_table} (
+                recvtimets bigint not null,
+                attrcode integer not null,
+                numvalue numeric,
+                boolvalue boolean,
+                textvalue text);"""
+        )
+    )
+    con.execute(
+        sqlalchemy.text(
+            f"""create trigger {TRIGGER_NAME} after insert on {schema}.{table_name}
+                for each row execute function {schema}.{TRIGGER_FUNCTION}('{shadow_table}');"""
+        )
+    )
+    con.execute(
+        sqlalchemy.text(
+            f"""insert into {schema}.{ATTRIBUTE_CODES_TABLE} (attrname)
+                select distinct attrname from {schema}.{table_name}
+                where attrname is not null
+                on conflict (attrname) do nothing;"""
+        )
+    )
+    con.execute(
+        sqlalchemy.text(
+            f"""insert into {schema}.{shadow_table} (recvtimets, attrcode, numvalue, boolvalue, textvalue)
+                select cast (cast (t.recvtimets as numeric) as bigint), c.attrcode,
+                case when t.attrvalue ~ '{NUMERIC_PATTERN}' then cast (t.attrvalue as numeric) end,
+                case when t.attrvalue in ('true', 'false') then cast (t.attrvalue as boolean) end,
+                case when t.attrvalue is null
+                     or (t.attrvalue !~ '{NUMERIC_PATTERN}' and t.attrvalue not in ('true', 'false'))
+                     then t.attrvalue end
+                from {schema}.{table_name} t
+                join {schema}.{ATTRIBUTE_CODES_TABLE} c on c.attrname = t.attrname
+                where t.recvtimets ~ '{NUMERIC_PATTERN}';"""
+        )
+    )
+    con.execute(
+        sqlalchemy.text(
+            f"""create index {Cygnus.get_identifier(table_name, SHADOW_INDEX_SUFFIX)}
+                on {schema}.{shadow_table} (attrcode, recvtimets);"""
+        )
+    )
+    con.execute(sqlalchemy.text(f"analyze {schema}.{shadow_table};"))
+
+
+def drop_shadow_table(con, table_name: str):
+    """Drop the shadow table of a Cygnus table and its trigger
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        table_name (str): PostgreSQL table name of the Cygnus table
+    """
+    schema = Cygnus.POSTGRES_SCHEMA
+    if Cygnus.table_exists(con, table_name):
+        con.execute(sqlalchemy.text(f"drop trigger if exists {TRIGGER_NAME} on {schema}.{table_name};"))
+    con.execute(sqlalchemy.text(f"drop table if exists {schema}.{get_shadow_table(table_name)};"))
+
+
+def main():
+    """Create the shadow tables of the Cygnus tables of all Workstations and their current Jobs"""
+    # imported here, because the LoopHandler imports the OEECalculator, that imports this module
+    from LoopHandler import LoopHandler
+
+    engine = LoopHandler.create_postgres_engine()
+    try:
+        for table_name in Cygnus.get_service_tables():
+            with engine.begin() as con:
+                if not Cygnus.table_exists(con, table_name):
+                    logger_ShadowTables.warning(f"The table {Cygnus.POSTGRES_SCHEMA}.{table_name} does not exist, skipping")
+                    continue
+                create_shadow_table(con, table_name)
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
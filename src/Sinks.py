@@ -0,0 +1,541 @@
+# -*- coding: utf-8 -*-
+"""Sinks the KPIs of each calculation are dispatched to, besides Orion
+
+The LoopHandler dispatches a record of each Workstation's KPIs after the calculation:
+    {
+    "id": the Workstation's Orion id,
+    "oee", "availability", "performance", "quality", "throughput": null if the calculation failed,
+    "calculatedAt": the time of the calculation in ISO 8601 format (UTC),
+    "error": the error message of a failed calculation or null
+    }
+
+Each sink has its own SinkWorker: a bounded queue and a thread writing the records in batches
+of at most batch_size records, at least every flush_interval seconds.
+If a sink's queue is full, the new records are dropped, so a slow sink never stalls the calculations.
+The metrics of each sink (written, dropped and failed records, batch latency) are kept,
+see SinkDispatcher.get_metrics, and served by the API.
+
+The sinks:
+    postgres: the KPIHistory table SINK_POSTGRES_TABLE, see KPIHistory
+    jsonl: newline-delimited JSON files in SINK_JSONL_DIR, a file for each UTC day: kpis-YYYY-MM-DD.jsonl
+    bus: an in-memory message bus stand-in of at most SINK_BUS_SIZE serialised records,
+        the oldest ones are dropped, see MemoryBusSink.consume
+
+Environment variables (defaults are starred):
+    KPI_SINKS: comma separated list of the sinks, the dispatcher is disabled if not set
+        None*
+    SINK_QUEUE_SIZE:
+        1000*
+    SINK_BATCH_SIZE:
+        100*
+    SINK_FLUSH_INTERVAL: seconds
+        1*
+    SINK_<SINK>_QUEUE_SIZE, SINK_<SINK>_BATCH_SIZE, SINK_<SINK>_FLUSH_INTERVAL:
+        the settings of a sink, for example SINK_JSONL_BATCH_SIZE. Default: the settings above
+    SINK_POSTGRES_TABLE:
+        oee_kpi_sink*
+    SINK_JSONL_DIR:
+        kpi_sink*
+    SINK_BUS_SIZE:
+        10000*
+"""
+# Standard Library imports
+from datetime import datetime
+import json
+import os
+import queue
+import threading
+import time
+
+# PyPI packages
+import psycopg2
+import sqlalchemy
+
+# Custom imports
+import KPIHistory
+from Logger import getLogger
+
+KPI_SINKS = os.environ.get("KPI_SINKS")
+
+SINK_QUEUE_SIZE = os.environ.get("SINK_QUEUE_SIZE")
+if SINK_QUEUE_SIZE is None:
+    SINK_QUEUE_SIZE = 1000
+else:
+    SINK_QUEUE_SIZE = int(SINK_QUEUE_SIZE)
+
+SINK_BATCH_SIZE = os.environ.get("SINK_BATCH_SIZE")
+if SINK_BATCH_SIZE is None:
+    SINK_BATCH_SIZE = 100
+else:
+    SINK_BATCH_SIZE = int(SINK_BATCH_SIZE)
+
+SINK_FLUSH_INTERVAL = os.environ.get("SINK_FLUSH_INTERVAL")
+if SINK_FLUSH_INTERVAL is None:
+    SINK_FLUSH_INTERVAL = 1
+else:
+    SINK_FLUSH_INTERVAL = float(SINK_FLUSH_INTERVAL)
+
+SINK_POSTGRES_TABLE = os.environ.get("SINK_POSTGRES_TABLE")
+if SINK_POSTGRES_TABLE is None:
+    SINK_POSTGRES_TABLE = "oee_kpi_sink"
+
+SINK_JSONL_DIR = os.environ.get("SINK_JSONL_DIR")
+if SINK_JSONL_DIR is None:
+    SINK_JSONL_DIR = "kpi_sink"
+
+SINK_BUS_SIZE = os.environ.get("SINK_BUS_SIZE")
+if SINK_BUS_SIZE is None:
+    SINK_BUS_SIZE = 10000
+else:
+    SINK_BUS_SIZE = int(SINK_BUS_SIZE)
+
+KPIS = ("oee", "availability", "performance", "quality")
+
+
+def get_record(
+    workstation_id: str, calculated_at: datetime, oee: dict = None, throughput: float = None, error: str = None
+) -> dict:
+    """Get the record of a Workstation's KPIs
+
+    Args:
+        workstation_id (str): the Workstation's Orion id
+        calculated_at (datetime): the time of the calculation, timezone aware
+        oee (dict): the OEE object, see OEECalculator.OEE_template. Default: None, the KPIs are None
+        throughput (float): the throughput per shift. Default: None
+        error (str): the error message if the calculation failed. Default: None
+
+    Returns:
+        the record (dict), see the module's docs
+    """
+    if oee is None:
+        oee = {}
+    record = {"id": workstation_id}
+    record.update({kpi: oee.get(kpi) for kpi in KPIS})
+    record["throughput"] = throughput
+    record["calculatedAt"] = calculated_at.isoformat()
+    record["error"] = error
+    return record
+
+
+def get_sink_setting(name: str, setting: str, default):
+    """Read the setting of a sink from the SINK_<NAME>_<SETTING> environment variable
+
+    Args:
+        name (str): the sink's name
+        setting (str): QUEUE_SIZE, BATCH_SIZE or FLUSH_INTERVAL
+        default (int or float): the value if the environment variable is not set, its type is used
+
+    Returns:
+        the setting (int or float)
+    """
+    value = os.environ.get(f"SINK_{name.upper()}_{setting}")
+    if value is None:
+        return default
+    return type(default)(value)
+
+
+class Sink:
+    """The base class of the sinks"""
+
+    name = None
+
+    def write_batch(self, records: list):
+        """Write a batch of records
+
+        Args:
+            records (list): the records, see get_record
+
+        Raises:
+            NotImplementedError:
+                if the sink does not implement it
+        """
+        raise NotImplementedError(f"The sink {self.name} does not implement write_batch")
+
+    def close(self):
+        """Release the sink's resources"""
+
+
+class PostgresSink(Sink):
+    """Write the records into a KPI history table, see KPIHistory"""
+
+    name = "postgres"
+
+    def __init__(self, url: str, table_name: str = SINK_POSTGRES_TABLE):
+        """The constructor of the PostgresSink class
+
+        Args:
+            url (str): the PostgreSQL database's URL, the engine is created at the first write
+            table_name (str): the name of the table
+        """
+        self.url = url
+        self.engine = None
+        self.history = KPIHistory.KPIHistory(table_name)
+
+    def __repr__(self):
+        return f"PostgresSink(table_name={self.history.table_name})"
+
+    def write_batch(self, records: list):
+        """Write a batch of records with a single COPY
+
+        The rows of a failed write are not kept, they are counted as failed by the SinkWorker.
+
+        Args:
+            records (list): the records, see get_record
+        """
+        if self.engine is None:
+            self.engine = sqlalchemy.create_engine(self.url)
+        self.history.rows = []
+        for record in records:
+            self.history.add(
+                datetime.fromisoformat(record["calculatedAt"]), record["id"], record, record["throughput"]
+            )
+        try:
+            with self.engine.connect() as con:
+                self.history.flush(con)
+        finally:
+            self.history.rows = []
+
+    def close(self):
+        """Dispose the engine"""
+        if self.engine is not None:
+            self.engine.dispose()
+
+
+class JSONLinesSink(Sink):
+    """Append the records to a newline-delimited JSON file of each UTC day"""
+
+    name = "jsonl"
+
+    def __init__(self, directory: str = SINK_JSONL_DIR):
+        """The constructor of the JSONLinesSink class
+
+        Args:
+            directory (str): the directory of the files, it is created if it does not exist
+        """
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __repr__(self):
+        return f"JSONLinesSink(directory={self.directory})"
+
+    def get_path(self, record: dict) -> str:
+        """Get the file of a record
+
+        Args:
+            record (dict): the record, see get_record
+
+        Returns:
+            the file's path (str)
+        """
+        return os.path.join(self.directory, f'kpis-{record["calculatedAt"][:10]}.jsonl')
+
+    def write_batch(self, records: list):
+        """Append a batch of records to the files of their days
+
+        Args:
+            records (list): the records, see get_record
+        """
+        lines = {}
+        for record in records:
+            lines.setdefault(self.get_path(record), []).append(json.dumps(record, separators=(",", ":")) + "\n")
+        for path, file_lines in lines.items():
+            with open(path, "a") as f:
+                f.writelines(file_lines)
+
+
+class MemoryBusSink(Sink):
+    """An in-memory message bus stand-in, the consumers read the serialised records with consume"""
+
+    name = "bus"
+
+    def __init__(self, max_messages: int = SINK_BUS_SIZE):
+        """The constructor of the MemoryBusSink class
+
+        Args:
+            max_messages (int): the number of messages kept, the oldest ones are dropped
+        """
+        self.messages = queue.Queue(maxsize=max_messages)
+
+    def __repr__(self):
+        return f"MemoryBusSink(max_messages={self.messages.maxsize})"
+
+    def write_batch(self, records: list):
+        """Publish a batch of records as JSON messages
+
+        Args:
+            records (list): the records, see get_record
+        """
+        for record in records:
+            message = json.dumps(record, separators=(",", ":")).encode("utf-8")
+            while True:
+                try:
+                    self.messages.put_nowait(message)
+                    break
+                except queue.Full:
+                    try:
+                        self.messages.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def consume(self, max_messages: int = None) -> list:
+        """Take the published messages
+
+        Args:
+            max_messages (int): the maximum number of messages. Default: None, all
+
+        Returns:
+            the messages (list of bytes) in the order of publishing
+        """
+        messages = []
+        while max_messages is None or len(messages) < max_messages:
+            try:
+                messages.append(self.messages.get_nowait())
+            except queue.Empty:
+                break
+        return messages
+
+
+class SinkWorker:
+    """A bounded queue and a thread writing its records to a sink in batches
+
+    Common usage:
+        worker = SinkWorker(sink)
+        worker.put(record)
+        ...
+        worker.close()
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(
+        self,
+        sink: Sink,
+        queue_size: int = SINK_QUEUE_SIZE,
+        batch_size: int = SINK_BATCH_SIZE,
+        flush_interval: float = SINK_FLUSH_INTERVAL,
+    ):
+        """The constructor of the SinkWorker class, starts the thread
+
+        Args:
+            sink (Sink): the sink
+            queue_size (int): the maximum number of queued records
+            batch_size (int): the maximum number of records in a batch
+            flush_interval (float): the maximum seconds a record waits for its batch
+        """
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.metrics = {
+            "queued": 0,
+            "dropped": 0,
+            "written": 0,
+            "failed": 0,
+            "batches": 0,
+            "last_latency_seconds": None,
+            "total_latency_seconds": 0.0,
+        }
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f"sink-{sink.name}", daemon=True)
+        self.thread.start()
+
+    def __repr__(self):
+        return (
+            f"SinkWorker(sink={self.sink}, queue_size={self.queue.maxsize}, "
+            f"batch_size={self.batch_size}, flush_interval={self.flush_interval})"
+        )
+
+    def count(self, metric: str, value: float = 1):
+        """Add to a metric
+
+        Args:
+            metric (str): the metric's name
+            value (float): the added value. Default: 1
+        """
+        with self.lock:
+            self.metrics[metric] += value
+
+    def put(self, record: dict) -> bool:
+        """Queue a record without waiting
+
+        Args:
+            record (dict): the record, see get_record
+
+        Returns:
+            True if the record was queued, False if it was dropped because the queue is full
+        """
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.count("dropped")
+            return False
+        self.count("queued")
+        return True
+
+    def collect(self) -> list:
+        """Wait for a batch of records
+
+        Returns:
+            the records (list), at most batch_size, empty if no record arrived within flush_interval
+        """
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout <= 0 or self.stopping.is_set():
+                    batch.append(self.queue.get_nowait())
+                else:
+                    batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, batch: list):
+        """Write a batch to the sink and update the metrics
+
+        A failed batch is logged and counted, it is not retried.
+
+        Args:
+            batch (list): the records
+        """
+        start = time.monotonic()
+        try:
+            self.sink.write_batch(batch)
+        except (
+            NotImplementedError,
+            OSError,
+            TypeError,
+            ValueError,
+            psycopg2.Error,
+            sqlalchemy.exc.SQLAlchemyError,
+        ) as error:
+            self.logger.error(f"The sink {self.sink.name} failed to write {len(batch)} records: {error}")
+            self.count("failed", len(batch))
+            return
+        latency = time.monotonic() - start
+        with self.lock:
+            self.metrics["written"] += len(batch)
+            self.metrics["batches"] += 1
+            self.metrics["last_latency_seconds"] = latency
+            self.metrics["total_latency_seconds"] += latency
+
+    def run(self):
+        """Write the queued records until closed, then write the remaining ones"""
+        while not (self.stopping.is_set() and self.queue.empty()):
+            batch = self.collect()
+            if batch:
+                self.write(batch)
+
+    def get_metrics(self) -> dict:
+        """Get the metrics of the sink
+
+        Returns:
+            dict: queued, dropped, written and failed records, batches, the last and the total
+                latency of the batches in seconds and the current queue depth
+        """
+        with self.lock:
+            metrics = dict(self.metrics)
+        metrics["queue_depth"] = self.queue.qsize()
+        return metrics
+
+    def close(self, timeout: float = None):
+        """Write the queued records and stop the thread
+
+        Args:
+            timeout (float): the maximum seconds to wait. Default: None, no limit
+        """
+        self.stopping.set()
+        self.thread.join(timeout)
+        self.sink.close()
+
+
+class SinkDispatcher:
+    """Dispatch the records to the SinkWorkers of all sinks
+
+    Common usage:
+        dispatcher = SinkDispatcher([PostgresSink(url), JSONLinesSink()])
+        dispatcher.dispatch(record)
+        ...
+        dispatcher.close()
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, sinks: list):
+        """The constructor of the SinkDispatcher class, starts a SinkWorker for each sink
+
+        The settings of the workers are read from the environment variables, see the module's docs.
+
+        Args:
+            sinks (list): the sinks (Sink)
+        """
+        self.workers = {
+            sink.name: SinkWorker(
+                sink,
+                get_sink_setting(sink.name, "QUEUE_SIZE", SINK_QUEUE_SIZE),
+                get_sink_setting(sink.name, "BATCH_SIZE", SINK_BATCH_SIZE),
+                get_sink_setting(sink.name, "FLUSH_INTERVAL", SINK_FLUSH_INTERVAL),
+            )
+            for sink in sinks
+        }
+
+    def __repr__(self):
+        return f"SinkDispatcher(sinks={list(self.workers)})"
+
+    def dispatch(self, record: dict):
+        """Queue a record for all sinks, without waiting
+
+        Args:
+            record (dict): the record, see get_record
+        """
+        for name, worker in self.workers.items():
+            if not worker.put(record):
+                self.logger.warning(f"The queue of the sink {name} is full, a record is dropped")
+
+    def get_metrics(self) -> dict:
+        """Get the metrics of the sinks
+
+        Returns:
+            the metrics of each sink (dict), see SinkWorker.get_metrics
+        """
+        return {name: worker.get_metrics() for name, worker in self.workers.items()}
+
+    def close(self, timeout: float = None):
+        """Write the queued records and stop the workers
+
+        Args:
+            timeout (float): the maximum seconds to wait for each worker. Default: None, no limit
+        """
+        for worker in self.workers.values():
+            worker.close(timeout)
+
+
+def create_dispatcher(names: str, postgres_url: str) -> SinkDispatcher:
+    """Create the dispatcher of the configured sinks
+
+    Args:
+        names (str): comma separated list of the sinks, see KPI_SINKS
+        postgres_url (str): the PostgreSQL database's URL, used by the postgres sink
+
+    Returns:
+        SinkDispatcher
+
+    Raises:
+        ValueError:
+            if a sink is not supported
+    """
+    sinks = []
+    for name in (name.strip().lower() for name in names.split(",")):
+        if name == "":
+            continue
+        if name == PostgresSink.name:
+            sinks.append(PostgresSink(postgres_url, SINK_POSTGRES_TABLE))
+        elif name == JSONLinesSink.name:
+            sinks.append(JSONLinesSink(SINK_JSONL_DIR))
+        elif name == MemoryBusSink.name:
+            sinks.append(MemoryBusSink(SINK_BUS_SIZE))
+        else:
+            raise ValueError(f"Unsupported KPI sink: {name}")
+    return SinkDispatcher(sinks)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""Statement timeouts and the slow query log of the OEECalculator's queries
+
+The queries are grouped into classes, each with its own statement_timeout:
+    logs: the queries downloading or streaming Cygnus logs
+    aggregate: the counter aggregates
+    exists: the check whether the Workstation was available since midnight
+A query exceeding its timeout is canceled by PostgreSQL and raises a RuntimeError,
+so only the calculation of the affected Workstation fails, see LoopHandler.handle_workstation.
+
+The queries taking at least SLOW_QUERY_MS milliseconds are logged
+with their class, table, number of rows and duration.
+If EXPLAIN_SLOW_QUERIES is TRUE, the query is run again with EXPLAIN (ANALYZE, BUFFERS)
+and the plan is logged too.
+
+The queries, their rows, errors and durations are counted, see Metrics, and traced, see Tracing.
+
+If ADAPTIVE_LIMIT is TRUE, the queries run within an adaptive concurrency limit,
+their latencies are compared within their query class,
+the statement timeouts and the other operational errors decrease the limit, see Limiter.
+
+Environment variables (defaults are starred):
+    STATEMENT_TIMEOUT: the default timeout of all classes in milliseconds, 0 means no timeout
+        0*
+    STATEMENT_TIMEOUT_LOGS, STATEMENT_TIMEOUT_AGGREGATE, STATEMENT_TIMEOUT_EXISTS:
+        the timeout of a class in milliseconds
+        STATEMENT_TIMEOUT*
+    SLOW_QUERY_MS:
+        1000*
+    EXPLAIN_SLOW_QUERIES:
+        TRUE
+        FALSE*
+    ADAPTIVE_LIMIT:
+        TRUE
+        FALSE*
+"""
+# Standard Library imports
+from contextlib import contextmanager, nullcontext
+import os
+import time
+
+# PyPI packages
+import psycopg2
+import sqlalchemy
+
+# Custom imports
+import Limiter
+from Logger import getLogger
+import Metrics
+import Tracing
+
+logger_Statements = getLogger(__name__)
+
+QUERY_CLASSES = ("logs", "aggregate", "exists")
+
+STATEMENT_TIMEOUT = os.environ.get("STATEMENT_TIMEOUT")
+if STATEMENT_TIMEOUT is None:
+    STATEMENT_TIMEOUT = 0
+else:
+    STATEMENT_TIMEOUT = int(STATEMENT_TIMEOUT)
+
+
+def get_statement_timeout(query_class: str) -> int:
+    """Read the statement_timeout of a query class from the environment variables
+
+    Args:
+        query_class (str): the class of the query, see QUERY_CLASSES
+
+    Returns:
+        the timeout in milliseconds (int), STATEMENT_TIMEOUT if not set
+    """
+    timeout = os.environ.get(f"STATEMENT_TIMEOUT_{query_class.upper()}")
+    if timeout is None:
+        return STATEMENT_TIMEOUT
+    return int(timeout)
+
+
+STATEMENT_TIMEOUTS = {query_class: get_statement_timeout(query_class) for query_class in QUERY_CLASSES}
+
+SLOW_QUERY_MS = os.environ.get("SLOW_QUERY_MS")
+if SLOW_QUERY_MS is None:
+    SLOW_QUERY_MS = 1000
+else:
+    SLOW_QUERY_MS = float(SLOW_QUERY_MS)
+
+EXPLAIN_SLOW_QUERIES = os.environ.get("EXPLAIN_SLOW_QUERIES")
+if EXPLAIN_SLOW_QUERIES is None:
+    EXPLAIN_SLOW_QUERIES = False
+elif EXPLAIN_SLOW_QUERIES.lower() == "true":
+    EXPLAIN_SLOW_QUERIES = True
+else:
+    EXPLAIN_SLOW_QUERIES = False
+
+# shared by all threads querying PostgreSQL
+limiter = Limiter.AdaptiveLimiter("PostgreSQL") if Limiter.ADAPTIVE_LIMIT else None
+
+
+@contextmanager
+def statement_timeout(con, milliseconds: int):
+    """Set the statement_timeout of the connection's session for the queries of the block
+
+    The previous timeout is restored after the block.
+    If a query of the block fails, the rollback of its transaction restores the previous timeout,
+    because setting it is part of the transaction.
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        milliseconds (int): the timeout, 0 or None means no change
+    """
+    if not milliseconds:
+        yield
+        return
+    previous = con.execute(
+        sqlalchemy.text(
+            "select current_setting('statement_timeout') as previous, set_config('statement_timeout', :timeout, false);"
+        ),
+        {"timeout": f"{int(milliseconds)}ms"},
+    ).scalar()
+    yield
+    con.execute(
+        sqlalchemy.text("select set_config('statement_timeout', :timeout, false);"), {"timeout": previous}
+    )
+
+
+def is_statement_timeout(error: Exception) -> bool:
+    """Check if an error is caused by a statement_timeout
+
+    Args:
+        error (Exception): a psycopg2 or sqlalchemy error
+
+    Returns:
+        True if PostgreSQL canceled the query, False otherwise
+    """
+    if isinstance(error, sqlalchemy.exc.DBAPIError):
+        error = error.orig
+    return isinstance(error, psycopg2.errors.QueryCanceled)
+
+
+def explain(con, query: str, params: dict = None) -> str:
+    """Run a query with EXPLAIN (ANALYZE, BUFFERS)
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        query (str): the SQL query, it may contain :named parameters
+        params (dict): the values of the query's named parameters. Default: None
+
+    Returns:
+        the plan (str)
+    """
+    statement = sqlalchemy.text(f"explain (analyze, buffers) {query.strip().rstrip(';')};")
+    rows = con.execute(statement, params or {}).fetchall()
+    return "\n".join(row[0] for row in rows)
+
+
+def log_slow_query(con, query_class: str, table_name: str, query: str, params: dict, n_rows: int, milliseconds: float):
+    """Log a slow query, with its plan if EXPLAIN_SLOW_QUERIES is TRUE
+
+    A failure of capturing the plan is logged, but not raised.
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        query_class (str): the class of the query, see QUERY_CLASSES
+        table_name (str): PostgreSQL table name
+        query (str): the SQL query
+        params (dict): the values of the query's named parameters
+        n_rows (int): the number of rows the query returned
+        milliseconds (float): the duration of the query
+    """
+    message = f"Slow {query_class} query of the table: {table_name}, rows: {n_rows}, duration: {milliseconds:.1f} ms"
+    if EXPLAIN_SLOW_QUERIES:
+        try:
+            with statement_timeout(con, STATEMENT_TIMEOUTS[query_class]):
+                message += f"\n{explain(con, query, params)}"
+        except (psycopg2.Error, sqlalchemy.exc.DBAPIError) as error:
+            message += f"\nThe plan cannot be captured: {error}"
+    logger_Statements.warning(message)
+
+
+@contextmanager
+def timed_query(con, query_class: str, table_name: str, query: str, params: dict = None):
+    """Run the block under the statement_timeout of a query class and log it if it is slow
+
+    The block runs within the adaptive concurrency limit if the limiter is set.
+
+    Common usage:
+        with timed_query(con, "logs", table_name, query, params) as result:
+            df = pd.read_sql_query(...)
+            result["rows"] = len(df)
+
+    Args:
+        con (sqlalchemy connection object): connection to PostgreSQL
+        query_class (str): the class of the query, see QUERY_CLASSES
+        table_name (str): PostgreSQL table name
+        query (str): the SQL query run in the block
+        params (dict): the values of the query's named parameters. Default: None
+
+    Yields:
+        dict: the block sets the number of rows in its "rows" key,
+            and optionally the in-memory size of the result in its "bytes" key
+
+    Raises:
+        RuntimeError:
+            if the query exceeds the statement_timeout
+        NotImplementedError:
+            if the query class is not supported
+    """
+    if query_class not in STATEMENT_TIMEOUTS:
+        raise NotImplementedError(f"Unsupported query class: {query_class}")
+    timeout = STATEMENT_TIMEOUTS[query_class]
+    result = {"rows": 0, "bytes": 0}
+    Metrics.SQL_QUERIES.inc((query_class,))
+    with Tracing.span(f"{query_class} query", "sql", table_name=table_name) as span_args, (
+        limiter.limit(query_class) if limiter is not None else nullcontext({})
+    ) as slot:
+        started = time.perf_counter()
+        try:
+            with statement_timeout(con, timeout):
+                yield result
+        except Exception as error:
+            Metrics.ERRORS.inc(("sql", type(error).__name__))
+            if not isinstance(error, (psycopg2.OperationalError, sqlalchemy.exc.OperationalError)):
+                raise
+            slot["overloaded"] = True
+            if is_statement_timeout(error):
+                raise RuntimeError(
+                    f"The {query_class} query of the table: {table_name} exceeded the statement timeout: {timeout} ms"
+                ) from error
+            raise
+        seconds = time.perf_counter() - started
+        span_args["rows"] = result["rows"]
+    Metrics.STAGE_DURATION.observe(seconds, ("sql_query",))
+    Metrics.SQL_ROWS.inc((query_class,), result["rows"])
+    Metrics.SQL_BYTES.inc((query_class,), result["bytes"])
+    milliseconds = seconds * 1e3
+    if milliseconds >= SLOW_QUERY_MS:
+        log_slow_query(con, query_class, table_name, query, params, result["rows"], milliseconds)
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""Tracing spans of the loops, exported in the Chrome trace event format
+
+A span is the duration of a stage, like a loop, the calculation of a Workstation,
+a query of a Cygnus table or an Orion request, with its arguments:
+the Workstation's id, the table's name, the number of rows and so on.
+If TRACE_DIR is set, the spans are collected in memory during a loop,
+and the spans of each loop are written into a JSON file in TRACE_DIR, see export.
+Only the newest TRACE_KEEP files are kept.
+The files can be opened as a timeline in chrome://tracing or https://ui.perfetto.dev,
+the spans of each thread, like the background publisher, are shown in their own row.
+If TRACE_DIR is not set, a span costs a function call.
+
+Common usage:
+    with Tracing.span("query_todays_data", "sql", table_name=table_name) as args:
+        df = ...
+        args["rows"] = len(df)
+
+Environment variables (defaults are starred):
+    TRACE_DIR: the directory of the trace files, the tracing is disabled if not set
+        None*
+    TRACE_KEEP: the number of the newest trace files kept
+        20*
+"""
+# Standard Library imports
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+import functools
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Custom imports
+from Logger import getLogger
+
+TRACE_DIR = os.environ.get("TRACE_DIR")
+
+TRACE_KEEP = os.environ.get("TRACE_KEEP")
+if TRACE_KEEP is None:
+    TRACE_KEEP = 20
+else:
+    TRACE_KEEP = int(TRACE_KEEP)
+
+# the maximum number of spans of a loop, the further spans are only counted
+MAX_SPANS = 100000
+
+
+class Tracer:
+    """Collect the spans of all threads until they are exported
+
+    Common usage:
+        with tracer.span("calculate_OEE", "compute", workstation_id=workstation_id):
+            ...
+        tracer.export(TRACE_DIR)
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, max_spans: int = MAX_SPANS):
+        """The constructor of the Tracer class
+
+        Args:
+            max_spans (int): the maximum number of spans kept until the export
+        """
+        self.max_spans = max_spans
+        # the complete ("X") events of the spans
+        self.events = []
+        self.dropped = 0
+        # format: {thread id: thread name}
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"Tracer(max_spans={self.max_spans})"
+
+    @contextmanager
+    def span(self, name: str, category: str, **args):
+        """Record the duration of the block as a span, even if it raises an exception
+
+        The class of a raised exception is added to the arguments as "error".
+
+        Args:
+            name (str): the span's name
+            category (str): the span's category, like "orion", "sql" or "compute"
+            args: the span's arguments
+
+        Yields:
+            dict: the arguments, the block can add further arguments, like the number of rows
+        """
+        started = time.perf_counter()
+        try:
+            yield args
+        except BaseException as error:
+            args["error"] = type(error).__name__
+            raise
+        finally:
+            self.record(name, category, started, time.perf_counter(), args)
+
+    def record(self, name: str, category: str, started: float, finished: float, args: dict):
+        """Record a span
+
+        Args:
+            name (str): the span's name
+            category (str): the span's category
+            started (float): the start of the span, time.perf_counter
+            finished (float): the end of the span, time.perf_counter
+            args (dict): the span's arguments
+        """
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": started * 1e6,
+            "dur": (finished - started) * 1e6,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": args,
+        }
+        with self.lock:
+            if len(self.events) >= self.max_spans:
+                self.dropped += 1
+                return
+            self.events.append(event)
+            self.threads[thread.ident] = thread.name
+
+    def take(self) -> dict:
+        """Take the collected spans, the tracer starts collecting again
+
+        Returns:
+            dict: the trace in the Chrome trace event format, the spans and the names of their threads
+        """
+        with self.lock:
+            events, self.events = self.events, []
+            threads, self.threads = self.threads, {}
+            dropped, self.dropped = self.dropped, 0
+        pid = os.getpid()
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in threads.items()
+        ]
+        metadata.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "oee"}})
+        return {
+            "traceEvents": metadata + events,
+            "displayTimeUnit": "ms",
+            "otherData": {"dropped_spans": dropped},
+        }
+
+    def export(self, directory: str, keep: int = TRACE_KEEP) -> str:
+        """Write the collected spans atomically into a new trace file, and remove the oldest trace files
+
+        Args:
+            directory (str): the directory of the trace files
+            keep (int): the number of the newest trace files kept
+
+        Returns:
+            the path of the written file (str), None if there were no spans
+
+        Raises:
+            OSError:
+                if the file cannot be written
+        """
+        trace = self.take()
+        if not any(event["ph"] == "X" for event in trace["traceEvents"]):
+            return None
+        os.makedirs(directory, exist_ok=True)
+        name = datetime.now(timezone.utc).strftime("trace-%Y%m%dT%H%M%S.%fZ.json")
+        path = os.path.join(directory, name)
+        file_descriptor, temporary = tempfile.mkstemp(prefix=".trace.", dir=directory)
+        try:
+            with os.fdopen(file_descriptor, "w") as f:
+                json.dump(trace, f, default=str)
+            os.replace(temporary, path)
+        except (OSError, TypeError, ValueError):
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        for old in sorted(glob.glob(os.path.join(directory, "trace-*.json")))[:-max(keep, 1)]:
+            os.remove(old)
+        self.logger.debug(f'Exported {len(trace["traceEvents"])} trace events to {path}')
+        return path
+
+
+tracer = Tracer() if TRACE_DIR else None
+
+
+def span(name: str, category: str, **args):
+    """Record the duration of the block as a span if the tracing is enabled, see Tracer.span
+
+    Args:
+        name (str): the span's name
+        category (str): the span's category, like "orion", "sql" or "compute"
+        args: the span's arguments
+
+    Returns:
+        the context manager of the span, yielding the arguments
+    """
+    if tracer is None:
+        return nullcontext(args)
+    return tracer.span(name, category, **args)
+
+
+def traced(category: str, get_args=None, rows: bool = False):
+    """Decorate a function so that its calls are recorded as spans named after it, see span
+
+    Args:
+        category (str): the spans' category
+        get_args: a function of the decorated function's arguments returning the span's arguments (dict).
+            Default: None, no arguments
+        rows (bool): add the number of rows of the returned DataFrame to the arguments. Default: False
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if tracer is None:
+                return function(*args, **kwargs)
+            span_args = get_args(*args, **kwargs) if get_args is not None else {}
+            with tracer.span(function.__qualname__, category, **span_args) as span_args:
+                result = function(*args, **kwargs)
+                if rows:
+                    span_args["rows"] = len(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def export():
+    """Export the spans of the loop into TRACE_DIR if the tracing is enabled, see Tracer.export
+
+    A failed export is logged, the spans are lost.
+    """
+    if tracer is None:
+        return
+    try:
+        tracer.export(TRACE_DIR)
+    except (OSError, TypeError, ValueError) as error:
+        tracer.logger.error(f"The trace cannot be exported to {TRACE_DIR}: {error}")
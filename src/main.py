@@ -6,14 +6,20 @@ The main module runs the LoopHandler each loop, using a period of about SLEEP_TI
 See the loop function's docs for why this time is not exact.
 
 Each loop, the LoopHandler calculates and updates the OEE and Throughput objects.
+If the API_PORT environment variable is set, the latest KPIs are also served by an HTTP API, see API.
+If the METRICS_PORT environment variable is set, the metrics are served at /metrics, see Metrics.
+If the TRACE_DIR environment variable is set, the spans of each loop are written into a trace file, see Tracing.
 """
 # Standard Library imports
 import os
 import sched
 import time
 
+import API
 from Logger import getLogger
 from LoopHandler import LoopHandler
+import Metrics
+import Tracing
 
 logger_main = getLogger(__name__)
 
@@ -45,6 +51,9 @@ def get_SLEEP_TIME() -> int:
 
 SLEEP_TIME = get_SLEEP_TIME()
 
+# the time the next loop is due, the scheduler lag is measured from it, see loop
+next_loop_due = None
+
 
 def loop(scheduler_: sched.scheduler):
     """The main loop, that runs each cycle
@@ -59,10 +68,15 @@ def loop(scheduler_: sched.scheduler):
     Args:
         scheduler_ (sched.scheduler): instance of sched.scheduler, used in all loops
     """
+    global next_loop_due
+    if next_loop_due is not None:
+        Metrics.SCHEDULER_LAG.observe(max(time.time() - next_loop_due, 0))
     logger_main.info("Calculating OEE and Throughput values")
     loopHandler = LoopHandler()
-    loopHandler.handle()
-    scheduler_.enter(SLEEP_TIME, 1, loop, (scheduler_,))
+    with Metrics.LOOP_DURATION.time():
+        loopHandler.handle()
+    Tracing.export()
+    next_loop_due = scheduler_.enter(SLEEP_TIME, 1, loop, (scheduler_,)).time
 
 
 def main():
@@ -75,12 +89,31 @@ def main():
     for k, v in os.environ.items():
         if "PASS" not in k and "KEY" not in k:
             logger_main.debug(f"environ: {k}={v}")
+    api_server = None
+    if LoopHandler.kpi_store is not None:
+        api_server = API.APIServer(LoopHandler.kpi_store, sinks=LoopHandler.sinks)
+        api_server.start()
+    metrics_server = None
+    if Metrics.METRICS_PORT is not None:
+        metrics_server = Metrics.MetricsServer()
+        metrics_server.start()
     scheduler = sched.scheduler(time.time, time.sleep)
     scheduler.enter(0, 1, loop, (scheduler,))
     try:
         scheduler.run()
     except KeyboardInterrupt:
         logger_main.info("KeyboardInterrupt. Stopping OEE microservice...")
+    finally:
+        if api_server is not None:
+            api_server.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+        if LoopHandler.sinks is not None:
+            # write the queued KPIs
+            LoopHandler.sinks.close()
+        if LoopHandler.publisher is not None:
+            # write the pending KPIs into Orion
+            LoopHandler.publisher.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,185 @@
+"""test API
+"""
+# Standard Library imports
+from datetime import datetime, timezone
+import json
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# PyPI imports
+import requests
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+import API
+from Logger import getLogger
+from LoopHandler import LoopHandler
+import OEE
+import Sinks
+from modules.TestCase_common import setupClass_common
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+OTHER_ID = "urn:ngsiv2:i40Asset:Workstation:002"
+OEE_OBJECT = {"oee": 0.36, "availability": 0.5, "performance": 0.8, "quality": 0.9}
+CALCULATED_AT = datetime(2022, 4, 4, 9, 0, 0, tzinfo=timezone.utc)
+PLACES = 5
+
+
+class test_API(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.engine.dispose()
+
+    def get_store(self) -> API.KPIStore:
+        kpi_store = API.KPIStore()
+        kpi_store.update(WORKSTATION_ID, CALCULATED_AT, OEE_OBJECT, 120.5)
+        kpi_store.update(OTHER_ID, CALCULATED_AT, error="no OEE data")
+        kpi_store.publish([WORKSTATION_ID, OTHER_ID], CALCULATED_AT)
+        return kpi_store
+
+    def test_KPIStore(self):
+        kpi_store = self.get_store()
+        kpis = json.loads(kpi_store.get_list())
+        self.assertEqual([record["id"] for record in kpis], [WORKSTATION_ID, OTHER_ID])
+        self.assertEqual(
+            kpis[0],
+            dict(
+                id=WORKSTATION_ID,
+                throughput=120.5,
+                calculatedAt=CALCULATED_AT.isoformat(),
+                error=None,
+                **OEE_OBJECT,
+            ),
+        )
+        self.assertEqual(kpis[1]["oee"], None)
+        self.assertEqual(kpis[1]["error"], "no OEE data")
+        self.assertEqual(json.loads(kpi_store.get_list(status="error")), [kpis[1]])
+        self.assertEqual(json.loads(kpi_store.get_list(ids=[OTHER_ID, "unknown"])), [kpis[1]])
+        self.assertEqual(json.loads(kpi_store.get_list(ids=[OTHER_ID], status="ok")), [])
+        with self.assertRaises(ValueError):
+            kpi_store.get_list(status="somehow")
+        # the Workstations removed from Orion are removed
+        kpi_store.publish([WORKSTATION_ID], CALCULATED_AT)
+        self.assertEqual(list(kpi_store.bodies), [WORKSTATION_ID])
+        self.assertEqual(json.loads(kpi_store.get_list()), [kpis[0]])
+
+    def test_APIServer(self):
+        server = API.APIServer(self.get_store(), host="127.0.0.1", port=0)
+        server.start()
+        try:
+            url = f"http://127.0.0.1:{server.port}"
+            response = requests.get(f"{url}/kpis")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers["Content-Type"], "application/json")
+            self.assertEqual(len(response.json()), 2)
+            response = requests.get(f"{url}/kpis", params={"status": "ok"})
+            self.assertEqual([record["id"] for record in response.json()], [WORKSTATION_ID])
+            response = requests.get(f"{url}/kpis", params={"id": [OTHER_ID]})
+            self.assertEqual([record["id"] for record in response.json()], [OTHER_ID])
+            self.assertEqual(requests.get(f"{url}/kpis", params={"status": "somehow"}).status_code, 400)
+            response = requests.get(f"{url}/kpis/{WORKSTATION_ID}")
+            self.assertEqual(response.json()["throughput"], 120.5)
+            self.assertEqual(requests.get(f"{url}/kpis/unknown").status_code, 404)
+            self.assertEqual(requests.get(f"{url}/health").json()["loopFinishedAt"], CALCULATED_AT.isoformat())
+            self.assertEqual(requests.get(f"{url}/other").status_code, 404)
+            # there are no sinks
+            self.assertEqual(requests.get(f"{url}/sinks").status_code, 404)
+        finally:
+            server.stop()
+
+    def test_sink_metrics(self):
+        sinks = Sinks.SinkDispatcher([Sinks.MemoryBusSink()])
+        server = API.APIServer(self.get_store(), host="127.0.0.1", port=0, sinks=sinks)
+        server.start()
+        try:
+            sinks.dispatch(Sinks.get_record(WORKSTATION_ID, CALCULATED_AT, OEE_OBJECT, 120.5))
+            metrics = requests.get(f"http://127.0.0.1:{server.port}/sinks").json()
+            self.assertEqual(list(metrics), ["bus"])
+            self.assertEqual(metrics["bus"]["queued"], 1)
+            self.assertEqual(metrics["bus"]["dropped"], 0)
+        finally:
+            server.stop()
+            sinks.close()
+
+    def test_EventBroker(self):
+        broker = API.EventBroker(epsilon=0.01, max_events=2)
+        kpi_store = API.KPIStore(broker)
+        kpi_store.update(WORKSTATION_ID, CALCULATED_AT, OEE_OBJECT, 120.5)
+        frames, last_id = broker.get_events(0)
+        self.assertEqual(last_id, 1)
+        self.assertTrue(frames[0].startswith(b"id: 1\nevent: kpis\ndata: "))
+        delta = json.loads(frames[0].split(b"data: ")[1])
+        self.assertEqual(set(delta), {"id", "calculatedAt", "throughput", "error"} | set(OEE_OBJECT))
+        # the changes within epsilon are not sent
+        kpi_store.update(WORKSTATION_ID, CALCULATED_AT, dict(OEE_OBJECT, oee=0.365), 120.5)
+        self.assertEqual(broker.last_id, 1)
+        # but they add up
+        kpi_store.update(WORKSTATION_ID, CALCULATED_AT, dict(OEE_OBJECT, oee=0.375), 120.5)
+        frames, last_id = broker.get_events(1)
+        self.assertEqual(last_id, 2)
+        self.assertEqual(
+            json.loads(frames[0].split(b"data: ")[1]),
+            {"id": WORKSTATION_ID, "calculatedAt": CALCULATED_AT.isoformat(), "oee": 0.375},
+        )
+        kpi_store.update(WORKSTATION_ID, CALCULATED_AT, error="no OEE data")
+        delta = json.loads(broker.get_events(2)[0][0].split(b"data: ")[1])
+        self.assertEqual(delta["error"], "no OEE data")
+        self.assertIsNone(delta["oee"])
+        # only the last max_events events are kept
+        self.assertEqual(len(broker.get_events(0)[0]), 2)
+        # the ids of a restarted service are lower, all events are sent
+        self.assertEqual(len(broker.get_events(100)[0]), 2)
+        self.assertEqual(broker.wait(3, timeout=0.01), ([], 3))
+
+    def test_event_stream(self):
+        kpi_store = API.KPIStore(API.EventBroker())
+        kpi_store.update(WORKSTATION_ID, CALCULATED_AT, OEE_OBJECT, 120.5)
+        kpi_store.update(OTHER_ID, CALCULATED_AT, error="no OEE data")
+        server = API.APIServer(kpi_store, host="127.0.0.1", port=0, heartbeat=0.05)
+        server.start()
+        try:
+            url = f"http://127.0.0.1:{server.port}/events"
+            with requests.get(url, headers={"Last-Event-ID": "1"}, stream=True, timeout=5) as response:
+                self.assertEqual(response.headers["Content-Type"], "text/event-stream")
+                lines = response.iter_lines()
+                self.assertEqual(next(lines), b"id: 2")
+                self.assertEqual(next(lines), b"event: kpis")
+                self.assertEqual(json.loads(next(lines)[len(b"data: "):])["id"], OTHER_ID)
+                kpi_store.update(OTHER_ID, CALCULATED_AT, OEE_OBJECT, 100)
+                # heartbeats may come first
+                self.assertEqual(next(line for line in lines if line.startswith(b"id: ")), b"id: 3")
+                self.assertEqual(next(lines), b"event: kpis")
+                self.assertEqual(json.loads(next(lines)[len(b"data: "):])["throughput"], 100)
+        finally:
+            server.stop()
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_LoopHandler_kpi_store(self, mock_datetime):
+        mock_datetime.now.return_value = datetime(2022, 4, 4, 9, 0, 0)
+        kpi_store = API.KPIStore()
+        with patch.object(LoopHandler, "kpi_store", kpi_store):
+            loopHandler = LoopHandler()
+            loopHandler.handle()
+        kpis = {record["id"]: record for record in json.loads(kpi_store.get_list())}
+        self.assertEqual(sorted(kpis), sorted(workstation["id"] for workstation in loopHandler.workstations))
+        self.assertAlmostEqual(kpis[WORKSTATION_ID]["availability"], 50 / 60, places=PLACES)
+        self.assertAlmostEqual(kpis[WORKSTATION_ID]["quality"], 70 / 71, places=PLACES)
+        self.assertIsNone(kpis[WORKSTATION_ID]["error"])
+        self.assertIsNotNone(json.loads(kpi_store.health_body)["loopFinishedAt"])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
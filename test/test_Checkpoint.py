@@ -0,0 +1,177 @@
+"""test Checkpoint
+"""
+# Standard Library imports
+import copy
+from datetime import datetime
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# PyPI imports
+import numpy as np
+import sqlalchemy
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+import Checkpoint
+from Logger import getLogger
+import OEE
+import Reducers
+from modules.TestCase_common import setupClass_common
+
+# Load environment variables
+POSTGRES_SCHEMA = os.environ.get("POSTGRES_SCHEMA")
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+WORKSTATION_TABLE = WORKSTATION_ID.lower().replace(":", "_") + "_i40asset"
+JOB_ID = "urn:ngsiv2:i40Process:Job:000001"
+JOB_TABLE = JOB_ID.lower().replace(":", "_") + "_i40process"
+SHIFT_ID = "urn:ngsiv2:i40Recipe:Shift:1"
+STATE = {"day": "2022-04-04", "shift_id": SHIFT_ID, "job_id": JOB_ID, "watermark": 1.5}
+CHUNK_SIZE = 100
+PLACES = 5
+
+
+class test_Checkpoint(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+        # the common connection is left in the transaction that uploaded the logs
+        cls.con.close()
+        cls.con = cls.engine.connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.engine.dispose()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "checkpoint.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def calculate_OEE(self, now: datetime, checkpoint: Checkpoint.CheckpointStore = None) -> OEE.OEECalculator:
+        with patch(f"{OEE.__name__}.datetime", wraps=datetime) as mock_datetime:
+            mock_datetime.now.return_value = now
+            oee = copy.deepcopy(self.oee_template)
+            oee.processing_mode = "chunked"
+            oee.chunk_size = CHUNK_SIZE
+            oee.checkpoint = checkpoint
+            oee.prepare(self.con)
+            oee.calculate_OEE()
+        return oee
+
+    def test_save_load(self):
+        checkpoint = Checkpoint.CheckpointStore(self.path, interval=3600)
+        self.assertEqual(checkpoint.states, {})
+        checkpoint.put(WORKSTATION_ID, STATE)
+        self.assertTrue(checkpoint.save())
+        # the interval has not elapsed
+        checkpoint.put("other", STATE)
+        self.assertFalse(checkpoint.save())
+        self.assertEqual(Checkpoint.CheckpointStore(self.path).states, {WORKSTATION_ID: STATE})
+        self.assertTrue(checkpoint.save(force=True))
+        self.assertEqual(sorted(Checkpoint.CheckpointStore(self.path).states), ["other", WORKSTATION_ID])
+        # no temporary file is left
+        self.assertEqual(os.listdir(self.directory.name), ["checkpoint.json"])
+
+    def test_invalid_file(self):
+        with open(self.path, "w") as f:
+            json.dump({"version": Checkpoint.CHECKPOINT_VERSION + 1, "states": {WORKSTATION_ID: STATE}}, f)
+        self.assertEqual(Checkpoint.CheckpointStore(self.path).states, {})
+        with open(self.path, "w") as f:
+            f.write('{"version": 1, "sta')
+        self.assertEqual(Checkpoint.CheckpointStore(self.path).states, {})
+
+    def test_get(self):
+        checkpoint = Checkpoint.CheckpointStore(self.path)
+        checkpoint.put(WORKSTATION_ID, STATE)
+        self.assertEqual(checkpoint.get(WORKSTATION_ID, "2022-04-04", SHIFT_ID, JOB_ID), STATE)
+        self.assertIsNone(checkpoint.get("other", "2022-04-04", SHIFT_ID, JOB_ID))
+        # a new Job invalidates the state
+        self.assertIsNone(checkpoint.get(WORKSTATION_ID, "2022-04-04", SHIFT_ID, "other"))
+        self.assertEqual(checkpoint.states, {})
+        checkpoint.put(WORKSTATION_ID, STATE)
+        self.assertIsNone(checkpoint.get(WORKSTATION_ID, "2022-04-05", SHIFT_ID, JOB_ID))
+
+    def test_reducer_state(self):
+        reducer = Reducers.AvailabilityReducer(10.0)
+        reducer.previous_timestamp = np.int64(20)
+        reducer.time_on = np.int64(10)
+        reducer.available = np.bool_(True)
+        state = json.loads(json.dumps(reducer.get_state()))
+        restored = Reducers.AvailabilityReducer.from_state(state)
+        self.assertEqual(restored.calculate(30), reducer.calculate(30))
+        reducer = Reducers.CounterReducer(("goodPartCounter",))
+        reducer.counters["goodPartCounter"] = {"min_value": 0, "max_value": 1, "zero_present": True}
+        state = reducer.get_state()
+        restored = Reducers.CounterReducer.from_state(state)
+        restored.counters["goodPartCounter"]["max_value"] = 2
+        # the state is not changed by the restored reducer
+        self.assertEqual(state["counters"]["goodPartCounter"]["max_value"], 1)
+
+    def test_OEECalculator_checkpoint(self):
+        for now in (datetime(2022, 4, 4, 8, 25, 0), datetime(2022, 4, 4, 9, 0, 0), datetime(2022, 4, 4, 13, 0, 0)):
+            expected = self.calculate_OEE(now)
+            # a new store from the saved file, like after a restart
+            checkpoint = Checkpoint.CheckpointStore(self.path)
+            oee = self.calculate_OEE(now, checkpoint)
+            checkpoint.save()
+            self.assertEqual(oee.today["reference_start_time"], expected.today["reference_start_time"])
+            self.assertEqual(oee.n_total_cycles, expected.n_total_cycles)
+            self.assertAlmostEqual(oee.total_available_time, expected.total_available_time, places=PLACES)
+            for kpi in ("availability", "performance", "quality", "oee"):
+                self.assertAlmostEqual(oee.oee[kpi], expected.oee[kpi], places=PLACES)
+            self.assertEqual(checkpoint.states[WORKSTATION_ID]["watermark"], oee.now_unix - checkpoint.lag)
+        # only the logs since the previous calculation were streamed
+        for table_name in (WORKSTATION_TABLE, JOB_TABLE):
+            self.assertLess(oee.rows_read[table_name], expected.rows_read[table_name])
+
+        # the logs are streamed from midnight if the state is of another Job
+        checkpoint.states[WORKSTATION_ID]["job_id"] = "other"
+        oee = self.calculate_OEE(now, checkpoint)
+        self.assertEqual(oee.rows_read, expected.rows_read)
+        self.assertAlmostEqual(oee.oee["oee"], expected.oee["oee"], places=PLACES)
+
+    def test_OEECalculator_late_rows(self):
+        now = datetime(2022, 4, 4, 9, 0, 0)
+        checkpoint = Checkpoint.CheckpointStore(self.path)
+        before = self.calculate_OEE(now, checkpoint)
+        # Cygnus commits a row before the previous calculation's time only after the checkpoint
+        late = before.now_unix - checkpoint.lag // 2
+        max_good = self.engine.execute(
+            f"select max(cast(attrvalue as int)) from {POSTGRES_SCHEMA}.{JOB_TABLE} where attrname = 'goodPartCounter';"
+        ).scalar()
+        self.engine.execute(
+            sqlalchemy.text(
+                f"""insert into {POSTGRES_SCHEMA}.{JOB_TABLE} (recvtimets, attrname, attrvalue)
+                    values (:recvtimets, 'goodPartCounter', :attrvalue);"""
+            ),
+            {"recvtimets": str(late), "attrvalue": str(max_good + 10)},
+        )
+        try:
+            expected = self.calculate_OEE(now)
+            oee = self.calculate_OEE(now, checkpoint)
+        finally:
+            self.engine.execute(
+                sqlalchemy.text(f"delete from {POSTGRES_SCHEMA}.{JOB_TABLE} where recvtimets = :recvtimets;"),
+                {"recvtimets": str(late)},
+            )
+        self.assertGreater(expected.n_total_cycles, before.n_total_cycles)
+        self.assertEqual(oee.n_total_cycles, expected.n_total_cycles)
+        self.assertAlmostEqual(oee.oee["oee"], expected.oee["oee"], places=PLACES)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""test CopyReader
+"""
+# Standard Library imports
+import copy
+from datetime import datetime
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# PyPI imports
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+from CopyReader import CopyReader
+import OEE
+from Logger import getLogger
+from modules.TestCase_common import setupClass_common
+
+# Constants
+JOB_ID = "urn:ngsiv2:i40Process:Job:000001"
+JOB_TABLE = JOB_ID.lower().replace(":", "_") + "_i40process"
+ESCAPE_TABLE = "copy_reader_escape_test"
+PLACES = 5
+
+# Load environment variables
+POSTGRES_SCHEMA = os.environ.get("POSTGRES_SCHEMA")
+
+
+class test_CopyReader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+        cls.query = f"select * from {POSTGRES_SCHEMA}.{JOB_TABLE};"
+        cls.expected = pd.read_sql_query(sqlalchemy.text(cls.query), con=cls.con)
+        cls.expected["recvtimets"] = cls.expected["recvtimets"].astype("int64")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.engine.execute(f"drop table if exists {POSTGRES_SCHEMA}.{ESCAPE_TABLE};")
+        cls.engine.dispose()
+
+    def assert_frame_matches_expected(self, df: pd.DataFrame):
+        self.assertEqual(list(df.columns), ["recvtimets", "attrname", "attrvalue"])
+        self.assertEqual(df["recvtimets"].dtype, np.int64)
+        self.assertTrue(df.equals(self.expected[["recvtimets", "attrname", "attrvalue"]]))
+
+    def test_read(self):
+        logs = CopyReader().read(self.con, self.query)
+        self.assertEqual(len(logs), len(self.expected))
+        self.assert_frame_matches_expected(logs.to_frame())
+        code = logs.attrname_code("goodPartCounter")
+        self.assertEqual(
+            np.count_nonzero(logs.attrname == code),
+            np.count_nonzero(self.expected["attrname"] == "goodPartCounter"),
+        )
+        self.assertEqual(logs.attrname_code("missing"), -1)
+
+        empty = CopyReader().read(self.con, f"select * from {POSTGRES_SCHEMA}.{JOB_TABLE} where false;")
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(len(empty.to_frame()), 0)
+
+    def test_read_in_chunks(self):
+        chunk_size = 1000
+        reader = CopyReader(chunk_size)
+        frames = []
+
+        def on_chunk(chunk):
+            self.assertLessEqual(len(chunk), chunk_size)
+            # the buffers are reused, so they must not grow
+            self.assertIs(chunk.recvtimets.base, reader.recvtimets_buffer)
+            frames.append(chunk.to_frame())
+
+        n_rows = reader.read(self.con, self.query, on_chunk=on_chunk)
+        self.assertEqual(n_rows, len(self.expected))
+        self.assertEqual(len(frames), -(-len(self.expected) // chunk_size))
+        self.assert_frame_matches_expected(pd.concat(frames, ignore_index=True))
+
+    def test_read_chunk_categories(self):
+        reader = CopyReader(1000, chunk_categories=True)
+        frames = []
+
+        def on_chunk(chunk):
+            # the categories only contain the chunk's values
+            self.assertEqual(len(chunk.reader.attrvalues), len(np.unique(chunk.attrvalue)))
+            frames.append(chunk.to_frame())
+
+        reader.read(self.con, self.query, on_chunk=on_chunk)
+        self.assert_frame_matches_expected(pd.concat(frames, ignore_index=True))
+
+    def test_read_params_and_escapes(self):
+        values = ["tab\there", "new\nline", "back\\slash", "back\\\\tab\\t", None, ""]
+        self.engine.execute(f"drop table if exists {POSTGRES_SCHEMA}.{ESCAPE_TABLE};")
+        self.engine.execute(
+            f"create table {POSTGRES_SCHEMA}.{ESCAPE_TABLE} (recvtimets text, attrname text, attrvalue text);"
+        )
+        for i, value in enumerate(values):
+            self.engine.execute(
+                sqlalchemy.text(
+                    f"insert into {POSTGRES_SCHEMA}.{ESCAPE_TABLE} values (:recvtimets, 'attr', :attrvalue);"
+                ),
+                {"recvtimets": str(i), "attrvalue": value},
+            )
+        df = CopyReader(chunk_size=3).read_frame(
+            self.con,
+            f"select * from {POSTGRES_SCHEMA}.{ESCAPE_TABLE} where attrname = :attrname order by cast (recvtimets as bigint);",
+            params={"attrname": "attr"},
+        )
+        self.assertEqual(list(df["attrvalue"]), values)
+        self.assertEqual(list(df["recvtimets"]), list(range(len(values))))
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_OEECalculator_copy_log_reader(self, mock_datetime):
+        mock_datetime.now.return_value = datetime(2022, 4, 4, 9, 0, 0)
+        for workstation_query_mode in ("from_midnight", "boundary"):
+            oee_pandas = copy.deepcopy(self.oee_template)
+            oee_pandas.workstation_query_mode = workstation_query_mode
+            oee_pandas.prepare(self.con)
+            oee_pandas.calculate_OEE()
+            oee_copy = copy.deepcopy(self.oee_template)
+            oee_copy.workstation_query_mode = workstation_query_mode
+            oee_copy.log_reader = "copy"
+            oee_copy.prepare(self.con)
+            oee_copy.calculate_OEE()
+            for kpi in ("availability", "performance", "quality", "oee"):
+                self.assertAlmostEqual(oee_copy.oee[kpi], oee_pandas.oee[kpi], places=PLACES)
+
+        oee = copy.deepcopy(self.oee_template)
+        oee.log_reader = "copy"
+        with self.assertRaises(RuntimeError):
+            oee.read_logs(self.con, f"select * from {POSTGRES_SCHEMA}.missing_table;", "missing_table")
+        # the connection is still usable after the error
+        self.assertEqual(self.con.execute(sqlalchemy.text("select 1;")).scalar(), 1)
+        oee.log_reader = "somehow_else"
+        with self.assertRaises(NotImplementedError):
+            oee.read_logs(self.con, self.query, JOB_TABLE)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""test Cygnus
+"""
+# Standard Library imports
+import copy
+from datetime import datetime
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# PyPI imports
+import sqlalchemy
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+import Cygnus
+from LoopHandler import LoopHandler
+import OEE
+import Orion
+from Logger import getLogger
+from modules.TestCase_common import setupClass_common
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+WORKSTATION_TABLE = WORKSTATION_ID.lower().replace(":", "_") + "_i40asset"
+JOB_ID = "urn:ngsiv2:i40Process:Job:000001"
+JOB_TABLE = JOB_ID.lower().replace(":", "_") + "_i40process"
+COLUMN_SUFFIX = "_column"
+# the tables of the "dm-by-entity-type" data model, shared with the logs of another entity
+TYPE_TABLES = {WORKSTATION_TABLE: "i40asset", JOB_TABLE: "i40process"}
+OTHER_ENTITY_IDS = {
+    WORKSTATION_TABLE: "urn:ngsiv2:i40Asset:Workstation:999",
+    JOB_TABLE: "urn:ngsiv2:i40Process:Job:999999",
+}
+PLACES = 5
+
+# Load environment variables
+POSTGRES_SCHEMA = os.environ.get("POSTGRES_SCHEMA")
+
+
+def get_column_table(table_name: str) -> str:
+    return table_name + COLUMN_SUFFIX
+
+
+class test_Cygnus(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+        # the common connection is left in the transaction that uploaded the logs
+        cls.con.close()
+        cls.con = cls.engine.connect()
+        # the Job's recvTime is written in ISO 8601 with a zone designator, the Workstation's without
+        for table_name, recvtime in (
+            (WORKSTATION_TABLE, "recvtime"),
+            (JOB_TABLE, "replace(recvtime, ' ', 'T') || 'Z'"),
+        ):
+            cls.create_column_table(table_name, recvtime)
+            cls.create_type_table(table_name)
+
+    @classmethod
+    def create_type_table(cls, table_name: str):
+        """Create a table of an entity type from the table of an entity and the differing logs of another entity"""
+        # the other entity is never available and produces other counter values
+        attrvalue = """case
+            when attrname = 'available' then 'false'
+            when attrname in ('goodPartCounter', 'rejectPartCounter') then cast (cast (attrvalue as bigint) * 7 + 3 as text)
+            else attrvalue end"""
+        with cls.engine.begin() as con:
+            con.execute(f"drop table if exists {POSTGRES_SCHEMA}.{TYPE_TABLES[table_name]};")
+            con.execute(
+                sqlalchemy.text(
+                    f"""create table {POSTGRES_SCHEMA}.{TYPE_TABLES[table_name]} as
+                        select * from {POSTGRES_SCHEMA}.{table_name}
+                        union all
+                        select recvtimets, recvtime, fiwareservicepath, :entity_id, entitytype,
+                        attrname, attrtype, {attrvalue}, attrmd
+                        from {POSTGRES_SCHEMA}.{table_name};"""
+                ),
+                {"entity_id": OTHER_ENTITY_IDS[table_name]},
+            )
+
+    @classmethod
+    def create_column_table(cls, table_name: str, recvtime: str):
+        """Create a column-mode table from a row-mode table: one row for each notification"""
+        attributes = [
+            row[0]
+            for row in cls.con.execute(
+                f"select distinct attrname from {POSTGRES_SCHEMA}.{table_name} order by attrname;"
+            )
+        ]
+        columns = ", ".join(
+            f"max(attrvalue) filter (where attrname = '{attribute}') as {attribute}, "
+            f"max(attrmd) filter (where attrname = '{attribute}') as {attribute}_md"
+            for attribute in attributes
+        )
+        column_table = get_column_table(table_name)
+        with cls.engine.begin() as con:
+            con.execute(f"drop table if exists {POSTGRES_SCHEMA}.{column_table};")
+            con.execute(
+                sqlalchemy.text(
+                    f"""create table {POSTGRES_SCHEMA}.{column_table} as
+                        select {recvtime} as recvtime, fiwareservicepath, entityid, entitytype, {columns}
+                        from {POSTGRES_SCHEMA}.{table_name}
+                        group by recvtimets, recvtime, fiwareservicepath, entityid, entitytype;"""
+                )
+            )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        with cls.engine.begin() as con:
+            for table_name in (WORKSTATION_TABLE, JOB_TABLE):
+                con.execute(f"drop table if exists {POSTGRES_SCHEMA}.{get_column_table(table_name)};")
+                con.execute(f"drop table if exists {POSTGRES_SCHEMA}.{TYPE_TABLES[table_name]};")
+        cls.engine.dispose()
+
+    def test_get_attr_persistence(self):
+        self.assertEqual(Cygnus.get_attr_persistence(self.con, JOB_TABLE, "auto"), "row")
+        self.assertEqual(Cygnus.get_attr_persistence(self.con, get_column_table(JOB_TABLE), "auto"), "column")
+        self.assertEqual(Cygnus.get_attr_persistence(self.con, "missing_table", "auto"), "row")
+        self.assertEqual(Cygnus.get_attr_persistence(self.con, JOB_TABLE, "column"), "column")
+        with self.assertRaises(NotImplementedError):
+            Cygnus.get_attr_persistence(self.con, JOB_TABLE, "somehow_else")
+
+    def test_get_column_logs_relation(self):
+        for table_name in (WORKSTATION_TABLE, JOB_TABLE):
+            relation = Cygnus.get_column_logs_relation(
+                self.con, get_column_table(table_name), OEE.OEECalculator.LOG_ATTRIBUTES
+            )
+            unpivoted = self.con.execute(
+                f"select recvtimets, attrname, attrvalue from {relation} order by 1, 2;"
+            ).fetchall()
+            attributes = ", ".join(f"'{attribute}'" for attribute in OEE.OEECalculator.LOG_ATTRIBUTES)
+            expected = self.con.execute(
+                f"""select cast (recvtimets as bigint), attrname, attrvalue from {POSTGRES_SCHEMA}.{table_name}
+                    where attrname in ({attributes}) order by 1, 2;"""
+            ).fetchall()
+            self.assertGreater(len(expected), 0)
+            self.assertEqual(unpivoted, expected)
+        with self.assertRaises(ValueError):
+            Cygnus.get_column_logs_relation(self.con, get_column_table(JOB_TABLE), ("missing",))
+        with self.assertRaises(ValueError):
+            Cygnus.get_column_logs_relation(self.con, JOB_TABLE, ("goodPartCounter",))
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_OEECalculator_column_mode(self, mock_datetime):
+        get_postgres_table = Cygnus.get_postgres_table
+        modes = (
+            {},
+            {"log_reader": "copy"},
+            {"workstation_query_mode": "boundary", "job_query_mode": "aggregate"},
+            {"processing_mode": "chunked"},
+        )
+        for now in (datetime(2022, 4, 4, 9, 0, 0), datetime(2022, 4, 4, 13, 0, 0)):
+            mock_datetime.now.return_value = now
+            oee_row = copy.deepcopy(self.oee_template)
+            oee_row.prepare(self.con)
+            oee_row.calculate_OEE()
+            for attr_persistence in ("column", "auto"):
+                for mode in modes:
+                    oee_column = copy.deepcopy(self.oee_template)
+                    oee_column.attr_persistence = attr_persistence
+                    for attribute, value in mode.items():
+                        setattr(oee_column, attribute, value)
+                    with patch.object(
+                        Cygnus, "get_postgres_table", side_effect=lambda obj, data_model=None: get_column_table(get_postgres_table(obj, data_model))
+                    ):
+                        oee_column.prepare(self.con)
+                    oee_column.calculate_OEE()
+                    self.assertEqual(oee_column.job["postgres_table"], get_column_table(JOB_TABLE))
+                    self.assertEqual(oee_column.n_total_cycles, oee_row.n_total_cycles)
+                    for kpi in ("availability", "performance", "quality", "oee"):
+                        self.assertAlmostEqual(oee_column.oee[kpi], oee_row.oee[kpi], places=PLACES)
+
+
+    def test_get_postgres_table(self):
+        workstation = {"id": WORKSTATION_ID, "type": "i40Asset"}
+        self.assertEqual(Cygnus.get_postgres_table(workstation), WORKSTATION_TABLE)
+        self.assertEqual(Cygnus.get_postgres_table(workstation, "dm-by-entity"), WORKSTATION_TABLE)
+        self.assertEqual(Cygnus.get_postgres_table(workstation, "dm-by-entity-type"), "i40asset")
+        with self.assertRaises(NotImplementedError):
+            Cygnus.get_postgres_table(workstation, "dm-by-service-path")
+        # the Jobs are downloaded together, not one by one
+        with patch.object(Orion, "get", side_effect=AssertionError("Job downloaded alone")):
+            self.assertEqual(
+                Cygnus.get_table_entities(
+                    [
+                        {"id": WORKSTATION_ID, "type": "i40Asset", "refJob": {"value": JOB_ID}},
+                        {"id": "urn:ngsiv2:i40Asset:Workstation:002", "type": "i40Asset", "refJob": {"value": JOB_ID}},
+                    ],
+                    "dm-by-entity-type",
+                ),
+                {"i40asset": [WORKSTATION_ID, "urn:ngsiv2:i40Asset:Workstation:002"], "i40process": [JOB_ID]},
+            )
+        self.assertEqual(Cygnus.quote_literal("it's"), "'it''s'")
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_OEECalculator_entity_type_tables(self, mock_datetime):
+        modes = (
+            {},
+            {"log_reader": "copy"},
+            {"workstation_query_mode": "boundary", "job_query_mode": "aggregate"},
+            {"processing_mode": "chunked"},
+        )
+        for now in (datetime(2022, 4, 4, 9, 0, 0), datetime(2022, 4, 4, 13, 0, 0)):
+            mock_datetime.now.return_value = now
+            oee_entity = copy.deepcopy(self.oee_template)
+            oee_entity.prepare(self.con)
+            oee_entity.calculate_OEE()
+            for mode in modes:
+                oee_type = copy.deepcopy(self.oee_template)
+                oee_type.data_model = "dm-by-entity-type"
+                for attribute, value in mode.items():
+                    setattr(oee_type, attribute, value)
+                oee_type.prepare(self.con)
+                oee_type.calculate_OEE()
+                self.assertEqual(oee_type.workstation["postgres_table"], TYPE_TABLES[WORKSTATION_TABLE])
+                self.assertEqual(oee_type.job["postgres_table"], TYPE_TABLES[JOB_TABLE])
+                self.assertEqual(oee_type.n_total_cycles, oee_entity.n_total_cycles)
+                for kpi in ("availability", "performance", "quality", "oee"):
+                    self.assertAlmostEqual(oee_type.oee[kpi], oee_entity.oee[kpi], places=PLACES)
+
+    @patch(f"{Cygnus.__name__}.datetime", wraps=datetime)
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_LoopHandler_prefetch_logs(self, mock_datetime, mock_cygnus_datetime):
+        mock_datetime.now.return_value = mock_cygnus_datetime.now.return_value = datetime(2022, 4, 4, 13, 0, 0)
+        oee_entity = copy.deepcopy(self.oee_template)
+        oee_entity.prepare(self.con)
+        oee_entity.calculate_OEE()
+
+        loopHandler = LoopHandler()
+        loopHandler.con = self.con
+        loopHandler.workstations = [{"id": WORKSTATION_ID, "type": "i40Asset", "refJob": {"value": JOB_ID}}]
+        # no bulk queries by default
+        loopHandler.prefetch_logs()
+        self.assertEqual(loopHandler.prefetched, {})
+        with patch.object(LoopHandler, "BULK_QUERIES", True), patch.object(
+            Cygnus, "CYGNUS_DATA_MODEL", "dm-by-entity-type"
+        ):
+            loopHandler.prefetch_logs()
+        self.assertEqual(set(loopHandler.prefetched), set(TYPE_TABLES.values()))
+        # the other entity's logs are not queried
+        self.assertEqual(set(loopHandler.prefetched[TYPE_TABLES[WORKSTATION_TABLE]]["entityid"]), {WORKSTATION_ID})
+        self.assertEqual(set(loopHandler.prefetched[TYPE_TABLES[JOB_TABLE]]["entityid"]), {JOB_ID})
+        # the logs are prefetched until the loop's time
+        self.assertEqual(loopHandler.prefetched_until, Cygnus.get_todays_window()[1])
+        for df in loopHandler.prefetched.values():
+            self.assertLessEqual(df["recvtimets"].max(), loopHandler.prefetched_until)
+
+        for log_reader in ("pandas", "copy"):
+            oee_bulk = copy.deepcopy(self.oee_template)
+            oee_bulk.data_model = "dm-by-entity-type"
+            oee_bulk.log_reader = log_reader
+            oee_bulk.prefetched = loopHandler.prefetched
+            oee_bulk.prefetched_until = loopHandler.prefetched_until
+            # the logs are not queried for each Workstation
+            with patch.object(OEE.OEECalculator, "read_logs", side_effect=AssertionError("logs queried")):
+                oee_bulk.prepare(self.con)
+            oee_bulk.calculate_OEE()
+            self.assertEqual(oee_bulk.n_total_cycles, oee_entity.n_total_cycles)
+            for kpi in ("availability", "performance", "quality", "oee"):
+                self.assertAlmostEqual(oee_bulk.oee[kpi], oee_entity.oee[kpi], places=PLACES)
+            self.assertEqual(oee_bulk.rows_read[TYPE_TABLES[WORKSTATION_TABLE]], oee_entity.rows_read[WORKSTATION_TABLE])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
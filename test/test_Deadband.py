@@ -0,0 +1,101 @@
+"""test Deadband
+"""
+# Standard Library imports
+from datetime import datetime
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+import Deadband
+from Logger import getLogger
+from LoopHandler import LoopHandler
+import OEE
+import Orion
+from modules.TestCase_common import setupClass_common
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+N_KPI_ATTRIBUTES = 6
+
+
+class test_Deadband(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.engine.dispose()
+
+    def test_within_deadband(self):
+        self.assertTrue(Deadband.within_deadband(0.5, 0.5000001, 1e-6, 0))
+        self.assertFalse(Deadband.within_deadband(0.5, 0.50001, 1e-6, 0))
+        self.assertTrue(Deadband.within_deadband(100, 100.5, 0, 0.01))
+        self.assertFalse(Deadband.within_deadband(100, 102, 0, 0.01))
+        self.assertTrue(Deadband.within_deadband(None, None, 1e-6, 0))
+        self.assertFalse(Deadband.within_deadband(None, 0, 1e-6, 0))
+        self.assertFalse(Deadband.within_deadband(True, 1, 1e-6, 0))
+        oee = {"oee": 0.36, "availability": 0.5, "performance": 0.8, "quality": 0.9}
+        self.assertTrue(Deadband.within_deadband(oee, dict(oee, oee=0.3600001), 1e-6, 0))
+        self.assertFalse(Deadband.within_deadband(oee, dict(oee, oee=0.37), 1e-6, 0))
+        self.assertFalse(Deadband.within_deadband(oee, dict(oee, extra=1), 1e-6, 0))
+
+    @patch(f"{Deadband.__name__}.time")
+    def test_DeadbandFilter(self, mock_time):
+        mock_time.monotonic.return_value = 1000
+        deadband = Deadband.DeadbandFilter(absolute=0.01, relative=0, max_staleness=60)
+        self.assertFalse(deadband.suppress(WORKSTATION_ID, "oee", 0.5))
+        deadband.written(WORKSTATION_ID, "oee", 0.5)
+        self.assertTrue(deadband.suppress(WORKSTATION_ID, "oee", 0.505))
+        self.assertFalse(deadband.suppress(WORKSTATION_ID, "oee", 0.52))
+        # the other attributes and objects are independent
+        self.assertFalse(deadband.suppress(WORKSTATION_ID, "oeeQuality", 0.5))
+        self.assertFalse(deadband.suppress("other", "oee", 0.5))
+        # the write is forced after the maximum staleness
+        mock_time.monotonic.return_value = 1060
+        self.assertFalse(deadband.suppress(WORKSTATION_ID, "oee", 0.5))
+        self.assertEqual(deadband.get_counts(), {"written": 1, "suppressed": 1, "heartbeats": 1})
+        # the written values are copied
+        oee = {"oee": 0.5}
+        deadband.written(WORKSTATION_ID, "oeeObject", oee)
+        oee["oee"] = 0.6
+        self.assertFalse(deadband.suppress(WORKSTATION_ID, "oeeObject", oee))
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_LoopHandler_deadband(self, mock_datetime):
+        mock_datetime.now.return_value = datetime(2022, 4, 4, 9, 0, 0)
+        deadband = Deadband.DeadbandFilter()
+        with patch.object(LoopHandler, "deadband", deadband), patch.object(
+            Orion, "update_attribute", wraps=Orion.update_attribute
+        ) as mock_update_attribute:
+            LoopHandler().handle()
+            n_first_writes = mock_update_attribute.call_count
+            self.assertGreaterEqual(n_first_writes, N_KPI_ATTRIBUTES)
+            # the same KPIs are not written again
+            LoopHandler().handle()
+            self.assertEqual(mock_update_attribute.call_count, n_first_writes)
+            # a changed KPI is written
+            mock_datetime.now.return_value = datetime(2022, 4, 4, 9, 30, 0)
+            LoopHandler().handle()
+            written = {call.args[:2] for call in mock_update_attribute.call_args_list[n_first_writes:]}
+        self.assertIn((WORKSTATION_ID, "oeeAvailability"), written)
+        self.assertEqual(deadband.get_counts()["written"], mock_update_attribute.call_count)
+        self.assertGreaterEqual(deadband.get_counts()["suppressed"], n_first_writes)
+        # Orion has the last written value
+        self.assertEqual(
+            Orion.get(WORKSTATION_ID)["oeeAvailability"]["value"],
+            deadband.last[(WORKSTATION_ID, "oeeAvailability")][0],
+        )
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
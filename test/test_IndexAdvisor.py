@@ -0,0 +1,152 @@
+# Standard Library imports
+import os
+import sys
+import unittest
+
+# PyPI imports
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import create_engine
+from sqlalchemy.types import Text
+
+# custom imports
+from modules import reupload_jsons_to_Orion
+
+sys.path.insert(0, os.path.join("..", "src"))
+from Logger import getLogger
+import Cygnus
+import IndexAdvisor
+
+# Load environment variables
+POSTGRES_HOST = os.environ.get("POSTGRES_HOST")
+POSTGRES_PASSWORD = os.environ.get("POSTGRES_PASSWORD")
+POSTGRES_PORT = os.environ.get("POSTGRES_PORT")
+POSTGRES_USER = os.environ.get("POSTGRES_USER")
+POSTGRES_SCHEMA = os.environ.get("POSTGRES_SCHEMA")
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+WORKSTATION_TABLE = WORKSTATION_ID.lower().replace(":", "_") + "_i40asset"
+JOB_ID = "urn:ngsiv2:i40Process:Job:000001"
+JOB_TABLE = JOB_ID.lower().replace(":", "_") + "_i40process"
+TABLES = (WORKSTATION_TABLE, JOB_TABLE)
+
+
+class test_IndexAdvisor(unittest.TestCase):
+    logger = getLogger(__name__)
+
+    @classmethod
+    def setUpClass(cls):
+        reupload_jsons_to_Orion.main()
+        cls.engine = create_engine(
+            f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}"
+        )
+        cls.con = cls.engine.connect()
+        if not cls.engine.dialect.has_schema(cls.engine, POSTGRES_SCHEMA):
+            cls.engine.execute(sqlalchemy.schema.CreateSchema(POSTGRES_SCHEMA))
+        for table in TABLES:
+            df = pd.read_csv(os.path.join("csv", f"{table}.csv"))
+            df["recvtimets"] = df["recvtimets"].map(int)
+            df.to_sql(
+                name=table,
+                con=cls.con,
+                schema=POSTGRES_SCHEMA,
+                index=False,
+                dtype=Text,
+                if_exists="replace",
+            )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.drop_indexes()
+        cls.con.close()
+        cls.engine.dispose()
+
+    @classmethod
+    def drop_indexes(cls):
+        for table in TABLES:
+            cls.engine.execute(
+                f"drop index if exists {POSTGRES_SCHEMA}.{IndexAdvisor.get_index_name(table)};"
+            )
+
+    def setUp(self):
+        self.drop_indexes()
+
+    def tearDown(self):
+        pass
+
+    def test_get_index_name(self):
+        self.assertEqual(
+            IndexAdvisor.get_index_name("table"), "table" + IndexAdvisor.INDEX_SUFFIX
+        )
+        long_table = "urn_ngsiv2_i40asset_workstation_with_a_very_long_name_001_i40asset"
+        index_name = IndexAdvisor.get_index_name(long_table)
+        self.assertLessEqual(len(index_name), Cygnus.MAX_IDENTIFIER_LENGTH)
+        self.assertTrue(index_name.endswith(IndexAdvisor.INDEX_SUFFIX))
+        self.assertNotEqual(index_name, IndexAdvisor.get_index_name(long_table + "2"))
+
+    def test_advise(self):
+        reports = IndexAdvisor.advise(self.engine, create=False)
+        self.assertEqual([report["table"] for report in reports], list(TABLES))
+        for report in reports:
+            self.assertEqual(report["index"], "missing")
+            self.assertIsNone(report["latency_after"])
+            self.assertGreater(report["statistics"]["total_bytes"], 0)
+            self.assertEqual(
+                set(report["latency_before"].keys()),
+                {"todays_data", "attribute_window", "boundary_row"},
+            )
+
+        reports = IndexAdvisor.advise(self.engine, create=True)
+        for report in reports:
+            self.assertEqual(report["index"], "missing")
+            self.assertEqual(
+                set(report["latency_after"].keys()), set(report["latency_before"].keys())
+            )
+            self.assertEqual(IndexAdvisor.get_index_state(self.con, report["table"]), "valid")
+
+        # running it again does not rebuild the valid indexes
+        reports = IndexAdvisor.advise(self.engine, create=True)
+        for report in reports:
+            self.assertEqual(report["index"], "valid")
+            self.assertIsNone(report["latency_after"])
+
+    def test_index_serves_time_window(self):
+        IndexAdvisor.advise(self.engine, create=True)
+        queries = Cygnus.get_benchmark_queries(WORKSTATION_TABLE)
+        # the timestamps are rendered as integers, so they are compared with the indexed bigint expression
+        self.assertNotIn(".0", queries["todays_data"])
+        with self.engine.connect() as con:
+            # the test tables are too small for the planner to prefer the index otherwise
+            con.execute("set enable_seqscan = off;")
+            for name in ("todays_data", "attribute_window"):
+                plan = "\n".join(row[0] for row in con.execute(sqlalchemy.text(f"explain {queries[name]}")))
+                self.logger.debug(f"{name} plan:\n{plan}")
+                index_conditions = [line for line in plan.splitlines() if "Index Cond" in line]
+                self.assertTrue(
+                    any("(recvtimets)::bigint >=" in line for line in index_conditions), plan
+                )
+                self.assertNotIn("::numeric", plan)
+
+    def test_create_index_rebuilds_invalid_index(self):
+        IndexAdvisor.advise(self.engine, create=True)
+        # simulate the leftover of an interrupted concurrent build
+        self.engine.execute(
+            sqlalchemy.text(
+                "update pg_index set indisvalid = false where indexrelid = to_regclass(:index);"
+            ),
+            {"index": f"{POSTGRES_SCHEMA}.{IndexAdvisor.get_index_name(WORKSTATION_TABLE)}"},
+        )
+        self.assertEqual(IndexAdvisor.get_index_state(self.con, WORKSTATION_TABLE), "invalid")
+        reports = IndexAdvisor.advise(self.engine, create=True)
+        self.assertEqual(reports[0]["index"], "invalid")
+        self.assertIsNotNone(reports[0]["latency_after"])
+        self.assertEqual(IndexAdvisor.get_index_state(self.con, WORKSTATION_TABLE), "valid")
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""test KPIHistory
+"""
+# Standard Library imports
+from datetime import datetime, timezone
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# PyPI imports
+import psycopg2
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+import KPIHistory
+from Logger import getLogger
+from LoopHandler import LoopHandler
+import OEE
+from modules.TestCase_common import setupClass_common
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+HISTORY_TABLE = "test_oee_kpi_history"
+PLACES = 5
+
+# Load environment variables
+POSTGRES_SCHEMA = os.environ.get("POSTGRES_SCHEMA")
+
+
+class test_KPIHistory(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+        # the common connection is left in the transaction that uploaded the logs
+        cls.con.close()
+        cls.con = cls.engine.connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.engine.dispose()
+
+    def setUp(self):
+        self.con.execute(f"drop table if exists {POSTGRES_SCHEMA}.{HISTORY_TABLE} cascade;")
+
+    def tearDown(self):
+        self.con.execute(f"drop table if exists {POSTGRES_SCHEMA}.{HISTORY_TABLE} cascade;")
+
+    def get_rows(self) -> list:
+        return self.con.execute(
+            f"select * from {POSTGRES_SCHEMA}.{HISTORY_TABLE} order by recvtime, workstation;"
+        ).fetchall()
+
+    def get_partitions(self) -> list:
+        return [
+            row[0]
+            for row in self.con.execute(
+                f"""select cast (inhrelid as regclass) from pg_inherits
+                    where inhparent = cast ('{POSTGRES_SCHEMA}.{HISTORY_TABLE}' as regclass) order by 1;"""
+            )
+        ]
+
+    def test_flush(self):
+        history = KPIHistory.KPIHistory(HISTORY_TABLE)
+        self.assertEqual(history.flush(self.con), 0)
+        first_day = datetime(2022, 4, 4, 23, 59, 0, tzinfo=timezone.utc)
+        second_day = datetime(2022, 4, 5, 0, 1, 0, tzinfo=timezone.utc)
+        oee = {"availability": 0.5, "performance": 0.8, "quality": 0.9, "oee": 0.36}
+        history.add(first_day, WORKSTATION_ID, oee, 120.5)
+        history.add(first_day, "urn:ngsiv2:i40Asset:Workstation:002")
+        history.add(second_day, WORKSTATION_ID, oee, 121)
+        self.assertEqual(history.flush(self.con), 3)
+        self.assertEqual(history.rows, [])
+        rows = self.get_rows()
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0].recvtime, first_day)
+        self.assertEqual(rows[0].workstation, WORKSTATION_ID)
+        for kpi, value in oee.items():
+            self.assertAlmostEqual(rows[0][kpi], value, places=PLACES)
+        self.assertAlmostEqual(rows[0].throughput, 120.5, places=PLACES)
+        # the KPIs that could not be calculated are NULL
+        self.assertEqual(tuple(rows[1])[2:], (None,) * 5)
+        self.assertEqual(
+            [partition.split(".")[-1] for partition in self.get_partitions()],
+            [f"{HISTORY_TABLE}_p20220404", f"{HISTORY_TABLE}_p20220405"],
+        )
+
+        # the existing partitions are not created again
+        history.add(second_day, WORKSTATION_ID, oee, 122)
+        with patch.object(KPIHistory, "create_day_partition") as mock_create_day_partition:
+            self.assertEqual(history.flush(self.con), 1)
+        mock_create_day_partition.assert_not_called()
+        self.assertEqual(len(self.get_rows()), 4)
+
+    def test_failed_flush_keeps_rows(self):
+        history = KPIHistory.KPIHistory(HISTORY_TABLE, max_rows=2)
+        timestamp = datetime(2022, 4, 4, 9, 0, 0, tzinfo=timezone.utc)
+        history.add(timestamp, None)
+        with self.assertRaises(psycopg2.errors.NotNullViolation):
+            history.flush(self.con)
+        self.assertEqual(len(history.rows), 1)
+        # the partition was rolled back, so it is created again
+        self.assertEqual(history.days, set())
+        # the oldest rows are dropped from a full buffer
+        history.add(timestamp, WORKSTATION_ID)
+        history.add(timestamp, WORKSTATION_ID)
+        self.assertEqual([row[1] for row in history.rows], [WORKSTATION_ID, WORKSTATION_ID])
+        self.assertEqual(history.flush(self.con), 2)
+        self.assertEqual(len(self.get_rows()), 2)
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_LoopHandler_history(self, mock_datetime):
+        mock_datetime.now.return_value = datetime(2022, 4, 4, 9, 0, 0)
+        history = KPIHistory.KPIHistory(HISTORY_TABLE)
+        with patch.object(LoopHandler, "history", history):
+            loopHandler = LoopHandler()
+            loopHandler.handle()
+        self.assertEqual(history.rows, [])
+        rows = self.get_rows()
+        self.assertEqual(len(rows), len(loopHandler.workstations))
+        row = [row for row in rows if row.workstation == WORKSTATION_ID][0]
+        self.assertEqual(row.recvtime, loopHandler.started)
+        self.assertAlmostEqual(row.availability, 50 / 60, places=PLACES)
+        self.assertAlmostEqual(row.quality, 70 / 71, places=PLACES)
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_LoopHandler_failed_update(self, mock_datetime):
+        mock_datetime.now.return_value = datetime(2022, 4, 4, 9, 0, 0)
+        history = KPIHistory.KPIHistory(HISTORY_TABLE)
+
+        def update_attribute(object_id, attribute_name, attribute_type, attribute_value):
+            if attribute_name == "oee" and attribute_value is not None:
+                raise RuntimeError("Failed to update the oee attribute")
+
+        with patch.object(LoopHandler, "history", history), patch.object(
+            LoopHandler, "update_attribute", side_effect=update_attribute
+        ):
+            loopHandler = LoopHandler()
+            loopHandler.con = self.con
+            loopHandler.started = datetime.now(timezone.utc)
+            with self.assertLogs(LoopHandler.logger, level="ERROR") as logs:
+                loopHandler.handle_workstation(WORKSTATION_ID)
+        self.assertIn("Failed to update the oee attribute", logs.output[0])
+        # the KPIs are cleared in Orion, so the row has no KPIs either
+        self.assertEqual(history.rows, [(loopHandler.started, WORKSTATION_ID) + (None,) * 5])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
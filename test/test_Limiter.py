@@ -0,0 +1,171 @@
+"""test Limiter
+"""
+# Standard Library imports
+from datetime import datetime
+import os
+import sys
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+# PyPI imports
+import requests
+import sqlalchemy
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+import Limiter
+from Logger import getLogger
+from LoopHandler import LoopHandler
+import OEE
+import Orion
+import Statements
+from modules.TestCase_common import setupClass_common
+
+# Constants
+JOB_ID = "urn:ngsiv2:i40Process:Job:000001"
+JOB_TABLE = JOB_ID.lower().replace(":", "_") + "_i40process"
+SLEEP_QUERY = "select pg_sleep(:seconds) as slept;"
+
+
+class test_Limiter(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+        # the common connection is left in the transaction that uploaded the logs
+        cls.con.close()
+        cls.con = cls.engine.connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.engine.dispose()
+
+    def test_AdaptiveLimiter(self):
+        limiter = Limiter.AdaptiveLimiter("test", initial=2, min_limit=1, max_limit=3, tolerance=2, backoff_ratio=0.5)
+        # the limit grows while it is used and the latency is flat
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(0.1)
+        self.assertEqual(limiter.get_limit(), 3)
+        self.assertAlmostEqual(limiter.get_metrics()["baseline_seconds"][Limiter.DEFAULT_REQUEST_CLASS], 0.1)
+        # only while at least half of it is used
+        self.assertEqual(limiter.get_metrics()["increases"], 1)
+        # a rising latency decreases it
+        limiter.acquire()
+        limiter.release(0.5)
+        self.assertEqual(limiter.get_limit(), 1)
+        # so does an overloaded server, but not below the minimum
+        limiter.acquire()
+        limiter.release(0.1, overloaded=True)
+        self.assertEqual(limiter.get_limit(), 1)
+        # a failed request without a latency does not change it
+        limiter.acquire()
+        limiter.release()
+        metrics = limiter.get_metrics()
+        self.assertEqual((metrics["limit"], metrics["decreases"], metrics["in_flight"]), (1, 2, 0))
+        with self.assertRaises(ValueError):
+            Limiter.AdaptiveLimiter("test", min_limit=2, max_limit=1)
+
+    def test_request_classes(self):
+        limiter = Limiter.AdaptiveLimiter("test", initial=4, min_limit=1, max_limit=8, tolerance=2, backoff_ratio=0.5)
+        # a fast and a slow endpoint interleaved, each with a flat latency
+        for _ in range(10):
+            for request_class, latency in (("GET /v2/entities/{id}", 0.01), ("GET /v2/entities", 0.5)):
+                for _ in range(4):
+                    limiter.acquire()
+                for _ in range(4):
+                    limiter.release(latency, request_class=request_class)
+        metrics = limiter.get_metrics()
+        self.assertEqual(metrics["decreases"], 0)
+        self.assertEqual(metrics["limit"], 8)
+        self.assertAlmostEqual(metrics["baseline_seconds"]["GET /v2/entities/{id}"], 0.01)
+        self.assertAlmostEqual(metrics["baseline_seconds"]["GET /v2/entities"], 0.5)
+        # a rising latency of the fast class still decreases the limit
+        limiter.acquire()
+        limiter.release(0.1, request_class="GET /v2/entities/{id}")
+        self.assertEqual(limiter.get_limit(), 4)
+
+    def test_throttling(self):
+        limiter = Limiter.AdaptiveLimiter("test", initial=1, max_limit=1)
+        finished = threading.Event()
+
+        def request():
+            with limiter.limit():
+                finished.set()
+
+        with limiter.limit() as slot:
+            thread = threading.Thread(target=request)
+            thread.start()
+            # the other request waits for the limit
+            self.assertFalse(finished.wait(0.1))
+            slot["overloaded"] = True
+        thread.join(5)
+        self.assertTrue(finished.is_set())
+        metrics = limiter.get_metrics()
+        self.assertEqual((metrics["throttled"], metrics["max_in_flight"], metrics["decreases"]), (1, 1, 1))
+        # an exception escaping the block releases the slot
+        with self.assertRaises(KeyError):
+            with limiter.limit():
+                raise KeyError("somehow")
+        self.assertEqual(limiter.get_metrics()["in_flight"], 0)
+
+    def test_Orion(self):
+        self.assertEqual(
+            Orion.get_request_class(requests.get, f"http://orion:1026/v2/entities/{JOB_ID}?options=keyValues"),
+            "GET /v2/entities/{id}",
+        )
+        self.assertEqual(
+            Orion.get_request_class(requests.post, "http://orion:1026/v2/op/update"), "POST /v2/op/update"
+        )
+        limiter = Limiter.AdaptiveLimiter("Orion", initial=4, backoff_ratio=0.5)
+        with patch.object(Orion, "limiter", limiter):
+            self.assertTrue(Orion.is_reachable())
+            self.assertEqual(limiter.get_limit(), 4)
+            self.assertEqual(list(limiter.get_metrics()["baseline_seconds"]), ["GET /version"])
+            with patch("requests.get", return_value=MagicMock(status_code=503)):
+                with self.assertRaises(RuntimeError):
+                    Orion.get(JOB_ID)
+            self.assertEqual(limiter.get_limit(), 2)
+            with patch("requests.post", side_effect=requests.exceptions.ConnectionError("refused")):
+                with self.assertRaises(requests.exceptions.ConnectionError):
+                    Orion.update_attribute(JOB_ID, "oee", "Number", 0.5)
+            self.assertEqual(limiter.get_limit(), 1)
+            self.assertEqual(limiter.get_metrics()["in_flight"], 0)
+
+    @patch.dict(Statements.STATEMENT_TIMEOUTS, {"logs": 100})
+    def test_Statements(self):
+        limiter = Limiter.AdaptiveLimiter("PostgreSQL", initial=4, backoff_ratio=0.5)
+        with patch.object(Statements, "limiter", limiter):
+            with Statements.timed_query(self.con, "logs", JOB_TABLE, SLEEP_QUERY, {"seconds": 0}):
+                self.con.execute(sqlalchemy.text(SLEEP_QUERY), {"seconds": 0})
+            self.assertEqual(list(limiter.get_metrics()["baseline_seconds"]), ["logs"])
+            # the statement timeout decreases the limit
+            with self.assertRaises(RuntimeError):
+                with Statements.timed_query(self.con, "logs", JOB_TABLE, SLEEP_QUERY, {"seconds": 2}):
+                    self.con.execute(sqlalchemy.text(SLEEP_QUERY), {"seconds": 2})
+            self.assertEqual(limiter.get_metrics()["decreases"], 1)
+            self.assertEqual(limiter.get_metrics()["in_flight"], 0)
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_LoopHandler_limits(self, mock_datetime):
+        mock_datetime.now.return_value = datetime(2022, 4, 4, 9, 0, 0)
+        orion_limiter = Limiter.AdaptiveLimiter("Orion")
+        postgres_limiter = Limiter.AdaptiveLimiter("PostgreSQL")
+        with patch.object(Orion, "limiter", orion_limiter), patch.object(Statements, "limiter", postgres_limiter):
+            with self.assertLogs(LoopHandler.logger, level="INFO") as logs:
+                LoopHandler().handle()
+        self.assertTrue(any("Concurrency limit of Orion" in line for line in logs.output))
+        self.assertTrue(any("Concurrency limit of PostgreSQL" in line for line in logs.output))
+        self.assertEqual(orion_limiter.get_metrics()["in_flight"], 0)
+        self.assertGreater(orion_limiter.get_metrics()["max_in_flight"], 0)
+        self.assertGreater(postgres_limiter.get_metrics()["max_in_flight"], 0)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
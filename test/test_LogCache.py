@@ -0,0 +1,177 @@
+"""test LogCache
+"""
+# Standard Library imports
+import copy
+from datetime import date, datetime
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# PyPI imports
+import numpy as np
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+import LogCache
+from Logger import getLogger
+import OEE
+from modules.TestCase_common import setupClass_common
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+WORKSTATION_TABLE = WORKSTATION_ID.lower().replace(":", "_") + "_i40asset"
+JOB_ID = "urn:ngsiv2:i40Process:Job:000001"
+JOB_TABLE = JOB_ID.lower().replace(":", "_") + "_i40process"
+DAY = date(2022, 4, 4)
+PLACES = 5
+
+
+def get_arrays(timestamps: list) -> dict:
+    return {
+        "recvtimets": np.array(timestamps, dtype=np.int64),
+        "attrname": np.array(["available"] * len(timestamps)),
+        "attrvalue": np.array(["true"] * len(timestamps)),
+    }
+
+
+class test_LogCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+        # the common connection is left in the transaction that uploaded the logs
+        cls.con.close()
+        cls.con = cls.engine.connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.engine.dispose()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def get_cache(self, **kwargs) -> LogCache.LogCache:
+        with patch(f"{LogCache.__name__}.datetime", wraps=datetime) as mock_datetime:
+            mock_datetime.now.return_value = datetime(2022, 4, 4, 9, 0, 0)
+            return LogCache.LogCache(self.directory.name, **kwargs)
+
+    def calculate_OEE(self, now: datetime, log_cache: LogCache.LogCache = None) -> OEE.OEECalculator:
+        with patch(f"{OEE.__name__}.datetime", wraps=datetime) as mock_datetime:
+            mock_datetime.now.return_value = now
+            oee = copy.deepcopy(self.oee_template)
+            oee.log_cache = log_cache
+            oee.prepare(self.con)
+            oee.calculate_OEE()
+            oee.calculate_throughput()
+        return oee
+
+    def test_store_load(self):
+        cache = self.get_cache()
+        key = LogCache.get_key(WORKSTATION_TABLE)
+        self.assertIsNone(cache.load(key, DAY))
+        cache.store(key, DAY, get_arrays([1, 2, 3]), 3.5)
+        entry = cache.load(key, DAY)
+        self.assertIsInstance(entry["recvtimets"], np.memmap)
+        self.assertEqual(entry["recvtimets"].tolist(), [1, 2, 3])
+        self.assertEqual(entry["attrvalue"].tolist(), ["true"] * 3)
+        self.assertEqual(entry["watermark"], 3.5)
+        # the entry is replaced, no temporary directory is left
+        cache.store(key, DAY, get_arrays([1, 2, 3, 4]), 4.5)
+        self.assertEqual(cache.load(key, DAY)["recvtimets"].tolist(), [1, 2, 3, 4])
+        self.assertEqual(os.listdir(os.path.dirname(cache.get_path(key, DAY))), [key])
+        # the keys of the entities sharing a table differ
+        self.assertNotEqual(LogCache.get_key("i40asset", WORKSTATION_ID), LogCache.get_key("i40asset", "other"))
+
+    def test_append(self):
+        cache = self.get_cache(max_segments=2)
+        key = LogCache.get_key(WORKSTATION_TABLE)
+        cache.store(key, DAY, get_arrays([1, 2, 3]), 3.5)
+        path = cache.get_path(key, DAY)
+        written = os.stat(os.path.join(path, "recvtimets.npy")).st_mtime_ns
+        # the tail since the overlap replaces the cached logs since its start
+        cache.append(key, DAY, get_arrays([3, 4, 5]), 2.5, 5.5)
+        cache.append(key, DAY, get_arrays([5, 6]), 4.5, 6.5)
+        entry = cache.load(key, DAY)
+        self.assertEqual(entry["recvtimets"].tolist(), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(entry["attrvalue"].tolist(), ["true"] * 6)
+        self.assertEqual((entry["watermark"], entry["segments"]), (6.5, 2))
+        # the arrays of the entry are not rewritten
+        self.assertEqual(os.stat(os.path.join(path, "recvtimets.npy")).st_mtime_ns, written)
+        # the compacted entry has no segments
+        cache.store(key, DAY, entry, entry["watermark"])
+        entry = cache.load(key, DAY)
+        self.assertEqual(entry["recvtimets"].tolist(), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(entry["segments"], 0)
+        files = [f"{column}.npy" for column in LogCache.COLUMNS] + [LogCache.META_FILE]
+        self.assertEqual(sorted(os.listdir(path)), sorted(files))
+
+    def test_corrupt_entry(self):
+        cache = self.get_cache()
+        cache.store("table", DAY, get_arrays([1, 2]), 2)
+        path = cache.get_path("table", DAY)
+        with open(os.path.join(path, "attrname.npy"), "w") as f:
+            f.write("not an array")
+        self.assertIsNone(cache.load("table", DAY))
+        self.assertFalse(os.path.exists(path))
+
+    def test_clean_up(self):
+        cache = self.get_cache()
+        cache.store("table", date(2022, 4, 3), get_arrays([1]), 1)
+        cache.store("table", DAY, get_arrays([1]), 1)
+        self.assertEqual(os.listdir(self.directory.name), [DAY.isoformat()])
+        # the least recently written entries are deleted above max_bytes
+        cache.max_bytes = LogCache.get_directory_size(cache.get_path("table", DAY)) * 2
+        path = cache.get_path("table", DAY)
+        os.utime(os.path.join(path, LogCache.META_FILE), (0, 0))
+        cache.store("other", DAY, get_arrays([1]), 1)
+        cache.store("third", DAY, get_arrays([1]), 1)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(path))), ["other", "third"])
+        # the cache's directory is only scanned when the day changes
+        cache.max_bytes = LogCache.LOG_CACHE_MAX_BYTES
+        with patch.object(cache, "clean_up", wraps=cache.clean_up) as mock_clean_up:
+            cache.store("other", DAY, get_arrays([1]), 1)
+            cache.append("other", DAY, get_arrays([1]), 1, 2)
+            mock_clean_up.assert_not_called()
+        # the temporary directories of a crashed write are deleted by a new cache
+        os.mkdir(os.path.join(os.path.dirname(path), ".table.crashed"))
+        cache = self.get_cache()
+        self.assertEqual(sorted(os.listdir(os.path.dirname(path))), ["other", "third"])
+        with patch.object(cache, "clean_up", wraps=cache.clean_up) as mock_clean_up:
+            cache.store("other", date(2022, 4, 5), get_arrays([1]), 1)
+            mock_clean_up.assert_called_once_with(date(2022, 4, 5))
+        self.assertEqual(os.listdir(self.directory.name), ["2022-04-05"])
+
+    def test_OEECalculator_log_cache(self):
+        cache = self.get_cache()
+        for now in (datetime(2022, 4, 4, 9, 0, 0), datetime(2022, 4, 4, 12, 30, 0)):
+            expected = self.calculate_OEE(now)
+            # a new cache on the same directory, like after a restart
+            cache = self.get_cache()
+            oee = self.calculate_OEE(now, cache)
+            for kpi in ("availability", "performance", "quality", "oee"):
+                self.assertAlmostEqual(oee.oee[kpi], expected.oee[kpi], places=PLACES)
+            self.assertAlmostEqual(oee.throughput, expected.throughput, places=PLACES)
+            entry = cache.load(LogCache.get_key(WORKSTATION_TABLE), DAY)
+            self.assertEqual(entry["watermark"], oee.now_unix)
+        # the logs since the previous calculation were appended
+        self.assertEqual(entry["segments"], 1)
+        # only the logs since the previous calculation were downloaded
+        for table_name in (WORKSTATION_TABLE, JOB_TABLE):
+            self.assertLess(oee.rows_read[table_name], expected.rows_read[table_name])
+        self.assertTrue(
+            (entry["recvtimets"] >= oee.get_query_start_timestamp("from_midnight")).all()
+        )
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""test Metrics
+"""
+# Standard Library imports
+from datetime import datetime
+import os
+import sys
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+import urllib.error
+import urllib.request
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+from Logger import getLogger
+from LoopHandler import LoopHandler
+import main as main_module
+import Metrics
+import OEE
+import Orion
+import Resilience
+from modules.TestCase_common import setupClass_common
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+STAGES = ("orion_fetch", "sql_query", "parse", "compute", "publish")
+
+
+class test_Metrics(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.engine.dispose()
+
+    def test_render(self):
+        registry = Metrics.Registry()
+        counter = registry.counter("test_requests_total", "The requests", ("method", "status"))
+        gauge = registry.gauge("test_depth", "The depth")
+        histogram = registry.histogram("test_seconds", "The durations", ("stage",), buckets=(0.1, 1))
+        counter.inc(("GET", "200"))
+        counter.inc(("GET", "200"), 2)
+        counter.inc(('say "hi"\\', "500"))
+        gauge.set(1.5)
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, ("sql",))
+        registry.add_collector(lambda: [("test_collected", "gauge", "Collected", [({"name": "a"}, None)])])
+        registry.add_collector(MagicMock(side_effect=RuntimeError("broken")))
+        with self.assertRaises(ValueError):
+            registry.gauge("test_depth", "The depth again")
+        with self.assertLogs(Metrics.Registry.logger, level="ERROR"):
+            lines = registry.render().decode("utf-8").splitlines()
+        self.assertEqual(lines[:5], [
+            "# HELP test_requests_total The requests",
+            "# TYPE test_requests_total counter",
+            'test_requests_total{method="GET",status="200"} 3',
+            'test_requests_total{method="say \\"hi\\"\\\\",status="500"} 1',
+            "# HELP test_depth The depth",
+        ])
+        self.assertIn("test_depth 1.5", lines)
+        # the buckets are cumulative
+        self.assertIn('test_seconds_bucket{stage="sql",le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="sql",le="1"} 3', lines)
+        self.assertIn('test_seconds_bucket{stage="sql",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_sum{stage="sql"} 3.65', lines)
+        self.assertIn('test_seconds_count{stage="sql"} 4', lines)
+        self.assertIn('test_collected{name="a"} NaN', lines)
+        self.assertEqual(histogram.get(("sql",)), (4, 3.65))
+
+    def test_MetricsServer(self):
+        registry = Metrics.Registry()
+        registry.counter("test_total", "Test").inc()
+        server = Metrics.MetricsServer(registry, "127.0.0.1", 0)
+        server.start()
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics", timeout=5) as response:
+                self.assertEqual(response.headers["Content-Type"], Metrics.CONTENT_TYPE)
+                self.assertIn(b"\ntest_total 1\n", response.read())
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(f"http://127.0.0.1:{server.port}/kpis", timeout=5)
+            self.assertEqual(context.exception.code, 404)
+        finally:
+            server.stop()
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_LoopHandler_metrics(self, mock_datetime):
+        mock_datetime.now.return_value = datetime(2022, 4, 4, 9, 0, 0)
+        stage_counts = {stage: Metrics.STAGE_DURATION.get((stage,))[0] for stage in STAGES}
+        rows = Metrics.SQL_ROWS.get(("logs",)) or 0
+        requests = Metrics.ORION_REQUESTS.get(("GET", "200")) or 0
+        LoopHandler().handle()
+        for stage in STAGES:
+            self.assertGreater(Metrics.STAGE_DURATION.get((stage,))[0], stage_counts[stage], stage)
+        self.assertGreater(Metrics.WORKSTATION_DURATION.get((WORKSTATION_ID,)), 0)
+        self.assertGreater(Metrics.SQL_ROWS.get(("logs",)), rows)
+        self.assertGreater(Metrics.SQL_BYTES.get(("logs",)), 0)
+        self.assertGreater(Metrics.ORION_REQUESTS.get(("GET", "200")), requests)
+        self.assertGreaterEqual(Metrics.POOL_CONNECTIONS.get(("size",)), 1)
+        # a failing calculation is counted by its exception
+        errors = Metrics.ERRORS.get(("workstation", "ZeroDivisionError")) or 0
+        with patch.object(LoopHandler, "calculate_KPIs", side_effect=ZeroDivisionError("zero")), patch.object(
+            Orion, "update_attribute"
+        ):
+            LoopHandler().handle()
+        self.assertEqual(Metrics.ERRORS.get(("workstation", "ZeroDivisionError")), errors + 1)
+        # the optional components are collected at the scrape
+        with patch.object(Orion, "breaker", Resilience.CircuitBreaker("Orion")):
+            text = Metrics.registry.render().decode("utf-8")
+        self.assertIn('oee_orion_circuit_state{state="closed"} 1', text)
+        self.assertIn("oee_orion_circuit_rejected 0", text)
+        self.assertIn('oee_stage_duration_seconds_count{stage="compute"}', text)
+
+    @patch(f"{main_module.__name__}.LoopHandler")
+    def test_loop_metrics(self, mock_LoopHandler):
+        lags = Metrics.SCHEDULER_LAG.get()[0]
+        loops = Metrics.LOOP_DURATION.get()[0]
+        scheduler = MagicMock()
+        scheduler.enter.return_value.time = 1e10
+        with patch.object(main_module, "next_loop_due", time.time() - 2):
+            main_module.loop(scheduler)
+            self.assertEqual(main_module.next_loop_due, 1e10)
+        mock_LoopHandler.return_value.handle.assert_called_once_with()
+        self.assertEqual(Metrics.SCHEDULER_LAG.get()[0], lags + 1)
+        self.assertGreaterEqual(Metrics.SCHEDULER_LAG.get()[1], 2)
+        self.assertEqual(Metrics.LOOP_DURATION.get()[0], loops + 1)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
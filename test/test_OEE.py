@@ -12,6 +12,7 @@ from unittest.mock import patch
 import numpy as np
 import pandas as pd
 import psycopg2
+import sqlalchemy
 
 # Custom imports
 sys.path.insert(0, os.path.join("..", "src"))
@@ -455,6 +456,97 @@ class test_OEECalculator(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.oee.get_current_job_start_time_today()
 
+    def insert_RefJob_row_into_postgres_at(self, datetime_: datetime, job_id: str):
+        timestamp = int(self.oee.datetime_to_milliseconds(datetime_))
+        self.con.execute(
+            sqlalchemy.text(
+                f"""insert into {POSTGRES_SCHEMA}.{workstation_TABLE}
+                (recvtimets, recvtime, fiwareservicepath, entityid, entitytype, attrname, attrtype, attrvalue, attrmd)
+                values ('{timestamp}', '', '/', '{workstation_ID}', 'i40Asset', 'refJob', 'Text', '{job_id}', '[]');"""
+            )
+        )
+
+    def delete_RefJob_rows_from_postgres(self):
+        self.con.execute(
+            sqlalchemy.text(f"delete from {POSTGRES_SCHEMA}.{workstation_TABLE} where attrname = 'refJob';")
+        )
+
+    def test_query_refJob_boundary_rows(self):
+        now = datetime(2022, 4, 4, 13, 0, 0)
+        self.oee.now_unix = now.timestamp()*1e3
+        self.oee.shift["orion"] = copy.deepcopy(self.jsons["shift001"])
+        self.oee.get_todays_shift_limits()
+        self.oee.job["id"] = JOB_ID
+        self.oee.workstation["orion"] = copy.deepcopy(self.jsons["workstation001"])
+        self.oee.workstation["postgres_table"] = workstation_TABLE
+        try:
+            df = self.oee.query_refJob_boundary_rows(self.con, workstation_TABLE)
+            self.assertEqual(len(df), 0)
+
+            dt_at_9h00 = datetime(2022, 4, 4, 9, 0, 0)
+            dt_at_9h30 = datetime(2022, 4, 4, 9, 30, 0)
+            self.insert_RefJob_row_into_postgres_at(dt_at_9h00, JOB_ID)
+            self.insert_RefJob_row_into_postgres_at(dt_at_9h30, JOB_ID)
+            self.oee.workstation["df"] = self.oee.convert_and_sort_logs(
+                self.oee.query_refJob_boundary_rows(self.con, workstation_TABLE)
+            )
+            self.assertEqual(len(self.oee.workstation["df"]), 2)
+            self.assertEqual(self.oee.get_current_job_start_time_today(), dt_at_9h00)
+
+            # the last refJob record differs from the Workstation's refJob
+            self.insert_RefJob_row_into_postgres_at(datetime(2022, 4, 4, 10, 0, 0), "urn:ngsiv2:i40Process:Job:000002")
+            self.oee.workstation["df"] = self.oee.convert_and_sort_logs(
+                self.oee.query_refJob_boundary_rows(self.con, workstation_TABLE)
+            )
+            with self.assertRaises(ValueError):
+                self.oee.get_current_job_start_time_today()
+        finally:
+            self.delete_RefJob_rows_from_postgres()
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_boundary_workstation_query_mode(self, mock_datetime):
+        for now in (
+            datetime(2022, 4, 4, 8, 10, 0),
+            datetime(2022, 4, 4, 8, 25, 0),
+            datetime(2022, 4, 4, 8, 45, 0),
+            datetime(2022, 4, 4, 9, 0, 0),
+        ):
+            mock_datetime.now.return_value = now
+            oee_from_midnight = copy.deepcopy(self.oee_template)
+            oee_from_midnight.prepare(self.con)
+            oee_from_midnight.handle_availability()
+            oee_boundary = copy.deepcopy(self.oee_template)
+            oee_boundary.workstation_query_mode = "boundary"
+            oee_boundary.prepare(self.con)
+            # only the last available record before reference_start_time is queried
+            df_before = oee_boundary.filter_in_relation_to_reference_start_time(
+                oee_boundary.workstation["df"], how="before"
+            )
+            self.assertLessEqual(len(df_before), 1)
+            oee_boundary.handle_availability()
+            self.assertAlmostEqual(
+                oee_boundary.oee["availability"], oee_from_midnight.oee["availability"], places=PLACES
+            )
+            self.assertEqual(oee_boundary.total_available_time, oee_from_midnight.total_available_time)
+
+        self.oee.workstation_query_mode = "boundary"
+        self.oee.prepare(self.con)
+        self.oee.calculate_OEE()
+        self.assertAlmostEqual(self.oee.oee["availability"], 50 / 60, places=PLACES)
+
+        # available: true since midnight, but not among the queried rows
+        df = self.oee.workstation["df"]
+        self.oee.workstation["df"] = df[df["attrvalue"] != "true"]
+        self.oee.workstation["available_since_midnight"] = True
+        self.oee.handle_availability()
+        self.oee.workstation["available_since_midnight"] = False
+        with self.assertRaises(ValueError):
+            self.oee.handle_availability()
+
+        self.oee.workstation_query_mode = "somehow_else"
+        with self.assertRaises(NotImplementedError):
+            self.oee.prepare(self.con)
+
     def test_set_reference_start_time(self):
         now = datetime(2022, 4, 5, 13, 46, 40)
         self.oee.now_unix = now.timestamp()*1e3
@@ -688,6 +780,59 @@ class test_OEECalculator(unittest.TestCase):
         self.assertEqual(self.oee.n_failed_cycles, n_failed_cycles)
         self.assertEqual(self.oee.n_total_cycles, n_total_cycles)
 
+    def test_count_cycles_based_on_counter_extrema(self):
+        self.oee.operation["orion"] = copy.deepcopy(self.jsons["operation_part001_001"])
+        # 16, ..., 56 --> 6 cycles
+        self.assertEqual(self.oee.count_cycles_based_on_counter_extrema(16, 56, False), 6)
+        # 0, ..., 56 --> 7 cycles
+        self.assertEqual(self.oee.count_cycles_based_on_counter_extrema(0, 56, True), 7)
+        self.oee.operation["orion"]["partsPerCycle"]["value"] = 0
+        with self.assertRaises(ZeroDivisionError):
+            self.oee.count_cycles_based_on_counter_extrema(0, 56, True)
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_query_counter_aggregates(self, mock_datetime):
+        now = datetime(2022, 4, 4, 9, 0, 0)
+        mock_datetime.now.return_value = now
+        self.oee.prepare(self.con)
+        counters = self.oee.query_counter_aggregates(self.con, self.oee.job["postgres_table"])
+        job_df = self.oee.job["df"]
+        for attribute in ("goodPartCounter", "rejectPartCounter"):
+            values = job_df[job_df["attrname"] == attribute]["attrvalue"].astype(int)
+            self.assertEqual(counters[attribute]["min_value"], values.min())
+            self.assertEqual(counters[attribute]["max_value"], values.max())
+            self.assertEqual(counters[attribute]["zero_present"], 0 in values.values)
+
+        with patch("pandas.read_sql_query") as mock_read_sql_query:
+            mock_read_sql_query.side_effect = psycopg2.errors.UndefinedTable
+            with self.assertRaises(RuntimeError):
+                self.oee.query_counter_aggregates(self.con, self.oee.job["postgres_table"])
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_aggregate_job_query_mode(self, mock_datetime):
+        now = datetime(2022, 4, 4, 9, 0, 0)
+        mock_datetime.now.return_value = now
+        self.oee.job_query_mode = "aggregate"
+        self.oee.prepare(self.con)
+        self.assertIsNone(self.oee.job["df"])
+        self.oee.calculate_OEE()
+        self.assertEqual(self.oee.n_successful_cycles, 70)
+        self.assertEqual(self.oee.n_failed_cycles, 1)
+        self.assertAlmostEqual(self.oee.oee["quality"], 70 / 71, places=PLACES)
+        self.assertAlmostEqual(self.oee.oee["performance"], (71 * 46) / (50 * 60), places=PLACES)
+
+        # no counter logs since reference_start_time
+        self.oee.job["counters"] = {}
+        with self.assertRaises(ValueError):
+            self.oee.handle_quality()
+        self.oee.job["counters"] = {"rejectPartCounter": {"min_value": 0, "max_value": 8, "zero_present": True}}
+        with self.assertRaises(ValueError):
+            self.oee.count_cycles()
+
+        self.oee.job_query_mode = "somehow_else"
+        with self.assertRaises(NotImplementedError):
+            self.oee.prepare(self.con)
+
     @patch(f"{OEE.__name__}.datetime", wraps=datetime)
     def test_handle_quality(self, mock_datetime):
         now = datetime(2022, 4, 4, 9, 0, 0)
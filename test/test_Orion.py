@@ -71,6 +71,19 @@ class test_Orion(unittest.TestCase):
             with self.assertRaises(RuntimeError):
                 Orion.get("urn:ngsiv2:i40Asset:Part:part001")
 
+    def test_get_objects(self):
+        self.assertEqual(
+            [remove_orion_metadata(object_) for object_ in Orion.get_objects([self.obj["id"], self.obj["id"], "missing"])],
+            [self.obj],
+        )
+        # one request for each batch
+        with patch.object(Orion, "GET_OBJECTS_BATCH_SIZE", 1), patch.object(
+            Orion, "get_request", wraps=Orion.get_request
+        ) as mock_get_request:
+            self.assertEqual(len(Orion.get_objects([self.obj["id"], "missing"])), 1)
+        self.assertEqual(mock_get_request.call_count, 2)
+        self.assertEqual(Orion.get_objects([]), [])
+
     def test_exists(self):
         self.assertTrue(Orion.exists("urn:ngsiv2:i40Asset:Part:part001"))
         self.assertFalse(Orion.exists("urn:ngsiv2:i40Asset:Part_Core002"))
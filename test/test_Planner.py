@@ -0,0 +1,215 @@
+"""test Planner
+"""
+# Standard Library imports
+import copy
+from datetime import datetime
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# PyPI imports
+import numpy as np
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+import OEE
+import LogCache
+from Logger import getLogger
+from LoopHandler import LoopHandler
+import Orion
+import Planner
+from modules.TestCase_common import setupClass_common
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+WORKSTATION_TABLE = WORKSTATION_ID.lower().replace(":", "_") + "_i40asset"
+JOB_ID = "urn:ngsiv2:i40Process:Job:000001"
+JOB_TABLE = JOB_ID.lower().replace(":", "_") + "_i40process"
+PLACES = 5
+
+# Load environment variables
+POSTGRES_SCHEMA = os.environ.get("POSTGRES_SCHEMA")
+
+
+class test_Planner(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+        # the common connection is left in the transaction that uploaded the logs
+        cls.con.close()
+        with cls.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as con:
+            for table_name in (WORKSTATION_TABLE, JOB_TABLE):
+                con.execute(f"analyze {POSTGRES_SCHEMA}.{table_name};")
+        cls.con = cls.engine.connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.engine.dispose()
+
+    def count_rows(self, table_name: str, start: float, end: float) -> int:
+        return self.con.execute(
+            f"""select count(*) from {POSTGRES_SCHEMA}.{table_name}
+                where {start} <= cast (recvtimets as bigint) and cast (recvtimets as bigint) <= {end};"""
+        ).scalar()
+
+    def test_estimate_rows_from_statistics(self):
+        statistics = {"n_live_tup": 1000, "n_mod_since_analyze": 0, "bounds": np.array([0.0, 100.0, 200.0])}
+        self.assertEqual(Planner.estimate_rows_from_statistics(statistics, 100, 200), 500)
+        self.assertEqual(Planner.estimate_rows_from_statistics(statistics, 50, 1000), 750)
+        self.assertEqual(Planner.estimate_rows_from_statistics(statistics, 300, 400), 0)
+        # the modified rows are assumed to be new logs
+        statistics["n_mod_since_analyze"] = 200
+        self.assertEqual(Planner.estimate_rows_from_statistics(statistics, 300, 400), 200)
+        statistics["bounds"] = None
+        self.assertEqual(Planner.estimate_rows_from_statistics(statistics, 300, 400), 1000)
+
+    def test_choose_strategy(self):
+        planner = Planner.QueryPlanner(full_max_rows=10, database_min_rows=100)
+        self.assertEqual(planner.choose_strategy(10), "full")
+        self.assertEqual(planner.choose_strategy(11), "chunked")
+        self.assertEqual(planner.choose_strategy(100), "database")
+        with self.assertRaises(ValueError):
+            Planner.QueryPlanner(full_max_rows=100, database_min_rows=10)
+
+    def test_estimate_rows_shared_table(self):
+        planner = Planner.QueryPlanner()
+        statistics = {"n_live_tup": 1000, "n_mod_since_analyze": 0, "bounds": None, "n_entities": 4}
+        with patch.object(Planner, "get_table_histogram", return_value=statistics):
+            self.assertEqual(planner.estimate_rows(self.con, "i40asset", 0, 100), (1000, "statistics"))
+            # the rows of one of the entities sharing the table
+            self.assertEqual(planner.estimate_rows(self.con, "i40asset", 0, 100, WORKSTATION_ID), (250, "statistics"))
+            # the last seen counts are kept for each entity
+            planner.last_seen[("i40asset", "other")] = (10, 100)
+            self.assertEqual(planner.estimate_rows(self.con, "i40asset", 0, 100, WORKSTATION_ID), (250, "statistics"))
+            self.assertEqual(planner.estimate_rows(self.con, "i40asset", 0, 100, "other"), (10, "last_seen"))
+
+    def test_get_table_histogram(self):
+        statistics = Planner.get_table_histogram(self.con, JOB_TABLE)
+        self.assertGreater(statistics["n_live_tup"], 0)
+        self.assertTrue(np.all(np.diff(statistics["bounds"]) >= 0))
+        self.assertEqual(statistics["n_entities"], 1)
+        self.assertIsNone(Planner.get_table_histogram(self.con, "missing_table"))
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_plan_and_record(self, mock_datetime):
+        mock_datetime.now.return_value = datetime(2022, 4, 4, 13, 0, 0)
+        planner = Planner.QueryPlanner(full_max_rows=10 ** 6, database_min_rows=10 ** 7)
+        oee_full = copy.deepcopy(self.oee_template)
+        oee_full.planner = planner
+        oee_full.prepare(self.con)
+        oee_full.calculate_OEE()
+        plan = planner.plans[WORKSTATION_ID]
+        self.assertEqual(plan["strategy"], "full")
+        for table_name, table in plan["tables"].items():
+            self.assertEqual(table["source"], "statistics")
+            # an estimate within 25% is enough to choose a strategy
+            self.assertAlmostEqual(
+                table["estimated_rows"], self.count_rows(table_name, *table["window"]), delta=0.25 * table["estimated_rows"] + 5
+            )
+
+        cost = planner.record(oee_full)
+        self.assertEqual(cost["rows_read"], len(oee_full.workstation["df"]) + oee_full.rows_read[JOB_TABLE])
+        self.assertGreater(cost["seconds"], 0)
+        self.assertEqual(planner.plans, {})
+        # the next plan uses the last seen counts
+        oee_full = copy.deepcopy(self.oee_template)
+        oee_full.planner = planner
+        oee_full.prepare(self.con)
+        for table_name, table in planner.plans[WORKSTATION_ID]["tables"].items():
+            self.assertEqual(table["source"], "last_seen")
+            self.assertEqual(table["estimated_rows"], self.count_rows(table_name, *table["window"]))
+
+        for full_max_rows, database_min_rows, strategy in ((0, 10 ** 7, "chunked"), (0, 1, "database")):
+            planner = Planner.QueryPlanner(full_max_rows=full_max_rows, database_min_rows=database_min_rows)
+            oee = copy.deepcopy(self.oee_template)
+            oee.planner = planner
+            oee.prepare(self.con)
+            oee.calculate_OEE()
+            self.assertEqual(planner.plans[WORKSTATION_ID]["strategy"], strategy)
+            for attribute, mode in Planner.STRATEGIES[strategy].items():
+                self.assertEqual(getattr(oee, attribute), mode)
+            for kpi in ("availability", "performance", "quality", "oee"):
+                self.assertAlmostEqual(oee.oee[kpi], oee_full.calculate_OEE()[kpi], places=PLACES)
+            cost = planner.record(oee)
+            self.assertLess(cost["rows_read"], sum(oee_full.rows_read.values()))
+            # only full downloads are kept as last seen counts
+            self.assertEqual(planner.last_seen, {})
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_last_seen_log_cache(self, mock_datetime):
+        planner = Planner.QueryPlanner(full_max_rows=10 ** 6, database_min_rows=10 ** 7)
+        with tempfile.TemporaryDirectory() as directory, patch(
+            f"{LogCache.__name__}.datetime", wraps=datetime
+        ) as mock_cache_datetime:
+            mock_cache_datetime.now.return_value = datetime(2022, 4, 4, 12, 30, 0)
+            log_cache = LogCache.LogCache(directory)
+            for now in (datetime(2022, 4, 4, 12, 30, 0), datetime(2022, 4, 4, 13, 0, 0)):
+                mock_datetime.now.return_value = now
+                oee = copy.deepcopy(self.oee_template)
+                oee.planner = planner
+                oee.log_cache = log_cache
+                oee.prepare(self.con)
+                oee.calculate_OEE()
+                windows = {
+                    table_name: table["window"] for table_name, table in planner.plans[WORKSTATION_ID]["tables"].items()
+                }
+                planner.record(oee)
+        # only the tail was downloaded, but all rows of the window are the last seen count
+        self.assertLess(oee.rows_read[WORKSTATION_TABLE], oee.rows_cached[WORKSTATION_TABLE])
+        for table_name, (start, end) in windows.items():
+            self.assertEqual(
+                planner.last_seen[(table_name, None)], (self.count_rows(table_name, start, end), end - start)
+            )
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_last_seen_refresh(self, mock_datetime):
+        mock_datetime.now.return_value = datetime(2022, 4, 4, 13, 0, 0)
+        planner = Planner.QueryPlanner(full_max_rows=0, database_min_rows=10 ** 7)
+        stale = {(WORKSTATION_TABLE, None): (1, 1000), (JOB_TABLE, None): (1, 1000)}
+        planner.last_seen = dict(stale)
+        planner.day = datetime(2022, 4, 4).date()
+        oee = copy.deepcopy(self.oee_template)
+        oee.planner = planner
+        oee.prepare(self.con)
+        self.assertEqual(planner.plans[WORKSTATION_ID]["strategy"], "chunked")
+        planner.record(oee)
+        # the chunked strategy does not read all rows, the statistics are used again
+        self.assertEqual(planner.last_seen, {})
+        oee.prepare(self.con)
+        for table in planner.plans[WORKSTATION_ID]["tables"].values():
+            self.assertEqual(table["source"], "statistics")
+
+        # the last seen counts expire at midnight
+        planner.last_seen = dict(stale)
+        mock_datetime.now.return_value = datetime(2022, 4, 5, 9, 0, 0)
+        oee = copy.deepcopy(self.oee_template)
+        oee.planner = planner
+        oee.set_now()
+        oee.get_objects_shift_limits()
+        planner.plan(self.con, oee)
+        self.assertEqual(planner.day, datetime(2022, 4, 5).date())
+        for table in planner.plans[WORKSTATION_ID]["tables"].values():
+            self.assertNotEqual(table["source"], "last_seen")
+
+    def test_LoopHandler_failed_plan(self):
+        planner = Planner.QueryPlanner()
+        with patch.object(LoopHandler, "planner", planner), patch.object(
+            OEE.OEECalculator, "calculate_OEE", side_effect=ZeroDivisionError("zero")
+        ), patch.object(Orion, "update_attribute"), patch(f"{OEE.__name__}.datetime", wraps=datetime) as mock_datetime:
+            mock_datetime.now.return_value = datetime(2022, 4, 4, 9, 0, 0)
+            loopHandler = LoopHandler()
+            loopHandler.handle()
+        # the plans of the failed calculations are not kept
+        self.assertEqual(planner.plans, {})
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""test Publisher
+"""
+# Standard Library imports
+from datetime import datetime
+import os
+import sys
+import threading
+import unittest
+from unittest.mock import patch
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+import Deadband
+from Logger import getLogger
+from LoopHandler import LoopHandler
+import OEE
+import Orion
+import Publisher
+from modules.TestCase_common import setupClass_common
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+OTHER_ID = "urn:ngsiv2:i40Asset:Workstation:002"
+PLACES = 5
+
+
+class test_Publisher(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.engine.dispose()
+
+    def test_coalescing(self):
+        release = threading.Event()
+        batches = []
+
+        def update(objects):
+            release.wait()
+            batches.append(objects)
+
+        with patch.object(Orion, "update", side_effect=update):
+            publisher = Publisher.BackgroundPublisher(batch_size=10)
+            # the thread is stuck writing the first update, the others are pending
+            publisher.publish("first", "oee", "Number", 0)
+            publisher.publish(WORKSTATION_ID, "oee", "Number", 0.1)
+            publisher.publish(WORKSTATION_ID, "oeeAvailability", "Number", 0.5)
+            publisher.publish(WORKSTATION_ID, "oee", "Number", 0.2)
+            publisher.publish(OTHER_ID, "oee", "Number", None)
+            release.set()
+            self.assertTrue(publisher.flush(timeout=5))
+            publisher.close()
+        self.assertEqual(
+            sum(batches, []),
+            [
+                {"id": "first", "oee": {"type": "Number", "value": 0}},
+                {
+                    "id": WORKSTATION_ID,
+                    "oee": {"type": "Number", "value": 0.2},
+                    "oeeAvailability": {"type": "Number", "value": 0.5},
+                },
+                {"id": OTHER_ID, "oee": {"type": "Number", "value": None}},
+            ],
+        )
+        metrics = publisher.get_metrics()
+        self.assertEqual((metrics["enqueued"], metrics["coalesced"], metrics["published"]), (5, 1, 3))
+        self.assertEqual((metrics["dropped"], metrics["failed"], metrics["pending"]), (0, 0, 0))
+        self.assertGreaterEqual(metrics["max_lag_seconds"], metrics["last_lag_seconds"])
+
+    def test_bounded(self):
+        release = threading.Event()
+        with patch.object(Orion, "update", side_effect=lambda objects: release.wait()) as mock_update:
+            publisher = Publisher.BackgroundPublisher(max_pending=2, batch_size=10)
+            publisher.publish("first", "oee", "Number", 0)
+            # wait until the thread takes the first update
+            self.assertFalse(publisher.flush(timeout=0.1))
+            for i in range(4):
+                publisher.publish(f"object{i}", "oee", "Number", i)
+            release.set()
+            publisher.close()
+        # the oldest updates are dropped
+        self.assertEqual([entity["id"] for entity in mock_update.call_args.args[0]], ["object2", "object3"])
+        metrics = publisher.get_metrics()
+        self.assertEqual((metrics["dropped"], metrics["published"]), (2, 3))
+
+    def test_retries(self):
+        with patch.object(Orion, "update", side_effect=[RuntimeError("Orion is down"), 204]) as mock_update:
+            publisher = Publisher.BackgroundPublisher(max_retries=2, backoff=0.01)
+            publisher.publish(WORKSTATION_ID, "oee", "Number", 0.1)
+            self.assertTrue(publisher.flush(timeout=5))
+        self.assertEqual(mock_update.call_count, 2)
+        metrics = publisher.get_metrics()
+        self.assertEqual((metrics["retries"], metrics["published"], metrics["failed"]), (1, 1, 0))
+        # the batch is dropped after the last retry
+        with patch.object(Orion, "update", side_effect=RuntimeError("Orion is down")) as mock_update:
+            publisher.publish(WORKSTATION_ID, "oee", "Number", 0.2)
+            self.assertTrue(publisher.flush(timeout=5))
+            publisher.close()
+        self.assertEqual(mock_update.call_count, 3)
+        self.assertEqual(publisher.get_metrics()["failed"], 1)
+
+    def test_retry_absorbs_newer_updates(self):
+        calls = []
+        failed = threading.Event()
+
+        def update(objects):
+            calls.append(objects)
+            if len(calls) == 1:
+                failed.set()
+                raise RuntimeError("Orion is down")
+
+        with patch.object(Orion, "update", side_effect=update):
+            publisher = Publisher.BackgroundPublisher(backoff=0.2)
+            publisher.publish(WORKSTATION_ID, "oee", "Number", 0.1)
+            failed.wait(5)
+            # the update arrives during the backoff
+            publisher.publish(WORKSTATION_ID, "oee", "Number", 0.2)
+            self.assertTrue(publisher.flush(timeout=5))
+            publisher.close()
+        self.assertEqual(calls[-1], [{"id": WORKSTATION_ID, "oee": {"type": "Number", "value": 0.2}}])
+        self.assertEqual(publisher.get_metrics()["published"], 1)
+
+    def test_deadband(self):
+        deadband = Deadband.DeadbandFilter()
+        with patch.object(Orion, "update", side_effect=RuntimeError("Orion is down")):
+            publisher = Publisher.BackgroundPublisher(max_retries=0, on_written=deadband.written)
+            publisher.publish(WORKSTATION_ID, "oee", "Number", None)
+            self.assertTrue(publisher.flush(timeout=5))
+        # the failed value is not suppressed by the deadband
+        self.assertFalse(deadband.suppress(WORKSTATION_ID, "oee", None))
+        with patch.object(Orion, "update"):
+            publisher.publish(WORKSTATION_ID, "oee", "Number", None)
+            self.assertTrue(publisher.flush(timeout=5))
+            publisher.close()
+        self.assertTrue(deadband.suppress(WORKSTATION_ID, "oee", None))
+        self.assertEqual(deadband.get_counts()["written"], 1)
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_LoopHandler_publisher(self, mock_datetime):
+        mock_datetime.now.return_value = datetime(2022, 4, 4, 9, 0, 0)
+        publisher = Publisher.BackgroundPublisher()
+        with patch.object(LoopHandler, "publisher", publisher), patch.object(
+            Orion, "update_attribute"
+        ) as mock_update_attribute:
+            loopHandler = LoopHandler()
+            loopHandler.handle()
+            self.assertTrue(publisher.flush(timeout=10))
+        publisher.close()
+        mock_update_attribute.assert_not_called()
+        metrics = publisher.get_metrics()
+        self.assertEqual(metrics["published"], len(loopHandler.workstations))
+        self.assertEqual(metrics["failed"], 0)
+        workstation = Orion.get(WORKSTATION_ID)
+        self.assertAlmostEqual(workstation["oeeAvailability"]["value"], 50 / 60, places=PLACES)
+        self.assertAlmostEqual(workstation["oeeQuality"]["value"], 70 / 71, places=PLACES)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
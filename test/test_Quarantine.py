@@ -0,0 +1,138 @@
+"""test Quarantine
+"""
+# Standard Library imports
+from datetime import datetime
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# PyPI imports
+import psycopg2
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+import Cygnus
+from Logger import getLogger
+from LoopHandler import LoopHandler
+import OEE
+import Orion
+import Quarantine
+import Resilience
+from modules.TestCase_common import setupClass_common
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+N_KPI_ATTRIBUTES = 6
+
+
+def raise_circuit_open(*args):
+    try:
+        raise Resilience.CircuitOpenError("The circuit of Orion is open, the request is not sent")
+    except RuntimeError as error:
+        raise RuntimeError("Get request failed to URL: url") from error
+
+
+class test_Quarantine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.engine.dispose()
+
+    @patch(f"{Quarantine.__name__}.time")
+    def test_Quarantine(self, mock_time):
+        mock_time.monotonic.return_value = 1000
+        quarantine = Quarantine.Quarantine(after=2, backoff=60, max_backoff=100)
+        self.assertFalse(quarantine.is_failing(WORKSTATION_ID))
+        # the KPIs are cleared at the first failure only
+        self.assertTrue(quarantine.failed(WORKSTATION_ID, "no table"))
+        self.assertFalse(quarantine.check(WORKSTATION_ID, "fingerprint"))
+        self.assertFalse(quarantine.failed(WORKSTATION_ID, "no table"))
+        # quarantined after the second failure
+        self.assertTrue(quarantine.check(WORKSTATION_ID, "fingerprint"))
+        mock_time.monotonic.return_value = 1060
+        # the trial after the backoff fails, the backoff is doubled up to the maximum
+        self.assertFalse(quarantine.check(WORKSTATION_ID, "fingerprint"))
+        quarantine.failed(WORKSTATION_ID, "no table")
+        mock_time.monotonic.return_value = 1159
+        self.assertTrue(quarantine.check(WORKSTATION_ID, "fingerprint"))
+        metrics = quarantine.get_metrics()
+        self.assertEqual((metrics["failing"], metrics["in_quarantine"], metrics["skipped"]), (1, 1, 2))
+        self.assertEqual(
+            metrics["workstations"][WORKSTATION_ID], {"failures": 3, "error": "no table", "remaining_seconds": 1}
+        )
+        # a changed fingerprint releases it early
+        self.assertFalse(quarantine.check(WORKSTATION_ID, "other fingerprint"))
+        self.assertEqual(quarantine.get_metrics()["released_early"], 1)
+        self.assertFalse(quarantine.check(WORKSTATION_ID, "other fingerprint"))
+        # a success forgets the failures
+        quarantine.succeeded(WORKSTATION_ID)
+        self.assertFalse(quarantine.is_failing(WORKSTATION_ID))
+        self.assertEqual(quarantine.get_metrics()["released"], 1)
+        self.assertTrue(quarantine.failed(WORKSTATION_ID, "no table"))
+
+    def test_LoopHandler_quarantine(self):
+        quarantine = Quarantine.Quarantine(after=2, backoff=60)
+        with patch.object(LoopHandler, "quarantine", quarantine), patch.object(
+            LoopHandler, "calculate_KPIs", side_effect=RuntimeError("broken")
+        ) as mock_calculate_KPIs, patch.object(Orion, "update_attribute") as mock_update_attribute:
+            loopHandler = LoopHandler()
+            loopHandler.handle()
+            n_workstations = len(loopHandler.workstations)
+            self.assertEqual(mock_update_attribute.call_count, n_workstations * N_KPI_ATTRIBUTES)
+            # the second failure quarantines the Workstations without clearing their KPIs again
+            LoopHandler().handle()
+            self.assertEqual(mock_calculate_KPIs.call_count, 2 * n_workstations)
+            self.assertEqual(mock_update_attribute.call_count, n_workstations * N_KPI_ATTRIBUTES)
+            # the quarantined Workstations are skipped
+            with self.assertLogs(LoopHandler.logger, level="INFO") as logs:
+                LoopHandler().handle()
+            self.assertEqual(mock_calculate_KPIs.call_count, 2 * n_workstations)
+            self.assertTrue(any("quarantined for seconds" in line for line in logs.output))
+            self.assertEqual(quarantine.get_metrics()["in_quarantine"], n_workstations)
+            # a table change releases them early
+            with patch.object(Cygnus, "table_exists", return_value=False):
+                LoopHandler().handle()
+            self.assertEqual(mock_calculate_KPIs.call_count, 3 * n_workstations)
+            self.assertEqual(quarantine.get_metrics()["released_early"], n_workstations)
+        # a successful calculation releases them
+        with patch.object(LoopHandler, "quarantine", quarantine), patch(
+            f"{OEE.__name__}.datetime", wraps=datetime
+        ) as mock_datetime:
+            mock_datetime.now.return_value = datetime(2022, 4, 4, 9, 0, 0)
+            LoopHandler().handle()
+        self.assertFalse(quarantine.is_failing(WORKSTATION_ID))
+
+    def test_LoopHandler_transient_errors(self):
+        quarantine = Quarantine.Quarantine(after=1, backoff=60)
+        with patch.object(LoopHandler, "quarantine", quarantine), patch.object(Orion, "update_attribute"):
+            # the outages of Orion and PostgreSQL do not count
+            for side_effect in (
+                raise_circuit_open,
+                psycopg2.OperationalError("canceling statement due to statement timeout"),
+            ):
+                with patch.object(LoopHandler, "calculate_KPIs", side_effect=side_effect):
+                    LoopHandler().handle()
+                self.assertFalse(quarantine.is_failing(WORKSTATION_ID))
+            with patch.object(LoopHandler, "calculate_KPIs", side_effect=KeyError("partsPerCycle")):
+                LoopHandler().handle()
+            self.assertTrue(quarantine.is_failing(WORKSTATION_ID))
+            # nor do they release the Workstation
+            with patch.object(Quarantine, "time") as mock_time:
+                mock_time.monotonic.return_value = 1e12
+                with patch.object(LoopHandler, "calculate_KPIs", side_effect=raise_circuit_open):
+                    LoopHandler().handle()
+            self.assertEqual(quarantine.get_metrics()["workstations"][WORKSTATION_ID]["failures"], 1)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""test Reducers
+"""
+# Standard Library imports
+import copy
+from datetime import datetime
+import os
+import sys
+import tracemalloc
+import unittest
+from unittest.mock import patch
+
+# PyPI imports
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+from CopyReader import CopyReader, LogArrays
+import OEE
+from Logger import getLogger
+import Reducers
+from modules.TestCase_common import setupClass_common
+
+# Constants
+JOB_ID = "urn:ngsiv2:i40Process:Job:000001"
+MEMORY_TABLE = "reducers_memory_test"
+N_MEMORY_ROWS = 200000
+CHUNK_SIZE = 100
+PLACES = 5
+
+# Load environment variables
+POSTGRES_SCHEMA = os.environ.get("POSTGRES_SCHEMA")
+
+
+class test_Reducers(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.engine.execute(f"drop table if exists {POSTGRES_SCHEMA}.{MEMORY_TABLE};")
+        cls.engine.dispose()
+
+    def get_chunks(self, df: pd.DataFrame, chunk_size: int) -> list:
+        reader = CopyReader(chunk_size)
+        logs = LogArrays(
+            df["recvtimets"].to_numpy(dtype=np.int64),
+            reader.encode_categories(df["attrname"].to_numpy(dtype=bytes), reader.attrnames, reader.attrname_codes),
+            reader.encode_categories(df["attrvalue"].to_numpy(dtype=bytes), reader.attrvalues, reader.attrvalue_codes),
+            reader,
+        )
+        return [
+            LogArrays(logs.recvtimets[i:i + chunk_size], logs.attrname[i:i + chunk_size], logs.attrvalue[i:i + chunk_size], reader)
+            for i in range(0, len(logs), chunk_size)
+        ]
+
+    def measure_peak_memory(self, function, *args) -> tuple:
+        tracemalloc.start()
+        try:
+            result = function(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return result, peak
+
+    def test_AvailabilityReducer(self):
+        df = pd.DataFrame(
+            {
+                "recvtimets": [0, 10, 20, 30, 40, 50],
+                "attrname": ["available"] * 6,
+                "attrvalue": ["false", "true", "true", "false", "true", "false"],
+            }
+        )
+        for chunk_size in (1, 2, 4, 6):
+            # reference start between records
+            reducer = Reducers.AvailabilityReducer(15)
+            for chunk in self.get_chunks(df, chunk_size):
+                reducer.update(chunk)
+            self.assertTrue(reducer.available_since_midnight)
+            # on: 15-30, 40-50 off: 30-40, 50-60
+            self.assertEqual(reducer.calculate(60), (25 / 45, 25, 45))
+            # reference start after the last record
+            reducer = Reducers.AvailabilityReducer(55)
+            for chunk in self.get_chunks(df, chunk_size):
+                reducer.update(chunk)
+            self.assertEqual(reducer.calculate(60), (0, 0, 5))
+        with self.assertRaises(ValueError):
+            Reducers.AvailabilityReducer(15).calculate(60)
+        reducer = Reducers.AvailabilityReducer(0)
+        reducer.update(self.get_chunks(df.iloc[:1], 1)[0])
+        with self.assertRaises(ZeroDivisionError):
+            reducer.calculate(0)
+
+    def test_CounterReducer(self):
+        df = pd.DataFrame(
+            {
+                "recvtimets": range(6),
+                "attrname": ["goodPartCounter", "rejectPartCounter"] * 3,
+                "attrvalue": ["16", "0", "24", "8", "40", "8"],
+            }
+        )
+        reducer = Reducers.CounterReducer(("goodPartCounter", "rejectPartCounter", "missing"))
+        for chunk in self.get_chunks(df, 4):
+            reducer.update(chunk)
+        self.assertEqual(
+            reducer.counters,
+            {
+                "goodPartCounter": {"min_value": 16, "max_value": 40, "zero_present": False},
+                "rejectPartCounter": {"min_value": 0, "max_value": 8, "zero_present": True},
+            },
+        )
+        df.loc[5, "attrvalue"] = "eight"
+        reducer = Reducers.CounterReducer(("goodPartCounter", "rejectPartCounter"))
+        with self.assertRaises(ValueError):
+            for chunk in self.get_chunks(df, 4):
+                reducer.update(chunk)
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_chunked_processing_mode(self, mock_datetime):
+        for now in (datetime(2022, 4, 4, 8, 25, 0), datetime(2022, 4, 4, 9, 0, 0), datetime(2022, 4, 4, 13, 0, 0)):
+            mock_datetime.now.return_value = now
+            oee_frames = copy.deepcopy(self.oee_template)
+            oee_frames.prepare(self.con)
+            oee_frames.calculate_OEE()
+            oee_chunked = copy.deepcopy(self.oee_template)
+            oee_chunked.processing_mode = "chunked"
+            oee_chunked.chunk_size = CHUNK_SIZE
+            oee_chunked.prepare(self.con)
+            oee_chunked.calculate_OEE()
+            self.assertEqual(
+                oee_chunked.today["reference_start_time"], oee_frames.today["reference_start_time"]
+            )
+            self.assertEqual(oee_chunked.n_total_cycles, oee_frames.n_total_cycles)
+            self.assertAlmostEqual(
+                oee_chunked.total_available_time, oee_frames.total_available_time, places=PLACES
+            )
+            for kpi in ("availability", "performance", "quality", "oee"):
+                self.assertAlmostEqual(oee_chunked.oee[kpi], oee_frames.oee[kpi], places=PLACES)
+
+        mock_datetime.now.return_value = datetime(2022, 4, 4, 9, 0, 0)
+        oee = copy.deepcopy(self.oee_template)
+        oee.processing_mode = "somehow_else"
+        with self.assertRaises(NotImplementedError):
+            oee.prepare(self.con)
+
+    def test_chunked_peak_memory(self):
+        self.engine.execute(f"drop table if exists {POSTGRES_SCHEMA}.{MEMORY_TABLE};")
+        self.engine.execute(
+            sqlalchemy.text(
+                f"""create table {POSTGRES_SCHEMA}.{MEMORY_TABLE} as
+                select cast (1649000000000 + i as text) as recvtimets,
+                case when i % 2 = 0 then 'goodPartCounter' else 'rejectPartCounter' end as attrname,
+                cast (i / 2 as text) as attrvalue
+                from generate_series(0, {N_MEMORY_ROWS - 1}) as i;"""
+            )
+        )
+        oee = copy.deepcopy(self.oee_template)
+        oee.now_unix = 1649000000000 + N_MEMORY_ROWS
+        oee.chunk_size = 1000
+        expected = {
+            "goodPartCounter": {"min_value": 0, "max_value": N_MEMORY_ROWS // 2 - 1, "zero_present": True},
+            "rejectPartCounter": {"min_value": 0, "max_value": N_MEMORY_ROWS // 2 - 1, "zero_present": True},
+        }
+        with self.engine.connect() as con:
+            reducer = Reducers.CounterReducer(OEE.OEECalculator.COUNTER_ATTRIBUTES)
+            n_rows, chunked_peak = self.measure_peak_memory(
+                oee.stream_attribute_logs, con, MEMORY_TABLE, OEE.OEECalculator.COUNTER_ATTRIBUTES, 0, reducer.update
+            )
+            df, frames_peak = self.measure_peak_memory(
+                lambda: oee.convert_and_sort_logs(
+                    oee.read_logs(con, f"select * from {POSTGRES_SCHEMA}.{MEMORY_TABLE};", MEMORY_TABLE)
+                )
+            )
+        self.assertEqual(n_rows, N_MEMORY_ROWS)
+        self.assertEqual(len(df), N_MEMORY_ROWS)
+        self.assertEqual(reducer.counters, expected)
+        self.logger.info(f"Peak memory: chunked: {chunked_peak} frames: {frames_peak}")
+        # the chunked peak is bounded by the chunk size, not by the number of rows
+        self.assertLess(chunked_peak, 1000 * oee.chunk_size)
+        self.assertLess(chunked_peak, frames_peak / 20)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
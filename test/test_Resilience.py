@@ -0,0 +1,162 @@
+"""test Resilience
+"""
+# Standard Library imports
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+# PyPI imports
+import requests
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+from Logger import getLogger
+from LoopHandler import LoopHandler
+import Orion
+import Resilience
+from modules.TestCase_common import setupClass_common
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+
+
+class test_Resilience(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.engine.dispose()
+
+    @patch(f"{Resilience.__name__}.time")
+    def test_CircuitBreaker(self, mock_time):
+        mock_time.monotonic.return_value = 1000
+        breaker = Resilience.CircuitBreaker("test", failures=2, latency=1, reset=30, trials=1)
+        with breaker.call() as slot:
+            slot["failed"] = True
+        # a success resets the consecutive failures
+        with breaker.call():
+            pass
+        with breaker.call() as slot:
+            slot["failed"] = True
+        self.assertFalse(breaker.is_open())
+        # so does a latency breach
+        with breaker.call():
+            mock_time.monotonic.return_value = 1002
+        self.assertTrue(breaker.is_open())
+        with self.assertRaises(Resilience.CircuitOpenError):
+            with breaker.call():
+                self.fail("the request is sent")
+        # half-open after the reset: one trial request, a failed trial opens the circuit again
+        mock_time.monotonic.return_value = 1032
+        self.assertFalse(breaker.is_open())
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            with breaker.call() as slot:
+                with self.assertRaises(Resilience.CircuitOpenError):
+                    breaker.before()
+                slot["failed"] = True
+                raise requests.exceptions.ConnectionError("refused")
+        self.assertTrue(breaker.is_open())
+        # a successful trial closes it
+        mock_time.monotonic.return_value = 1062
+        with breaker.call():
+            pass
+        metrics = breaker.get_metrics()
+        self.assertEqual((metrics["state"], metrics["consecutive_failures"]), ("closed", 0))
+        self.assertEqual((metrics["opened"], metrics["rejected"], metrics["trials"]), (2, 2, 2))
+
+    def test_Hedger(self):
+        hedger = Resilience.Hedger(percentile=95, min_samples=3)
+        calls = []
+        release = threading.Event()
+
+        def send_request(url, **kwargs):
+            calls.append(url)
+            # the first request hangs
+            if len(calls) == 1:
+                release.wait(5)
+            return len(calls)
+
+        # no hedging without enough samples
+        self.assertEqual(hedger.send(lambda url: url, "url"), "url")
+        self.assertIsNone(hedger.get_delay())
+        hedger.latencies.extend([0.01] * 5)
+        self.assertAlmostEqual(hedger.get_delay(), 0.01)
+        self.assertEqual(hedger.send(send_request, "url"), 2)
+        release.set()
+        self.assertEqual(calls, ["url", "url"])
+        self.assertEqual(hedger.get_metrics()["hedge_wins"], 1)
+
+        # the error is raised if both requests fail
+        def fail(url, **kwargs):
+            time.sleep(0.05)
+            raise requests.exceptions.ConnectionError("refused")
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            hedger.send(fail, "url")
+        metrics = hedger.get_metrics()
+        self.assertEqual((metrics["requests"], metrics["hedged"], metrics["hedge_wins"]), (3, 2, 1))
+
+        # hung requests are waited for at most their timeout
+        hang = threading.Event()
+        started = time.monotonic()
+        with self.assertRaises(requests.exceptions.Timeout):
+            hedger.send(lambda url, **kwargs: hang.wait(5), "url", timeout=0.2)
+        self.assertLess(time.monotonic() - started, 2)
+        hang.set()
+
+    def test_Orion(self):
+        breaker = Resilience.CircuitBreaker("Orion", failures=2, reset=60)
+        response = MagicMock(status_code=503)
+        with patch.object(Orion, "breaker", breaker), patch.object(Orion, "ORION_TIMEOUT", 5), patch(
+            "requests.get", return_value=response
+        ) as mock_get:
+            for _ in range(3):
+                with self.assertRaises(RuntimeError):
+                    Orion.get(WORKSTATION_ID)
+            # the third request fails fast
+            self.assertEqual(mock_get.call_count, 2)
+            self.assertEqual(mock_get.call_args.kwargs["timeout"], 5)
+            with self.assertRaises(Resilience.CircuitOpenError):
+                Orion.update_attribute(WORKSTATION_ID, "oee", "Number", None)
+        self.assertEqual(breaker.get_metrics()["rejected"], 2)
+        # without ORION_TIMEOUT, a hung Orion times out at the breaker's latency
+        breaker = Resilience.CircuitBreaker("Orion", latency=3)
+        with patch.object(Orion, "breaker", breaker), patch.object(Orion, "ORION_TIMEOUT", None), patch(
+            "requests.get", return_value=MagicMock(status_code=200)
+        ) as mock_get:
+            Orion.send(requests.get, "url")
+        self.assertEqual(mock_get.call_args.kwargs["timeout"], 3)
+
+    def test_LoopHandler_circuit(self):
+        breaker = Resilience.CircuitBreaker("Orion", failures=1, reset=60)
+        workstation = Orion.get(WORKSTATION_ID)
+        workstations = [workstation] + [dict(workstation, id=f"{WORKSTATION_ID}{i}") for i in range(3)]
+        failed_urls = []
+
+        def fail(url, **kwargs):
+            failed_urls.append(url)
+            return MagicMock(status_code=503)
+
+        with patch.object(Orion, "breaker", breaker), patch.object(
+            Orion, "get_workstations", return_value=workstations
+        ), patch("requests.get", side_effect=fail):
+            with self.assertLogs(LoopHandler.logger, level="ERROR") as logs:
+                LoopHandler().handle()
+        # only the first Workstation waited for Orion
+        self.assertEqual(len(failed_urls), 1)
+        self.assertTrue(any("skipping the remaining" in line for line in logs.output))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""test Retention
+"""
+# Standard Library imports
+from datetime import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# PyPI imports
+import numpy as np
+import pandas as pd
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+import Cygnus
+from Logger import getLogger
+import Retention
+import ShadowTables
+from modules.TestCase_common import setupClass_common
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+WORKSTATION_TABLE = WORKSTATION_ID.lower().replace(":", "_") + "_i40asset"
+JOB_ID = "urn:ngsiv2:i40Process:Job:000001"
+JOB_TABLE = JOB_ID.lower().replace(":", "_") + "_i40process"
+HORIZON = datetime(2022, 4, 5)
+
+# Load environment variables
+POSTGRES_SCHEMA = os.environ.get("POSTGRES_SCHEMA")
+
+
+class test_Retention(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+
+    def setUp(self):
+        # the tests delete rows, so the logs are uploaded again for each test
+        setupClass_common(self)
+        # the common connection is left in a transaction that would block the vacuum
+        self.con.close()
+        self.archive_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.archive_dir)
+        self.engine.dispose()
+
+    def count_rows(self, table: str) -> int:
+        return self.engine.execute(f"select count(*) from {POSTGRES_SCHEMA}.{table};").scalar()
+
+    def logs_before_horizon(self, df: pd.DataFrame) -> pd.DataFrame:
+        df = df.copy()
+        df["recvtimets"] = df["recvtimets"].astype("float64").astype("int64")
+        df = df[df["recvtimets"] < HORIZON.timestamp() * 1e3]
+        return df.sort_values(by=["recvtimets"]).reset_index(drop=True)
+
+    def test_get_horizon(self):
+        self.assertEqual(Retention.get_horizon(datetime(2022, 4, 5, 13, 0, 0), days=1), HORIZON)
+        self.assertEqual(Retention.get_horizon(datetime(2022, 4, 5, 13, 0, 0), days=7), datetime(2022, 3, 30))
+
+    def test_get_schema_tables(self):
+        with self.engine.connect() as con:
+            tables = Cygnus.get_schema_tables(con)
+        self.assertIn(WORKSTATION_TABLE, tables)
+        self.assertIn(JOB_TABLE, tables)
+
+    def test_archive_table(self):
+        n_rows = self.count_rows(JOB_TABLE)
+        expected = self.logs_before_horizon(self.job_df)
+        self.assertGreater(len(expected), 0)
+        report = Retention.archive_table(
+            self.engine, JOB_TABLE, HORIZON, archive_dir=self.archive_dir, batch_size=1000
+        )
+        self.assertEqual(report["archived_rows"], len(expected))
+        self.assertEqual(self.count_rows(JOB_TABLE), n_rows - len(expected))
+        self.assertGreater(report["bytes_reclaimed"], 0)
+        self.assertEqual(
+            report["archive_files"],
+            [Retention.get_archive_path(JOB_TABLE, datetime(2022, 4, 4), self.archive_dir)],
+        )
+        self.assertEqual(set(report["latency_after"].keys()), set(report["latency_before"].keys()))
+
+        archived = Retention.read_archive(JOB_TABLE, datetime(2022, 4, 4), HORIZON, self.archive_dir)
+        self.assertEqual(archived["recvtimets"].dtype, np.int64)
+        self.assertEqual(list(archived.columns), list(expected.columns))
+        self.assertEqual(
+            sorted(map(tuple, archived.applymap(str).values)),
+            sorted(map(tuple, expected.applymap(str).values)),
+        )
+
+        # running it again does not change the archive
+        report = Retention.archive_table(
+            self.engine, JOB_TABLE, HORIZON, archive_dir=self.archive_dir, batch_size=1000
+        )
+        self.assertEqual(report["archived_rows"], 0)
+        self.assertEqual(
+            len(Retention.read_archive(JOB_TABLE, datetime(2022, 4, 4), HORIZON, self.archive_dir)),
+            len(expected),
+        )
+
+        with self.assertRaises(FileNotFoundError):
+            Retention.read_archive(JOB_TABLE, datetime(2022, 4, 1), datetime(2022, 4, 2), self.archive_dir)
+
+    def test_write_archive_merges(self):
+        path = Retention.get_archive_path(WORKSTATION_TABLE, datetime(2022, 4, 4), self.archive_dir)
+        df = self.logs_before_horizon(self.workstation_df)
+        Retention.write_archive(df.iloc[:5], path)
+        Retention.write_archive(df.iloc[3:], path)
+        self.assertEqual(len(Retention.load_archive_file(path)), len(df))
+        self.assertEqual(os.listdir(os.path.dirname(path)), [os.path.basename(path)])
+
+    def test_archive_table_trims_shadow_table(self):
+        with self.engine.begin() as con:
+            ShadowTables.create_shadow_table(con, WORKSTATION_TABLE)
+        try:
+            Retention.archive_table(
+                self.engine, WORKSTATION_TABLE, HORIZON, archive_dir=self.archive_dir, batch_size=2
+            )
+            self.assertEqual(
+                self.count_rows(ShadowTables.get_shadow_table(WORKSTATION_TABLE)),
+                self.count_rows(WORKSTATION_TABLE),
+            )
+        finally:
+            with self.engine.begin() as con:
+                ShadowTables.drop_shadow_table(con, WORKSTATION_TABLE)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""test Rollups
+"""
+# Standard Library imports
+import copy
+from datetime import date, datetime
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# PyPI imports
+import numpy as np
+import sqlalchemy
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+from Logger import getLogger
+import OEE
+import Rollups
+from modules.TestCase_common import setupClass_common
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+JOB_ID = "urn:ngsiv2:i40Process:Job:000001"
+JOB_TABLE = JOB_ID.lower().replace(":", "_") + "_i40process"
+DAY = date(2022, 4, 4)
+LATE_TIMESTAMP = datetime(2022, 4, 4, 10, 30, 0).timestamp() * 1e3
+PLACES = 5
+
+# Load environment variables
+POSTGRES_SCHEMA = os.environ.get("POSTGRES_SCHEMA")
+
+
+class test_Rollups(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+        # the common connection is left in the transaction that uploaded the logs
+        cls.con.close()
+        cls.con = cls.engine.connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.engine.dispose()
+
+    def setUp(self):
+        self.drop_tables()
+
+    def tearDown(self):
+        self.drop_tables()
+        with self.con.begin():
+            self.con.execute(f"delete from {POSTGRES_SCHEMA}.{JOB_TABLE} where recvtimets = '{int(LATE_TIMESTAMP)}';")
+
+    def drop_tables(self):
+        # on the test's connection, that may hold locks of its reads
+        with self.con.begin():
+            for table_name in (Rollups.HOURLY_TABLE, Rollups.SHIFT_TABLE, Rollups.DAILY_TABLE):
+                self.con.execute(f"drop table if exists {POSTGRES_SCHEMA}.{table_name};")
+
+    def update(self, rollups: Rollups.RollupMaintainer, now: datetime) -> list:
+        with patch(f"{Rollups.__name__}.datetime", wraps=datetime) as mock_datetime, patch(
+            f"{OEE.__name__}.datetime", wraps=datetime
+        ) as mock_oee_datetime:
+            mock_datetime.now.return_value = mock_oee_datetime.now.return_value = now
+            return rollups.update(self.con, WORKSTATION_ID)
+
+    def calculate_OEE(self, now: datetime) -> OEE.OEECalculator:
+        with patch(f"{OEE.__name__}.datetime", wraps=datetime) as mock_datetime:
+            mock_datetime.now.return_value = now
+            oee = copy.deepcopy(self.oee_template)
+            oee.prepare(self.con)
+            oee.calculate_OEE()
+        return oee
+
+    def get_hourly(self) -> dict:
+        rows = self.con.execute(
+            f"""select cast (xmin as text) as xmin, * from {POSTGRES_SCHEMA}.{Rollups.HOURLY_TABLE}
+                where workstation = '{WORKSTATION_ID}' order by bucket_start;"""
+        ).fetchall()
+        return {row.bucket_start.astimezone().hour: row for row in rows}
+
+    def test_get_available_time(self):
+        timestamps = np.array([10, 20, 30, 40])
+        values = np.array([True, False, True, True])
+        self.assertEqual(Rollups.get_available_time(timestamps, values, 0, 100), 10 + 70)
+        self.assertEqual(Rollups.get_available_time(timestamps, values, 15, 35), 5 + 5)
+        self.assertEqual(Rollups.get_available_time(timestamps[:0], values[:0], 15, 35), 0)
+
+    def test_get_counter_levels(self):
+        timestamps = np.array([10, 20, 30])
+        level = Rollups.get_counter_levels(timestamps, np.array([16, 24, 40]), 8)
+        # the first logged value is a cycle, like in the OEECalculator
+        self.assertEqual(level(0), 1)
+        # the records at the time are not counted yet
+        self.assertEqual(level(20), 2)
+        self.assertEqual(level(21), 3)
+        self.assertEqual(level(31) - level(0), 4)
+        level = Rollups.get_counter_levels(timestamps, np.array([0, 8, 16]), 8)
+        self.assertEqual(level(31) - level(0), 2)
+        # continued from a level carried over from an earlier hour
+        level = Rollups.get_counter_levels(timestamps, np.array([16, 24, 40]), 8, initial=2)
+        self.assertEqual(level(0), 2)
+        self.assertEqual(level(21), 3)
+        self.assertEqual(level(31) - level(0), 3)
+        self.assertEqual(Rollups.get_counter_levels(timestamps[:0], timestamps[:0], 8, initial=2)(31), 2)
+
+    def test_update(self):
+        rollups = Rollups.RollupMaintainer()
+        for now in (datetime(2022, 4, 4, 9, 0, 0), datetime(2022, 4, 4, 12, 30, 0), datetime(2022, 4, 4, 13, 0, 0)):
+            first_buckets = self.update(rollups, now)
+            oee = self.calculate_OEE(now)
+            hourly = self.get_hourly()
+            self.assertEqual(list(hourly), list(range(8, now.hour + (1 if now.minute else 0))))
+            sums = {measure: sum(row[measure] for row in hourly.values()) for measure in Rollups.MEASURES}
+            self.assertAlmostEqual(sums["available_ms"], oee.total_available_time, places=PLACES)
+            self.assertAlmostEqual(sums["total_ms"], oee.total_time_so_far_since_reference_start_time, places=PLACES)
+            self.assertAlmostEqual(sums["good_cycles"], oee.n_successful_cycles, places=PLACES)
+            self.assertAlmostEqual(sums["reject_cycles"], oee.n_failed_cycles, places=PLACES)
+            rollup = Rollups.get_period_rollup(self.con, WORKSTATION_ID, DAY, DAY)
+            for kpi in ("availability", "performance", "quality", "oee"):
+                self.assertAlmostEqual(rollup[kpi], oee.oee[kpi], places=PLACES)
+            shift = self.con.execute(
+                f"select * from {POSTGRES_SCHEMA}.{Rollups.SHIFT_TABLE} where workstation = '{WORKSTATION_ID}';"
+            ).fetchall()
+            self.assertEqual(len(shift), 1)
+            for measure in Rollups.MEASURES:
+                self.assertAlmostEqual(shift[0][measure], sums[measure], places=PLACES)
+        # only the last hour was recalculated
+        self.assertEqual(first_buckets, [datetime(2022, 4, 4, 12, 0, 0)])
+        self.assertEqual(Rollups.get_week_to_date(self.con, WORKSTATION_ID, DAY)["oee"], rollup["oee"])
+        self.assertEqual(Rollups.get_month_to_date(self.con, WORKSTATION_ID, date(2022, 5, 1))["oee"], None)
+
+    def test_carried_state(self):
+        rollups = Rollups.RollupMaintainer()
+        self.update(rollups, datetime(2022, 4, 4, 12, 30, 0))
+        starts = []
+        query_attribute_logs = rollups.query_attribute_logs
+
+        def record_start(con, oee, table_name, attributes, start, end):
+            starts.append(start)
+            return query_attribute_logs(con, oee, table_name, attributes, start, end)
+
+        now = datetime(2022, 4, 4, 13, 0, 0)
+        with patch.object(rollups, "query_attribute_logs", side_effect=record_start):
+            self.update(rollups, now)
+        # only the logs since the last rolled up hour were queried
+        self.assertTrue(starts)
+        self.assertEqual(set(starts), {datetime(2022, 4, 4, 12, 0, 0).timestamp() * 1e3})
+        incremental = self.get_hourly()
+        self.assertIsNotNone(incremental[11].end_available)
+        self.assertIsNotNone(incremental[11].good_level)
+
+        # the same rollups as calculated from midnight
+        self.drop_tables()
+        self.update(Rollups.RollupMaintainer(), now)
+        recalculated = self.get_hourly()
+        self.assertEqual(list(incremental), list(recalculated))
+        for hour, row in recalculated.items():
+            for measure in Rollups.MEASURES + ("end_available", "good_level", "reject_level"):
+                self.assertAlmostEqual(incremental[hour][measure], row[measure], places=PLACES)
+
+    def test_late_logs(self):
+        rollups = Rollups.RollupMaintainer(late_check_interval=0)
+        now = datetime(2022, 4, 4, 13, 0, 0)
+        self.update(rollups, now)
+        before = self.get_hourly()
+        # a late cycle logged far above the previous counter values
+        with self.con.begin():
+            self.con.execute(
+                sqlalchemy.text(
+                    f"""insert into {POSTGRES_SCHEMA}.{JOB_TABLE} (recvtimets, entityid, attrname, attrvalue)
+                        values (:recvtimets, :entityid, 'rejectPartCounter', '10000');"""
+                ),
+                {"recvtimets": str(int(LATE_TIMESTAMP)), "entityid": JOB_ID},
+            )
+        self.assertEqual(self.update(rollups, now), [datetime(2022, 4, 4, 10, 0, 0)])
+        after = self.get_hourly()
+        for hour in (8, 9):
+            self.assertEqual(after[hour].xmin, before[hour].xmin)
+        for hour in (10, 11, 12):
+            self.assertNotEqual(after[hour].xmin, before[hour].xmin)
+        self.assertEqual(after[10].n_job_logs, before[10].n_job_logs + 1)
+        self.assertGreater(after[10].reject_cycles, before[10].reject_cycles)
+        oee = self.calculate_OEE(now)
+        sums = {measure: sum(row[measure] for row in after.values()) for measure in Rollups.MEASURES}
+        self.assertAlmostEqual(sums["reject_cycles"], oee.n_failed_cycles, places=PLACES)
+        self.assertAlmostEqual(sums["good_cycles"], oee.n_successful_cycles, places=PLACES)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""test ShadowTables
+"""
+# Standard Library imports
+import copy
+from datetime import datetime
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# PyPI imports
+import sqlalchemy
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+import OEE
+from Logger import getLogger
+import ShadowTables
+from modules.TestCase_common import setupClass_common
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+WORKSTATION_TABLE = WORKSTATION_ID.lower().replace(":", "_") + "_i40asset"
+JOB_ID = "urn:ngsiv2:i40Process:Job:000001"
+JOB_TABLE = JOB_ID.lower().replace(":", "_") + "_i40process"
+TABLES = (WORKSTATION_TABLE, JOB_TABLE)
+PLACES = 5
+
+# Load environment variables
+POSTGRES_SCHEMA = os.environ.get("POSTGRES_SCHEMA")
+
+
+class test_ShadowTables(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+        # the common connection is left in a transaction that would block dropping the triggers
+        cls.con.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.drop_shadow_tables()
+        cls.engine.dispose()
+
+    @classmethod
+    def drop_shadow_tables(cls):
+        with cls.engine.begin() as con:
+            for table in TABLES:
+                ShadowTables.drop_shadow_table(con, table)
+
+    def setUp(self):
+        self.drop_shadow_tables()
+        with self.engine.begin() as con:
+            for table in TABLES:
+                ShadowTables.create_shadow_table(con, table)
+
+    def tearDown(self):
+        self.drop_shadow_tables()
+        # remove the rows inserted by the tests
+        self.engine.execute(
+            f"delete from {POSTGRES_SCHEMA}.{WORKSTATION_TABLE} where attrname = 'shadowTest';"
+        )
+
+    def shadow_table_exists(self, table: str) -> bool:
+        # a fresh connection, so no open transaction blocks dropping the shadow tables
+        with self.engine.connect() as con:
+            return ShadowTables.shadow_table_exists(con, table)
+
+    def prepare(self, oee: OEE.OEECalculator):
+        with self.engine.connect() as con:
+            oee.prepare(con)
+
+    def count_rows(self, table: str) -> int:
+        return self.engine.execute(f"select count(*) from {POSTGRES_SCHEMA}.{table};").scalar()
+
+    def query_shadow_rows(self, attrname: str) -> list:
+        return self.engine.execute(
+            sqlalchemy.text(
+                f"select * from {ShadowTables.get_logs_relation(WORKSTATION_TABLE)} where attrname = :attrname order by recvtimets;"
+            ),
+            {"attrname": attrname},
+        ).fetchall()
+
+    def insert_workstation_row(self, recvtimets: str, attrvalue: str):
+        self.engine.execute(
+            sqlalchemy.text(
+                f"""insert into {POSTGRES_SCHEMA}.{WORKSTATION_TABLE} (recvtimets, attrname, attrvalue)
+                    values (:recvtimets, 'shadowTest', :attrvalue);"""
+            ),
+            {"recvtimets": recvtimets, "attrvalue": attrvalue},
+        )
+
+    def test_create_shadow_table(self):
+        for table in TABLES:
+            self.assertTrue(self.shadow_table_exists(table))
+            self.assertEqual(
+                self.count_rows(ShadowTables.get_shadow_table(table)), self.count_rows(table)
+            )
+        # the shadow table reads like the Cygnus table
+        df = self.workstation_df
+        available = df[df["attrname"] == "available"].copy()
+        available["recvtimets"] = available["recvtimets"].map(int)
+        available = available.sort_values(by=["recvtimets"])
+        rows = self.query_shadow_rows("available")
+        self.assertEqual([row.recvtimets for row in rows], list(available["recvtimets"]))
+        self.assertEqual([row.attrvalue for row in rows], list(available["attrvalue"]))
+        self.assertTrue(all(row.numvalue is None for row in rows))
+        # creating it again does nothing
+        with self.engine.begin() as con:
+            ShadowTables.create_shadow_table(con, WORKSTATION_TABLE)
+        self.assertEqual(
+            self.count_rows(ShadowTables.get_shadow_table(WORKSTATION_TABLE)), self.count_rows(WORKSTATION_TABLE)
+        )
+
+    def test_trigger(self):
+        self.insert_workstation_row("1649056000000", "16")
+        self.insert_workstation_row("1649056001000", "true")
+        self.insert_workstation_row("1649056002000", "not a number")
+        # not mirrored, but Cygnus' insert succeeds
+        self.insert_workstation_row("not a timestamp", "17")
+        rows = self.query_shadow_rows("shadowTest")
+        self.assertEqual(
+            [(row.recvtimets, row.attrvalue) for row in rows],
+            [(1649056000000, "16"), (1649056001000, "true"), (1649056002000, "not a number")],
+        )
+        self.assertEqual(rows[0].numvalue, 16)
+        self.assertEqual(self.count_rows(WORKSTATION_TABLE), len(self.workstation_df) + 4)
+
+    def test_trigger_never_rejects(self):
+        sequence = self.engine.execute(
+            f"select pg_get_serial_sequence('{POSTGRES_SCHEMA}.{ShadowTables.ATTRIBUTE_CODES_TABLE}', 'attrcode');"
+        ).scalar()
+        self.insert_workstation_row("1649056000000", "16")
+        last_value = self.engine.execute(f"select last_value from {sequence};").scalar()
+        # the known attributes do not use up the sequence
+        for i in range(5):
+            self.insert_workstation_row(f"164905600{i}000", "16")
+        self.assertEqual(self.engine.execute(f"select last_value from {sequence};").scalar(), last_value)
+        # a row that cannot be mirrored is still inserted into the Cygnus table
+        self.engine.execute(f"select setval('{sequence}', 2147483647);")
+        try:
+            self.engine.execute(
+                sqlalchemy.text(
+                    f"""insert into {POSTGRES_SCHEMA}.{WORKSTATION_TABLE} (recvtimets, attrname, attrvalue)
+                        values ('1649056009000', 'shadowTest', 'new code'), ('1649056009000', 'shadowTestNew', '1');"""
+                )
+            )
+        finally:
+            self.engine.execute(f"select setval('{sequence}', {last_value});")
+            self.engine.execute(
+                f"delete from {POSTGRES_SCHEMA}.{WORKSTATION_TABLE} where attrname = 'shadowTestNew';"
+            )
+        self.assertEqual(len(self.query_shadow_rows("shadowTest")), 7)
+        self.assertEqual(self.query_shadow_rows("shadowTestNew"), [])
+
+    def test_counter_value(self):
+        self.insert_workstation_row("1649056000000", "8")
+        self.insert_workstation_row("1649056001000", "8.5")
+        oee = copy.deepcopy(self.oee_template)
+        oee.shadow_tables = True
+        with self.engine.connect() as con:
+            source = oee.get_logs_source(con, WORKSTATION_TABLE)
+            query = f"""select {source["counter_value"]} from {source["relation"]}
+                where attrname = 'shadowTest' and recvtimets = :recvtimets;"""
+            self.assertEqual(con.execute(sqlalchemy.text(query), {"recvtimets": 1649056000000}).scalar(), 8)
+            # a non-integer counter raises an error like in the Cygnus table, it is not rounded
+            with self.assertRaises(sqlalchemy.exc.DataError):
+                con.execute(sqlalchemy.text(query), {"recvtimets": 1649056001000}).scalar()
+
+    def test_drop_shadow_table(self):
+        with self.engine.begin() as con:
+            ShadowTables.drop_shadow_table(con, WORKSTATION_TABLE)
+        self.assertFalse(self.shadow_table_exists(WORKSTATION_TABLE))
+        # the trigger is dropped as well
+        self.insert_workstation_row("1649056000000", "16")
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_OEECalculator_reads_shadow_tables(self, mock_datetime):
+        for now in (
+            datetime(2022, 4, 4, 8, 25, 0),
+            datetime(2022, 4, 4, 9, 0, 0),
+        ):
+            mock_datetime.now.return_value = now
+            for workstation_query_mode, job_query_mode in (
+                ("from_midnight", "rows"),
+                ("boundary", "aggregate"),
+            ):
+                oee_text = copy.deepcopy(self.oee_template)
+                oee_text.workstation_query_mode = workstation_query_mode
+                oee_text.job_query_mode = job_query_mode
+                self.prepare(oee_text)
+                oee_text.calculate_OEE()
+
+                oee_typed = copy.deepcopy(self.oee_template)
+                oee_typed.shadow_tables = True
+                oee_typed.workstation_query_mode = workstation_query_mode
+                oee_typed.job_query_mode = job_query_mode
+                self.prepare(oee_typed)
+                self.assertIn(
+                    ShadowTables.get_shadow_table(WORKSTATION_TABLE),
+                    oee_typed.logs_sources[WORKSTATION_TABLE]["relation"],
+                )
+                oee_typed.calculate_OEE()
+                for kpi in ("availability", "performance", "quality", "oee"):
+                    self.assertAlmostEqual(oee_typed.oee[kpi], oee_text.oee[kpi], places=PLACES)
+                self.assertEqual(oee_typed.today["reference_start_time"], oee_text.today["reference_start_time"])
+
+        # falls back to the Cygnus table without a shadow table
+        self.drop_shadow_tables()
+        oee = copy.deepcopy(self.oee_template)
+        oee.shadow_tables = True
+        self.prepare(oee)
+        self.assertEqual(
+            oee.logs_sources[WORKSTATION_TABLE]["relation"], f"{POSTGRES_SCHEMA}.{WORKSTATION_TABLE}"
+        )
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
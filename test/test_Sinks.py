@@ -0,0 +1,174 @@
+"""test Sinks
+"""
+# Standard Library imports
+from datetime import datetime, timezone
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+from Logger import getLogger
+from LoopHandler import LoopHandler
+import OEE
+import Sinks
+from modules.TestCase_common import setupClass_common
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+OEE_OBJECT = {"oee": 0.36, "availability": 0.5, "performance": 0.8, "quality": 0.9}
+SINK_TABLE = "test_oee_kpi_sink"
+PLACES = 5
+
+# Load environment variables
+POSTGRES_HOST = os.environ.get("POSTGRES_HOST")
+POSTGRES_PASSWORD = os.environ.get("POSTGRES_PASSWORD")
+POSTGRES_PORT = os.environ.get("POSTGRES_PORT")
+POSTGRES_USER = os.environ.get("POSTGRES_USER")
+POSTGRES_SCHEMA = os.environ.get("POSTGRES_SCHEMA")
+
+
+def get_records(n_records: int, day: int = 4) -> list:
+    return [
+        Sinks.get_record(WORKSTATION_ID, datetime(2022, 4, day, 9, 0, i, tzinfo=timezone.utc), OEE_OBJECT, i)
+        for i in range(n_records)
+    ]
+
+
+class RecordingSink(Sinks.Sink):
+    name = "recording"
+
+    def __init__(self, error: Exception = None):
+        self.batches = []
+        self.error = error
+        self.release = threading.Event()
+        self.release.set()
+
+    def write_batch(self, records: list):
+        self.release.wait()
+        if self.error is not None:
+            raise self.error
+        self.batches.append(records)
+
+
+class test_Sinks(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+        # the common connection is left in the transaction that uploaded the logs
+        cls.con.close()
+        cls.con = cls.engine.connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.execute(f"drop table if exists {POSTGRES_SCHEMA}.{SINK_TABLE} cascade;")
+        cls.con.close()
+        cls.engine.dispose()
+
+    def test_SinkWorker_batches(self):
+        sink = RecordingSink()
+        worker = Sinks.SinkWorker(sink, queue_size=10, batch_size=3, flush_interval=0.05)
+        sink.release.clear()
+        for record in get_records(7):
+            self.assertTrue(worker.put(record))
+        sink.release.set()
+        worker.close()
+        self.assertEqual(sum(sink.batches, []), get_records(7))
+        self.assertTrue(all(len(batch) <= 3 for batch in sink.batches))
+        metrics = worker.get_metrics()
+        self.assertEqual((metrics["queued"], metrics["written"], metrics["dropped"]), (7, 7, 0))
+        self.assertEqual(metrics["batches"], len(sink.batches))
+        self.assertEqual(metrics["queue_depth"], 0)
+        self.assertIsNotNone(metrics["last_latency_seconds"])
+
+    def test_SinkWorker_backpressure(self):
+        sink = RecordingSink()
+        sink.release.clear()
+        worker = Sinks.SinkWorker(sink, queue_size=2, batch_size=1, flush_interval=0.01)
+        records = get_records(10)
+        # the worker is stuck writing a record, the others fill the queue
+        results = [worker.put(record) for record in records]
+        self.assertIn(False, results)
+        sink.release.set()
+        worker.close()
+        metrics = worker.get_metrics()
+        self.assertEqual(metrics["dropped"], results.count(False))
+        self.assertEqual(metrics["written"], results.count(True))
+
+    def test_SinkWorker_failure(self):
+        worker = Sinks.SinkWorker(RecordingSink(OSError("disk full")), batch_size=2, flush_interval=0.01)
+        for record in get_records(3):
+            worker.put(record)
+        worker.close()
+        metrics = worker.get_metrics()
+        self.assertEqual((metrics["written"], metrics["failed"]), (0, 3))
+
+    def test_JSONLinesSink(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sink = Sinks.JSONLinesSink(directory)
+            sink.write_batch(get_records(2) + get_records(1, day=5))
+            sink.write_batch(get_records(1))
+            self.assertEqual(sorted(os.listdir(directory)), ["kpis-2022-04-04.jsonl", "kpis-2022-04-05.jsonl"])
+            with open(os.path.join(directory, "kpis-2022-04-04.jsonl")) as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual(lines, get_records(2) + get_records(1))
+
+    def test_MemoryBusSink(self):
+        sink = Sinks.MemoryBusSink(max_messages=2)
+        sink.write_batch(get_records(3))
+        # the oldest message is dropped
+        self.assertEqual([json.loads(message) for message in sink.consume()], get_records(3)[1:])
+        self.assertEqual(sink.consume(), [])
+
+    def test_PostgresSink(self):
+        self.con.execute(f"drop table if exists {POSTGRES_SCHEMA}.{SINK_TABLE} cascade;")
+        url = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}"
+        sink = Sinks.PostgresSink(url, SINK_TABLE)
+        sink.write_batch(get_records(2) + [Sinks.get_record(WORKSTATION_ID, datetime.now(timezone.utc))])
+        sink.close()
+        rows = self.con.execute(f"select * from {POSTGRES_SCHEMA}.{SINK_TABLE} order by recvtime;").fetchall()
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0].recvtime, datetime(2022, 4, 4, 9, 0, 0, tzinfo=timezone.utc))
+        self.assertAlmostEqual(rows[1].oee, OEE_OBJECT["oee"], places=PLACES)
+        self.assertEqual(rows[1].throughput, 1)
+        self.assertIsNone(rows[2].oee)
+
+    def test_create_dispatcher(self):
+        with tempfile.TemporaryDirectory() as directory, patch.object(Sinks, "SINK_JSONL_DIR", directory), patch.dict(
+            os.environ, {"SINK_BUS_BATCH_SIZE": "5"}
+        ):
+            dispatcher = Sinks.create_dispatcher("bus, jsonl", "postgresql://")
+            self.assertEqual(list(dispatcher.workers), ["bus", "jsonl"])
+            self.assertEqual(dispatcher.workers["bus"].batch_size, 5)
+            self.assertEqual(dispatcher.workers["jsonl"].batch_size, Sinks.SINK_BATCH_SIZE)
+            dispatcher.close()
+        with self.assertRaises(ValueError):
+            Sinks.create_dispatcher("bus,somewhere", "postgresql://")
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_LoopHandler_sinks(self, mock_datetime):
+        mock_datetime.now.return_value = datetime(2022, 4, 4, 9, 0, 0)
+        bus = Sinks.MemoryBusSink()
+        dispatcher = Sinks.SinkDispatcher([bus])
+        with patch.object(LoopHandler, "sinks", dispatcher):
+            loopHandler = LoopHandler()
+            loopHandler.handle()
+        dispatcher.close()
+        records = {record["id"]: record for record in map(json.loads, bus.consume())}
+        self.assertEqual(sorted(records), sorted(workstation["id"] for workstation in loopHandler.workstations))
+        self.assertAlmostEqual(records[WORKSTATION_ID]["availability"], 50 / 60, places=PLACES)
+        self.assertIsNone(records[WORKSTATION_ID]["error"])
+        self.assertEqual(dispatcher.get_metrics()["bus"]["written"], len(records))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""test Statements
+"""
+# Standard Library imports
+import copy
+from datetime import datetime
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# PyPI imports
+import sqlalchemy
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+import OEE
+from Logger import getLogger
+import Statements
+from modules.TestCase_common import setupClass_common
+
+# Constants
+JOB_ID = "urn:ngsiv2:i40Process:Job:000001"
+JOB_TABLE = JOB_ID.lower().replace(":", "_") + "_i40process"
+SLEEP_QUERY = "select pg_sleep(:seconds) as slept;"
+
+# Load environment variables
+POSTGRES_SCHEMA = os.environ.get("POSTGRES_SCHEMA")
+
+
+class test_Statements(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+        # the common connection is left in the transaction that uploaded the logs
+        cls.con.close()
+        cls.con = cls.engine.connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.engine.dispose()
+
+    def get_statement_timeout(self) -> str:
+        return self.con.execute(sqlalchemy.text("show statement_timeout;")).scalar()
+
+    def test_statement_timeout(self):
+        previous = self.get_statement_timeout()
+        with Statements.statement_timeout(self.con, 100):
+            self.assertEqual(self.get_statement_timeout(), "100ms")
+        self.assertEqual(self.get_statement_timeout(), previous)
+
+        with self.assertRaises(sqlalchemy.exc.OperationalError) as context:
+            with Statements.statement_timeout(self.con, 100):
+                self.con.execute(sqlalchemy.text(SLEEP_QUERY), {"seconds": 2})
+        self.assertTrue(Statements.is_statement_timeout(context.exception))
+        # the rollback restored the previous timeout
+        self.assertEqual(self.get_statement_timeout(), previous)
+
+        with Statements.statement_timeout(self.con, 0):
+            self.assertEqual(self.get_statement_timeout(), previous)
+
+    @patch.dict(Statements.STATEMENT_TIMEOUTS, {"logs": 100})
+    def test_timed_query(self):
+        with self.assertRaises(RuntimeError):
+            with Statements.timed_query(self.con, "logs", JOB_TABLE, SLEEP_QUERY, {"seconds": 2}):
+                self.con.execute(sqlalchemy.text(SLEEP_QUERY), {"seconds": 2})
+        self.assertEqual(self.con.execute(sqlalchemy.text("select 1;")).scalar(), 1)
+
+        with self.assertRaises(NotImplementedError):
+            with Statements.timed_query(self.con, "other", JOB_TABLE, SLEEP_QUERY):
+                pass
+
+        with patch.object(Statements, "SLOW_QUERY_MS", 10), patch.object(Statements, "EXPLAIN_SLOW_QUERIES", True):
+            with self.assertLogs(Statements.logger_Statements, level="WARNING") as logs:
+                with Statements.timed_query(self.con, "logs", JOB_TABLE, SLEEP_QUERY, {"seconds": 0.02}) as result:
+                    self.con.execute(sqlalchemy.text(SLEEP_QUERY), {"seconds": 0.02})
+                    result["rows"] = 1
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn(f"Slow logs query of the table: {JOB_TABLE}, rows: 1", logs.output[0])
+        self.assertIn("actual time", logs.output[0])
+        self.assertIn("Execution Time", logs.output[0])
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_locked_table_times_out(self, mock_datetime):
+        mock_datetime.now.return_value = datetime(2022, 4, 4, 9, 0, 0)
+        previous = self.get_statement_timeout()
+        with self.engine.connect() as locking_con:
+            transaction = locking_con.begin()
+            locking_con.execute(f"lock table {POSTGRES_SCHEMA}.{JOB_TABLE} in access exclusive mode;")
+            try:
+                with patch.dict(Statements.STATEMENT_TIMEOUTS, {"logs": 200, "aggregate": 200}):
+                    for processing_mode, job_query_mode, log_reader in (
+                        ("frames", "rows", "pandas"),
+                        ("frames", "rows", "copy"),
+                        ("frames", "aggregate", "pandas"),
+                        ("chunked", "rows", "pandas"),
+                    ):
+                        oee = copy.deepcopy(self.oee_template)
+                        oee.processing_mode = processing_mode
+                        oee.job_query_mode = job_query_mode
+                        oee.log_reader = log_reader
+                        with self.assertRaises(RuntimeError):
+                            oee.prepare(self.con)
+                        # the connection can be used for the next Workstation
+                        self.assertEqual(self.get_statement_timeout(), previous)
+            finally:
+                transaction.rollback()
+        oee = copy.deepcopy(self.oee_template)
+        oee.prepare(self.con)
+        oee.calculate_OEE()
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""test Tracing
+"""
+# Standard Library imports
+from datetime import datetime
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+# Custom imports
+sys.path.insert(0, os.path.join("..", "src"))
+from Logger import getLogger
+from LoopHandler import LoopHandler
+import OEE
+import Tracing
+from modules.TestCase_common import setupClass_common
+
+# Constants
+WORKSTATION_ID = "urn:ngsiv2:i40Asset:Workstation:001"
+WORKSTATION_TABLE = WORKSTATION_ID.lower().replace(":", "_") + "_i40asset"
+
+
+class test_Tracing(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = getLogger(__name__)
+        setupClass_common(cls)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.engine.dispose()
+
+    def test_Tracer(self):
+        tracer = Tracing.Tracer(max_spans=3)
+        with tracer.span("loop", "loop"):
+            with tracer.span("query", "sql", table_name="table") as args:
+                args["rows"] = 5
+            with self.assertRaises(ZeroDivisionError):
+                with tracer.span("compute", "compute"):
+                    1 / 0
+        thread = threading.Thread(target=lambda: tracer.record("update", "orion", 1, 2, {}), name="publisher")
+        thread.start()
+        thread.join()
+        trace = tracer.take()
+        spans = {event["name"]: event for event in trace["traceEvents"] if event["ph"] == "X"}
+        self.assertEqual(set(spans), {"loop", "query", "compute"})
+        self.assertEqual(spans["query"]["args"], {"table_name": "table", "rows": 5})
+        self.assertEqual(spans["compute"]["args"], {"error": "ZeroDivisionError"})
+        # the parent span contains its children
+        self.assertLessEqual(spans["loop"]["ts"], spans["query"]["ts"])
+        self.assertGreaterEqual(
+            spans["loop"]["ts"] + spans["loop"]["dur"], spans["compute"]["ts"] + spans["compute"]["dur"]
+        )
+        self.assertEqual(trace["otherData"]["dropped_spans"], 1)
+        self.assertEqual(tracer.take()["otherData"]["dropped_spans"], 0)
+
+        # the spans of each loop are exported into a new file, the oldest files are removed
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertIsNone(tracer.export(directory))
+            paths = []
+            for i in range(3):
+                with tracer.span("loop", "loop", i=i):
+                    pass
+                paths.append(tracer.export(directory, keep=2))
+            self.assertEqual(sorted(os.listdir(directory)), sorted(os.path.basename(path) for path in paths[1:]))
+            with open(paths[-1]) as f:
+                trace = json.load(f)
+            self.assertEqual(trace["displayTimeUnit"], "ms")
+            names = [event["args"]["name"] for event in trace["traceEvents"] if event["name"] == "thread_name"]
+            self.assertEqual(names, [threading.current_thread().name])
+            self.assertEqual([event["args"] for event in trace["traceEvents"] if event["ph"] == "X"], [{"i": 2}])
+
+    @patch(f"{OEE.__name__}.datetime", wraps=datetime)
+    def test_LoopHandler_trace(self, mock_datetime):
+        mock_datetime.now.return_value = datetime(2022, 4, 4, 9, 0, 0)
+        tracer = Tracing.Tracer()
+        with tempfile.TemporaryDirectory() as directory, patch.object(Tracing, "tracer", tracer), patch.object(
+            Tracing, "TRACE_DIR", directory
+        ):
+            LoopHandler().handle()
+            spans = [event for event in tracer.take()["traceEvents"] if event["ph"] == "X"]
+            names = {event["name"] for event in spans}
+            for name in (
+                "LoopHandler.handle",
+                "handle_workstation",
+                "OEECalculator.prepare",
+                "OEECalculator.query_todays_data",
+                "OEECalculator.convert_and_sort_logs",
+                "OEECalculator.calc_availability",
+                "OEECalculator.calculate_OEE",
+                "OEECalculator.calculate_throughput",
+                "logs query",
+                "get",
+                "GET",
+                "update_attribute",
+            ):
+                self.assertIn(name, names)
+            by_name = {}
+            for event in spans:
+                by_name.setdefault(event["name"], []).append(event)
+            workstation, = by_name["handle_workstation"]
+            self.assertEqual(workstation["args"], {"workstation_id": WORKSTATION_ID})
+            queries = {
+                event["args"]["table_name"]: event["args"] for event in by_name["OEECalculator.query_todays_data"]
+            }
+            self.assertEqual(queries[WORKSTATION_TABLE]["workstation_id"], WORKSTATION_ID)
+            self.assertGreater(queries[WORKSTATION_TABLE]["rows"], 0)
+            self.assertTrue(all("rows" in event["args"] for event in by_name["logs query"]))
+            self.assertTrue(all(event["args"]["status_code"] == 200 for event in by_name["GET"]))
+            # the stages of the Workstation are within its span
+            prepare, = by_name["OEECalculator.prepare"]
+            self.assertLessEqual(workstation["ts"], prepare["ts"])
+            self.assertLessEqual(prepare["ts"] + prepare["dur"], workstation["ts"] + workstation["dur"])
+            # the export of a loop
+            LoopHandler().handle()
+            Tracing.export()
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()